@@ -15,7 +15,6 @@ from __future__ import print_function
 from __future__ import division
 import six
 from six.moves import xrange
-from six.moves import cPickle as pickle
 import argparse
 import mtpwifi
 from mtpdef import *
@@ -30,13 +29,23 @@ import math
 import traceback
 import platform
 import socket
-import hashlib
 from dlinkedlist import *
 from collections import namedtuple
 from applog import *
 import rename
+import mtpobjcache
+import dlhistory
 import ssdp
 import subprocess
+import downloadexec
+import threading
+import collections
+import json
+import functools
+import random
+import zlib
+import array
+import operator
 
 #
 # constants
@@ -44,8 +53,25 @@ import subprocess
 
 AIRMTPCMD_APP_VERSION	= "1.1"
 
-DEFAULT_MAX_KB_PER_GET_OBJECT_REQUEST				= 1024 		# 1MB - empirically tweaked to get max download performance from Nikon bodies (too large an xfer and Nikon bodies start intermittently dropping connections)
+DEFAULT_MAX_KB_PER_GET_OBJECT_REQUEST				= 1024 		# 1MB - empirically tweaked to get max download performance from Nikon bodies (too large an xfer and Nikon bodies start intermittently dropping connections). starting point for adaptive sizing
+ADAPTIVE_GET_OBJECT_MIN_KB							= 128		# smallest MTP_OP_GetPartialObject request size adaptive sizing will shrink to
+ADAPTIVE_GET_OBJECT_MAX_KB							= 4096		# largest MTP_OP_GetPartialObject request size adaptive sizing will grow to
+ADAPTIVE_GET_OBJECT_STEP_KB							= 256		# additive increase of the request size each time throughput improves
+ADAPTIVE_GET_OBJECT_SAMPLE_KB						= 8192		# amount of data downloaded at a given request size before we measure its throughput
+ADAPTIVE_GET_OBJECT_MIN_IMPROVEMENT_PCT				= 5			# throughput improvement required to keep growing the request size
 DEFAULT_MAX_KB_TO_BUFFER_FOR_GET_OBJECT_REQUESTS 	= 32768		# 32MB - max bytes we buffer before flushing what we have to disk
+DEFAULT_GET_OBJECT_PIPELINE_DEPTH					= 1			# max MTP_OP_GetPartialObject requests in flight for models not in the pipeline allowlist. 1 = no pipelining (opt-in since not all bodies tolerate it)
+GET_OBJECT_PIPELINE_ENTRY_EXPIRE_DAYS				= 90		# pipeline allowlist entries not updated in this many days are forgotten, so a disallowed model (ex: since fixed by a firmware update) is retried
+DEFAULT_GET_OBJECT_INFO_PIPELINE_DEPTH				= 1			# max MTP_OP_GetObjectInfo requests in flight during enumeration. 1 = no pipelining
+GET_OBJECT_INFO_PREFETCH_BATCH_SIZE					= 128		# number of handles we prefetch MTP_OP_GetObjectInfo for at a time when pipelining
+LAZY_ENUM_MIN_FOLDER_OBJS_FOR_DATE_SEARCH			= 16		# min number of objects in a folder before lazy enumeration tries to binary-search it by capture date
+DEFAULT_MTP_OBJ_CACHE_VERIFY_SAMPLE_SIZE			= 0			# number of randomly-chosen cached file objects verified against the camera (in addition to the directories) when the card has changed
+DEFAULT_OVERLAP_ENUM_WINDOW_SIZE					= 64		# number of handles enumerated at a time when overlapping enumeration with downloads. also the window --transferorder is honored within
+DOWNLOAD_HISTORY_PREFETCH_BATCH_SIZE				= 256		# number of upcoming files we look up in the download history with a single query (see prefetchDownloadHistory)
+DOWNLOAD_RATE_CONTROL_FILE_CHECK_SECS				= 2			# how often we check --downloadratecontrolfile for changes and update --downloadratestatusfile
+RESUME_JOURNAL_COMMIT_INTERVAL_SECS					= 1.0		# min time between commits of a download's resume journal (each commit fsyncs the .part file)
+GET_OBJECT_PIPELINE_MAX_COMM_ERRORS					= 3			# consecutive comm errors during pipelined downloads (without a successful pipelined download) before we stop pipelining for a model
+DEFAULT_DOWNLOADEXEC_MAX_CONCURRENT					= 4			# max number of --downloadexec apps we have running at once
 
 # values for g.fileTransferOrder
 FILE_TRANSFER_ORDER_USER_CONFIGURED		= 0
@@ -61,6 +87,8 @@ REALTIME_DOWNLOAD_METHOD_NIKON_EVENTS	= 0
 REALTIME_DOWNLOAD_METHOD_MTPOBJ_POLLING	= 1
 REALTIME_DOWNLOAD_METHOD_SONY_EXIT		= 2
 REALTIME_DOWNLOAD_METHOD_MAX			= REALTIME_DOWNLOAD_METHOD_SONY_EXIT
+# MTP events that end a realtime wait early because they mean the object list may have changed (see waitForRealtimeMtpEvents)
+REALTIME_OBJLIST_EVENT_CODES			= frozenset([ MTP_EVENT_ObjectAdded, MTP_EVENT_ObjectRemoved, MTP_EVENT_StoreAdded, MTP_EVENT_StoreRemoved ])
 # values for g.args['sonyuniquecmdsenable'] (bitmask)
 SONY_UNQIUECMD_ENABLE_SENDING_MSG					= 0x00000001
 SONY_UNQIUECMD_ENABLE_UNKNOWN_CMD_1					= 0x00000002
@@ -129,7 +157,141 @@ class CreateMtpObjectStatsStruct:
 		self.countCacheHits = 0
 
 
-class GlobalVarsStruct:
+#
+# read-only dictionary of object handle -> MtpObjectInfoTuple of the objects in an MtpObjectStore,
+# whose values are only built as they're accessed
+#
+class MtpObjectInfoDictView(object):
+	def __init__(self, store):
+		self.store = store
+	def __len__(self):
+		return len(self.store.objectHandleDict)
+	def __contains__(self, objHandle):
+		return objHandle in self.store.objectHandleDict
+	def __iter__(self):
+		return iter(self.store.objectHandleDict)
+	def keys(self):
+		return self.store.objectHandleDict.keys()
+	def __getitem__(self, objHandle):
+		return self.store.objectHandleDict[objHandle].mtpObjectInfo
+	def iteritems(self):
+		for (objHandle, mtpObject) in six.iteritems(self.store.objectHandleDict):
+			yield (objHandle, mtpObject.mtpObjectInfo)
+	items = iteritems
+
+
+#
+# collection of all MtpObject instances of a session (see MtpObject). the state of each object
+# is kept here rather than in the MtpObject instance itself, in compact per-store arrays indexed
+# by the slot number assigned to the object when it's added, since a Python object (and int/str
+# object) for each field of each object costs an order of magnitude more memory than the field
+# data itself and a camera can have many thousands of objects:
+#
+#	objHandles/objSizes/objFormats/objParents	- MtpObjectInfoTuple fields we access most often
+#	objSharedFieldsIndexes	- index into sharedFieldsList of the object's fields that are typically the
+#							  same across many objects (storage ID, dimensions, association type, etc...)
+#	objHeapOffsets			- offset into objInfoHeap of the object's remaining fields - a header with
+#							  the integer fields that vary by object and the length of each of its
+#							  strings, followed by the (utf-8) strings
+#	objFlags				- MTPOBJ_FLAG_* bits
+#
+# the MtpObjectInfoTuple of an object is only built (decoded) when its mtpObjectInfo is accessed
+#
+MTPOBJ_FLAG_IN_CAMERA_TRANSFER_LIST		= 0x01	# user selected this image for transfer in the camera
+MTPOBJ_FLAG_DOWNLOADED_THIS_SESSION		= 0x02	# object has been downloaded successfully this session
+MTPOBJ_FLAG_FROM_MTP_OBJ_CACHE			= 0x04	# object's info came from (and so is unchanged from) the MTP object cache
+MTPOBJSTORE_SHARED_FIELD_NAMES			= ('storageId', 'protectionStatus', 'thumbFormat', 'thumbPixWidth', 'thumbPixHeight',\
+											'imagePixWidth', 'imagePixHeight', 'imageBitDepth', 'associationType', 'associationDesc')
+MTPOBJSTORE_SHARED_FIELDS_GETTER		= operator.attrgetter(*MTPOBJSTORE_SHARED_FIELD_NAMES)
+MTPOBJSTORE_HEAP_HEADER_STRUCT			= struct.Struct('<IIHHH')	# thumbCompressedSize, sequenceNumber, length of filename, captureDateStr, modificationDateStr
+class MtpObjectStore:
+	def __init__(self):
+		self.llCaptureDateSorted = LinkedList()		# link list of all MtpObject instances, sorted by capture date ([0] = oldest, [n-1]=newest)
+		self.objectHandleDict = {}					# dictionary of all objects, keyed by object handle
+		self.countDirectories = 0					# number MtpObjects that represent directories
+		self.objHandles = array.array('I')
+		self.objSizes = array.array('I')
+		self.objFormats = array.array('H')
+		self.objParents = array.array('I')
+		self.objSharedFieldsIndexes = array.array('I')
+		self.objHeapOffsets = array.array('I')
+		self.objFlags = bytearray()
+		self.objInfoHeap = bytearray()
+		self.sharedFieldsList = []					# distinct tuples of the MTPOBJSTORE_SHARED_FIELD_NAMES fields of objects
+		self.sharedFieldsIndexDict = {}				# index into sharedFieldsList of each tuple, keyed by the tuple
+		self.partialDownloadDataDict = {}			# PartialDownloadData of objects with a download in progress, keyed by slot
+	#
+	# stores the MtpObjectInfoTuple of a new object, returning the slot number assigned to it
+	#
+	def addObjectInfo(self, mtpObjectHandle, mtpObjectInfo):
+		slot = len(self.objHandles)
+		sharedFields = MTPOBJSTORE_SHARED_FIELDS_GETTER(mtpObjectInfo)
+		sharedFieldsIndex = self.sharedFieldsIndexDict.get(sharedFields)
+		if sharedFieldsIndex == None:
+			sharedFieldsIndex = len(self.sharedFieldsList)
+			self.sharedFieldsList.append(sharedFields)
+			self.sharedFieldsIndexDict[sharedFields] = sharedFieldsIndex
+		heapOffset = len(self.objInfoHeap)
+		filenameBytes = six.text_type(mtpObjectInfo.filename).encode('utf-8')
+		captureDateBytes = six.text_type(mtpObjectInfo.captureDateStr).encode('utf-8')
+		modificationDateBytes = six.text_type(mtpObjectInfo.modificationDateStr).encode('utf-8')
+		self.objInfoHeap += MTPOBJSTORE_HEAP_HEADER_STRUCT.pack(mtpObjectInfo.thumbCompressedSize, mtpObjectInfo.sequenceNumber,\
+			len(filenameBytes), len(captureDateBytes), len(modificationDateBytes))
+		self.objInfoHeap += filenameBytes + captureDateBytes + modificationDateBytes
+		self.objHandles.append(mtpObjectHandle)
+		self.objSizes.append(mtpObjectInfo.objectCompressedSize)
+		self.objFormats.append(mtpObjectInfo.objectFormat)
+		self.objParents.append(mtpObjectInfo.parentObject)
+		self.objSharedFieldsIndexes.append(sharedFieldsIndex)
+		self.objHeapOffsets.append(heapOffset)
+		self.objFlags.append(0)
+		return slot
+	#
+	# returns the filename of the object in 'slot', without building its whole MtpObjectInfoTuple
+	#
+	def getObjectFilename(self, slot):
+		offset = self.objHeapOffsets[slot]
+		filenameLen = MTPOBJSTORE_HEAP_HEADER_STRUCT.unpack_from(self.objInfoHeap, offset)[2]
+		offset += MTPOBJSTORE_HEAP_HEADER_STRUCT.size
+		return self.objInfoHeap[offset:offset+filenameLen].decode('utf-8')
+	#
+	# returns the capture date string of the object in 'slot', without building its whole MtpObjectInfoTuple
+	#
+	def getObjectCaptureDateStr(self, slot):
+		offset = self.objHeapOffsets[slot]
+		(filenameLen, captureDateLen) = MTPOBJSTORE_HEAP_HEADER_STRUCT.unpack_from(self.objInfoHeap, offset)[2:4]
+		offset += MTPOBJSTORE_HEAP_HEADER_STRUCT.size + filenameLen
+		return self.objInfoHeap[offset:offset+captureDateLen].decode('utf-8')
+	#
+	# builds the MtpObjectInfoTuple of the object in 'slot'
+	#
+	def getObjectInfo(self, slot):
+		(storageId, protectionStatus, thumbFormat, thumbPixWidth, thumbPixHeight, imagePixWidth, imagePixHeight,\
+			imageBitDepth, associationType, associationDesc) = self.sharedFieldsList[self.objSharedFieldsIndexes[slot]]
+		heap = self.objInfoHeap
+		offset = self.objHeapOffsets[slot]
+		(thumbCompressedSize, sequenceNumber, filenameLen, captureDateLen, modificationDateLen) = MTPOBJSTORE_HEAP_HEADER_STRUCT.unpack_from(heap, offset)
+		offset += MTPOBJSTORE_HEAP_HEADER_STRUCT.size
+		captureDateOffset = offset + filenameLen
+		modificationDateOffset = captureDateOffset + captureDateLen
+		return MtpObjectInfoTuple._make((storageId, self.objFormats[slot], protectionStatus,\
+			self.objSizes[slot], thumbFormat, thumbCompressedSize,\
+			thumbPixWidth, thumbPixHeight, imagePixWidth, imagePixHeight,\
+			imageBitDepth, self.objParents[slot], associationType,\
+			associationDesc, sequenceNumber, heap[offset:captureDateOffset].decode('utf-8'),\
+			heap[captureDateOffset:modificationDateOffset].decode('utf-8'), heap[modificationDateOffset:modificationDateOffset+modificationDateLen].decode('utf-8')))
+
+
+#
+# All the state of a session with a camera - the command-line arguments it was started
+# with, its connections to the camera, the camera's objects, download stats, etc... Nearly
+# every function in this module accesses the state of the session it's running under via
+# the module-level 'g', which resolves to the session activated for the calling thread (see
+# CameraSessionProxy), so separate sessions can run in parallel threads, each with its own
+# camera. run() performs a complete session; main() is a thin wrapper around it for the
+# command line. Note that the applog logging module remains process-wide, shared by all sessions
+#
+class CameraSession:
 	def __init__(self):
 	
 		self.isWin32 = None								# True if we're running on a Windows platform
@@ -144,13 +306,26 @@ class GlobalVarsStruct:
 		
 		self.objfilter_dateStartEpoch = None			# user-specified starting date filter. any file earlier than this will be filtered.
 		self.objfilter_dateEndEpoch = None				# user-specified ending date filter. any file later than this will be filtered.
-		self.maxGetObjTransferSize = None				# max size of MTP_OP_GetPartialObject requests
+		self.downloadRateLimiter = None					# DownloadRateLimiter if download rate is limited (--maxdownloadratekbsec or --downloadratecontrolfile)
+		self.getObjTransferSize = None					# AdaptiveGetObjTransferSize that determines the size of MTP_OP_GetPartialObject requests. set by determineGetObjTransferSize()
 		self.maxGetObjBufferSize = None					# max amount of download file data we buffer before flushing
+		self.getObjPipelineDepth = None					# max MTP_OP_GetPartialObject requests we keep in flight. determined by determineGetObjPipelineDepth()
+		self.getObjPipelineAllowlistDict = None			# contents of the get-object pipeline allowlist, loaded once per session (see loadGetObjPipelineDepthAllowlist)
+		self.getObjInfoPipelineDepth = None				# max MTP_OP_GetObjectInfo requests we keep in flight when enumerating objects
 		
 		self.fileTransferOrder = None					# FILE_TRANSFER_ORDER_* constant
+		
+		self.filenameSpecCompiled = None				# rename.CompiledRenameSpec for --filenamespec (compiled once by processCmdLine)
+		self.dirnameSpecCompiled = None					# rename.CompiledRenameSpec for --dirnamespec
+		self.downloadExecSpecsCompiled = []				# rename.CompiledRenameSpec for each --downloadexec arg
+		self.downloadExecFirstPerFileArgIndex = None	# index of first --downloadexec arg that varies by file. args before it are common to a batch (see doDownloadExec)
+		self.downloadExecEngine = None					# downloadexec.DownloadExecEngine that launches --downloadexec apps (see getDownloadExecEngine)
 	
-		self.socketPrimary = None
-		self.socketEvents = None
+		self.connPrimary = None							# mtpwifi.MtpConnection used for MTP requests
+		self.connEvents = None							# mtpwifi.MtpConnection used for events
+		self.mtpOpStats = mtpwifi.MtpOpStatsRegistry()	# per-op counts/latencies of all MTP ops this session, across reconnects (see reportMtpOpStats)
+		self.traceRecorder = None						# mtpwifi.MtpTraceRecorder all connections this session are traced to, if --tracefile was specified (see getTraceRecorder)
+		self.lastConnectErrMsg = ""						# last connect err msg, to allow supressing reporting while waiting for connection across retries
 		
 		self.cameraMake = CAMERA_MAKE_UNDETERMINED 
 		self.realtimeDownloadMethod = None
@@ -163,12 +338,15 @@ class GlobalVarsStruct:
 		self.cameraLocalMetadataPathAndRootName = None	# path+root name for all metadata files we associate with a specific model+serial number
 		
 		self.lastFullMtpHandleListProcessedByBuildMtpObjects = None
+		self.mtpObjCache = None							# mtpobjcache.MtpObjCache for the camera we're connected to (see getMtpObjCache)
+		self.mtpObjCacheStorageSignature = None			# signature of the card(s) as of this session's object enumeration (see genMtpObjCacheStorageSignature)
+		self.mtpObjects = MtpObjectStore()				# all MtpObject instances created this session
 		
 		self.fAllObjsAreFromCameraTransferList = False	# True if buildMtpObjects() found and retrieved a transfer list from the camera (ie, user picked photos to download on camera)
 		self.fRetrievedMtpObjects = False				# True if buildMtpObjects() has successfully completed this session
 		self.fRealTimeDownloadPhaseStarted = False		# True if we've completed a "normal" mode transfer (or bypassed it by user config) and have started realtime image download
 		
-		self.downloadHistoryDict = None					# download history
+		self.downloadHistory = None						# dlhistory.DownloadHistory for the camera we're connected to (see openDownloadHistory)
 		self.downloadMtpFileObjects_LastMtpObjectDownload = None # MTP object last downloaded (either last completed or last we were working on)
 		
 		self.countFilesDownloadedPersistentAcrossStatsReset = 0	# count of files downloaded this session, survives reset of DownloadStatsStruct
@@ -178,11 +356,60 @@ class GlobalVarsStruct:
 
 		# exit cleanup tracking vars
 		self.filesToDeleteOnAppExit = []
-	
+
+	#
+	# makes this the session 'g' resolves to for the calling thread
+	#
+	def activate(self):
+		CameraSessionProxy.threadLocal.session = self
+
+	#
+	# performs the session: processes the command-line arguments in 'argv' (None for
+	# sys.argv), downloads from the camera, retrying on errors as configured, and
+	# cleans up. returns the session's exit code (errno)
+	#
+	def run(self, argv=None):
+		self.activate()
+		if self.appDataDir == None:
+			establishAppEnvironment()
+		if self.appStartTimeEpoch == None:
+			self.appStartTimeEpoch = time.time()
+		processCmdLine(argv)
+		_errno = runSessionWithRetries()
+		reportMtpOpStats()
+		closeTraceRecorder()
+		_errnoDownloadExec = drainDownloadExecEngine()
+		if not _errno:
+			_errno = _errnoDownloadExec
+		deleteFilesMarkedForDeletionOnExit()
+		return _errno
+
+
+#
+# proxy through which all code in this module accesses the state of the session it's
+# running under - attribute accesses are forwarded to the CameraSession activated for the
+# calling thread. threads that haven't activated a session use the default session, which
+# is the one used by the command line
+#
+class CameraSessionProxy(object):
+	threadLocal = threading.local()
+	defaultSession = CameraSession()
+	def __getattr__(self, name):
+		return getattr(getActiveCameraSession(), name)
+	def __setattr__(self, name, value):
+		setattr(getActiveCameraSession(), name, value)
+
+#
+# returns the CameraSession that 'g' resolves to for the calling thread. helper threads
+# that access 'g' must activate() the session of the thread that created them
+#
+def getActiveCameraSession():
+	return getattr(CameraSessionProxy.threadLocal, 'session', CameraSessionProxy.defaultSession)
+
 #
 # global vars
 #
-g  = GlobalVarsStruct()
+g  = CameraSessionProxy()
 
 #
 # global constant data
@@ -197,7 +424,8 @@ CmdLineActionToMtpTransferOpDict = {
 # used to maintain information about current file being downloaded
 # across any retry/resumption attempts
 # 
-class PartialDownloadData():
+class PartialDownloadData(object):
+	__slots__ = ('bytesWritten', 'downloadTimeSecs', 'localFilenameWithoutPath')
 	def __init__(self):
 		self.bytesWritten = 0
 		self.downloadTimeSecs = 0
@@ -221,69 +449,112 @@ class PartialDownloadData():
 class MtpObject(LinkedListObj):
 
 	#
-	# class variables
+	# the collection of objects (sorted list, handle dictionary, counts) is kept per-session,
+	# in g.mtpObjects (MtpObjectStore)
 	#
-	__MtpObjects_LL_CaptureDateSorted = LinkedList()	# link list of all MtpObject instances, sorted by capture date ([0] = oldest, [n-1]=newest)	
-	__MtpObjects_ObjectHandleDict = {}					# dictionary of all objects, keyed by object handle 
-	_CountMtpObjectDirectories = 0						# number MtpObjects that represent directories
-
+	
 	#
-	# instance variables (documentation only since variables don't need to be declared in Python)
+	# instance variables. the object's state is kept in its MtpObjectStore rather than in the instance,
+	# which considerably reduces our memory footprint when a camera has many thousands of objects. the
+	# only instance variables are the store and our slot in it, declared as slots rather than living in
+	# a per-instance __dict__. the state is accessed through these properties:
 	# self.mtpObjectHandle:			Handle by which camera references this object
-	# self.mtpObjectInfo: 			Structure containing information from MTP_OP_GetObjectInfo
-	# self.captureDateEpoch:		self.mtpObjectInfo.captureDateStr converted to epoch time
-	# self.bInTransferList:			TRUE if user selected this image for transfer in the camera
+	# self.mtpObjectInfo: 			Structure containing information from MTP_OP_GetObjectInfo (built on each access)
+	# self.captureDateEpoch:		self.mtpObjectInfo.captureDateStr converted to epoch time (our linked-list key)
+	# self.bInCameraTransferList:	TRUE if user selected this image for transfer in the camera
 	# self.bDownloadedThisSession	TRUE if object has been downloaded successfully this session [for possible future retry logic, if implemented]
+	# self.partialDownloadData		PartialDownloadData if a download of this object is in progress
 	#
+	__slots__ = ('_store', '_slot')
 
 	def __init__(self, mtpObjectHandle, mtpObjectInfo):
 	
-		# init some instance vars
-		self.bInCameraTransferList = False
-		self.bDownloadedThisSession = False
-		self.partialDownloadData = None
-
-		# save handle and object info to instance vars
-		self.mtpObjectHandle = mtpObjectHandle
-		self.mtpObjectInfo = mtpObjectInfo
+		# save handle and object info to our store
+		self._store = g.mtpObjects
+		self._slot = self._store.addObjectInfo(mtpObjectHandle, mtpObjectInfo)
 
 		if isDebugLog():
 			applog_d("Creating MtpObject with the following mtpObjectInfo:\n" + str(self))
 		
 		# calculate instance vars that are based on mtpObjectInfo data
-		self.captureDateEpoch = 0
-		if self.mtpObjectInfo.captureDateStr: # there is a non-empty capture date string
-			self.captureDateEpoch = mtpTimeStrToEpoch(self.mtpObjectInfo.captureDateStr)
+		captureDateEpoch = 0
+		if mtpObjectInfo.captureDateStr: # there is a non-empty capture date string
+			captureDateEpoch = mtpTimeStrToEpoch(mtpObjectInfo.captureDateStr)
 		else:
 			#
 			# Sony uses a date stamp for the filename of folders. Extract that as the date if this is a folder object. this is
 			# important because we rely on folder timestamps for the MTP object cache logic
 			#
-			if self.mtpObjectInfo.associationType == MTP_OBJASSOC_GenericFolder:
-				if len(self.mtpObjectInfo.filename)==10 and self.mtpObjectInfo.filename[4]=='-' and self.mtpObjectInfo.filename[7]=='-':
+			if mtpObjectInfo.associationType == MTP_OBJASSOC_GenericFolder:
+				if len(mtpObjectInfo.filename)==10 and mtpObjectInfo.filename[4]=='-' and mtpObjectInfo.filename[7]=='-':
 					# capture date is in in YYYY-MM-DD (Sony uses this for folders)
-					self.captureDateEpoch = time.mktime( time.strptime(self.mtpObjectInfo.filename, "%Y-%m-%d"))			
+					captureDateEpoch = time.mktime( time.strptime(mtpObjectInfo.filename, "%Y-%m-%d"))			
 			
 		# make sure this object hasn't already been inserted
 		if MtpObject.objInList(self):
 			raise AssertionError("MtpObject: Attempting to insert mtpObjectHandle that's already in dictionary. newObj:\n{:s}, existingObj:\n{:s}".format(
-				str(self), str(MtpObject.__MtpObjects_ObjectHandleDict[self.mtpObjectHandle])))
+				str(self), str(self._store.objectHandleDict[mtpObjectHandle])))
 
 		# insert into capture-date sorted linked list
-		LinkedListObj.__init__(self, self.captureDateEpoch, MtpObject.__MtpObjects_LL_CaptureDateSorted)
+		LinkedListObj.__init__(self, captureDateEpoch, self._store.llCaptureDateSorted)
 			
 		# insert into object handle dictionary, which is used for quick lookups by object handle
-		MtpObject.__MtpObjects_ObjectHandleDict[self.mtpObjectHandle] = self
+		self._store.objectHandleDict[mtpObjectHandle] = self
 		
 		# update counts based on this object type
-		if self.mtpObjectInfo.associationType == MTP_OBJASSOC_GenericFolder:
-			MtpObject._CountMtpObjectDirectories += 1
-					
+		if mtpObjectInfo.associationType == MTP_OBJASSOC_GenericFolder:
+			self._store.countDirectories += 1
+
+	@property
+	def mtpObjectHandle(self):
+		return self._store.objHandles[self._slot]
+
+	@property
+	def mtpObjectInfo(self):
+		return self._store.getObjectInfo(self._slot)
+
+	@property
+	def captureDateEpoch(self):
+		return self._key
+
+	@property
+	def bInCameraTransferList(self):
+		return bool(self._store.objFlags[self._slot] & MTPOBJ_FLAG_IN_CAMERA_TRANSFER_LIST)
+
+	@property
+	def bDownloadedThisSession(self):
+		return bool(self._store.objFlags[self._slot] & MTPOBJ_FLAG_DOWNLOADED_THIS_SESSION)
+
+	@property
+	def partialDownloadData(self):
+		return self._store.partialDownloadDataDict.get(self._slot)
+
+	#
+	# accessors for the mtpObjectInfo fields we use most often, which don't build the whole mtpObjectInfo
+	#
+	def getFilename(self): # ex: "DSC_2266.NEF"
+		return self._store.getObjectFilename(self._slot)
+
+	def getCaptureDateStr(self):
+		return self._store.getObjectCaptureDateStr(self._slot)
+
+	def getObjectFormat(self):
+		return self._store.objFormats[self._slot]
+
+	def getObjectSize(self):
+		return self._store.objSizes[self._slot]
+
 	def setAsDownloadedThisSession(self):
-		self.bDownloadedThisSession = True
+		self._store.objFlags[self._slot] |= MTPOBJ_FLAG_DOWNLOADED_THIS_SESSION
 		
 	def wasDownloadedThisSession(self):
 		return self.bDownloadedThisSession
+
+	def setAsFromMtpObjCache(self):
+		self._store.objFlags[self._slot] |= MTPOBJ_FLAG_FROM_MTP_OBJ_CACHE
+
+	def isFromMtpObjCache(self):
+		return bool(self._store.objFlags[self._slot] & MTPOBJ_FLAG_FROM_MTP_OBJ_CACHE)
 		
 	def isPartialDownload(self):
 		return self.partialDownloadData != None
@@ -291,37 +562,38 @@ class MtpObject(LinkedListObj):
 	def partialDownloadObj(self):
 		if self.partialDownloadData:
 			return self.partialDownloadData
-		self.partialDownloadData = PartialDownloadData()
+		self._store.partialDownloadDataDict[self._slot] = PartialDownloadData()
 		return self.partialDownloadData
 		
 	def releasePartialDownloadObj(self):
-		if self.partialDownloadData:
-			self.partialDownloadData = None
+		self._store.partialDownloadDataDict.pop(self._slot, None)
 			
 	def getImmediateDirectory(self): # gets immediate camera directory that this object is in. ex: "100NC1J4"
-		objHandleDirectory = self.mtpObjectInfo.parentObject
+		store = self._store
+		objHandleDirectory = store.objParents[self._slot]
 		if not objHandleDirectory:
 			# no parent to this object
 			return ""
-		if objHandleDirectory not in MtpObject.__MtpObjects_ObjectHandleDict:
-			applog_d("getImmediateDirectory(): Unable to locate parent object for {:s}, parent=0x{:08x}".format(self.mtpObjectInfo.filename, objHandleDirectory))
+		if objHandleDirectory not in store.objectHandleDict:
+			applog_d("getImmediateDirectory(): Unable to locate parent object for {:s}, parent=0x{:08x}".format(store.getObjectFilename(self._slot), objHandleDirectory))
 			return ""			
-		dirObject = MtpObject.__MtpObjects_ObjectHandleDict[objHandleDirectory]
-		return dirObject.mtpObjectInfo.filename		
+		dirObject = store.objectHandleDict[objHandleDirectory]
+		return store.getObjectFilename(dirObject._slot)
 							
 	def genFullPathStr(self): # builds full path string to this object on camera, including filename itself. Ex: "DCIM\100NC1J4\DSC_2266.NEF"
 		# full path built by walking up the parent object tree for this object, prepending the directory of each parent we find
-		pathStr = self.mtpObjectInfo.filename
-		objHandleAncestorDirectory = self.mtpObjectInfo.parentObject
+		store = self._store
+		pathStr = store.getObjectFilename(self._slot)
+		objHandleAncestorDirectory = store.objParents[self._slot]
 		loopIterationCounter_EndlessLoopProtectionFromCorruptList = 0
 		while (objHandleAncestorDirectory != 0):
-			if objHandleAncestorDirectory not in MtpObject.__MtpObjects_ObjectHandleDict:
+			if objHandleAncestorDirectory not in store.objectHandleDict:
 				# couldn't find next folder up. this shouldn't happen since we always pull down full directory tree for all objects
-				applog_d("genFullPathStr(): Unable to locate parent object for {:s}, parent=0x{:08x}".format(self.mtpObjectInfo.filename, objHandleDirectory))
+				applog_d("genFullPathStr(): Unable to locate parent object for {:s}, parent=0x{:08x}".format(store.getObjectFilename(self._slot), objHandleAncestorDirectory))
 				return pathStr
-			dirObject = MtpObject.__MtpObjects_ObjectHandleDict[objHandleAncestorDirectory]
-			pathStr = dirObject.mtpObjectInfo.filename + "\\" + pathStr
-			objHandleAncestorDirectory = dirObject.mtpObjectInfo.parentObject
+			dirObject = store.objectHandleDict[objHandleAncestorDirectory]
+			pathStr = store.getObjectFilename(dirObject._slot) + "\\" + pathStr
+			objHandleAncestorDirectory = store.objParents[dirObject._slot]
 			loopIterationCounter_EndlessLoopProtectionFromCorruptList += 1
 			if loopIterationCounter_EndlessLoopProtectionFromCorruptList >= 512:	
 				# 512 is arbitrary. wouldn't expect cameras to have more than one or two directory levels
@@ -331,19 +603,19 @@ class MtpObject(LinkedListObj):
 									
 	@classmethod
 	def getCount(cls):	# returns count of objects
-		return MtpObject.__MtpObjects_LL_CaptureDateSorted.count()
+		return g.mtpObjects.llCaptureDateSorted.count()
 		
 	@classmethod
 	def getOldest(cls):	# returns oldest object in age collection
-		if MtpObject.__MtpObjects_LL_CaptureDateSorted.count():		# if list is not empty
-			return MtpObject.__MtpObjects_LL_CaptureDateSorted.head()
+		if g.mtpObjects.llCaptureDateSorted.count():		# if list is not empty
+			return g.mtpObjects.llCaptureDateSorted.head()
 		else:
 			return None
 							
 	@classmethod
 	def getNewest(cls):	# returns newest object in age collection
-		if MtpObject.__MtpObjects_LL_CaptureDateSorted.count():		# if list is not empty
-			return MtpObject.__MtpObjects_LL_CaptureDateSorted.tail()
+		if g.mtpObjects.llCaptureDateSorted.count():		# if list is not empty
+			return g.mtpObjects.llCaptureDateSorted.tail()
 		else:
 			return None
 		
@@ -355,36 +627,37 @@ class MtpObject(LinkedListObj):
 
 	@classmethod
 	def getByMtpObjectHandle(cls, mtpObjectHandle):
-		if mtpObjectHandle in MtpObject.__MtpObjects_ObjectHandleDict:
-			return MtpObject.__MtpObjects_ObjectHandleDict[mtpObjectHandle]
+		if mtpObjectHandle in g.mtpObjects.objectHandleDict:
+			return g.mtpObjects.objectHandleDict[mtpObjectHandle]
 		else:
 			return None
 			
 	@classmethod
 	def objInList(cls, mtpObj):		
-		return mtpObj.mtpObjectHandle in MtpObject.__MtpObjects_ObjectHandleDict
+		return mtpObj.mtpObjectHandle in g.mtpObjects.objectHandleDict
 			
 			
 	def __str__(self):	# generates string description of object
+		mtpObjectInfo = self.mtpObjectInfo
 		s =  "MtpObject instance = 0x{:08x}\n".format(id(self))
 		s += "  mtpObjectHandle = 0x{:08x}\n".format(self.mtpObjectHandle)
 		s += "  --- mptObjectInfo ---\n"		
-		s += "    storageId          = " + getMtpStorageIdDesc(self.mtpObjectInfo.storageId) + "\n"
-		s += "    objectFormat       = " + getMtpObjFormatDesc(self.mtpObjectInfo.objectFormat) + "\n"
-		s += "    protectionStatus   = " + strutil.hexShort(self.mtpObjectInfo.protectionStatus) + "\n"
-		s += "    compressedSize     = " + strutil.hexWord(self.mtpObjectInfo.objectCompressedSize) + "\n"
-		s += "    thumbFormat        = " + getMtpObjFormatDesc(self.mtpObjectInfo.thumbFormat) + "\n"
-		s += "    thumbCompressedSize= " + strutil.hexWord(self.mtpObjectInfo.thumbCompressedSize) + "\n"
-		s += "    thumbPixDimensions = " + str(self.mtpObjectInfo.thumbPixWidth) + "x" + str(self.mtpObjectInfo.thumbPixHeight) + "\n"
-		s += "    imagePixDimensions = " + str(self.mtpObjectInfo.imagePixWidth) + "x" + str(self.mtpObjectInfo.imagePixHeight) + "\n"
-		s += "    imageBitDepth      = " + str(self.mtpObjectInfo.imageBitDepth) + "\n"
-		s += "    parentObject       = " + strutil.hexWord(self.mtpObjectInfo.parentObject) + "\n"
-		s += "    associationType    = " + getObjAssocDesc(self.mtpObjectInfo.associationType) + "\n"
-		s += "    associationDesc    = " + strutil.hexWord(self.mtpObjectInfo.associationDesc) + "\n"
-		s += "    sequenceNumber     = " + strutil.hexWord(self.mtpObjectInfo.sequenceNumber) + "\n"
+		s += "    storageId          = " + getMtpStorageIdDesc(mtpObjectInfo.storageId) + "\n"
+		s += "    objectFormat       = " + getMtpObjFormatDesc(mtpObjectInfo.objectFormat) + "\n"
+		s += "    protectionStatus   = " + strutil.hexShort(mtpObjectInfo.protectionStatus) + "\n"
+		s += "    compressedSize     = " + strutil.hexWord(mtpObjectInfo.objectCompressedSize) + "\n"
+		s += "    thumbFormat        = " + getMtpObjFormatDesc(mtpObjectInfo.thumbFormat) + "\n"
+		s += "    thumbCompressedSize= " + strutil.hexWord(mtpObjectInfo.thumbCompressedSize) + "\n"
+		s += "    thumbPixDimensions = " + str(mtpObjectInfo.thumbPixWidth) + "x" + str(mtpObjectInfo.thumbPixHeight) + "\n"
+		s += "    imagePixDimensions = " + str(mtpObjectInfo.imagePixWidth) + "x" + str(mtpObjectInfo.imagePixHeight) + "\n"
+		s += "    imageBitDepth      = " + str(mtpObjectInfo.imageBitDepth) + "\n"
+		s += "    parentObject       = " + strutil.hexWord(mtpObjectInfo.parentObject) + "\n"
+		s += "    associationType    = " + getObjAssocDesc(mtpObjectInfo.associationType) + "\n"
+		s += "    associationDesc    = " + strutil.hexWord(mtpObjectInfo.associationDesc) + "\n"
+		s += "    sequenceNumber     = " + strutil.hexWord(mtpObjectInfo.sequenceNumber) + "\n"
 		s += "    filename           = " + self.genFullPathStr() + "\n"
-		s += "    captureDateSt      = " + self.mtpObjectInfo.captureDateStr + "\n"
-		s += "    modificationDateStr= " + self.mtpObjectInfo.modificationDateStr
+		s += "    captureDateSt      = " + mtpObjectInfo.captureDateStr + "\n"
+		s += "    modificationDateStr= " + mtpObjectInfo.modificationDateStr
 		return s
 
 		
@@ -614,7 +887,7 @@ def conver_int_auto_radix(argStr):
 	return int(argStr, 0)
 	
 	
-def processCmdLine():
+def processCmdLine(argv=None):
 
 	#
 	# note: if you add additional filter options/logic, go to realTimeCapture() to see if those options
@@ -653,13 +926,31 @@ def processCmdLine():
 	# hidden args (because they wont be used often and will complicate users learning the command line - they are documented online)
 	parser.add_argument('--connecttimeout', help=argparse.SUPPRESS, type=int, default=10, required=False)
 	parser.add_argument('--socketreadwritetimeout', help=argparse.SUPPRESS, type=int, default=5, required=False)
+	parser.add_argument('--downloadexec_maxconcurrent', help=argparse.SUPPRESS, type=int, default=DEFAULT_DOWNLOADEXEC_MAX_CONCURRENT, required=False)
+	parser.add_argument('--downloadexec_batchsize', help=argparse.SUPPRESS, type=int, default=0, required=False)
+	parser.add_argument('--downloadexec_batchsecs', help=argparse.SUPPRESS, type=float, default=0, required=False)
 	parser.add_argument('--retrycount', help=argparse.SUPPRESS, type=int, default=sys.maxsize, required=False)
 	parser.add_argument('--retrydelaysecs', help=argparse.SUPPRESS, type=int, default=5, required=False)
 	parser.add_argument('--printstackframes', help=argparse.SUPPRESS, type=str.lower, choices=['no', 'yes'], default='no', required=False)
+	parser.add_argument('--maxdownloadratekbsec', help=argparse.SUPPRESS, type=int, default=0, required=False)
+	parser.add_argument('--downloadratecontrolfile', help=argparse.SUPPRESS, type=str, default=None, required=False)
+	parser.add_argument('--downloadratestatusfile', help=argparse.SUPPRESS, type=str, default=None, required=False)
+	parser.add_argument('--mtpopstatsfile', help=argparse.SUPPRESS, type=str, default=None, required=False)
+	parser.add_argument('--tracefile', help=argparse.SUPPRESS, type=str, default=None, required=False)
+	parser.add_argument('--tracefullpayloads', help=argparse.SUPPRESS, type=str.lower, choices=['no', 'yes'], default='no', required=False)
+	parser.add_argument('--replaymode', help=argparse.SUPPRESS, type=str.lower, choices=['no', 'yes'], default='no', required=False)
+	parser.add_argument('--resumejournal', type=str.lower, choices=['yes', 'no'], help=argparse.SUPPRESS, default='yes', required=False)
 	parser.add_argument('--mtpobjcache', type=str.lower, choices=['enabled', 'writeonly', 'readonly', 'verify', 'disabled'], help=argparse.SUPPRESS, default='enabled', required=False)	
 	parser.add_argument('--mtpobjcache_maxagemins', help=argparse.SUPPRESS, type=int, default=0, required=False) # default is 0=indefinite (never invalidate based on age)
-	parser.add_argument('--maxgetobjtransfersizekb', help=argparse.SUPPRESS, type=int, default=DEFAULT_MAX_KB_PER_GET_OBJECT_REQUEST, required=False)	
+	parser.add_argument('--mtpobjcache_verifysample', help=argparse.SUPPRESS, type=int, default=DEFAULT_MTP_OBJ_CACHE_VERIFY_SAMPLE_SIZE, required=False)
+	parser.add_argument('--maxgetobjtransfersizekb', help=argparse.SUPPRESS, type=int, default=None, required=False)	
 	parser.add_argument('--maxgetobjbuffersizekb', help=argparse.SUPPRESS, type=int, default=DEFAULT_MAX_KB_TO_BUFFER_FOR_GET_OBJECT_REQUESTS, required=False)
+	parser.add_argument('--getobjpipelinedepth', help=argparse.SUPPRESS, type=int, default=None, required=False)
+	parser.add_argument('--getobjpipelinereset', help=argparse.SUPPRESS, type=str.lower, choices=['no', 'yes'], default='no', required=False)
+	parser.add_argument('--getobjinfopipelinedepth', help=argparse.SUPPRESS, type=int, default=DEFAULT_GET_OBJECT_INFO_PIPELINE_DEPTH, required=False)
+	parser.add_argument('--lazyenum', help=argparse.SUPPRESS, type=str.lower, choices=['no', 'yes'], default='no', required=False)
+	parser.add_argument('--overlapenum', help=argparse.SUPPRESS, type=str.lower, choices=['no', 'yes'], default='no', required=False)
+	parser.add_argument('--overlapenumwindow', help=argparse.SUPPRESS, type=int, default=DEFAULT_OVERLAP_ENUM_WINDOW_SIZE, required=False)
 	parser.add_argument('--initcmdreq_guid', help=argparse.SUPPRESS, type=str.lower, default='0x7766554433221100-0x0000000000009988', required=False) # GUID order in string is high-low
 	parser.add_argument('--initcmdreq_hostname', help=argparse.SUPPRESS, type=str, default='airmtp', required=False)
 	parser.add_argument('--initcmdreq_hostver', help=argparse.SUPPRESS, type=conver_int_auto_radix, default=0x00010000, required=False)
@@ -671,6 +962,8 @@ def processCmdLine():
 	parser.add_argument('--rtd_pollingmethod', help=argparse.SUPPRESS, type=int, default=None, required=False)
 	parser.add_argument('--rtd_mtppollingmethod_newobjdetection', help=argparse.SUPPRESS, type=str.lower, choices=['objlist', 'numobjs'], default='objlist', required=False)
 	parser.add_argument('--rtd_maxsecsbeforeforceinitialobjlistget', help=argparse.SUPPRESS, type=int, default=5, required=False)
+	parser.add_argument('--rtd_mtpevents', help=argparse.SUPPRESS, type=str.lower, choices=['no', 'yes'], default='yes', required=False)
+	parser.add_argument('--rtd_mtpeventsfallbackpollsecs', help=argparse.SUPPRESS, type=int, default=30, required=False)
 	parser.add_argument('--ssdp_discoveryattempts', help=argparse.SUPPRESS, type=int, default=3, required=False)
 	parser.add_argument('--ssdp_discoverytimeoutsecsperattempt', help=argparse.SUPPRESS, type=int, default=2, required=False)	
 	parser.add_argument('--ssdp_discoveryflags', help=argparse.SUPPRESS, type=conver_int_auto_radix, default=None, required=False)
@@ -681,13 +974,14 @@ def processCmdLine():
 	#
 	# if there is a default arguments file present, add it to the argument list so that parse_args() will process it
 	#
+	argv = list(sys.argv[1:] if argv == None else argv)
 	defaultArgFilename = os.path.join(g.appDir, "airmtpcmd-defaultopts")
 	if os.path.exists(defaultArgFilename):
-		sys.argv.insert(1, "!" + defaultArgFilename) # insert as first arg (past script name), so that the options in the file can still be overriden by user-entered cmd line options
+		argv.insert(0, "!" + defaultArgFilename) # insert as first arg, so that the options in the file can still be overriden by user-entered cmd line options
 			
 	# perform the argparse
 	try:
-		args = vars(parser.parse_args())
+		args = vars(parser.parse_args(argv))
 	except ArgumentParserError as e:
 		applog_e("Command line error: " + str(e))
 		exitAfterCmdLineError(ERRNO_BAD_CMD_LINE_ARG)	
@@ -718,13 +1012,13 @@ def processCmdLine():
 	# verify syntax of --filenamespec and --dirnamespec
 	if g.args['filenamespec']:
 		try:
-			rename.verifyRenameFormatStringSyntax(g.args['filenamespec'])
+			g.filenameSpecCompiled = rename.verifyRenameFormatStringSyntax(g.args['filenamespec'])
 		except rename.GenerateReplacementNameException as e:
 			applog_e("Error parsing filenamespec: " + str(e))
 			exitAfterCmdLineError(ERRNO_RENAME_ENGINE_PARSING_ERROR)
 	if g.args['dirnamespec']:
 		try:
-			rename.verifyRenameFormatStringSyntax(g.args['dirnamespec'])
+			g.dirnameSpecCompiled = rename.verifyRenameFormatStringSyntax(g.args['dirnamespec'])
 		except rename.GenerateReplacementNameException as e:
 			applog_e("Error parsing dirnamespec: " + str(e))
 			exitAfterCmdLineError(ERRNO_RENAME_ENGINE_PARSING_ERROR)
@@ -733,10 +1027,15 @@ def processCmdLine():
 	if g.args['downloadexec']:
 		try:
 			for argNumber, arg in enumerate(g.args['downloadexec']):
-				rename.verifyRenameFormatStringSyntax(arg)
+				g.downloadExecSpecsCompiled.append(rename.verifyRenameFormatStringSyntax(arg))
 		except rename.GenerateReplacementNameException as e:
 			applog_e("Error parsing downloadexec arg #{:d} \"{:s}\": {:s}".format(argNumber+1, arg, str(e)))
 			exitAfterCmdLineError(ERRNO_RENAME_ENGINE_PARSING_ERROR)
+		g.downloadExecFirstPerFileArgIndex = len(g.downloadExecSpecsCompiled)
+		for argIndex in xrange(1, len(g.downloadExecSpecsCompiled)):
+			if g.downloadExecSpecsCompiled[argIndex].hasSpecifiers():
+				g.downloadExecFirstPerFileArgIndex = argIndex
+				break
 	
 	# verify --downloadexec_options
 	validDownloadExecOptions = [ 'ignorelauncherror', 'wait', 'exitonfailcode', 'delay', 'notildereplacement' ]
@@ -759,8 +1058,20 @@ def processCmdLine():
 	# else we'll set the capture date filters later for realtime operation
 		
 	g.fileTransferOrder = FILE_TRANSFER_ORDER_OLDEST_FIRST if g.args['transferorder']=='oldestfirst' else FILE_TRANSFER_ORDER_NEWEST_FIRST	
-	g.maxGetObjTransferSize = g.args['maxgetobjtransfersizekb'] * 1024
 	g.maxGetObjBufferSize = g.args['maxgetobjbuffersizekb'] * 1024		
+	if g.args['maxdownloadratekbsec'] > 0 or g.args['downloadratecontrolfile'] or g.args['downloadratestatusfile']:
+		g.downloadRateLimiter = DownloadRateLimiter(g.args['maxdownloadratekbsec'] * 1024, g.args['downloadratecontrolfile'], g.args['downloadratestatusfile'])
+	g.getObjInfoPipelineDepth = max(g.args['getobjinfopipelinedepth'], 1)
+	g.args['overlapenumwindow'] = max(g.args['overlapenumwindow'], 1)
+	if g.args['replaymode'] == 'yes':
+		#
+		# we're talking to mtpsim.py replaying a trace (--replay) rather than a camera. the replay
+		# should exercise the same MTP traffic as the original session, so we don't set the clock or
+		# use the object cache, and it shouldn't alter the persistent state (object cache, download
+		# history, learned get-object settings) of the camera the trace was recorded from
+		#
+		g.args['maxclockdeltabeforesync'] = 'disablesync'
+		g.args['mtpobjcache'] = 'disabled'
 	verifyIntegerArgStrOptions('maxclockdeltabeforesync', ['disablesync', 'alwayssync'])	
 	verifyIntegerArgRange('rtd_pollingmethod', 0, REALTIME_DOWNLOAD_METHOD_MAX)
 	
@@ -774,13 +1085,30 @@ def processCmdLine():
 		applog_set_loggingFlags(APPLOGF_LEVEL_INFORMATIONAL | APPLOGF_LEVEL_ERROR | APPLOGF_LEVEL_WARNING | APPLOGF_LEVEL_VERBOSE | APPLOGF_LEVEL_DEBUG)
 
 	# log the cmd line arguments
-	applog_d("Orig cmd line: {:s}".format(str(sys.argv)))
+	applog_d("Orig cmd line: {:s}".format(str(argv)))
 	applog_d("Processed cmd line: {:s}".format(str(g.args)))
 
 
+#
+# decorator for the functions that parse data received from the camera. a response that's
+# shorter than its fields call for or otherwise garbled raises a struct.error (or similar)
+# deep in the parsing - we convert those to an MtpProtocolException so that they're handled
+# (and retried) like any other protocol error rather than terminating the app
+#
+def mtpResponseParser(parseFunc):
+	@functools.wraps(parseFunc)
+	def parseFuncWrapper(*args, **kwargs):
+		try:
+			return parseFunc(*args, **kwargs)
+		except (struct.error, IndexError, KeyError, UnicodeDecodeError) as e:
+			raise mtpwifi.MtpProtocolException("Camera Protocol Error: Malformed data in response, detected by {:s}(): {:s}".format(parseFunc.__name__, str(e)))
+	return parseFuncWrapper
+
+
 #
 # Converts counted utf-16 MTP string to unicode string
 #
+@mtpResponseParser
 def mtpCountedUtf16ToPythonUnicodeStr(data):
 	# format of string: first byte has character length of string inlcuding NULL (# bytes / 2)
 	if not data:
@@ -819,6 +1147,7 @@ def removeLeadingCharsFromStr(str, charsToRemoveSet):
 # where 'list' is the list of entries and 'bytesConsumedFromData' is the number of
 # bytes used from 'data' to generate the list
 #
+@mtpResponseParser
 def parseMtpCountedList(data, elementSizeInBytes):
 
 	elementSizeToUnpackStr = { 1 : 'B', 2 : 'H', 4 : 'I' }
@@ -848,6 +1177,7 @@ def parseMptStorageIds(data):
 #
 # parses the raw data from MTP_OP_GetStorageInfo into a MtpStorageInfo tuple
 #		
+@mtpResponseParser
 def parseMtpStorageInfo(data):
 	(storageType,fileSystemType,accessCapability,maxCapacityBytes,freeSpaceBytes,freeSpaceInImages,storageDescription) = struct.unpack('<HHHQQIB', data[0:27])
 	(volumeLabel,byteLen) = mtpCountedUtf16ToPythonUnicodeStr(data[27:])	
@@ -858,6 +1188,7 @@ def parseMtpStorageInfo(data):
 #
 # parses the raw data from MTP_OP_GetDeviceInfo into a MtpDeviceInfo tuple
 #			
+@mtpResponseParser
 def parseMtpDeviceInfo(data):
 
 	(standardVersion, vendorExtensionID, vendorExtensionVersion) = struct.unpack('<HIH', data[0:8])
@@ -921,13 +1252,14 @@ def mtpSessionKeepAlive(timeProbeLastSent):
 	# for that purpose but Sony cameras will still time'out
 	# the session if we just send those
 	#
-	mtpwifi.execMtpOp(g.socketPrimary, MTP_OP_GetDeviceInfo)
+	mtpwifi.execMtpOp(g.connPrimary, MTP_OP_GetDeviceInfo)
 	return timeCurrent
 
 
 #
 # parses the raw data from MTP_OP_GetObjectInfo into a MtpObjectInfo tuple
 #									
+@mtpResponseParser
 def parseMtpObjectInfo(data):
 
 	(storageId, objectFormat, protectionStatus) = struct.unpack('<IHH', data[0:8])
@@ -951,19 +1283,36 @@ def parseMtpObjectInfo(data):
 						imageBitDepth, parentObject, associationType, \
 						associationDesc, sequenceNumber, filename, \
 						captureDateStr, modificationDateStr)
+
 						
 
 #
-# closes TCP/IP connection sockets to camera's MTP interface
+# closes TCP/IP connections to camera's MTP interface
 #
 def closeSockets():	
-	if g.socketPrimary:
-		g.socketPrimary.close()
-		g.socketPrimary = None
-	if g.socketEvents:
-		g.socketEvents.close()
-		g.socketEvents = None
+	if g.connPrimary:
+		g.connPrimary.close()
+		g.connPrimary = None
+	if g.connEvents:
+		g.connEvents.close()
+		g.connEvents = None
 		
+#
+# returns the recorder that the session's connections are traced to (see mtpwifi.MtpTraceRecorder), creating
+# it on first use. returns None if tracing isn't enabled (--tracefile). the trace covers all the connections
+# of the session, including those of retries, so it can be replayed as a whole by mtpsim.py --replay
+#
+def getTraceRecorder():
+	if g.traceRecorder == None and g.args['tracefile']:
+		g.traceRecorder = mtpwifi.MtpTraceRecorder(g.args['tracefile'], g.args['tracefullpayloads'] == 'yes')
+		applog_v("Tracing MTP/IP traffic to \"{:s}\"".format(g.args['tracefile']))
+	return g.traceRecorder
+
+def closeTraceRecorder():
+	if g.traceRecorder:
+		g.traceRecorder.close()
+		g.traceRecorder = None
+
 #
 # converts a GUID string to a pair of 64-bit values (high/low).
 # the following string formats are support:
@@ -1016,19 +1365,21 @@ def getNumMtpObjects(storageId):
 	# note that Sony cameras require the optional parameters to MTP_OP_GetNumObjects - Canon/Nikon do not
 	# oddly a given Sony wont always reject the absence of the optional parameters
 	#
-	mtpTcpCmdResult = mtpwifi.execMtpOp(g.socketPrimary, MTP_OP_GetNumObjects, struct.pack('<III', storageId, 0, 0)) 
+	mtpTcpCmdResult = mtpwifi.execMtpOp(g.connPrimary, MTP_OP_GetNumObjects, struct.pack('<III', storageId, 0, 0)) 
 	return mtpTcpCmdResult.mtpResponseParameter
 
 
 #
 # retrieves list of MTP object handles for a given storage ID
 #
-def getMtpObjectHandles(storageId):
+def getMtpObjectHandles(storageId, objectFormat=0, parentObjHandle=0):
 	#
 	# note that Sony cameras require the optional parameters to MTP_OP_GetObjectHandles - Canon/Nikon do not
-	# oddly a given Sony wont always reject the absence of the optional parameters
+	# oddly a given Sony wont always reject the absence of the optional parameters. 'objectFormat' of zero
+	# means objects of all formats. 'parentObjHandle' of zero means objects in all folders, MTP_OBJHANDLE_ROOT
+	# means objects in the root folder, otherwise it's the handle of the folder to get the objects of
 	#
-	mtpTcpCmdResult = mtpwifi.execMtpOp(g.socketPrimary, MTP_OP_GetObjectHandles, struct.pack('<III', storageId, 0, 0))
+	mtpTcpCmdResult = mtpwifi.execMtpOp(g.connPrimary, MTP_OP_GetObjectHandles, struct.pack('<III', storageId, objectFormat, parentObjHandle))
 	(objHandlesList, bytesConsumed) = parseMtpCountedWordList(mtpTcpCmdResult.dataReceived)
 	return objHandlesList
 
@@ -1048,7 +1399,7 @@ def getMtpObjectInfo(objHandle, fRetryErrors = True):
 	timeStart = secondsElapsed(None)
 	while True:
 		try:
-			mtpTcpCmdResult = mtpwifi.execMtpOp(g.socketPrimary, MTP_OP_GetObjectInfo, struct.pack('<I', objHandle))
+			mtpTcpCmdResult = mtpwifi.execMtpOp(g.connPrimary, MTP_OP_GetObjectInfo, struct.pack('<I', objHandle))
 			return parseMtpObjectInfo(mtpTcpCmdResult.dataReceived)
 		except mtpwifi.MtpOpExecFailureException as e:
 			if fRetryErrors == False or e.mtpRespCode == MTP_RESP_COMMUNICATION_ERROR:
@@ -1114,27 +1465,27 @@ def startMtpSession():
 	#
 	# open TCP/IP socket connection to camera
 	#
-	g.socketPrimary = mtpwifi.openConnection(ipAddressStr, True, g.args['connecttimeout'], g.args['socketreadwritetimeout'])
+	g.connPrimary = mtpwifi.openConnection(ipAddressStr, True, g.args['connecttimeout'], g.args['socketreadwritetimeout'], g.mtpOpStats, getTraceRecorder())
 
 	#
 	# get session ID
 	#
-	data = mtpwifi.sendInitCmdReq(g.socketPrimary, (guidHigh, guidLow), g.args['initcmdreq_hostname'], g.args['initcmdreq_hostver'])
+	data = mtpwifi.sendInitCmdReq(g.connPrimary, (guidHigh, guidLow), g.args['initcmdreq_hostname'], g.args['initcmdreq_hostver'])
 	(g.sessionId,) = struct.unpack('<I', data[:4])
 	applog_d("Session ID = 0x{:08x}".format(g.sessionId))
 		
 	#
 	# open secondary socket for events
 	#
-	g.socketEvents = mtpwifi.openConnection(ipAddressStr, False, g.args['connecttimeout'], g.args['socketreadwritetimeout'])
-	data = mtpwifi.sendInitEvents(g.socketEvents, g.sessionId)
+	g.connEvents = mtpwifi.openConnection(ipAddressStr, False, g.args['connecttimeout'], g.args['socketreadwritetimeout'], g.mtpOpStats, getTraceRecorder())
+	data = mtpwifi.sendInitEvents(g.connEvents, g.sessionId)
 
 	#
 	# send a probe request on the event socket (not sure why this
 	# is reqiured but failing to do so will cause the MTP session
 	# to hang unless I replace the probe with a one-second delay)
 	#
-	mtpwifi.sendProbeRequest(g.socketEvents)
+	mtpwifi.sendProbeRequest(g.connEvents)
 	
 	#
 	# get device information, which is needed now because some cameras
@@ -1157,7 +1508,7 @@ def startMtpSession():
 		g.sessionId = g.args['opensessionid']		
 	while True:
 		try:
-			mtpwifi.execMtpOp(g.socketPrimary, MTP_OP_OpenSession, struct.pack('<I', g.sessionId))
+			mtpwifi.execMtpOp(g.connPrimary, MTP_OP_OpenSession, struct.pack('<I', g.sessionId))
 			break # successful
 		except mtpwifi.MtpOpExecFailureException as e:
 			if not fSessionIdFromCmdLine and e.mtpRespCode != MTP_RESP_COMMUNICATION_ERROR:
@@ -1188,8 +1539,8 @@ def notifyCameraUserTransferSessionStarting():
 		#
 		if g.args['sonyuniquecmdsenable'] & SONY_UNQIUECMD_ENABLE_SENDING_MSG:
 			data = struct.pack('<5IB', 0x00000002, 0x00000002, 0x00000000, 0x00000000, 0x00020001, 0x00)
-			mtpwifi.execMtpOp(g.socketPrimary, MTP_OP_Sony_Set_Request, struct.pack('<I', 0x4), data)
-			mtpwifi.execMtpOp(g.socketPrimary, MTP_OP_Sony_Get_Request, struct.pack('<I', 0x4))
+			mtpwifi.execMtpOp(g.connPrimary, MTP_OP_Sony_Set_Request, struct.pack('<I', 0x4), data)
+			mtpwifi.execMtpOp(g.connPrimary, MTP_OP_Sony_Get_Request, struct.pack('<I', 0x4))
 
 #
 # notifies the user via the camera that an airmtpcmd transfer sequence has ended
@@ -1231,8 +1582,8 @@ def notifyCameraUserTransferSessionEnding():
 		#
 		if g.args['sonyuniquecmdsenable'] & SONY_UNQIUECMD_ENABLE_UNKNOWN_CMD_1:
 			data = struct.pack('<4I3B', 0x00000000, 0x00000003, 0x00000000, 0x00000000, 0x02, 0x00, 0x30)
-			mtpwifi.execMtpOp(g.socketPrimary, MTP_OP_Sony_Set_Request, struct.pack('<I', 0x4), data)
-			mtpwifi.execMtpOp(g.socketPrimary, MTP_OP_Sony_Get_Request, struct.pack('<I', 0x4))
+			mtpwifi.execMtpOp(g.connPrimary, MTP_OP_Sony_Set_Request, struct.pack('<I', 0x4), data)
+			mtpwifi.execMtpOp(g.connPrimary, MTP_OP_Sony_Get_Request, struct.pack('<I', 0x4))
 
 		#
 		# this command causes a "The saving process has been cancelled." message to be displayed
@@ -1241,8 +1592,8 @@ def notifyCameraUserTransferSessionEnding():
 		#
 		if g.args['sonyuniquecmdsenable'] & SONY_UNQIUECMD_ENABLE_SAVING_PROCESS_CANCELLED_MSG:
 			data = struct.pack('<4I3B', 0x00000000, 0x00000004, 0x00000000, 0x00000000, 0x02, 0x00, 0x00)
-			mtpwifi.execMtpOp(g.socketPrimary, MTP_OP_Sony_Set_Request, struct.pack('<I', 0x4), data)
-			mtpwifi.execMtpOp(g.socketPrimary, MTP_OP_Sony_Get_Request, struct.pack('<I', 0x4))			
+			mtpwifi.execMtpOp(g.connPrimary, MTP_OP_Sony_Set_Request, struct.pack('<I', 0x4), data)
+			mtpwifi.execMtpOp(g.connPrimary, MTP_OP_Sony_Get_Request, struct.pack('<I', 0x4))			
 					
 		#
 		# this causes the camera to leave 'Send to Computer' mode and sleep. this is necessary because the
@@ -1251,8 +1602,8 @@ def notifyCameraUserTransferSessionEnding():
 		#
 		if g.args['camerasleepwhendone'] == 'yes':
 			data = struct.pack('<4I3B', 0x00000000, 0x00000005, 0x00000000, 0x00000000, 0x02, 0x00, 0x30)
-			mtpwifi.execMtpOp(g.socketPrimary, MTP_OP_Sony_Set_Request, struct.pack('<I', 0x4), data)
-			mtpwifi.execMtpOp(g.socketPrimary, MTP_OP_Sony_Get_Request, struct.pack('<I', 0x4))
+			mtpwifi.execMtpOp(g.connPrimary, MTP_OP_Sony_Set_Request, struct.pack('<I', 0x4), data)
+			mtpwifi.execMtpOp(g.connPrimary, MTP_OP_Sony_Get_Request, struct.pack('<I', 0x4))
 		
 		
 #
@@ -1281,7 +1632,7 @@ def endMtpSession():
 	if secsElapsedSinceOpenSession < 1:
 		applog_d("endMtpSession(): Delaying for {:.2f} seconds to work around Nikon bug".format(1 - secsElapsedSinceOpenSession))
 		time.sleep(1 - secsElapsedSinceOpenSession)
-	mtpwifi.execMtpOp(g.socketPrimary, MTP_OP_CloseSession)
+	mtpwifi.execMtpOp(g.connPrimary, MTP_OP_CloseSession)
 
 #
 # called when we determine the make of a camera, this method sets internal flags
@@ -1303,7 +1654,7 @@ def processCameraMakeDetermination():
 # performs a MTP_OP_GetDeviceInfo and saves the information into g.mtpDeviceInfo
 #
 def getMtpDeviceInfo():
-	mtpTcpCmdResult = mtpwifi.execMtpOp(g.socketPrimary, MTP_OP_GetDeviceInfo)	
+	mtpTcpCmdResult = mtpwifi.execMtpOp(g.connPrimary, MTP_OP_GetDeviceInfo)	
 	mtpDeviceInfo = parseMtpDeviceInfo(mtpTcpCmdResult.dataReceived)
 	if g.mtpDeviceInfo:
 		# this is a retry invocation. make sure we're talking with the same camera as before
@@ -1357,7 +1708,7 @@ def getSlotIndexFromStorageId(storageId):
 #	
 def selectMtpStorageId():
 
-	mtpTcpCmdResult = mtpwifi.execMtpOp(g.socketPrimary, MTP_OP_GetStorageIDs)
+	mtpTcpCmdResult = mtpwifi.execMtpOp(g.connPrimary, MTP_OP_GetStorageIDs)
 	mtpStorageIds = parseMptStorageIds(mtpTcpCmdResult.dataReceived)
 	
 	countCardSlots = len(mtpStorageIds.storageIdsList)
@@ -1410,7 +1761,7 @@ def selectMtpStorageId():
 def getMtpStorageInfo():
 	g.mtpStorageInfoList = []
 	if g.storageId != MTP_STORAGEID_ALL_CARDS:
-		mtpTcpCmdResult = mtpwifi.execMtpOp(g.socketPrimary, MTP_OP_GetStorageInfo, struct.pack('<I', g.storageId))
+		mtpTcpCmdResult = mtpwifi.execMtpOp(g.connPrimary, MTP_OP_GetStorageInfo, struct.pack('<I', g.storageId))
 		mtpStorageInfo = parseMtpStorageInfo(mtpTcpCmdResult.dataReceived)
 		applog_d(mtpStorageInfo)
 		g.mtpStorageInfoList.append(mtpStorageInfo)
@@ -1419,7 +1770,7 @@ def getMtpStorageInfo():
 		for i in xrange(0, countCardSlots):
 			storageId = g.mtpStorageIds.storageIdsList[i]
 			if (storageId & MTP_STORAGEID_PresenceBit):				
-				mtpTcpCmdResult = mtpwifi.execMtpOp(g.socketPrimary, MTP_OP_GetStorageInfo, struct.pack('<I', storageId))
+				mtpTcpCmdResult = mtpwifi.execMtpOp(g.connPrimary, MTP_OP_GetStorageInfo, struct.pack('<I', storageId))
 				mtpStorageInfo = parseMtpStorageInfo(mtpTcpCmdResult.dataReceived)
 				applog_d(mtpStorageInfo)
 				g.mtpStorageInfoList.append(mtpStorageInfo)
@@ -1434,90 +1785,95 @@ def deleteFileIgnoreErrors(filename):
 	except:
 		pass
 
+#
+# writes 'obj' as JSON to a temporary file that then replaces 'filename', so that other
+# sessions sharing the file (ex: airmtpdaemon's workers) never read a partially-written copy.
+# the temporary filename is unique to our process/thread in case they're saving concurrently
+#
+def writeJsonFileAtomically(filename, obj, indent=None):
+	filenameTemp = "{:s}.{:d}-{:d}.tmp".format(filename, os.getpid(), threading.current_thread().ident)
+	try:
+		with open(filenameTemp, "w") as f:
+			json.dump(obj, f, indent=indent, sort_keys=True)
+		if hasattr(os, 'replace'):
+			os.replace(filenameTemp, filename)
+		else:
+			# python 2 - os.rename() replaces an existing file except on Windows
+			if os.name == 'nt':
+				deleteFileIgnoreErrors(filename)
+			os.rename(filenameTemp, filename)
+	except:
+		deleteFileIgnoreErrors(filenameTemp)
+		raise
+
 
 #
-# generates and saves a cache of all the MtpObjectInfo(s) we've retrieved this session.
-# this is done to avoid having to re-retrieve these same MtpObjectInfo instances from
-# the camera on subsequent sessions. we generate the cache by serializing the 
-# MtpObjectInfo instances (and handle instances) via python's pickle's module. 
-#		
-MtpObjectInfoCacheTuple = namedtuple('MtpObjectInfoCacheTuple', 'mtpObjectInfoList objHandlesList timeSavedEpoch')
-def saveMtpObjectsToDiskCache():
+# returns the MtpObjCache instance for the camera we're connected to. the cache is a
+# memory-mapped snapshot plus an append-only journal of changes (see mtpobjcache.py) so
+# that each session only reads the objects it needs and only writes the objects that
+# changed since the previous session. caches from versions prior to this format (a
+# pickle of all the objects) are deleted the first time we're called
+#
+def getMtpObjCache():
+	mtpObjCacheFilenameRoot = g.cameraLocalMetadataPathAndRootName + "-objinfo"
+	if g.mtpObjCache == None or g.mtpObjCache.filenameRoot != mtpObjCacheFilenameRoot:
+		deleteFileIgnoreErrors(g.cameraLocalMetadataPathAndRootName + "-objinfocache")
+		if g.mtpObjCache:
+			g.mtpObjCache.close()
+		g.mtpObjCache = mtpobjcache.MtpObjCache(mtpObjCacheFilenameRoot)
+	return g.mtpObjCache
+
+
+#
+# saves the MtpObjectInfo(s) we've retrieved this session to the object cache, to
+# avoid having to re-retrieve these same MtpObjectInfo instances from the camera
+# on subsequent sessions. only the objects that differ from the cache's last saved
+# contents are written
+#
+def saveMtpObjectsToDiskCache(objHandlesToKeepSet=None):
 
 	if g.args['mtpobjcache'] == 'disabled' or g.args['mtpobjcache'] == 'readonly':
 		return None	
 	
-	mtpObjectInfoCacheFilename = g.cameraLocalMetadataPathAndRootName + "-objinfocache"
+	mtpObjCache = getMtpObjCache()
 
 	#
-	# build mtpObjectInfoList[] and objHandlesList[] from the mtpObject entries that were
-	# inserted by buildMtpObjects(). I'm rebuilding the lists here rather than using the
+	# get a dictionary of handle -> mtpObjectInfo of the mtpObject entries that were
+	# inserted by buildMtpObjects(). I'm using all the objects here rather than the
 	# locally-available lists in buildMtpObjects() because I wanted this routine to
-	# be callable in the future outside of just buildMtpObjects()
-	#
-	mtpObjectInfoList = []
-	objHandlesList = []
-	countObjs = MtpObject.getCount()
-	mtpObject = MtpObject.getOldest()
-	for nObjInex in xrange(0, countObjs):
-		mtpObjectInfoList.append(mtpObject.mtpObjectInfo)
-		objHandlesList.append(mtpObject.mtpObjectHandle)
-		mtpObject = mtpObject.getNewer()
-		
-	#
-	# generate the named-tuple (structure) that we'll be serializing to disk. this tuple
-	# contains the mtpObjectInfoList[] and objHandlesList[] lists generated above, plus
-	# a timestamp that can be used to evaluate the age of the cache in future invocations
+	# be callable in the future outside of just buildMtpObjects(). the dictionary builds
+	# each mtpObjectInfo as it's accessed rather than all of them up front
 	#
-	mtpObjectInfoCacheTuple = MtpObjectInfoCacheTuple(mtpObjectInfoList, objHandlesList, time.time())
+	mtpObjectInfoDict = MtpObjectInfoDictView(g.mtpObjects)
 
 	#
-	# build a hash of the tuple, which will be saved in the serialization data with the tuple. this
-	# hash will allow us to validate the integirty of the serialized data when we use load it
-	# on subsequent invocations to use as a cache. this validation is to protect against:
+	# cached objects that don't have an MtpObject are removed from the cache unless the
+	# caller passed their handles in 'objHandlesToKeepSet', such as the cached objects a
+	# lazy enumeration didn't need - otherwise we'd be removing them from the cache
 	#
-	# -> Corruption of the cache data if the user inadvertently modifies the file holding the data
-	# -> Future changes to the content of the cache data (a version number would work but since we're already generating the hash....)
-	# -> Future changes to the python pickle implementation or the algorithm we use
 	#
-	# when loadMtpObjectsInfoCache() load this serialization data he generates a hash of the loaded
-	# data and compares it against the hash that was generated+saved here
-	#
-	mtpObjectInfoCacheAsPickleBytes = pickle.dumps(mtpObjectInfoCacheTuple)	# generate byte array of the tuple
-	hashOfMtpObjectInfoCacheTuple = hashlib.sha512(mtpObjectInfoCacheAsPickleBytes).hexdigest()	# generate a SHA-512 hash digest, represented in hex ASCII
-
-	#
-	# write the serialization data. if any error occurs, either I/O error or pickling/code error,
-	# we close the file and delete it, to prevent any partially-written cache data from lingering
-	# on disk. any error is treated as benign since the cache is not essential to the operation
-	# of the program - it's only a performance optimization
+	# write the changes. any error is treated as benign since the cache is not essential to the
+	# operation of the program - it's only a performance optimization. on an error we delete the
+	# cache in case some (partial) data was written before the exception
 	#
 	try:
-		fMtpObjectCache = open(mtpObjectInfoCacheFilename, "wb")
-		fMtpObjectCache.write(mtpObjectInfoCacheAsPickleBytes)			# write the tuple. note we're using the already-pickled data instead of calling dump(). this is for performance
-		pickle.dump(hashOfMtpObjectInfoCacheTuple, fMtpObjectCache)		# write the SHA-512 hash digest
-		fMtpObjectCache.close()
-	except IOError as e:
-		if fMtpObjectCache:
-			fMtpObjectCache.close()				
-		applog_e("I/O error writing obj hash to {:s}, cache will not be available next session: {:s}".format(mtpObjectInfoCacheFilename, str(e)))
-		deleteFileIgnoreErrors(mtpObjectInfoCacheFilename)	# delete cache in case some (partial) data was written before exception
-	except (ImportError, pickle.PickleError, ValueError, AttributeError):
-		# ImportError if the serialized data refers to a module that doesn't exist (changed module names between versions)
-		# PickleError if the decoding of the serialized data failed (corrupt data, modified format between versions, etc...
-		# ValueError if importing from different pickle protoocl
-		applog_d("Exception serializing obj cache:\n")
-		applog_d(traceback.format_exc())	
-		if fMtpObjectCache:
-			fMtpObjectCache.close()				
-		applog_e("Non-I/O error generating obj hash to {:s}, cache will not be saved.".format(mtpObjectInfoCacheFilename))
-		deleteFileIgnoreErrors(mtpObjectInfoCacheFilename)	# delete cache in case some (partial) data was written before exception
-	applog_d("Saved {:d} MTP objects to disk cache".format(countObjs))
-
-#
-# loads the MtpObjectInfo cache info that was saved to disk on a previous session by
-# saveMtpObjectsToDiskCache(). if the cache is loaded successfully and passes the
-# hashed integrity check then a MtpObjectInfoCacheTuple is returned. note that 
+		countObjsWritten = mtpObjCache.save(mtpObjectInfoDict, objHandlesToKeepSet, lambda objHandle: g.mtpObjects.objectHandleDict[objHandle].isFromMtpObjCache())
+	except (IOError, OSError) as e:
+		applog_e("I/O error writing MTP object cache {:s}, cache will not be available next session: {:s}".format(mtpObjCache.filename, str(e)))
+		mtpObjCache.discard()
+		deleteMtpObjCacheStorageSignature()
+		return
+	if g.mtpObjCacheStorageSignature:
+		saveMtpObjCacheStorageSignature(g.mtpObjCacheStorageSignature)
+	applog_d("Saved {:d} MTP objects to disk cache ({:d} written)".format(len(mtpObjectInfoDict), countObjsWritten))
+
+#
+# loads the MtpObjectInfo cache that was saved to disk on a previous session by
+# saveMtpObjectsToDiskCache(). if the cache is loaded successfully then an MtpObjCacheView
+# is returned, which acts as a read-only dictionary of object handle -> MtpObjectInfo whose
+# entries are only decoded from the memory-mapped cache file as they're looked up. each
+# record of the cache is checksummed so a corrupt record only costs us that record (or the
+# changes from the session that wrote it). note that 
 # even if the cache is loaded successfully the caller must perform his own coherency
 # check to make sure the cache contents are valid vs the objects on the camera. 
 #
@@ -1526,101 +1882,50 @@ def loadMtpObjectInfoCacheFromDisk():
 	if g.args['mtpobjcache'] == 'disabled':
 		return None	
 
-	mtpObjectInfoCacheFilename = g.cameraLocalMetadataPathAndRootName + "-objinfocache"
+	mtpObjCache = getMtpObjCache()
+	if g.args['mtpobjcache'] == 'writeonly':
+		if os.path.exists(mtpObjCache.filename):
+			applog_v("Ignoring found MTP object cache file per user configuration")
+		return None
 	
 	#
-	# read  the serialization data. if any error occurs, either I/O error or pickling/code error 
-	# we close the file. we only delete the file if the hash is corrupt; that way the cache will
-	# still be available on future invocations in case the I/O error we got here was transitory (even
-	# though the file is about to get rewritten anyway once we fetch the objects from the camera and
-	# later call saveMtpObjectsToDiskCache). any error is treated as benign since the cache is not
-	# essential to the operation of the program - it's only a performance optimization
+	# read the cache. on an I/O error we leave the file in place in case the error was
+	# transitory. any error is treated as benign since the cache is not essential to the
+	# operation of the program - it's only a performance optimization
 	#	
-	if os.path.exists(mtpObjectInfoCacheFilename):
-		if g.args['mtpobjcache'] == 'writeonly':
-			applog_v("Ignoring found MTP object cache file per user configuration")
-			return None
-		fMtpObjectCache = None # needed so that exception handlers can know whether the file was opened before the exception and thus needs closing
-		try:
-			fMtpObjectCache = open(mtpObjectInfoCacheFilename, "rb")
-			mtpObjectInfoCacheTuple = pickle.load(fMtpObjectCache)
-			hashOfMtpObjectInfoCacheTuple_Loaded = pickle.load(fMtpObjectCache)
-			fMtpObjectCache.close()
-			
-			mtpObjectInfoCacheAsPickleBytes = pickle.dumps(mtpObjectInfoCacheTuple)
-			hashOfMtpObjectInfoCacheTuple_Calculated = hashlib.sha512(mtpObjectInfoCacheAsPickleBytes).hexdigest()
-		except IOError as e:
-			if fMtpObjectCache:
-				fMtpObjectCache.close()				
-			applog_e("I/O error reading obj hash from {:s}: {:s}".format(mtpObjectInfoCacheFilename, str(e)))
-			return None
-		except:
-			# ImportError if the serialized data refers to a module that doesn't exist (changed module names between versions)
-			# PickleError if the decoding of the serialized data failed (corrupt data, modified format between versions, etc...
-			# ValueError if importing from different pickle protocol
-			# AttributeError if the module name associated with the class/type objects being deserialized can't be found/mismatch
-			# plus any others that the pickle case may throw - need a generic "except" in case I missed any, otherwise we'll
-			# ungracefully throw an exception that terminates the app for what should be handled as discarded-cache case
-			
-			#
-			# note: in v1.1 we moved the appdata for OSX out of app bundle and into user's home directory. this means the data
-			# will be shared between the frozen OSX app and any non-frozen version of airmtp run on the same machine (ie, running
-			# airmtp from source instead of OSX app). in the frozen app this module runs as airmtpcmd (__name__ == airmtpcmd) due
-			# to the OSX wrapper importing it and executing it rather than airmtpcmd being the main execution module,
-			# whereas in all other cases on other platforms and OSX non-frozen this module runs as __main__. this v1.1 change causes
-			# the OSX frozen app's picke load of the objcache to fail with an AttributeError, because the top-level module
-			# associated with 'MtpObjectInfoCacheTuple' will be different (c__main__ vs cairmtpcmd). one fix would be to move
-			# the defintion of 'MtpObjectInfoCacheTuple' into its own module, that way the module in the pickle data would be 
-			# the same no matter how airmtpcmd was run. the problem with this is that the pickle data wouldn't be backwards
-			# compatible with v1.0, which is fine except v1.0 wasn't catching the 'AttributeError' exception for the pickle load,
-			# which means it'll throw an uncaptured exception rather than gracefully discarding the cache and recreate it. for
-			# this reason I'm going to keep the situation as-is and let the OSX frozen vs non-frozen executions recreate the
-			# cache upon experiencing the AttributeError, since that's gracefully handled now in v1.1. plus I don't expect
-			# many users to be running both OSX frozen and non-frozen, and esp not switching between them enough to make the
-			# cache recreation a (performance) issue
-			#
-			applog_d("Exception deserializing obj cache:\n")
-			applog_d(traceback.format_exc())	
-			if fMtpObjectCache:
-				fMtpObjectCache.close()				
-			applog_e("Non-I/O error reading obj hash from {:s}. Cache will be discarded. (err={:s})".format(mtpObjectInfoCacheFilename, str(sys.exc_info()[0])))
-			deleteFileIgnoreErrors(mtpObjectInfoCacheFilename) # delete the potentially corrupt cache
-			return None
-
-		#
-		# cache was read successfully. verify its integrity
-		#
-		if hashOfMtpObjectInfoCacheTuple_Loaded != hashOfMtpObjectInfoCacheTuple_Calculated:			
-			applog_e("Obj cache in {:s} is corrupt - will delete and ignore".format(mtpObjectInfoCacheFilename))
-			fMtpObjectCache.close()
-			deleteFileIgnoreErrors(mtpObjectInfoCacheFilename)	# delete the corrupt cache
-			return None
-			
-		#
-		# have valid cache
-		#
-		cacheAgeSeconds = secondsElapsed(mtpObjectInfoCacheTuple.timeSavedEpoch)
-		
-		# display cache info (verbose/debug)
-		applog_v("MTP Object cache has {:d} objects, age is {:s}".\
-			format(len(mtpObjectInfoCacheTuple.mtpObjectInfoList), str(datetime.timedelta(seconds=cacheAgeSeconds))))
-		if isDebugLog():
-			applog_d("MTP object cache entries [count={:d}]".format(len(mtpObjectInfoCacheTuple.mtpObjectInfoList)))
-			for i in xrange(len(mtpObjectInfoCacheTuple.mtpObjectInfoList)):
-				applog_d("Entry {:4d}, handle = 0x{:08x}: {:s}".format(i, mtpObjectInfoCacheTuple.objHandlesList[i], str(mtpObjectInfoCacheTuple.mtpObjectInfoList[i])))
-				
-		#
-		# ignore (discard) cache if its older than the max configured age
-		#
-		if g.args['mtpobjcache_maxagemins'] != 0 and cacheAgeSeconds/60 >= g.args['mtpobjcache_maxagemins']:
-			applog_v("Discarding MTP object cache due to age (max age is {:s})".format(str(datetime.timedelta(minutes=g.args['mtpobjcache_maxagemins']))))
-			return None
+	try:
+		cachedMtpObjectInfoDict = mtpObjCache.load()
+	except IOError as e:
+		applog_e("I/O error reading MTP object cache {:s}: {:s}".format(mtpObjCache.filename, str(e)))
+		return None
+	except mtpobjcache.MtpObjCacheCorruptException as e:
+		applog_e("{:s} - will delete and ignore".format(str(e)))
+		mtpObjCache.discard()
+		return None
+	if cachedMtpObjectInfoDict == None:
+		return None
 			
-		return mtpObjectInfoCacheTuple
+	#
+	# have valid cache
+	#
+	cacheAgeSeconds = secondsElapsed(mtpObjCache.timeSavedEpoch)
+	
+	# display cache info (verbose/debug)
+	applog_v("MTP Object cache has {:d} objects, age is {:s}".\
+		format(len(cachedMtpObjectInfoDict), str(datetime.timedelta(seconds=cacheAgeSeconds))))
+	if isDebugLog():
+		applog_d("MTP object cache entries [count={:d}]".format(len(cachedMtpObjectInfoDict)))
+		for (i, objHandle) in enumerate(sorted(cachedMtpObjectInfoDict)):
+			applog_d("Entry {:4d}, handle = 0x{:08x}: {:s}".format(i, objHandle, str(cachedMtpObjectInfoDict[objHandle])))
 			
-	else:
+	#
+	# ignore (discard) cache if its older than the max configured age
+	#
+	if g.args['mtpobjcache_maxagemins'] != 0 and cacheAgeSeconds/60 >= g.args['mtpobjcache_maxagemins']:
+		applog_v("Discarding MTP object cache due to age (max age is {:s})".format(str(datetime.timedelta(minutes=g.args['mtpobjcache_maxagemins']))))
 		return None
-
+		
+	return cachedMtpObjectInfoDict
 
 #
 # Loads the MPT object info cache from the previous session (if available) and validates
@@ -1693,10 +1998,28 @@ def loadMtpObjectInfoCacheFromDisk():
 #
 def loadAndValidateMtpObjectInfoCacheFromDisk(objHandlesFromCameraList):
 
-	mtpObjectInfoCacheTuple = loadMtpObjectInfoCacheFromDisk()
-	if not mtpObjectInfoCacheTuple:
+	#
+	# generate the storage signature of the card(s) as they are now. it's saved with the
+	# cache by saveMtpObjectsToDiskCache() and lets a future session recognize that
+	# nothing on the card(s) has changed since then (see below)
+	#
+	g.mtpObjCacheStorageSignature = genMtpObjCacheStorageSignature(objHandlesFromCameraList)
+
+	cachedMtpObjectInfoListDict = loadMtpObjectInfoCacheFromDisk()
+	if cachedMtpObjectInfoListDict == None:
 		# no cache found or it failed its integrity test or usage was disabled by user configuration, etc...
 		return None
+
+	#
+	# fast path - if the storage signature matches the one saved with the cache then the card(s)
+	# have the same object handles and the same free space as when the cache was last known
+	# to be coherent, so nothing has been added, removed or reformatted since then and we can
+	# skip the (relatively slow) per-object checks below. this is the typical case for the
+	# reconnect-and-resume cycles of a session, when the card hasn't changed at all
+	#
+	if g.mtpObjCacheStorageSignature == loadMtpObjCacheStorageSignature():
+		applog_v("MTP object cache validated by storage signature ({:d} objects, unchanged since cache was saved)".format(len(objHandlesFromCameraList)))
+		return cachedMtpObjectInfoListDict
 	
 	#
 	# build a set of the camera's current object handles so that we can quickly do memebership
@@ -1710,31 +2033,20 @@ def loadAndValidateMtpObjectInfoCacheFromDisk(objHandlesFromCameraList):
 	objHandlesFromCameraSet = set(objHandlesFromCameraList) 
 		
 	#
-	# the following loop scans through all the cached objects to perform two tasks:
+	# gather all the cached objects that are directory entries. we validate them by downloading
+	# the objects at those handles and verifying the directories are identical in name, date, etc..
+	# If there is a mismatch then that means the cached object info we have is stale and the cache
+	# needs to be discaded. the cache is memory-mapped, so finding the directory entries doesn't
+	# require decoding the cached info of every object
 	#
-	# 1) Validate all objects that are directory entries by downloading the objects at those handles and verifying
-	#    the directories are identical in name, date, etc.. If there is a mismatch then that means the cached object
-	#    info we have is stale and the cache needs to be discaded
-	#
-	# 2) Builds dictionary that hashes the cached object handles to cached cached MtpObjectInfo objects - we'll use this
-	#    to match up the object handles in the MTP_OP_GetObjectInfo loop to know which objects we have cached and thus
-	#    don't have to fetch from the camera
-	#
-	# The tasks are somewhat unrelated but I'm performing them in the same loop as an optimziation.
-	#
-	bInvalidateCache = False
-	cachedMtpObjectInfoListDict = {}
-	for nObjIndex in xrange(0, len(mtpObjectInfoCacheTuple.mtpObjectInfoList)):
+	objHandlesToVerifyList = []
+	for objHandle in cachedMtpObjectInfoListDict.iterObjHandlesWithAssociationType(MTP_OBJASSOC_GenericFolder):
 	
-		objHandle = mtpObjectInfoCacheTuple.objHandlesList[nObjIndex]
-		cachedMtpObjectInfo = mtpObjectInfoCacheTuple.mtpObjectInfoList[nObjIndex]
-
-		# put cached object in cache dictionary we're building
-		cachedMtpObjectInfoListDict[objHandle] = cachedMtpObjectInfo
-					
-		if mtpObjectInfoCacheTuple.mtpObjectInfoList[nObjIndex].associationType != MTP_OBJASSOC_GenericFolder:
-			# this object is not a directory - nothing more to do with it
-			continue
+		cachedMtpObjectInfo = cachedMtpObjectInfoListDict.get(objHandle)
+		if cachedMtpObjectInfo == None:
+			# cached info for the directory failed its integrity check
+			applog_v("The MTP object cache was detected as stale and will be discarded")
+			return None
 			
 		#
 		# this is a directory object. first make sure that this object handle 
@@ -1745,59 +2057,128 @@ def loadAndValidateMtpObjectInfoCacheFromDisk(objHandlesFromCameraList):
 		#
 		if objHandle not in objHandlesFromCameraSet:
 			applog_d("MTP obj handle 0x{:08x} for cache directory object \"{:s}\" does not exist".format(objHandle, cachedMtpObjectInfo.filename))
-			bInvalidateCache = True
-			break
+			applog_v("The MTP object cache was detected as stale and will be discarded")
+			return None
+		objHandlesToVerifyList.append(objHandle)
+	countDirObjsToVerify = len(objHandlesToVerifyList)
 
+	#
+	# optionally add a random sample of the cached file objects still on the camera to
+	# the objects we verify. verifying directories catches the common cases of a stale
+	# cache (different/reformatted card) - the sample extends that to the files themselves
+	# and lets us report how confident we are that the cached files are coherent
+	#
+	if g.args['mtpobjcache_verifysample'] > 0:
+		objHandlesToVerifySet = set(objHandlesToVerifyList)
+		cachedFileObjHandlesList = [objHandle for objHandle in cachedMtpObjectInfoListDict if objHandle in objHandlesFromCameraSet and objHandle not in objHandlesToVerifySet]
+		objHandlesToVerifyList.extend(random.sample(cachedFileObjHandlesList, min(g.args['mtpobjcache_verifysample'], len(cachedFileObjHandlesList))))
+	countFileObjsToVerify = len(objHandlesToVerifyList) - countDirObjsToVerify
+
+	#
+	# retrieve the objects from the camera (pipelined if enabled - see --getobjinfopipelinedepth)
+	# and compare them against our cached copies
+	#
+	try:
+		for (objHandle, mtpObjectInfo) in getMtpObjectInfosPipelined(objHandlesToVerifyList):
+			cachedMtpObjectInfo = cachedMtpObjectInfoListDict.get(objHandle)
+			applog_d("Validating MTP obj cache object \"{:s}\" on handle 0x{:08x}".format(cachedMtpObjectInfo.filename, objHandle))
+			if mtpObjectInfo != cachedMtpObjectInfo:
+				# mismatches - the most likely cause is the timestamp
+				applog_v("Found mismatch in MTP object cached {:s} \"{:s}\"".format("directory" if cachedMtpObjectInfo.associationType == MTP_OBJASSOC_GenericFolder else "file", cachedMtpObjectInfo.filename))
+				applog_d("    Cached copy: {:s}".format(str(cachedMtpObjectInfo)))
+				applog_d("Downloaded copy: {:s}".format(str(mtpObjectInfo)))
+				applog_v("The MTP object cache was detected as stale and will be discarded")
+				return None
+	except mtpwifi.MtpOpExecFailureException as e:
+		if e.mtpRespCode == MTP_RESP_COMMUNICATION_ERROR:
+			# request failed for reasons other than camera reporting an MPT error on the
+			# cmd itself (ie, delivery of command failed) propagate exception and leave
+			raise
 		#
-		# the directory object handle still exists on the camera. now we need
-		# to perform a MTP_OP_GetObjectInfo of the handle and compare it against
-		# our cached copy to confirm its the same directory/timestamp
-		#		
-		try:
-			applog_d("Validating MTP obj cache directory object \"{:s}\" on handle 0x{:08x}".format(cachedMtpObjectInfo.filename, objHandle))
-			mtpObjectInfo = getMtpObjectInfo(objHandle)
-		except mtpwifi.MtpOpExecFailureException as e:
-			if e.mtpRespCode == MTP_RESP_COMMUNICATION_ERROR:
-				# request failed for reasons other than camera reporting an MPT error on the
-				# cmd itself (ie, delivery of command failed) propagate exception and leave
-				raise
-			#
-			# request failed, which really shouldn't happen because we already know the
-			# object handle should be valid, even if the object data associated with it
-			# might be stale. since we can't determine whether its stale without
-			# successfully completing a MTP_OP_GetObjectInfo we'll just invalidate
-			#
-			applog_d("MTP object cache validation of \"{:s}\" resulted in {:s}".format(cachedMtpObjectInfo.filename, str(e)))
-			bInvalidateCache = True
-			break
-			
-		#
-		# obtained the object data from the camera. now compare against our cached copy
+		# request failed, which really shouldn't happen because we already know the
+		# object handle should be valid, even if the object data associated with it
+		# might be stale. since we can't determine whether its stale without
+		# successfully completing a MTP_OP_GetObjectInfo we'll just invalidate
 		#
-		if mtpObjectInfo != cachedMtpObjectInfo:
-			# mismatches - the most likely cause is the timestamp
-			applog_v("Found mismatch in MTP object cached directory \"{:s}\"".format(cachedMtpObjectInfo.filename))
-			applog_d("    Cached copy: {:s}".format(str(cachedMtpObjectInfo)))
-			applog_d("Downloaded copy: {:s}".format(str(mtpObjectInfo)))
-			bInvalidateCache = True
-			break;
-								
-	if bInvalidateCache:
-		# generate a message if the cache was invalidated for any reason
+		applog_d("MTP object cache validation resulted in {:s}".format(str(e)))
 		applog_v("The MTP object cache was detected as stale and will be discarded")
 		return None
-		
+
 	#
-	# cached passed all the coherency checks. it's good! hopefully :)
+	# cached passed all the coherency checks. it's good! hopefully :). if we verified a sample
+	# of the files report the confidence it gives us - when none of n randomly sampled files
+	# mismatch we can say with 95% confidence that no more than 3/n of the cached files are
+	# stale (the "rule of three")
 	#
+	if countFileObjsToVerify:
+		applog_v("MTP object cache verified {:d} dir(s) and {:d} sampled file(s) - 95% confidence that at most {:.1f}% of cached files are stale".format(\
+			countDirObjsToVerify, countFileObjsToVerify, min(100.0, 300.0 / countFileObjsToVerify)))
 	return cachedMtpObjectInfoListDict
 
 
+#
+# generates a signature of the state of the card(s) in the camera, from the storage info we
+# retrieved this session and the list of object handles. objects being added, removed or
+# modified, a card being swapped or reformatted, etc... will all change at least one of
+# the free space, object count or handles. the signature is a dict of plain types so
+# that it can be saved as JSON
+#
+def genMtpObjCacheStorageSignature(objHandlesFromCameraList):
+	signatureDict = {}
+	signatureDict['storageid'] = g.storageId
+	signatureDict['storages'] = [[mtpStorageInfo.maxCapacityBytes, mtpStorageInfo.freeSpaceBytes, mtpStorageInfo.freeSpaceInImages, mtpStorageInfo.volumeLabel]\
+		for mtpStorageInfo in g.mtpStorageInfoList]
+	signatureDict['numobjs'] = len(objHandlesFromCameraList)
+	signatureDict['handlescrc'] = zlib.crc32(struct.pack('<' + 'I'*len(objHandlesFromCameraList), *sorted(objHandlesFromCameraList))) & 0xffffffff
+	return signatureDict
+
+def getMtpObjCacheStorageSignatureFilename():
+	return g.cameraLocalMetadataPathAndRootName + "-objinfosig"
+
+def loadMtpObjCacheStorageSignature():
+	try:
+		with open(getMtpObjCacheStorageSignatureFilename(), "r") as f:
+			signatureDict = json.load(f)
+		if isinstance(signatureDict, dict):
+			return signatureDict
+	except (IOError, ValueError) as e:
+		pass # file doesn't exist yet or is corrupt
+	return None
+
+def saveMtpObjCacheStorageSignature(signatureDict):
+	try:
+		with open(getMtpObjCacheStorageSignatureFilename(), "w") as f:
+			json.dump(signatureDict, f, sort_keys=True)
+	except IOError as e:
+		applog_d("Unable to save MTP object cache storage signature: {:s}".format(str(e)))
+
+def deleteMtpObjCacheStorageSignature():
+	deleteFileIgnoreErrors(getMtpObjCacheStorageSignatureFilename())
+
+
+#
+# generator that retrieves the MtpObjectInfo for each handle in a list, yielding (handle, MtpObjectInfo)
+# tuples. the requests are pipelined if enabled (see --getobjinfopipelinedepth)
+#
+def getMtpObjectInfosPipelined(objHandlesList):
+	countInfosRetrieved = 0
+	try:
+		for mtpTcpCmdResult in mtpwifi.execMtpOpPipelined(g.connPrimary, MTP_OP_GetObjectInfo,\
+			(struct.pack('<I', objHandle) for objHandle in objHandlesList), g.getObjInfoPipelineDepth):
+			yield (objHandlesList[countInfosRetrieved], parseMtpObjectInfo(mtpTcpCmdResult.dataReceived))
+			countInfosRetrieved += 1
+	except mtpwifi.MtpProtocolException as e:
+		if g.getObjInfoPipelineDepth > 1:
+			applog_v("Error during pipelined object info retrieval - falling back to a pipeline depth of 1")
+			g.getObjInfoPipelineDepth = 1
+		raise
+
+
 #
 # creates an MTP object instance for a given MTP handle, optionally recursing to create
 # the MTP objects for the directory tree referenced by the object
 # 
-def createMtpObjectFromHandle(objHandle, createMtpObjectStatsStruct=None, cachedMtpObjectInfoListDict=None, fFindAndCreateAntecendentDirs=True, mtpObjectInfo=None):
+def createMtpObjectFromHandle(objHandle, createMtpObjectStatsStruct=None, cachedMtpObjectInfoListDict=None, fFindAndCreateAntecendentDirs=True, mtpObjectInfo=None, prefetchedMtpObjectInfoDict=None):
 
 	if not createMtpObjectStatsStruct:
 		# use dummy local copy
@@ -1816,20 +2197,24 @@ def createMtpObjectFromHandle(objHandle, createMtpObjectStatsStruct=None, cached
 		createMtpObjectStatsStruct.countMtpObjectsAlreadyExisting += 1
 	else:
 		fIsInCache = False
+		if mtpObjectInfo == None and prefetchedMtpObjectInfoDict and objHandle in prefetchedMtpObjectInfoDict:
+			# info for this object was retrieved by prefetchMtpObjectInfos()
+			mtpObjectInfo = prefetchedMtpObjectInfoDict.pop(objHandle)
 		if mtpObjectInfo == None: # caller didn't already retrieive the info for this object
-			fIsInCache = cachedMtpObjectInfoListDict and (objHandle in cachedMtpObjectInfoListDict)
+			cachedMtpObjectInfo = cachedMtpObjectInfoListDict.get(objHandle) if cachedMtpObjectInfoListDict else None # single lookup - the cache decodes the entry on each lookup
+			fIsInCache = cachedMtpObjectInfo != None
 			if fIsInCache and g.args['mtpobjcache'] != 'verify':
 				# found mtpObjectInfo for this handle in the cache - use cached copy
 				applog_d("Found objHandle 0x{:08x} in cache".format(objHandle))
-				mtpObjectInfo = cachedMtpObjectInfoListDict[objHandle]
+				mtpObjectInfo = cachedMtpObjectInfo
 			else:
 				# didn't find mtpObjectInfo for this handle in the cache or we're validating cache - get the mtpObjectInfo from the camera
 				mtpObjectInfo = getMtpObjectInfo(objHandle)
 				if fIsInCache:
 					# we're validating cache
-					if mtpObjectInfo != cachedMtpObjectInfoListDict[objHandle]:
-						applog_e("Found MTP object cache mismatch for \"{:s}\" vs  \"{:s}\"".format(mtpObjectInfo.filename, cachedMtpObjectInfoListDict[objHandle].filename))
-						applog_e("    Cached copy: {:s}".format(str(cachedMtpObjectInfoListDict[objHandle])))
+					if mtpObjectInfo != cachedMtpObjectInfo:
+						applog_e("Found MTP object cache mismatch for \"{:s}\" vs  \"{:s}\"".format(mtpObjectInfo.filename, cachedMtpObjectInfo.filename))
+						applog_e("    Cached copy: {:s}".format(str(cachedMtpObjectInfo)))
 						applog_e("Downloaded copy: {:s}".format(str(mtpObjectInfo)))
 						sys.exit(ERRNO_MTP_OBJ_CACHE_VALIDATE_FAILED)
 
@@ -1839,13 +2224,14 @@ def createMtpObjectFromHandle(objHandle, createMtpObjectStatsStruct=None, cached
 		#
 		if fFindAndCreateAntecendentDirs and mtpObjectInfo.parentObject and MtpObject.getByMtpObjectHandle(mtpObjectInfo.parentObject)==None:
 			applog_d("Recursing to get parent dir of \"{:s}\" - objHandle=0x{:08x}, parent=0x{:08x}".format(mtpObjectInfo.filename, objHandle, mtpObjectInfo.parentObject))
-			createMtpObjectFromHandle(mtpObjectInfo.parentObject, createMtpObjectStatsStruct, cachedMtpObjectInfoListDict, fFindAndCreateAntecendentDirs)				
+			createMtpObjectFromHandle(mtpObjectInfo.parentObject, createMtpObjectStatsStruct, cachedMtpObjectInfoListDict, fFindAndCreateAntecendentDirs, prefetchedMtpObjectInfoDict=prefetchedMtpObjectInfoDict)
 
 		#
 		# create instance of MtpObject for this MtpObjectInfo
 		#
 		mtpObj = MtpObject(objHandle, mtpObjectInfo)
 		if fIsInCache:
+			mtpObj.setAsFromMtpObjCache() # info matches the cache ('verify' exits above if it doesn't)
 			createMtpObjectStatsStruct.countCacheHits += 1
 			
 	createMtpObjectStatsStruct.countObjectsProcessed += 1
@@ -1853,17 +2239,170 @@ def createMtpObjectFromHandle(objHandle, createMtpObjectStatsStruct=None, cached
 	return mtpObj
 
 	
+#
+# retrieves the MtpObjectInfo for a list of handles using pipelined MTP_OP_GetObjectInfo
+# requests (up to g.getObjInfoPipelineDepth in flight), adding the results to
+# prefetchedMtpObjectInfoDict for createMtpObjectFromHandle() to consume. handles which
+# already have an MtpObject or which are in the object cache are skipped. if the camera
+# fails one of the requests we stop prefetching - createMtpObjectFromHandle() will then
+# retrieve the remaining infos one at a time via getMtpObjectInfo(), which retries errors.
+# returns the number of infos retrieved
+#
+def prefetchMtpObjectInfos(objHandlesList, cachedMtpObjectInfoListDict, prefetchedMtpObjectInfoDict):
+	objHandlesToFetch = [objHandle for objHandle in objHandlesList if objHandle not in prefetchedMtpObjectInfoDict and\
+		not MtpObject.getByMtpObjectHandle(objHandle) and not (cachedMtpObjectInfoListDict and objHandle in cachedMtpObjectInfoListDict)]
+	countInfosRetrieved = 0
+	try:
+		for (objHandle, mtpObjectInfo) in getMtpObjectInfosPipelined(objHandlesToFetch):
+			prefetchedMtpObjectInfoDict[objHandle] = mtpObjectInfo
+			countInfosRetrieved += 1
+	except mtpwifi.MtpOpExecFailureException as e:
+		if e.mtpRespCode == MTP_RESP_COMMUNICATION_ERROR:
+			raise
+		applog_d("prefetchMtpObjectInfos(): {:s} for objHandle 0x{:08x}, remaining infos will be retrieved individually".format(\
+			getMtpRespDesc(e.mtpRespCode), objHandlesToFetch[countInfosRetrieved]))
+	return countInfosRetrieved
+
 #
 # creates MTP object instances for each handle in a list
 # 
-def createMtpObjectsFromHandleList(objHandlesList, createMtpObjectStatsStruct=None, cachedMtpObjectInfoListDict=None, fFindAndCreateAntecendentDirs=True):
+def createMtpObjectsFromHandleList(objHandlesList, createMtpObjectStatsStruct=None, cachedMtpObjectInfoListDict=None, fFindAndCreateAntecendentDirs=True, fReportRetrievalRate=True):
+
+	if not createMtpObjectStatsStruct:
+		# use dummy local copy
+		createMtpObjectStatsStruct = CreateMtpObjectStatsStruct()
+	countObjectsProcessedAtStart = createMtpObjectStatsStruct.countObjectsProcessed
+	countNonCameraObjectsAtStart = createMtpObjectStatsStruct.countCacheHits + createMtpObjectStatsStruct.countMtpObjectsAlreadyExisting
+	timeStart = secondsElapsed(None)
+
+	prefetchedMtpObjectInfoDict = {}
 	numObjectHandles = len(objHandlesList)
 	for nObjIndex in xrange(0, numObjectHandles):
 		consoleWriteLine("\rRetrieving list of images/files from camera: {:d}/{:d}     ".format(nObjIndex, numObjectHandles))
-		createMtpObjectFromHandle(objHandlesList[nObjIndex], createMtpObjectStatsStruct, cachedMtpObjectInfoListDict, fFindAndCreateAntecendentDirs)
+		if g.getObjInfoPipelineDepth > 1 and nObjIndex % GET_OBJECT_INFO_PREFETCH_BATCH_SIZE == 0:
+			prefetchMtpObjectInfos(objHandlesList[nObjIndex:nObjIndex+GET_OBJECT_INFO_PREFETCH_BATCH_SIZE], cachedMtpObjectInfoListDict, prefetchedMtpObjectInfoDict)
+		createMtpObjectFromHandle(objHandlesList[nObjIndex], createMtpObjectStatsStruct, cachedMtpObjectInfoListDict, fFindAndCreateAntecendentDirs, prefetchedMtpObjectInfoDict=prefetchedMtpObjectInfoDict)
 	consoleClearLine()
+
+	#
+	# report the rate at which we retrieved object infos from the camera, to help tune
+	# the enumeration for each model (see --getobjinfopipelinedepth)
+	#
+	countObjectsFromCamera = (createMtpObjectStatsStruct.countObjectsProcessed - countObjectsProcessedAtStart) -\
+		(createMtpObjectStatsStruct.countCacheHits + createMtpObjectStatsStruct.countMtpObjectsAlreadyExisting - countNonCameraObjectsAtStart)
+	if countObjectsFromCamera and fReportRetrievalRate:
+		elapsedTimeSecs = secondsElapsed(timeStart)
+		applog_v("Retrieved info for {:d} objects from camera in {:.2f} seconds ({:.1f} objects/sec, pipeline depth {:d})".format(\
+			countObjectsFromCamera, elapsedTimeSecs, countObjectsFromCamera / elapsedTimeSecs if elapsedTimeSecs else 0, g.getObjInfoPipelineDepth))
 		
 
+#
+# determines if a camera folder name passes the user's --onlyfolders/--excludefolders
+# filters, which apply to the immediate folder an object is in. this mirrors the folder
+# checks in doesMtpObjectPassUserFileFilter()
+#
+def doesCameraFolderPassUserFolderFilter(cameraFolder):
+	if cameraFolder == "":
+		cameraFolder = "<ROOT>"
+	if g.args['onlyfolders'] and cameraFolder not in g.args['onlyfolders']:
+		return False
+	if g.args['excludefolders'] and cameraFolder in g.args['excludefolders']:
+		return False
+	return True
+
+#
+# used by lazyEnumTrimFolderObjHandlesByDate() to binary-search a folder's handles (in
+# ascending order) by capture date. returns the index of the first handle whose capture
+# date is >= 'dateEpoch' (or > 'dateEpoch' if 'fAfter'). every handle probed is recorded
+# in probedDict (index -> capture date), which the caller uses to confirm the dates
+# actually follow the handle order
+#
+def lazyEnumBisectObjHandlesByDate(objHandlesList, dateEpoch, fAfter, createMtpObjectStatsStruct, cachedMtpObjectInfoListDict, probedDict):
+	lo = 0
+	hi = len(objHandlesList)
+	while lo < hi:
+		mid = (lo+hi) // 2
+		if mid not in probedDict:
+			probedDict[mid] = createMtpObjectFromHandle(objHandlesList[mid], createMtpObjectStatsStruct, cachedMtpObjectInfoListDict).captureDateEpoch
+		if probedDict[mid] < dateEpoch or (fAfter and probedDict[mid] == dateEpoch):
+			lo = mid+1
+		else:
+			hi = mid
+	return lo
+
+#
+# narrows a folder's object handles to those likely in the user's --startdate/--enddate range,
+# relying on the observation that cameras assign handles in increasing order as files are
+# created, so handle order follows capture-date order. we binary-search for the range and
+# then make sure every capture date we looked at during the search is consistent with
+# that ordering - if not (ex: files copied onto the card, clock changes, etc...) we don't
+# trust the heuristic for this folder and return all its handles
+#
+def lazyEnumTrimFolderObjHandlesByDate(objHandlesList, createMtpObjectStatsStruct, cachedMtpObjectInfoListDict):
+	if len(objHandlesList) < LAZY_ENUM_MIN_FOLDER_OBJS_FOR_DATE_SEARCH:
+		return objHandlesList
+	objHandlesList = sorted(objHandlesList)
+	probedDict = {}
+	startIndex = 0
+	endIndex = len(objHandlesList)
+	if g.objfilter_dateStartEpoch != None:
+		startIndex = lazyEnumBisectObjHandlesByDate(objHandlesList, g.objfilter_dateStartEpoch, False, createMtpObjectStatsStruct, cachedMtpObjectInfoListDict, probedDict)
+	if g.objfilter_dateEndEpoch != None:
+		endIndex = lazyEnumBisectObjHandlesByDate(objHandlesList, g.objfilter_dateEndEpoch, True, createMtpObjectStatsStruct, cachedMtpObjectInfoListDict, probedDict)
+	probedDatesInHandleOrder = [probedDict[index] for index in sorted(probedDict)]
+	if 0 in probedDatesInHandleOrder or probedDatesInHandleOrder != sorted(probedDatesInHandleOrder):
+		applog_d("lazyEnumTrimFolderObjHandlesByDate(): capture dates don't follow handle order, using all {:d} handles".format(len(objHandlesList)))
+		return objHandlesList
+	applog_d("lazyEnumTrimFolderObjHandlesByDate(): narrowed {:d} handles to {:d} after {:d} probes".format(len(objHandlesList), max(endIndex-startIndex, 0), len(probedDict)))
+	return objHandlesList[startIndex:endIndex]
+
+#
+# lazy enumeration - instead of retrieving the MtpObjectInfo of every object on the card we
+# first retrieve only the folder objects, use them to prune whole folders by the user's
+# --onlyfolders/--excludefolders filters (and folders created after --enddate), then list
+# the objects in each remaining folder and narrow those by --startdate/--enddate using
+# the handle ordering heuristic above. returns the list of handles whose info should be
+# retrieved, or None if the camera doesn't support the folder-specific forms of
+# MTP_OP_GetObjectHandles, in which case the caller should fall back to a full enumeration
+#
+def lazyEnumCandidateMtpObjectHandles(fullObjHandlesList, createMtpObjectStatsStruct, cachedMtpObjectInfoListDict):
+
+	timeStart = secondsElapsed(None)
+	try:
+		folderObjHandlesList = getMtpObjectHandles(g.storageId, MTP_OBJFORMAT_Assocation, 0)
+		createMtpObjectsFromHandleList(folderObjHandlesList, createMtpObjectStatsStruct, cachedMtpObjectInfoListDict, True)
+		folderObjHandlesSet = set(folderObjHandlesList)
+		for folderObjHandle in folderObjHandlesList:
+			if MtpObject.getByMtpObjectHandle(folderObjHandle).mtpObjectInfo.objectFormat != MTP_OBJFORMAT_Assocation:
+				# camera ignored the object format we asked for
+				applog_d("lazyEnumCandidateMtpObjectHandles(): camera returned non-folder objects for folder list")
+				return None
+
+		candidateObjHandlesList = []
+		fullObjHandlesSet = set(fullObjHandlesList)
+		folderObjHandlesToListList = [(MTP_OBJHANDLE_ROOT, "")] + [(folderObjHandle, MtpObject.getByMtpObjectHandle(folderObjHandle).mtpObjectInfo.filename) for folderObjHandle in folderObjHandlesList]
+		for (folderObjHandle, folderName) in folderObjHandlesToListList:
+			if not doesCameraFolderPassUserFolderFilter(folderName):
+				applog_d("lazyEnumCandidateMtpObjectHandles(): skipping folder \"{:s}\" per folder filters".format(folderName))
+				continue
+			if folderObjHandle != MTP_OBJHANDLE_ROOT and g.objfilter_dateEndEpoch != None and MtpObject.getByMtpObjectHandle(folderObjHandle).captureDateEpoch > g.objfilter_dateEndEpoch:
+				# folder was created after the end date, so all its files were as well
+				applog_d("lazyEnumCandidateMtpObjectHandles(): skipping folder \"{:s}\" - created after end date".format(folderName))
+				continue
+			objHandlesInFolderList = [objHandle for objHandle in getMtpObjectHandles(g.storageId, 0, folderObjHandle)\
+				if objHandle not in folderObjHandlesSet and objHandle in fullObjHandlesSet]
+			candidateObjHandlesList.extend(lazyEnumTrimFolderObjHandlesByDate(objHandlesInFolderList, createMtpObjectStatsStruct, cachedMtpObjectInfoListDict))
+
+	except mtpwifi.MtpOpExecFailureException as e:
+		if e.mtpRespCode == MTP_RESP_COMMUNICATION_ERROR:
+			raise
+		applog_d("lazyEnumCandidateMtpObjectHandles(): {:s}, falling back to full enumeration".format(getMtpRespDesc(e.mtpRespCode)))
+		return None
+
+	applog_v("Lazy enumeration selected {:d} of {:d} objects in {:.2f} seconds".format(len(candidateObjHandlesList), len(fullObjHandlesList), secondsElapsed(timeStart)))
+	return candidateObjHandlesList
+
+
 #
 # Enumerates all MTP objects on the camera, creating instances of our MtpObject()
 # class for each object found.
@@ -1890,6 +2429,18 @@ def createMtpObjectsFromHandleList(objHandlesList, createMtpObjectStatsStruct=No
 # for details on how we maintain coherency of the cache.
 #		
 def buildMtpObjects(fReportObjectTotals=True):
+	for windowObjHandlesList in buildMtpObjectsInWindows(fReportObjectTotals):
+		pass
+
+#
+# generator that does the work of buildMtpObjects(). if 'objHandlesWindowSize' is specified
+# the objects are created in windows of that many handles, yielding the list of handles
+# in each window once its objects have been created. this lets the caller act on
+# the objects (ie, download them) while the rest are still being enumerated - see
+# genMtpObjectsOverlappedWithEnumeration(). without a window size all the objects
+# are created in a single window
+#
+def buildMtpObjectsInWindows(fReportObjectTotals=True, objHandlesWindowSize=None):
 
 	#
 	# get full list of MTP objects for storage ID
@@ -1908,7 +2459,7 @@ def buildMtpObjects(fReportObjectTotals=True):
 		#
 		if MTP_OP_GetTransferList in g.mtpDeviceInfo.operationsSupportedSet or g.cameraMake == CAMERA_MAKE_NIKON: 
 			try:
-				mtpTcpCmdResult = mtpwifi.execMtpOp(g.socketPrimary, MTP_OP_GetTransferList)
+				mtpTcpCmdResult = mtpwifi.execMtpOp(g.connPrimary, MTP_OP_GetTransferList)
 				(objHandlesListToGet, bytesConsumed) = parseMtpCountedWordList(mtpTcpCmdResult.dataReceived)
 				numObjectHandlesToGet = len(objHandlesListToGet)
 				g.fAllObjsAreFromCameraTransferList = True
@@ -1954,10 +2505,33 @@ def buildMtpObjects(fReportObjectTotals=True):
 	cachedMtpObjectInfoListDict = loadAndValidateMtpObjectInfoCacheFromDisk(fullObjHandlesList)
 
 	#
-	# create the MTP objects, downloading those not already in cache
+	# if lazy enumeration is enabled and the user's filters allow us to skip objects, narrow
+	# the list of objects we need to retrieve info for (see lazyEnumCandidateMtpObjectHandles)
 	#
 	createMtpObjectStatsStruct = CreateMtpObjectStatsStruct()
-	createMtpObjectsFromHandleList(objHandlesListToGet, createMtpObjectStatsStruct, cachedMtpObjectInfoListDict, True)		
+	fLazyEnum = False
+	if g.args['lazyenum'] == 'yes' and not g.fAllObjsAreFromCameraTransferList and\
+		(g.args['onlyfolders'] or g.args['excludefolders'] or g.objfilter_dateStartEpoch != None or g.objfilter_dateEndEpoch != None):
+		candidateObjHandlesList = lazyEnumCandidateMtpObjectHandles(fullObjHandlesList, createMtpObjectStatsStruct, cachedMtpObjectInfoListDict)
+		if candidateObjHandlesList != None:
+			objHandlesListToGet = candidateObjHandlesList
+			fLazyEnum = True
+
+	#
+	# create the MTP objects, downloading those not already in cache. when creating in windows
+	# for --transferorder newestfirst we start with the highest handles, since cameras assign
+	# handles in increasing order as files are created
+	#
+	if objHandlesWindowSize:
+		if g.fileTransferOrder == FILE_TRANSFER_ORDER_NEWEST_FIRST:
+			objHandlesListToGet = sorted(objHandlesListToGet, reverse=True)
+		for nWindowStart in xrange(0, len(objHandlesListToGet), objHandlesWindowSize):
+			windowObjHandlesList = objHandlesListToGet[nWindowStart:nWindowStart+objHandlesWindowSize]
+			createMtpObjectsFromHandleList(windowObjHandlesList, createMtpObjectStatsStruct, cachedMtpObjectInfoListDict, True, False)
+			yield windowObjHandlesList
+	else:
+		createMtpObjectsFromHandleList(objHandlesListToGet, createMtpObjectStatsStruct, cachedMtpObjectInfoListDict, True)
+		yield objHandlesListToGet
 	if fReportObjectTotals or isDebugLog(): # always report object totals when debug logging is enabled
 		applog_i("Processed info for {:d} files/dirs [{:d} from object cache, {:d} previous]".format(\
 			createMtpObjectStatsStruct.countObjectsProcessed, createMtpObjectStatsStruct.countCacheHits, createMtpObjectStatsStruct.countMtpObjectsAlreadyExisting))
@@ -1978,6 +2552,10 @@ def buildMtpObjects(fReportObjectTotals=True):
 		else:
 			applog_d("Not updating MPT cache for transferlist items")
 		g.lastFullMtpHandleListProcessedByBuildMtpObjects = None
+	elif fLazyEnum:
+		# keep the cached info for the objects lazy enumeration skipped that are still on the camera, unless the cache was stale
+		saveMtpObjectsToDiskCache(set(fullObjHandlesList) if cachedMtpObjectInfoListDict != None else None)
+		g.lastFullMtpHandleListProcessedByBuildMtpObjects = fullObjHandlesList
 	else:
 		saveMtpObjectsToDiskCache()
 		g.lastFullMtpHandleListProcessedByBuildMtpObjects = fullObjHandlesList
@@ -2022,41 +2600,34 @@ def promptWithSingleKeyResponse(promptStr, validKeyListStr):
 
 	
 #
-# Open/create download history file for this camera. We use this file to track
+# Open/create download history for this camera. We use the history to track
 # which images we've alread downloaded in previous invocations, allowing the
 # user to optionally skip these files for this or future invocations. 
 #
-# The history file contains one line of text for every file downloaded. The text
-# is separated into two areas - a 'key area' and an 'additional info' area. The key
-# area doubles as a unique identifier for a particular file along with holding
-# information about the file. The 'addtional info' area has extra info about the
-# download of the file, including a time stamp of when it was download and the path
-# it was downloaded to.
+# The history has one entry for every file downloaded. Each entry has a key
+# that doubles as a unique identifier for a particular file along with holding
+# information about the file, plus extra info about the download of the file,
+# including a time stamp of when it was download and the path it was downloaded to.
 #
-# Here's the format of the history line for a file:
+# Here's the format of the key for a file:
 #
-# 	localFilenameWithoutPath::MTP capture data str::Size in human-readable comma form::::download date/time string::outputDirPathAbsolute
+# 	localFilenameWithoutPath::MTP capture data str::Size in human-readable comma form
 #
 # Examples:
-#	DSC_0094.NEF::20150804T120900::22,719,774:::05/05/15 13:44::c:\pics
-#	DSC_2570.JPG.sthumb.jpg::20150828T112418::3,419,512::::09/02/15 22:22:43::c:\pics\vacation
+#	DSC_0094.NEF::20150804T120900::22,719,774
+#	DSC_2570.JPG.sthumb.jpg::20150828T112418::3,419,512
 #
-# The 'key area' and 'additional info area' are demarcated by four consecutive colons.
-# Each field within those areas are separated by two consecutive colons. The 'key area'
-# has enough information to uniquely identify a file and protect against false history
+# The key has enough information to uniquely identify a file and protect against false history
 # positives/negatives, since it's the combination of the (camera-generated) filename,
 # capture date+time, and file size. The likelihood that the camera's reuse of the filename will 
 # have the same capture date+time and size should be nearly impossible.
 #
-# Generation of the history text to store in the history file is simple. Loading and using that
-# history for the skip-alreayd-downloaded feature (on subsequent sessions) requires a little more
-# work. To accomplish this we load and parse the file into a Python dictionary, with the 'key area'
-# serving as the dictionary key and the 'addtional info area' serving as the value. Before downloading
-# a file we build the history key and additional area strings for this session and then do a membership
-# test of the key string against the dictionary we built from the history; if the keys match and
-# we've been instructed to skip matches for this session then we wont download the file. If those
-# conditions aren't met then we do download the file and then use the built key/additional area strings
-# to generate the history event in the file.
+# The history is stored in an indexed database (see dlhistory.py) rather than loaded into
+# memory - before downloading a file we build the history key for the file and look it up; if
+# the key is found and we've been instructed to skip matches for this session then we wont download
+# the file. If those conditions aren't met then we do download the file and then add an entry for
+# it to the history. Histories from versions prior to the database (a text file with a line for
+# each entry) are migrated into the database the first time it's opened.
 #
 # Some additional notes:
 #
@@ -2067,75 +2638,113 @@ def promptWithSingleKeyResponse(promptStr, validKeyListStr):
 # Even if we've been instructed to ignore the history this session (ie, to download files even if
 # they're in the history), we still store entries for files we download this session, to support
 # the ability of future sessions to skip these files if the user desires.
+#
+# In --replaymode the camera's history is left alone - we use an empty in-memory history instead
 #	
-def loadDownloadHistory():
-	downloadHistoryFilename = g.cameraLocalMetadataPathAndRootName + "-downloadhist";
-	if g.downloadHistoryDict:
-		downloadHistoryDict = g.downloadHistoryDict # we already have download history loaded this session
+def openDownloadHistory():
+	if g.args['replaymode'] == 'yes':
+		(downloadHistoryDbFilename, legacyTextFilename) = (":memory:", None)
 	else:
-		downloadHistoryDict = dict() # in case load fails we'll return an empty dictionary
-		if (os.path.exists(downloadHistoryFilename)):
-			if g.args['downloadhistory'] == 'clear':
-				#
-				# user instructed clearing the history file. we'll delete the file but then recreate it to allow
-				# history to be generated for the files we download this session. since we're deleting the history
-				# file there wont be any history to use for this session, thus no files will be skipped this session
-				#
-				applog_v("Deleting download history file \"{:s}\" per user configuration".format(downloadHistoryFilename))
-				os.remove(downloadHistoryFilename)
-			else:
-				#
-				# load download history into a dictionary. the 'downloadHistoryDict =' composite below separates the
-				# 'key area' and 'additional info area' so that a dictionary entry is created for each line in the file.
-				# here is a break-down of that line to make it easier to understand:
-				#
-				#   downloadHistoryDict = { for line in f } - the entire block is in curly braces, indicating a dictionary is
-				#	being built. The expression starts by reading a line from the file into variable 'line'
-				#
-				# 	The left side of the expression then builds the key from the string loaded into 'line':
-				#
-				#		"{:s}".format(line[0:line.index("::::")])
-				#		The 0: specifies the string starts at character 0. The end of the string is determined by
-				#		line.index(":::"), which does a forward pattern match looking for the ":::" separator between the
-				#		'key area' and 'additional info' area. index() returns the starting character position of the ":::",
-				#		which serves as our ending subscript for the string of the 'key area'. The "{:s}" isn't really
-				#		necessary but makes clear that the expression results in a string.
-				#
-				#	The right side of the expression then builds the 'additonal info area' from the string loaded into 'line':
-				#
-				#		"{:s}".format(line[line.index("::::", 0)+4: line.rindex("\n")])
-				#		The line.index(":::", 0)+4 does the same pattern match performed on the key to find the same separator,
-				#		but this time adds 4 to the result to get the starting charactor position of the substring we're extracting.
-				#		The ending character position of the substring is determined via line.rindex("\n"), which finds the newline
-				#
-				#	Note that both index() and rindex() throw an exception if their substring searches fail - we catch this
-				#	exception and report the history file as corrupt when we do. We then ignore its contents and delete the file,
-				#	allowing a fresh file to be created when we reopen it for writing at the end of the routine
-				#
-				try:
-					with open(downloadHistoryFilename) as f:
-						downloadHistoryDict_Temp = { "{:s}".format(line[0:line.index("::::")])  :  "{:s}".format(line[line.index("::::", 0)+4: line.rindex("\n")]) for line in f }
-					# succesfully loaded history
-					downloadHistoryDict = downloadHistoryDict_Temp
-					applog_v("Download history file \"{:s}\" loaded - {:d} entries".format(downloadHistoryFilename, len(downloadHistoryDict)))
-				except ValueError:
-					applog_e("Download history file \"{:s}\" appears corrupt and will be ignored and deleted".format(downloadHistoryFilename))
-					os.remove(downloadHistoryFilename)
-				except IOError as e:
-					applog_e("Error openg/reading download history file \"{:s}\". No history will be available this session.".format(downloadHistoryFilename))
-		else:
-			applog_v("Download history file \"{:s}\" not found - will create".format(downloadHistoryFilename))
-			
-		g.downloadHistoryDict = downloadHistoryDict
-		
-	#
-	# re(open) the download history file for appending to support new history entries generated
-	# this session. return both the download history dictionary and the reopened history file
-	#
-	fileDownloadHistory = open(downloadHistoryFilename, "a")
-	return (downloadHistoryDict, fileDownloadHistory)
+		(downloadHistoryDbFilename, legacyTextFilename) = (g.cameraLocalMetadataPathAndRootName + "-downloadhist.db", g.cameraLocalMetadataPathAndRootName + "-downloadhist")
+	fFirstOpenThisSession = not g.downloadHistory or g.downloadHistory.dbFilename != downloadHistoryDbFilename
+	if fFirstOpenThisSession:
+		g.downloadHistory = dlhistory.DownloadHistory(downloadHistoryDbFilename, legacyTextFilename)
+		if g.args['downloadhistory'] == 'clear':
+			#
+			# user instructed clearing the history. we'll delete the history but then recreate it to allow
+			# history to be generated for the files we download this session. since we're deleting the history
+			# there wont be any history to use for this session, thus no files will be skipped this session
+			#
+			applog_v("Deleting download history \"{:s}\" per user configuration".format(downloadHistoryDbFilename))
+			g.downloadHistory.clear()
+	try:
+		g.downloadHistory.open()
+	except dlhistory.DownloadHistoryException as e:
+		#
+		# the history is unusable (corrupt, etc...). we'll delete it, allowing a fresh history to be created
+		#
+		applog_e("{:s}. The history will be ignored and deleted".format(str(e)))
+		g.downloadHistory.clear()
+		g.downloadHistory.open()
+	if fFirstOpenThisSession:
+		applog_v("Download history \"{:s}\" opened - {:d} entries".format(downloadHistoryDbFilename, g.downloadHistory.count()))
+	return g.downloadHistory
 	
 	
+#
+# To allow a download interrupted by the process exiting (killed, crash, laptop sleep) to be
+# resumed by a later invocation we keep a small JSON journal next to the .part file of
+# each MTP_OP_GetPartialObject download, recording which camera object the .part belongs to
+# and how many bytes of it are committed - ie, fsync'ed to disk. The journal is updated at
+# piece boundaries (at most every RESUME_JOURNAL_COMMIT_INTERVAL_SECS) by the file's
+# BackgroundFileWriter, after it has written and fsync'ed all the data up to that point.
+# .part files that have a journal are kept on exit (see deleteFilesMarkedForDeletionOnExit).
+# When a later invocation starts downloading the same object to the same local filename it
+# validates the journal, truncates the .part file to the committed size (anything past it
+# may not have made it to disk intact) and resumes from there. The object is identified by
+# camera serial, capture filename, capture date and size; the handle is recorded but
+# not required to match since not all cameras keep handles stable across sessions
+#
+def getResumeJournalFilename(localFilenameWithPath):
+	return localFilenameWithPath + ".part.resume"
+
+def genResumeJournalDict(mtpObject, bytesCommitted):
+	mtpObjectInfo = mtpObject.mtpObjectInfo
+	return { 'cameraserial'		: g.mtpDeviceInfo.serialNumberStr,
+			 'handle'			: mtpObject.mtpObjectHandle,
+			 'capturefilename'	: mtpObjectInfo.filename,
+			 'capturedate'		: mtpObjectInfo.captureDateStr,
+			 'size'				: mtpObjectInfo.objectCompressedSize,
+			 'bytescommitted'	: bytesCommitted }
+
+def writeResumeJournal(localFilenameWithPath, mtpObject, bytesCommitted):
+	try:
+		with open(getResumeJournalFilename(localFilenameWithPath), "w") as f:
+			json.dump(genResumeJournalDict(mtpObject, bytesCommitted), f, sort_keys=True)
+			f.flush()
+			os.fsync(f.fileno())
+	except (IOError, OSError) as e:
+		applog_d("Unable to write resume journal for \"{:s}\": {:s}".format(localFilenameWithPath, str(e)))
+
+def deleteResumeJournal(localFilenameWithPath):
+	deleteFileIgnoreErrors(getResumeJournalFilename(localFilenameWithPath))
+
+#
+# checks for a resume journal left by a prior invocation for a download of 'mtpObject' to
+# 'localFilenameWithPath'. if valid the .part file is truncated to the committed size and that
+# size is returned, otherwise any journal is deleted and None is returned
+#
+def loadResumeJournalForDownload(localFilenameWithPath, mtpObject):
+	journalFilename = getResumeJournalFilename(localFilenameWithPath)
+	if not os.path.exists(journalFilename):
+		return None
+	localFilenameWithPath_TemporaryFilename = localFilenameWithPath + ".part"
+	try:
+		with open(journalFilename, "r") as f:
+			journalDict = json.load(f)
+		if not isinstance(journalDict, dict):
+			raise ValueError("journal is not a JSON object")
+		journalDictExpected = genResumeJournalDict(mtpObject, journalDict.get('bytescommitted'))
+		journalDictExpected['handle'] = journalDict.get('handle')
+		bytesCommitted = journalDict['bytescommitted']
+		if journalDict != journalDictExpected:
+			applog_d("{:s} - resume journal is for a different object - discarding".format(localFilenameWithPath))
+		elif not isinstance(bytesCommitted, six.integer_types) or bytesCommitted <= 0 or bytesCommitted > mtpObject.mtpObjectInfo.objectCompressedSize:
+			applog_d("{:s} - resume journal has invalid committed size - discarding".format(localFilenameWithPath))
+		elif not os.path.exists(localFilenameWithPath_TemporaryFilename) or os.path.getsize(localFilenameWithPath_TemporaryFilename) < bytesCommitted:
+			applog_d("{:s} - partial file missing or smaller than resume journal's committed size - discarding".format(localFilenameWithPath))
+		else:
+			if journalDict['handle'] != mtpObject.mtpObjectHandle:
+				applog_d("{:s} - resume journal handle 0x{:x} differs from current 0x{:x} - object otherwise matches".format(localFilenameWithPath, journalDict['handle'], mtpObject.mtpObjectHandle))
+			with open(localFilenameWithPath_TemporaryFilename, "r+b") as f:
+				f.truncate(bytesCommitted)
+			return bytesCommitted
+	except (IOError, OSError, ValueError, KeyError, TypeError) as e:
+		applog_d("{:s} - unable to use resume journal: {:s}".format(localFilenameWithPath, str(e)))
+	deleteResumeJournal(localFilenameWithPath)
+	return None
+
+
 #
 # writes data to a file being downloaded from the camera. 
 #			
@@ -2177,6 +2786,182 @@ def writeDataToDownloadedFile(fileHandleIfAlreadyOpen, filenameWithPath, data, b
 		applog_e("\nError creating or writing to \"{:s}\". {:s}".format(filenameWithPath, str(e)))
 		sys.exit(ERRNO_DOWNLOAD_FILE_OP_FAILED)
 
+#
+# writes a file being downloaded from the camera on a background thread, so that
+# we can issue the next MTP_OP_GetPartialObject request while the data from the
+# previous one is still being written to (a potentially slow) disk. writes are queued
+# up to 'maxQueuedBytes' - beyond that write() blocks until the writer thread catches
+# up, which keeps our memory use bounded when the disk can't keep up with the camera.
+# the file is created/opened via writeDataToDownloadedFile() on the caller's thread,
+# so the .part naming and g.filesToDeleteOnAppExit handling are the same as for
+# synchronous writes. any error on the writer thread is reported on the caller's
+# thread on the next write()/close(), again matching writeDataToDownloadedFile().
+# commit() queues a callback that the writer thread invokes once all the data queued
+# before it has been written and fsync'ed (used to update the resume journal)
+#
+class BackgroundFileWriter:
+	def __init__(self, filenameWithPath, bIsAppending, maxQueuedBytes):
+		self.filenameWithPath = filenameWithPath
+		self.maxQueuedBytes = maxQueuedBytes
+		self.fo = writeDataToDownloadedFile(None, filenameWithPath, six.binary_type(), False, bIsAppending)
+		self.queue = collections.deque()
+		self.queuedBytes = 0
+		self.fClosing = False
+		self.ioError = None
+		self.cond = threading.Condition()
+		self.session = getActiveCameraSession() # commit callbacks access 'g'
+		self.thread = threading.Thread(target=self.__writerThread)
+		self.thread.daemon = True # don't hold up app exit on an abnormal termination
+		self.thread.start()
+	def __writerThread(self):
+		self.session.activate()
+		while True:
+			with self.cond:
+				while not self.queue and not self.fClosing:
+					self.cond.wait()
+				if not self.queue:
+					# closing and everything has been written
+					return
+				data = self.queue[0]
+			try:
+				if callable(data):
+					# commit callback - make sure everything written so far is on disk first
+					self.fo.flush()
+					os.fsync(self.fo.fileno())
+					data()
+					data = six.binary_type()
+				else:
+					self.fo.write(data)
+			except Exception as e:
+				# any failure (not just I/O errors - ex: MemoryError or an exception from a
+				# commit callback) must be reported, otherwise write()/close() would wait forever
+				with self.cond:
+					self.ioError = e
+					self.queue.clear()
+					self.queuedBytes = 0
+					self.cond.notify_all()
+				return
+			with self.cond:
+				self.queue.popleft()
+				self.queuedBytes -= len(data)
+				self.cond.notify_all()
+	def __checkForIoError(self):
+		if self.ioError:
+			try:
+				self.fo.close()
+			except IOError:
+				pass
+			applog_e("\nError creating or writing to \"{:s}\". {:s}".format(self.filenameWithPath, str(self.ioError) or type(self.ioError).__name__))
+			sys.exit(ERRNO_DOWNLOAD_FILE_OP_FAILED)
+	def write(self, data):
+		data = six.binary_type(data) # copy - caller's data (ie, memoryview from mtpwifi) is only valid for the duration of the call
+		with self.cond:
+			while self.queuedBytes and self.queuedBytes + len(data) > self.maxQueuedBytes and not self.ioError:
+				self.cond.wait() # back-pressure - disk has fallen behind the camera
+			self.__checkForIoError()
+			self.queue.append(data)
+			self.queuedBytes += len(data)
+			self.cond.notify_all()
+	def commit(self, fnCommitted):
+		with self.cond:
+			self.__checkForIoError()
+			self.queue.append(fnCommitted)
+			self.cond.notify_all()
+	def close(self):
+		if self.fo == None:
+			return
+		with self.cond:
+			self.fClosing = True
+			self.cond.notify_all()
+		self.thread.join()
+		self.__checkForIoError()
+		writeDataToDownloadedFile(self.fo, self.filenameWithPath, six.binary_type(), True, True)
+		self.fo = None
+
+#
+# limits the rate we download file data from the camera (--maxdownloadratekbsec), via a token
+# bucket that holds up to a second's worth of data. the limit is enforced by sleeping in the
+# data sink, which stops us reading from the socket and lets TCP flow control slow the camera.
+# the limit (and the download buffer size) can be changed while we're running through a
+# JSON control file (--downloadratecontrolfile), which is how airmtpdaemon shares a single
+# bandwidth and write-buffer budget across the cameras it's downloading from. the file
+# holds a dictionary with optional 'maxdownloadratekbsec' and 'maxgetobjbuffersizekb' keys.
+# in the other direction we report how much we've downloaded through a JSON status file
+# (--downloadratestatusfile) holding a dictionary with a 'bytesdownloaded' key, which
+# airmtpdaemon uses to tell the cameras that are downloading from those that are idle or
+# unreachable. the status file is only updated while we're downloading
+#
+class DownloadRateLimiter:
+	def __init__(self, maxBytesPerSec, controlFilename=None, statusFilename=None):
+		self.maxBytesPerSec = maxBytesPerSec
+		self.controlFilename = controlFilename
+		self.controlFileMtime = None
+		self.timeControlFileChecked = None
+		self.statusFilename = statusFilename
+		self.timeStatusFileWritten = None
+		self.totalBytesDownloaded = 0
+		self.tokens = 0
+		self.timeLastThrottle = None
+	def __checkControlFile(self):
+		if self.timeControlFileChecked != None and secondsElapsed(self.timeControlFileChecked) < DOWNLOAD_RATE_CONTROL_FILE_CHECK_SECS:
+			return
+		self.timeControlFileChecked = secondsElapsed(None)
+		try:
+			mtime = os.path.getmtime(self.controlFilename)
+			if mtime == self.controlFileMtime:
+				return
+			with open(self.controlFilename, "r") as f:
+				controlDict = json.load(f)
+			self.controlFileMtime = mtime
+		except (IOError, OSError, ValueError) as e:
+			return # file not created yet or caught mid-write - try again next check
+		if not isinstance(controlDict, dict):
+			return
+		if isinstance(controlDict.get('maxdownloadratekbsec'), six.integer_types):
+			self.maxBytesPerSec = controlDict['maxdownloadratekbsec'] * 1024
+			applog_d("Download rate limit set to {:d} KB/s via control file".format(controlDict['maxdownloadratekbsec']))
+		if isinstance(controlDict.get('maxgetobjbuffersizekb'), six.integer_types) and controlDict['maxgetobjbuffersizekb'] > 0:
+			g.maxGetObjBufferSize = controlDict['maxgetobjbuffersizekb'] * 1024 # takes effect with the next file downloaded
+	def __writeStatusFile(self):
+		if self.timeStatusFileWritten != None and secondsElapsed(self.timeStatusFileWritten) < DOWNLOAD_RATE_CONTROL_FILE_CHECK_SECS:
+			return
+		self.timeStatusFileWritten = secondsElapsed(None)
+		try:
+			with open(self.statusFilename, "w") as f:
+				json.dump({ 'bytesdownloaded' : self.totalBytesDownloaded }, f)
+		except IOError as e:
+			applog_d("Unable to write download rate status file \"{:s}\": {:s}".format(self.statusFilename, str(e)))
+	def throttle(self, numBytes):
+		self.totalBytesDownloaded += numBytes
+		if self.statusFilename:
+			self.__writeStatusFile()
+		if self.controlFilename:
+			self.__checkControlFile()
+		if self.maxBytesPerSec <= 0:
+			return
+		timeCurrent = secondsElapsed(None)
+		if self.timeLastThrottle != None:
+			self.tokens = min(self.tokens + (timeCurrent - self.timeLastThrottle) * self.maxBytesPerSec, self.maxBytesPerSec)
+		self.timeLastThrottle = timeCurrent
+		self.tokens -= numBytes
+		if self.tokens < 0:
+			time.sleep(-self.tokens / self.maxBytesPerSec)
+
+#
+# data sink for MTP_OP_GetPartialObject requests, invoked by mtpwifi.execMtpOp() as
+# each chunk of data arrives from the camera. queues the chunk to the download file's
+# writer and accounts for it in the object's partial download info, so that a retry
+# invocation knows where to resume from. the writer is always closed (which drains
+# its queue) before a retry, so counting the bytes at queue time is safe. this is
+# called for every chunk received, so the caller passes in the session's rate
+# limiter rather than us resolving it through 'g' each time
+#
+def downloadMtpFileObjects_DataSink(fileWriter, mtpObject, downloadRateLimiter, data):
+	fileWriter.write(data)
+	mtpObject.partialDownloadObj().addBytesWritten(len(data))
+	if downloadRateLimiter:
+		downloadRateLimiter.throttle(len(data))
+
 	
 #
 # checks if the extension of an MTP filename is in a list of file extensions
@@ -2198,54 +2983,92 @@ def isMtpFilenameExtInList(mtpFilename, extList):
 #
 def doesMtpObjectPassUserFileFilter(mtpObject, fPrintFilterAction=True):
 
+	session = getActiveCameraSession() # resolve 'g' once - we're called for every object on each scan
+
 	# first filter out objects that don't correspond to files
-	if mtpObject.mtpObjectInfo.objectFormat == MTP_OBJFORMAT_Assocation or mtpObject.mtpObjectInfo.objectFormat == MTP_OBJFORMAT_NONE:
+	objectFormat = mtpObject.getObjectFormat()
+	if objectFormat == MTP_OBJFORMAT_Assocation or objectFormat == MTP_OBJFORMAT_NONE:
 		if fPrintFilterAction:
-			applog_d("Skipping {:s} - object is not file - {:s}".format(mtpObject.mtpObjectInfo.filename, getMtpObjFormatDesc(mtpObject.mtpObjectInfo.objectFormat)))
+			applog_d("Skipping {:s} - object is not file - {:s}".format(mtpObject.getFilename(), getMtpObjFormatDesc(objectFormat)))
 		return False
 
-	if g.fAllObjsAreFromCameraTransferList == True:
+	if session.fAllObjsAreFromCameraTransferList == True:
 		# all objects presently in list are from the camera transfer list, so all bypass user filters
 		return True
 		
 	# filter against user-specified extensions
-	if g.args['extlist'] and isMtpFilenameExtInList(mtpObject.mtpObjectInfo.filename, g.args['extlist']) == False:
+	if session.args['extlist'] and isMtpFilenameExtInList(mtpObject.getFilename(), session.args['extlist']) == False:
 			if fPrintFilterAction:
-				applog_v("Skipping {:s} - filename extension not in user-specified list".format(mtpObject.mtpObjectInfo.filename))
+				applog_v("Skipping {:s} - filename extension not in user-specified list".format(mtpObject.getFilename()))
 			return False
 		
 	# filter against capture date range
-	if g.objfilter_dateStartEpoch != None and mtpObject.captureDateEpoch < g.objfilter_dateStartEpoch:
+	if session.objfilter_dateStartEpoch != None and mtpObject.captureDateEpoch < session.objfilter_dateStartEpoch:
 		# user specified starting date filter and this object has a capture date earlier than specified filter
 		if fPrintFilterAction:
-			applog_v("Skipping {:s} - has capture date earlier than user-specified start date filter".format(mtpObject.mtpObjectInfo.filename))
+			applog_v("Skipping {:s} - has capture date earlier than user-specified start date filter".format(mtpObject.getFilename()))
 		return False
-	if g.objfilter_dateEndEpoch != None and mtpObject.captureDateEpoch > g.objfilter_dateEndEpoch:
+	if session.objfilter_dateEndEpoch != None and mtpObject.captureDateEpoch > session.objfilter_dateEndEpoch:
 		# user specified ending date filter and this object has a capture date later than specified filter
 		if fPrintFilterAction:
-			applog_v("Skipping {:s} - has capture date later than user-specified end date filter".format(mtpObject.mtpObjectInfo.filename))
+			applog_v("Skipping {:s} - has capture date later than user-specified end date filter".format(mtpObject.getFilename()))
 		return False
 		
 	# filter against folders
-	if g.args['onlyfolders']:
+	if session.args['onlyfolders']:
 		cameraFolder = mtpObject.getImmediateDirectory()
-		if (cameraFolder=="" and ("<ROOT>" not in g.args['onlyfolders'])) or cameraFolder not in g.args['onlyfolders']:
+		if (cameraFolder=="" and ("<ROOT>" not in session.args['onlyfolders'])) or cameraFolder not in session.args['onlyfolders']:
 			# image is in root directory of camera and "<ROOT>" not in list, or image is in directory not in list
 			if fPrintFilterAction:
-				applog_v("Skipping {:s}\\{:s} - folder not in --onlyfolders".format(cameraFolder, mtpObject.mtpObjectInfo.filename))
+				applog_v("Skipping {:s}\\{:s} - folder not in --onlyfolders".format(cameraFolder, mtpObject.getFilename()))
 			return False
-	if g.args['excludefolders']:
+	if session.args['excludefolders']:
 		cameraFolder = mtpObject.getImmediateDirectory()
-		if (cameraFolder=="" and "<ROOT>" in g.args['excludefolders']) or cameraFolder in g.args['excludefolders']:
+		if (cameraFolder=="" and "<ROOT>" in session.args['excludefolders']) or cameraFolder in session.args['excludefolders']:
 			# image is in root directory of camera and "<root>" is in list, or image is in directory in list
 			if fPrintFilterAction:
-				applog_v("Skipping {:s}\\{:s} - folder in --excludefolders".format(cameraFolder, mtpObject.mtpObjectInfo.filename))
+				applog_v("Skipping {:s}\\{:s} - folder in --excludefolders".format(cameraFolder, mtpObject.getFilename()))
 			return False
 
 	# passes all user filters
 	return True
 
 
+#
+# returns the filename of an object as used for the download history, which has a
+# suffix added if we're downloading one of its thumbnails instead of the object itself
+#
+def getFilenameWithObjTypeSuffix(mtpObject, mtpOpGet):
+	if mtpOpGet == MTP_OP_GetThumb:
+		return mtpObject.getFilename() + ".sthumb.jpg"
+	if mtpOpGet == MTP_OP_GetLargeThumb:
+		return mtpObject.getFilename() + ".lthumb.jpg"
+	return mtpObject.getFilename()
+
+#
+# download history entry of a file, as returned by dlhistory.DownloadHistory.lookup()
+#
+DownloadHistoryElement = namedtuple('DownloadHistoryElement', 'dateDownloadedStr pathDownloadedToStr')
+
+#
+# generates the download history key for an object - see downloadMtpFileObjects()
+#
+def genDownloadHistoryKey(filenameWithObjTypeSuffix, mtpObject):
+	return "{:s}::{:s}::{:,}".format(filenameWithObjTypeSuffix, mtpObject.getCaptureDateStr(), mtpObject.getObjectSize())
+
+#
+# looks up the download history for 'mtpObject' and the files that follow it, up to
+# DOWNLOAD_HISTORY_PREFETCH_BATCH_SIZE files, with a single query rather than a query
+# for each file. on a card that has mostly been downloaded nearly every file is in the
+# history, so this is what the download loop spends most of its time on
+#
+def prefetchDownloadHistory(downloadHistory, mtpObject, mtpOpGet):
+	keysList = []
+	while mtpObject and len(keysList) < DOWNLOAD_HISTORY_PREFETCH_BATCH_SIZE:
+		keysList.append(genDownloadHistoryKey(getFilenameWithObjTypeSuffix(mtpObject, mtpOpGet), mtpObject))
+		mtpObject = getNextUserFilteredMtpFileObject(mtpObject)
+	downloadHistory.prefetch(keysList)
+
 #
 # Returns the next MTP file object that passes the user-configured filters. This
 # function is used in MTP file object enumeration loops. Call with -1 to start
@@ -2265,6 +3088,28 @@ def getNextUserFilteredMtpFileObject(prevObject, fileTransferOrder = FILE_TRANSF
 	return mtpObject
 
 
+#
+# generator that enumerates the MTP objects on the camera in windows of --overlapenumwindow
+# handles (see buildMtpObjectsInWindows()), yielding the objects of each window that pass
+# the user-configured filters as soon as the window has been enumerated. this is used
+# to overlap enumeration with downloading, so that on cards with many objects we start
+# downloading without first waiting for the info of every object to be retrieved. since
+# we haven't seen the objects of later windows yet, --transferorder is only honored
+# within each window. Returns when all objects have been enumerated
+#
+def genMtpObjectsOverlappedWithEnumeration():
+	fNewestFirst = (g.fileTransferOrder == FILE_TRANSFER_ORDER_NEWEST_FIRST)
+	for windowObjHandlesList in buildMtpObjectsInWindows(True, g.args['overlapenumwindow']):
+		windowMtpObjects = []
+		for objHandle in windowObjHandlesList:
+			mtpObject = MtpObject.getByMtpObjectHandle(objHandle)
+			if mtpObject and doesMtpObjectPassUserFileFilter(mtpObject):
+				windowMtpObjects.append(mtpObject)
+		windowMtpObjects.sort(key=lambda mtpObject: mtpObject.captureDateEpoch, reverse=fNewestFirst)
+		for mtpObject in windowMtpObjects:
+			yield mtpObject
+
+
 #
 # generates a partial dictionary for use by rename.performRename() with
 # keys common to all files this session
@@ -2305,15 +3150,15 @@ def updateRenameDictKeysSpecificToMtpObject(renameDict, mtpObject, dlnum, dlnum_
 def performDirAndFileRename(renameDict, fCreateDirs=False):
 	filenameAfterRename = renameDict['filename']
 	dirAfterRename = g.args['outputdir'] # note this may be an empty string when 'dirnamespec' was specified by user
-	# note that syntax for both filenamespec and dirnamespec were verified during cmd-line arg parsing
+	# note that both filenamespec and dirnamespec were verified and compiled during cmd-line arg parsing
 	if g.args['dirnamespec']:
-		dirAfterRename = os.path.join(dirAfterRename, rename.performRename(g.args['dirnamespec'], renameDict))
+		dirAfterRename = os.path.join(dirAfterRename, rename.performRename(g.dirnameSpecCompiled, renameDict))
 		if fCreateDirs and not os.path.exists(dirAfterRename):
 			applog_v("Creating directory tree \"{:s}\"".format(dirAfterRename))
 			os.makedirs(dirAfterRename)	
 		renameDict['path'] = dirAfterRename # update dict with possible generated directory from above	
 	if g.args['filenamespec']:
-		filenameAfterRename = rename.performRename(g.args['filenamespec'], renameDict)
+		filenameAfterRename = rename.performRename(g.filenameSpecCompiled, renameDict)
 		if not filenameAfterRename:
 			applog_e("--filenamespec resulted in an empty filename. Please review your specification string")
 			sys.exit(ERRNO_FILENAMESPEC_RESULT_EMPTY_STR)
@@ -2325,7 +3170,34 @@ def performDirAndFileRename(renameDict, fCreateDirs=False):
 
 
 #
-# performs  launch of application and arguments specified in 'downloadexec' command-line option
+# returns the engine that launches --downloadexec apps, creating it on first use. the engine persists
+# across retries of appMain() and is drained by drainDownloadExecEngine() before we exit
+#
+def getDownloadExecEngine():
+	if g.downloadExecEngine == None:
+		g.downloadExecEngine = downloadexec.DownloadExecEngine(g.args['downloadexec_maxconcurrent'], g.args['downloadexec_batchsize'],\
+			g.args['downloadexec_batchsecs'], 'ignorelauncherror' in g.args['downloadexec_options'], 'exitonfailcode' in g.args['downloadexec_options'])
+	return g.downloadExecEngine
+
+
+#
+# handles an error reported by the --downloadexec engine
+#
+def exitOnDownloadExecError(downloadExecException):
+	if downloadExecException.errorType == downloadexec.DownloadExecException.NON_ZERO_EXIT_CODE:
+		applog_i("Exiting due to non-zero return code ({:d}) of launched app for '--downloadexec'".format(downloadExecException.retCode))
+		sys.exit(ERRNO_DOWNLOADEXEC_NON_ZERO_EXIT_CODE)
+	applog_e(str(downloadExecException))
+	sys.exit(ERRNO_DOWNLOADEXEC_LAUNCH_ERROR)
+
+
+#
+# performs  launch of application and arguments specified in 'downloadexec' command-line option.
+# the launch is done by the downloadexec engine, which limits how many launched apps run
+# at once and optionally batches many files into one launch (--downloadexec_batchsize
+# and --downloadexec_batchsecs). for batching the args are split into the leading args that
+# don't use any rename specifiers (common to every file, starting with the app/script
+# name) and the remaining args, which are repeated for each file in the batch
 #	
 def doDownloadExec(renameDict, mtpObject):
 
@@ -2333,9 +3205,12 @@ def doDownloadExec(renameDict, mtpObject):
 		return
 
 	execArgs = []
-	# note that syntax for rename args were verified during cmd-line arg parsing
-	for arg in g.args['downloadexec']:
-		renamedArg = rename.performRename(arg, renameDict)
+	countExecArgsCommon = None # number of args in 'execArgs' that were generated from the common args
+	# note that rename args were verified and compiled during cmd-line arg parsing
+	for argIndex, argSpecCompiled in enumerate(g.downloadExecSpecsCompiled):
+		if argIndex == g.downloadExecFirstPerFileArgIndex:
+			countExecArgsCommon = len(execArgs)
+		renamedArg = rename.performRename(argSpecCompiled, renameDict)
 		if renamedArg != "":
 			if 'notildereplacement' not in g.args['downloadexec_options']:
 				#
@@ -2361,35 +3236,52 @@ def doDownloadExec(renameDict, mtpObject):
 	applog_d("download exec args input: " + str(g.args['downloadexec']))
 	applog_d("download exec args output: " + str(execArgs))
 	if execArgs:
-		applog_v("Launching 'downloadexec': {:s}".format(str(execArgs)))
+		if countExecArgsCommon == None:
+			countExecArgsCommon = len(execArgs)
+		#
+		# we call mtpSessionKeepAlive() whenever we have to wait on launched apps (for a free
+		# slot or for the 'wait' option) to make sure the camera keeps the MTP session going
+		#
+		keepAliveStateDict = { 'timeLastCameraKeepAlive' : None }
+		def keepAliveWhileWaiting():
+			keepAliveStateDict['timeLastCameraKeepAlive'] = mtpSessionKeepAlive(keepAliveStateDict['timeLastCameraKeepAlive'])
+		downloadExecEngine = getDownloadExecEngine()
 		try:
-			process = subprocess.Popen(execArgs)
-		except:
-			# different platforms can throw different platform-specific exceptions
-			errStr = "Error launching for 'downloadexec' {:s}: {:s} {:s}".format(str(execArgs), str(sys.exc_info()[0]), str(sys.exc_info()[1]))
-			if 'ignorelauncherror' in g.args['downloadexec_options']:
-				applog_d(errStr)
-				return
-			applog_e(errStr)
-			sys.exit(ERRNO_DOWNLOADEXEC_LAUNCH_ERROR)
-		if 'wait' in g.args['downloadexec_options']:
-			#
-			# we're instructed to wait until launched app exits before
-			# continuing to next download. we'll wait in a loop,
-			# calling mtpSessionKeepAlive() to make sure the camera
-			# keeps the MTP session going
-			#
-			timeLastCameraKeepAlive = None
-			while process.poll() == None:
-				timeLastCameraKeepAlive = mtpSessionKeepAlive(timeLastCameraKeepAlive)
-				time.sleep(.10) # sleep for 100ms between each process completion check				
-			retCode = process.wait()
-			if 'exitonfailcode' in g.args['downloadexec_options']:
-				if retCode != 0:
-					applog_i("Exiting due to non-zero return code ({:d}) of launched app for '--downloadexec'".format(retCode))
-					sys.exit(ERRNO_DOWNLOADEXEC_NON_ZERO_EXIT_CODE)
-		if 'delay' in g.args['downloadexec_options']:
-			time.sleep(5)
+			downloadExecEngine.submit(execArgs[:countExecArgsCommon], execArgs[countExecArgsCommon:], keepAliveWhileWaiting)
+			if 'wait' in g.args['downloadexec_options']:
+				#
+				# we're instructed to wait until launched app exits before
+				# continuing to next download. in batch mode submit() only queues
+				# the file, so launch the pending batch first
+				#
+				downloadExecEngine.flush(keepAliveWhileWaiting)
+				downloadExecEngine.waitForAll(keepAliveWhileWaiting)
+		except downloadexec.DownloadExecException as e:
+			exitOnDownloadExecError(e)
+	if 'delay' in g.args['downloadexec_options']:
+		time.sleep(5)
+
+
+#
+# waits for any pending --downloadexec launches to complete, including launching any
+# partial batch. invoked when we exit
+#
+def drainDownloadExecEngine():
+	if g.downloadExecEngine == None:
+		return 0
+	downloadExecEngine = g.downloadExecEngine
+	g.downloadExecEngine = None
+	try:
+		downloadExecEngine.drain()
+	except downloadexec.DownloadExecException as e:
+		try:
+			exitOnDownloadExecError(e)
+		except SystemExit as e:
+			return e.code
+	except KeyboardInterrupt as e:
+		applog_e("\n>> Terminated by user keypress while waiting for '--downloadexec' app(s) <<")
+		return errno.EINTR
+	return 0
 			
 						
 #
@@ -2423,6 +3315,237 @@ def respErrorDuringDownload_checkIfFileDeletedOnCamera(mtpObject, localFilename,
 		return False
 
 
+#
+# loads the per-model record of which camera models tolerate pipelined MTP_OP_GetPartialObject
+# requests. the record is learned at runtime - a model is added when a pipelined download
+# succeeds and is disallowed when it misbehaves (see updateGetObjPipelineDepthAllowlist).
+# the file is a JSON dictionary keyed by model name, each value a dictionary with:
+#
+#	'depth'			- largest pipeline depth the model has successfully handled
+#	'disallowed'	- True if the model misbehaves with pipelined requests
+#	'commerrors'	- consecutive communication errors seen during pipelined downloads
+#	'updated'		- time the entry was last updated (epoch). entries older than
+#					  GET_OBJECT_PIPELINE_ENTRY_EXPIRE_DAYS are ignored
+#
+# the file is shared by all sessions (ex: airmtpdaemon's workers), so it's only read once per
+# session for lookups but each save re-reads it and merges in just our model's entry, to
+# avoid wiping out entries other sessions have written since we read it
+#
+def getObjPipelineDepthAllowlistFilename():
+	return os.path.join(g.appDataDir, "airmtpcmd-getobjpipelinedepth.json")
+
+def readGetObjPipelineDepthAllowlistFile():
+	try:
+		with open(getObjPipelineDepthAllowlistFilename(), "r") as f:
+			allowlistDict = json.load(f)
+		if isinstance(allowlistDict, dict):
+			return allowlistDict
+	except (IOError, ValueError) as e:
+		pass # file doesn't exist yet or is corrupt - start over
+	return {}
+
+def loadGetObjPipelineDepthAllowlist():
+	if g.getObjPipelineAllowlistDict == None:
+		g.getObjPipelineAllowlistDict = readGetObjPipelineDepthAllowlistFile()
+	return g.getObjPipelineAllowlistDict
+
+#
+# saves the allowlist entry for camera model 'modelStr' ('modelEntry' of None removes it)
+#
+def saveGetObjPipelineDepthAllowlistEntry(modelStr, modelEntry):
+	allowlistDict = readGetObjPipelineDepthAllowlistFile()
+	if modelEntry != None:
+		allowlistDict[modelStr] = modelEntry
+	else:
+		allowlistDict.pop(modelStr, None)
+	g.getObjPipelineAllowlistDict = allowlistDict
+	if g.args['replaymode'] == 'yes':
+		return
+	try:
+		writeJsonFileAtomically(getObjPipelineDepthAllowlistFilename(), allowlistDict, indent=1)
+	except (IOError, OSError) as e:
+		applog_d("Unable to save get-object pipeline allowlist: {:s}".format(str(e)))
+
+#
+# returns the allowlist entry for the camera model, or None if there isn't one or it has expired
+#
+def getGetObjPipelineDepthAllowlistEntry():
+	modelEntry = loadGetObjPipelineDepthAllowlist().get(g.mtpDeviceInfo.modelStr)
+	if modelEntry and time.time() - modelEntry.get('updated', 0) > GET_OBJECT_PIPELINE_ENTRY_EXPIRE_DAYS*24*60*60:
+		applog_d("Get-object pipeline allowlist entry for \"{:s}\" has expired".format(g.mtpDeviceInfo.modelStr))
+		return None
+	return modelEntry
+
+#
+# determines the pipeline depth to use for MTP_OP_GetPartialObject requests this session.
+# if the user specified a depth (--getobjpipelinedepth) we use that unless the camera model
+# has previously misbehaved with pipelined requests, otherwise we use the depth the model
+# has successfully handled before (if any). --getobjpipelinereset forgets what we've learned
+# about the model
+#
+def determineGetObjPipelineDepth():
+	if g.args['getobjpipelinereset'] == 'yes':
+		if g.mtpDeviceInfo.modelStr in loadGetObjPipelineDepthAllowlist():
+			applog_i("Reset get-object pipeline allowlist entry for \"{:s}\"".format(g.mtpDeviceInfo.modelStr))
+			saveGetObjPipelineDepthAllowlistEntry(g.mtpDeviceInfo.modelStr, None)
+	modelEntry = getGetObjPipelineDepthAllowlistEntry() or {}
+	if g.args['getobjpipelinedepth'] != None:
+		g.getObjPipelineDepth = max(g.args['getobjpipelinedepth'], 1)
+	else:
+		g.getObjPipelineDepth = max(modelEntry.get('depth', DEFAULT_GET_OBJECT_PIPELINE_DEPTH), 1)
+	if g.getObjPipelineDepth > 1 and modelEntry.get('disallowed'):
+		applog_v("Not pipelining get-object requests for \"{:s}\" - it has misbehaved with them before".format(g.mtpDeviceInfo.modelStr))
+		g.getObjPipelineDepth = 1
+	applog_d("Using get-object pipeline depth of {:d}".format(g.getObjPipelineDepth))
+
+#
+# updates the pipeline allowlist with the result of a pipelined download. a protocol error
+# where the camera responds for the wrong transaction (MtpTransactionIdMismatchException)
+# means the model can't handle pipelining at all. communication errors can also be caused by
+# a marginal wifi link so we only give up on a model after several of them without a
+# successful pipelined download. either type of error drops us back to a depth of 1 for the
+# rest of this session
+#
+def updateGetObjPipelineDepthAllowlist(fSuccess, fTransactionIdMismatch=False):
+	if g.getObjPipelineDepth <= 1:
+		return
+	modelEntry = getGetObjPipelineDepthAllowlistEntry() or { 'depth' : 1, 'disallowed' : False, 'commerrors' : 0 }
+	if fSuccess:
+		if modelEntry['depth'] >= g.getObjPipelineDepth and modelEntry['commerrors'] == 0 and\
+				time.time() - modelEntry.get('updated', 0) < GET_OBJECT_PIPELINE_ENTRY_EXPIRE_DAYS*24*60*60 / 2:
+			return # already recorded (and not close to expiring) - nothing to update
+		modelEntry['depth'] = max(modelEntry['depth'], g.getObjPipelineDepth)
+		modelEntry['commerrors'] = 0
+	else:
+		if fTransactionIdMismatch:
+			modelEntry['disallowed'] = True
+		else:
+			modelEntry['commerrors'] += 1
+			if modelEntry['commerrors'] >= GET_OBJECT_PIPELINE_MAX_COMM_ERRORS:
+				modelEntry['disallowed'] = True
+		applog_v("Error during pipelined download - falling back to a get-object pipeline depth of 1")
+		g.getObjPipelineDepth = 1
+	modelEntry['updated'] = time.time()
+	saveGetObjPipelineDepthAllowlistEntry(g.mtpDeviceInfo.modelStr, modelEntry)
+
+#
+# determines the size of MTP_OP_GetPartialObject requests. the optimal size varies by camera
+# model and by the quality of the wifi link, so unless the user specified a fixed size
+# (--maxgetobjtransfersizekb) we adapt it during the session, AIMD-style: after each
+# ADAPTIVE_GET_OBJECT_SAMPLE_KB of downloads we compare the throughput against the throughput
+# at the previous size and grow the size by ADAPTIVE_GET_OBJECT_STEP_KB while it keeps
+# improving, settling on the previous size once it stops. a communication error (which
+# includes timeouts) halves the size, since the data of a piece in flight has to be
+# downloaded again on a flaky link. once a full sample's worth of data has downloaded
+# without another error we start growing again from the reduced size, so a transient
+# dropout doesn't leave the session at a small size. the size we grow to or settle on is
+# kept per camera (model+serial) so the next session starts from it - reductions aren't
+# saved since they reflect the link at the time rather than what the camera can handle
+#
+class AdaptiveGetObjTransferSize:
+	def __init__(self, filename, initialSize, fAdaptive):
+		self.filename = filename
+		self.fAdaptive = fAdaptive
+		self.size = initialSize
+		self.fGrowing = fAdaptive
+		self.fReducedSinceSample = False	# size was reduced by a communication error since our last measurement
+		self.prevSize = None			# size before our last increase
+		self.prevThroughput = None		# throughput measured at 'prevSize'
+		self.sampleBytes = 0			# bytes downloaded at 'size' since our last measurement
+		self.sampleSecs = 0.0			# time spent downloading 'sampleBytes'
+	@staticmethod
+	def loadLearnedSize(filename):
+		try:
+			with open(filename, "r") as f:
+				learnedDict = json.load(f)
+			if isinstance(learnedDict, dict) and isinstance(learnedDict.get('size'), six.integer_types):
+				return learnedDict['size']
+		except (IOError, ValueError) as e:
+			pass # file doesn't exist yet or is corrupt
+		return None
+	def saveLearnedSize(self):
+		if g.args['replaymode'] == 'yes':
+			return
+		try:
+			writeJsonFileAtomically(self.filename, { 'size' : self.size })
+		except (IOError, OSError) as e:
+			applog_d("Unable to save get-object transfer size: {:s}".format(str(e)))
+	#
+	# records a completed download of 'bytesTransferred' bytes at the current size
+	#
+	def recordTransfer(self, bytesTransferred, secs):
+		if not self.fAdaptive or (not self.fGrowing and not self.fReducedSinceSample):
+			return
+		self.sampleBytes += bytesTransferred
+		self.sampleSecs += secs
+		if self.sampleBytes < ADAPTIVE_GET_OBJECT_SAMPLE_KB*1024 or self.sampleSecs <= 0:
+			return
+		throughput = self.sampleBytes / self.sampleSecs
+		self.sampleBytes = 0
+		self.sampleSecs = 0.0
+		if self.fReducedSinceSample:
+			# a clean sample since the size was reduced - resume growing, using this sample as the baseline
+			applog_d("No communication errors at {:d}KB get-object transfer size - resuming growth".format(self.size // 1024))
+			self.fReducedSinceSample = False
+			self.fGrowing = True
+			self.prevThroughput = None
+		if self.prevThroughput == None or throughput > self.prevThroughput * (1 + ADAPTIVE_GET_OBJECT_MIN_IMPROVEMENT_PCT/100):
+			if self.size >= ADAPTIVE_GET_OBJECT_MAX_KB*1024:
+				applog_v("Get-object transfer size settled at max of {:d}KB ({:.2f} MB/s)".format(self.size // 1024, throughput / 1048576))
+				self.fGrowing = False
+				return
+			self.prevSize = self.size
+			self.prevThroughput = throughput
+			self.size = min(self.size + ADAPTIVE_GET_OBJECT_STEP_KB*1024, ADAPTIVE_GET_OBJECT_MAX_KB*1024)
+			applog_d("Throughput at {:d}KB get-object transfer size is {:.2f} MB/s - growing to {:d}KB".format(self.prevSize // 1024, throughput / 1048576, self.size // 1024))
+		else:
+			applog_v("Get-object transfer size settled at {:d}KB ({:.2f} MB/s vs {:.2f} MB/s at {:d}KB)".format(self.prevSize // 1024,\
+				self.prevThroughput / 1048576, throughput / 1048576, self.size // 1024))
+			self.size = self.prevSize
+			self.fGrowing = False
+		self.saveLearnedSize()
+	#
+	# records a communication error (or timeout) during a download
+	#
+	def recordCommError(self):
+		if not self.fAdaptive:
+			return
+		self.fGrowing = False
+		self.fReducedSinceSample = True
+		self.sampleBytes = 0
+		self.sampleSecs = 0.0
+		newSize = max(self.size // 2, ADAPTIVE_GET_OBJECT_MIN_KB*1024)
+		if newSize != self.size:
+			applog_v("Communication error during download - reducing get-object transfer size from {:d}KB to {:d}KB".format(self.size // 1024, newSize // 1024))
+			self.size = newSize
+
+def getObjTransferSizeFilename():
+	return g.cameraLocalMetadataPathAndRootName + "-getobjtransfersize"
+
+def determineGetObjTransferSize():
+	if g.args['maxgetobjtransfersizekb'] != None:
+		g.getObjTransferSize = AdaptiveGetObjTransferSize(None, g.args['maxgetobjtransfersizekb'] * 1024, False)
+		applog_v("Using get-object transfer size of {:d}KB (fixed)".format(g.getObjTransferSize.size // 1024))
+		return
+	learnedSize = AdaptiveGetObjTransferSize.loadLearnedSize(getObjTransferSizeFilename())
+	if learnedSize != None:
+		initialSize = min(max(learnedSize, ADAPTIVE_GET_OBJECT_MIN_KB*1024), ADAPTIVE_GET_OBJECT_MAX_KB*1024)
+	else:
+		initialSize = DEFAULT_MAX_KB_PER_GET_OBJECT_REQUEST*1024
+	g.getObjTransferSize = AdaptiveGetObjTransferSize(getObjTransferSizeFilename(), initialSize, True)
+	applog_v("Using get-object transfer size of {:d}KB ({:s})".format(initialSize // 1024, "learned from prior sessions" if learnedSize != None else "default"))
+
+#
+# generates the arguments for each MTP_OP_GetPartialObject request of a download. the size
+# of each request is constrained by 'transferSize'
+#
+def downloadMtpFileObjects_GenGetPartialObjectArgs(mtpObject, localFilenameWithoutPath, offsetIntoImage, fileSizeBytes, transferSize):
+	while offsetIntoImage < fileSizeBytes:
+		bytesToDownloadThisPiece = min(transferSize, fileSizeBytes-offsetIntoImage)
+		applog_d("{:s} - requesting next piece, offset=0x{:x}, count=0x{:x}".format(localFilenameWithoutPath, offsetIntoImage, bytesToDownloadThisPiece))
+		yield struct.pack('<III', mtpObject.mtpObjectHandle, offsetIntoImage, bytesToDownloadThisPiece)
+		offsetIntoImage += bytesToDownloadThisPiece
+
 #
 # download progress callback for MTP get requests issued by downloadMtpFileObjects().
 # displays the progress to console as a percentage of completion.
@@ -2480,15 +3603,23 @@ def downloadMtpFileObjects_DownloadProgressCallback(bytesReceivedAllCurrentPaylo
 # unnecessary. Rather than take it out I decided it best to leave it in place, to support
 # any scenarios where the wifi connection can be marginal, such as when the camera is further
 # away from the computer. I left the max-transfer size configurable, to allow for future
-# tweaking/experimentation of different camera models, in g.maxGetObjTransferSize
+# tweaking/experimentation of different camera models, in --maxgetobjtransfersizekb. When
+# not specified the size is adapted to the camera and link - see AdaptiveGetObjTransferSize
 #
-def downloadMtpFileObjects(firstMtpObjectToDownload = None):
+def downloadMtpFileObjects(firstMtpObjectToDownload = None, mtpObjectsIter = None):
+
+	session = getActiveCameraSession() # resolve 'g' once rather than on every access in the loop below
 
 	#
 	# load download history and open history file for writing for new history to be generated this session
 	#
-	(downloadHistoryDict, fileDownloadHistory) = loadDownloadHistory()
-	fSkipDownloadedFiles = (g.args['downloadhistory'] != 'ignore') # skip files if instructed to do so
+	downloadHistory = openDownloadHistory()
+	fSkipDownloadedFiles = (session.args['downloadhistory'] != 'ignore') # skip files if instructed to do so
+
+	if session.getObjPipelineDepth == None:
+		determineGetObjPipelineDepth()
+	if session.getObjTransferSize == None:
+		determineGetObjTransferSize()
 	
 	#
 	# various forms of the filename/path are used in this routine for different purposes. here's a guide to 
@@ -2518,22 +3649,28 @@ def downloadMtpFileObjects(firstMtpObjectToDownload = None):
 	#
 	
 	
-	fUsingRenameEngineForDirOrFile = g.args['filenamespec'] != None or g.args['dirnamespec'] != None
-	fUsingRenameEngineForAnyParameter = fUsingRenameEngineForDirOrFile or g.args['downloadexec']
+	fUsingRenameEngineForDirOrFile = session.args['filenamespec'] != None or session.args['dirnamespec'] != None
+	fUsingRenameEngineForAnyParameter = fUsingRenameEngineForDirOrFile or session.args['downloadexec']
 	if fUsingRenameEngineForAnyParameter:
 		renameDict = genRenameDictKeysCommonToAllMtpObjects()		
 		
 	#
 	# scan all objects and download each file that passes the user-configured filters
 	#
-	if firstMtpObjectToDownload == None:
+	if mtpObjectsIter != None:
+		#
+		# caller is supplying the (already user-filtered) objects to download, such
+		# as when we're overlapping the enumeration of objects with their download
+		#
+		mtpObject = None
+	elif firstMtpObjectToDownload == None:
 		#
 		# caller didn't specify specific starting point/object. we'll start at the
 		# beginning of the object list if this is our first time downloading or at
 		# the last file we were downloading/completed downloading if we're resuming
 		# a download interrupted by error
 		#
-		mtpObject = g.downloadMtpFileObjects_LastMtpObjectDownload
+		mtpObject = session.downloadMtpFileObjects_LastMtpObjectDownload
 		if mtpObject == None:
 			mtpObject = getNextUserFilteredMtpFileObject(-1)
 	else:
@@ -2555,7 +3692,9 @@ def downloadMtpFileObjects(firstMtpObjectToDownload = None):
 		#
 		# get next file object to process
 		#
-		if fFirstLoopIteration:
+		if mtpObjectsIter != None:
+			mtpObject = next(mtpObjectsIter, None)
+		elif fFirstLoopIteration:
 			# use first object set in 'mtpObject' before start of while loop
 			fFirstLoopIteration = False
 		else:
@@ -2570,29 +3709,12 @@ def downloadMtpFileObjects(firstMtpObjectToDownload = None):
 			applog_d("Skipping {:s} - already downloaded this session".format(mtpObject.mtpObjectInfo.filename))
 			continue
 			
-		g.downloadMtpFileObjects_LastMtpObjectDownload = mtpObject
+		session.downloadMtpFileObjects_LastMtpObjectDownload = mtpObject
 				
-		mtpOpGet = CmdLineActionToMtpTransferOpDict[g.args['action']]
+		mtpOpGet = CmdLineActionToMtpTransferOpDict[session.args['action']]
 		
 		# build local filename that will hold image
-		filenameWithObjTypeSuffixBeforeRename = mtpObject.mtpObjectInfo.filename
-		if mtpOpGet == MTP_OP_GetThumb:
-			filenameWithObjTypeSuffixBeforeRename += ".sthumb.jpg"
-		elif mtpOpGet == MTP_OP_GetLargeThumb:
-			filenameWithObjTypeSuffixBeforeRename += ".lthumb.jpg"
-			
-		#
-		# perform rename engine on directory and/or filename if specified by user
-		#
-		if fUsingRenameEngineForAnyParameter:
-			# update dict with fields that change for each file
-			updateRenameDictKeysSpecificToMtpObject(renameDict, mtpObject, g.countFilesDownloadedPersistentAcrossStatsReset, len(downloadHistoryDict), filenameWithObjTypeSuffixBeforeRename)
-		if fUsingRenameEngineForDirOrFile:
-			(dirAfterRename, filenameAfterRename) = performDirAndFileRename(renameDict, True)
-		else:
-			filenameAfterRename = filenameWithObjTypeSuffixBeforeRename
-			dirAfterRename = os.path.abspath(g.args['outputdir'])
-			
+		filenameWithObjTypeSuffixBeforeRename = getFilenameWithObjTypeSuffix(mtpObject, mtpOpGet)
 			
 		#
 		# build download history description, which is used both to check if we've already
@@ -2603,32 +3725,48 @@ def downloadMtpFileObjects(firstMtpObjectToDownload = None):
 		# filename we use the original name with the appended sthumb/lthumb suffix if we'read
 		# downloading thumbs - that way we can uniquely track the downloading of the thumbs vs
 		# the actual image/video file. see the comments for loadDownloadHistory() for
-		# more information on how the history is handled
+		# more information on how the history is handled. the key doesn't depend on the
+		# rename engine, so we check the history before running it - skipped files (the
+		# common case on a card that's mostly been downloaded) don't pay for the rename
 		#
-		# format:
-		# 	filenameWithObjTypeSuffixBeforeRename::MTP capture data str::Size in human-readable comma form::::current time str::outputDirAnFilename
+		# format of key:
+		# 	filenameWithObjTypeSuffixBeforeRename::MTP capture data str::Size in human-readable comma form
 		# example:
-		#   DSC_0094.NEF::20150804T120900::22,719,774:::05/05/15 13:44::c:\pics\DSC_0094.NEF
+		#   DSC_0094.NEF::20150804T120900::22,719,774
+		#
+		# when walking the object list we look up the history for the upcoming files in batches (see prefetchDownloadHistory)
 		#
-		downloadHistoryDescStr_Key = "{:s}::{:s}::{:,}".format(filenameWithObjTypeSuffixBeforeRename, mtpObject.mtpObjectInfo.captureDateStr, mtpObject.mtpObjectInfo.objectCompressedSize)
-		if fSkipDownloadedFiles and downloadHistoryDescStr_Key in downloadHistoryDict:
+		downloadHistoryDescStr_Key = genDownloadHistoryKey(filenameWithObjTypeSuffixBeforeRename, mtpObject)
+		if fSkipDownloadedFiles and mtpObjectsIter == None and not downloadHistory.isPrefetched(downloadHistoryDescStr_Key):
+			prefetchDownloadHistory(downloadHistory, mtpObject, mtpOpGet)
+		downloadHistoryEntry = downloadHistory.lookup(downloadHistoryDescStr_Key) if fSkipDownloadedFiles else None
+		if downloadHistoryEntry:
 			#
-			# this file is in history. put the 'additional info area' into a named tuple for clarity and then
+			# this file is in history. put the download info into a named tuple for clarity and then
 			# log the information so the user knows the file has been skipped and when and where it was originally
 			# downloaded. note that a file may have been previously  downloaded multiple times, which is possible
 			# if the user instructed us to ignore history on one of those sessions - we only write the history on
 			# the first/original download, thus the history reflects that instead a more recent re-download
 			#
-			DownloadHistoryElement = namedtuple('DownloadHistoryElement', 'dateDownloadedStr pathDownloadedToStr')
-			listDownloadHistory = str.split(downloadHistoryDict[downloadHistoryDescStr_Key], '::') # each field of the additional info area is separated by two colons
-			downloadHistoryElementTuple = DownloadHistoryElement(listDownloadHistory[0], listDownloadHistory[1])				
+			downloadHistoryElementTuple = DownloadHistoryElement._make(downloadHistoryEntry)
 			applog_v("Skipping \"{:s}\" - downloaded on {:s} to \"{:s}\" ".\
 				format(filenameWithObjTypeSuffixBeforeRename, downloadHistoryElementTuple.dateDownloadedStr, downloadHistoryElementTuple.pathDownloadedToStr))
-			g.dlstats.countFilesSkippedDueToDownloadHistory += 1
+			session.dlstats.countFilesSkippedDueToDownloadHistory += 1
 			mtpObject.setAsDownloadedThisSession() # mark as downloaded so it wont be re-evaluated on subsequent scans
 			continue
-						
-			
+
+		#
+		# perform rename engine on directory and/or filename if specified by user
+		#
+		if fUsingRenameEngineForAnyParameter:
+			# update dict with fields that change for each file
+			updateRenameDictKeysSpecificToMtpObject(renameDict, mtpObject, session.countFilesDownloadedPersistentAcrossStatsReset, downloadHistory.count(), filenameWithObjTypeSuffixBeforeRename)
+		if fUsingRenameEngineForDirOrFile:
+			(dirAfterRename, filenameAfterRename) = performDirAndFileRename(renameDict, True)
+		else:
+			filenameAfterRename = filenameWithObjTypeSuffixBeforeRename
+			dirAfterRename = os.path.abspath(session.args['outputdir'])
+
 		#
 		# check if the output file already exists (if this isn't a file we're resuming a
 		# failed download on)
@@ -2637,7 +3775,7 @@ def downloadMtpFileObjects(firstMtpObjectToDownload = None):
 			localFilenameWithoutPath = filenameAfterRename
 			localFilenameWithPath = os.path.join(dirAfterRename, localFilenameWithoutPath)
 			if (os.path.exists(localFilenameWithPath)):
-				if g.args['ifexists'] == 'prompt':
+				if session.args['ifexists'] == 'prompt':
 					applog_i("\"{:s}\" exists".format(localFilenameWithPath))
 					#
 					# note that if the user takes too long to respond the MTP session may
@@ -2648,27 +3786,36 @@ def downloadMtpFileObjects(firstMtpObjectToDownload = None):
 					keyResponse = promptWithSingleKeyResponse("(S)kip, (O)verwrite, (U)niquename, (E)xit [+enter]: ", 'soue')
 				else:
 					keyResponse = ''			
-				if g.args['ifexists'] == 'skip' or keyResponse == 'S':
+				if session.args['ifexists'] == 'skip' or keyResponse == 'S':
 					if not keyResponse:
 						applog_i("Skipping \"{:s}\" - file exists".format(localFilenameWithPath))
-					g.dlstats.countFilesSkippedDueToFileExistingLocally += 1
+					session.dlstats.countFilesSkippedDueToFileExistingLocally += 1
 					continue
-				elif g.args['ifexists'] == 'overwrite' or keyResponse == 'O':
+				elif session.args['ifexists'] == 'overwrite' or keyResponse == 'O':
 					if not keyResponse:
 						applog_v("\"{:s}\" exists - will be overwritten".format(localFilenameWithPath))
 					applog_d("{:s} - deleting existing file per user config".format(localFilenameWithPath))
 					os.remove(localFilenameWithPath)
-				elif g.args['ifexists'] == 'uniquename' or keyResponse == 'U':
+				elif session.args['ifexists'] == 'uniquename' or keyResponse == 'U':
 					uniqueFilenameWithPath = generateUniqueFilename(localFilenameWithPath)
 					uniqueFilenameWithoutPath = os.path.basename(uniqueFilenameWithPath)
 					if not keyResponse:
 						applog_v("\"{:s}\" exists - will write to \"{:s}\"".format(localFilenameWithPath, uniqueFilenameWithoutPath))
 					localFilenameWithPath = uniqueFilenameWithPath
 					localFilenameWithoutPath = uniqueFilenameWithoutPath
-				elif g.args['ifexists'] == 'exit' or keyResponse == 'E':
+				elif session.args['ifexists'] == 'exit' or keyResponse == 'E':
 					applog_i("\"{:s}\" exists - exiting per user config".format(localFilenameWithPath))
 					sys.exit(ERRNO_FILE_EXISTS_USER_SPECIFIED_EXIT)
 			#
+			# check if a prior invocation was interrupted while downloading this file and
+			# left a resume journal - if so we'll resume from the data it committed
+			#
+			if mtpOpGet == MTP_OP_GetObject and session.args['resumejournal'] == 'yes':
+				bytesCommitted = loadResumeJournalForDownload(localFilenameWithPath, mtpObject)
+				if bytesCommitted:
+					applog_v("Resuming interrupted download of \"{:s}\" at {:,} of {:,} bytes".format(localFilenameWithoutPath, bytesCommitted, mtpObject.mtpObjectInfo.objectCompressedSize))
+					mtpObject.partialDownloadObj().addBytesWritten(bytesCommitted)
+			#
 			# save the local filename in case we had to generate a unique name and the
 			# transfer fails this invocation (we'll need the potentially unique filename
 			# on the retry invocation)
@@ -2686,17 +3833,15 @@ def downloadMtpFileObjects(firstMtpObjectToDownload = None):
 			localFilenameWithPath = os.path.join(dirAfterRename, localFilenameWithoutPath)
 
 		#
-		# generate download history strings based on the final path and filename. note that the key
-		# was already generated and is based on the pre-rename of the filename
+		# the download history entry will be based on the final path and filename along with the current
+		# time. note that the key was already generated and is based on the pre-rename of the filename
 		# 
 		currentTimeStr = strutil.getDateTimeStr(fMilitaryTime=True)
-		downloadHistoryDescStr_Info = "{:s}::{:s}\n".format(currentTimeStr, localFilenameWithPath)
-		downloadHistoryDescStr_Full = downloadHistoryDescStr_Key + "::::" + downloadHistoryDescStr_Info
 			
 					
 		# notify camera of acquisition start for this object if it was selected by the user in the camera (in camera transfer list)
-		if g.fAllObjsAreFromCameraTransferList:
-			mtpwifi.execMtpOp(g.socketPrimary, MTP_OP_NotifyFileAcquisitionStart, struct.pack('<I', mtpObject.mtpObjectHandle))
+		if session.fAllObjsAreFromCameraTransferList:
+			mtpwifi.execMtpOp(session.connPrimary, MTP_OP_NotifyFileAcquisitionStart, struct.pack('<I', mtpObject.mtpObjectHandle))
 		
 		# get the object
 		applog_d(">> {:s}".format(getMtpOpDesc(mtpOpGet)))
@@ -2708,6 +3853,7 @@ def downloadMtpFileObjects(firstMtpObjectToDownload = None):
 		#			
 		bUsingGetPartialObject = (mtpOpGet == MTP_OP_GetObject) # as opposed to MTP_OP_GetThumb or MTP_OP_GetLargeThumb
 		foDownloadedFile = None # no (new) data written to file yet this invocation
+		fileWriter = None
 		fFileDeletedOnCamera = False
 		localFilenameWithPath_TemporaryFilename = localFilenameWithPath + ".part"
 		if bUsingGetPartialObject:
@@ -2744,38 +3890,38 @@ def downloadMtpFileObjects(firstMtpObjectToDownload = None):
 				#
 
 				#
-				# loop to download and write each piece of the object. the size of each
-				# transfer is constrained by g.maxGetObjTransferSize
+				# loop to download each piece of the object. the size of each transfer is
+				# constrained by g.getObjTransferSize, which is fixed for the duration of
+				# a file (the pieces in flight must agree with our offsets). the data is streamed to the file as
+				# it arrives (see downloadMtpFileObjects_DataSink) rather than being accumulated
+				# in memory, and is written on a background thread so that the camera link
+				# isn't idle while we wait on the disk - g.maxGetObjBufferSize limits how much
+				# data can be queued for the writer before we stop and wait for it
+				#
+				# the requests are pipelined (up to g.getObjPipelineDepth in flight) for cameras
+				# that support it, to hide the round-trip latency of the wifi link
 				#
 				offsetIntoImage = bytesWritten
-				dataReceived = six.binary_type()
-				while offsetIntoImage < fileSizeBytes:
-					bytesToDownloadThisPiece = min(g.maxGetObjTransferSize, fileSizeBytes-offsetIntoImage)
-					if len(dataReceived)+bytesToDownloadThisPiece > g.maxGetObjBufferSize:
-						# the amount of data we already have + size of this transfer would exceed our configure maxgetobjbuffersize - constrain it
-						bytesToDownloadThisPiece -= (len(dataReceived)+bytesToDownloadThisPiece) - g.maxGetObjBufferSize
-					if bytesToDownloadThisPiece == 0:
-						# shouldn't happen
-						raise AssertionError("bytesToDownloadThisPiece is zero! offset=0x{:x}, fileSize=0x{:x}, dataReceived=0x{:x}, max=0x{:x}/0x{:x}".format(\
-							offsetIntoImage, fileSizeBytes, len(dataReceived), g.maxGetObjTransferSize, g.maxGetObjBufferSize))
-					applog_d("{:s} - downloading next piece, offset=0x{:x}, count=0x{:x}".format(localFilenameWithoutPath, offsetIntoImage, bytesToDownloadThisPiece))
-					timeStart = secondsElapsed(None)
-					mtpTcpCmdResultGetObj = mtpwifi.execMtpOp(g.socketPrimary, MTP_OP_GetPartialObject, struct.pack('<III',\
-						mtpObject.mtpObjectHandle, offsetIntoImage, bytesToDownloadThisPiece),\
-						rxTxProgressFunc=lambda bytesReceivedAllCurrentPayloads, totalBytesExpectedAllCurrentPayloads :\
-						downloadMtpFileObjects_DownloadProgressCallback(bytesReceivedAllCurrentPayloads, totalBytesExpectedAllCurrentPayloads, offsetIntoImage, fileSizeBytes))
+				transferSize = session.getObjTransferSize.size
+				fileWriter = BackgroundFileWriter(localFilenameWithPath, (bytesWritten != 0), session.maxGetObjBufferSize)
+				timeStart = secondsElapsed(None)
+				timeStartFile = timeStart
+				timeLastResumeJournalCommit = timeStart
+				for mtpTcpCmdResultGetObj in mtpwifi.execMtpOpPipelined(session.connPrimary, MTP_OP_GetPartialObject,\
+					downloadMtpFileObjects_GenGetPartialObjectArgs(mtpObject, localFilenameWithoutPath, offsetIntoImage, fileSizeBytes, transferSize), session.getObjPipelineDepth,\
+					rxTxProgressFunc=lambda bytesReceivedAllCurrentPayloads, totalBytesExpectedAllCurrentPayloads :\
+					downloadMtpFileObjects_DownloadProgressCallback(bytesReceivedAllCurrentPayloads, totalBytesExpectedAllCurrentPayloads, offsetIntoImage, fileSizeBytes),\
+					dataSinkFunc=lambda data : downloadMtpFileObjects_DataSink(fileWriter, mtpObject, session.downloadRateLimiter, data)):
 					mtpObject.partialDownloadObj().addDownloadTimeSecs(secondsElapsed(timeStart))
-												
-					dataReceived += mtpTcpCmdResultGetObj.dataReceived				
-					offsetIntoImage += bytesToDownloadThisPiece
-
-					bIsFinalPiece = (offsetIntoImage == fileSizeBytes)
-					if bIsFinalPiece or len(dataReceived) >= g.maxGetObjBufferSize:
-						# we've reached/exceeded our max buffer size or this is the final piece. write out the data we have
-						foDownloadedFile = writeDataToDownloadedFile(foDownloadedFile, localFilenameWithPath, dataReceived, bIsFinalPiece, (bytesWritten != 0)) # close file if this is the last piece
-						mtpObject.partialDownloadObj().addBytesWritten(len(dataReceived))
-						bytesWritten += len(dataReceived)
-						dataReceived = six.binary_type()						
+					timeStart = secondsElapsed(None)
+					offsetIntoImage += min(transferSize, fileSizeBytes-offsetIntoImage)
+					if session.args['resumejournal'] == 'yes' and secondsElapsed(timeLastResumeJournalCommit) >= RESUME_JOURNAL_COMMIT_INTERVAL_SECS:
+						fileWriter.commit(lambda bytesCommitted=mtpObject.partialDownloadObj().getBytesWritten() : writeResumeJournal(localFilenameWithPath, mtpObject, bytesCommitted))
+						timeLastResumeJournalCommit = secondsElapsed(None)
+				transferSecs = secondsElapsed(timeStartFile)
+				fileWriter.close() # wait for all the data to be written and close the file
+				updateGetObjPipelineDepthAllowlist(True)
+				session.getObjTransferSize.recordTransfer(fileSizeBytes-bytesWritten, transferSecs)
 
 				#
 				# we've completed the download and writing of the file
@@ -2792,33 +3938,40 @@ def downloadMtpFileObjects(firstMtpObjectToDownload = None):
 						
 				if fFileDeletedOnCamera == False:
 			
+					if e.mtpRespCode == MTP_RESP_COMMUNICATION_ERROR:
+						updateGetObjPipelineDepthAllowlist(False)
+						session.getObjTransferSize.recordCommError()
 					mtpObject.partialDownloadObj().addDownloadTimeSecs(secondsElapsed(timeStart))
-					applog_d("{:s} - error during download, writing 0x{:x} bytes of buffered data".format(localFilenameWithoutPath, len(dataReceived)))
+					applog_d("{:s} - error during download, 0x{:x} bytes written so far".format(localFilenameWithoutPath, mtpObject.partialDownloadObj().getBytesWritten()))
 					
-					# flush out any unwritten data we have in 'dataReceived'
-					if dataReceived:
-						foDownloadedFile = writeDataToDownloadedFile(foDownloadedFile, localFilenameWithPath, dataReceived, False, (bytesWritten != 0))
-						bytesWritten += len(dataReceived)
-						mtpObject.partialDownloadObj().addBytesWritten(len(dataReceived))
 					if e.partialData:
 						#
-						# more data was received before the communication failure. write
-						# that partial data to the file so that we don't have to incur the
-						# performance penalty of re-downloading it on the next retry invocation
+						# more data was received before the communication failure that wasn't
+						# streamed to the file yet. write that partial data to the file so that
+						# we don't have to incur the performance penalty of re-downloading it
+						# on the next retry invocation
 						# 
 						applog_d("{:s} - writing partial payload data of 0x{:x} bytes".format(localFilenameWithoutPath, len(e.partialData)))
-						foDownloadedFile = writeDataToDownloadedFile(foDownloadedFile, localFilenameWithPath, e.partialData, False, (bytesWritten != 0))
-						bytesWritten += len(e.partialData)
+						fileWriter.write(e.partialData)
 						mtpObject.partialDownloadObj().addBytesWritten(len(e.partialData))
-					if foDownloadedFile:
-						foDownloadedFile.close()
+					if session.args['resumejournal'] == 'yes' and mtpObject.partialDownloadObj().getBytesWritten() > 0:
+						fileWriter.commit(lambda bytesCommitted=mtpObject.partialDownloadObj().getBytesWritten() : writeResumeJournal(localFilenameWithPath, mtpObject, bytesCommitted))
 					raise
+
+			except mtpwifi.MtpTransactionIdMismatchException as e:
+				updateGetObjPipelineDepthAllowlist(False, True)
+				raise
+
+			finally:
+				# make sure all queued data is written and the file closed before we move on or a retry is attempted
+				if fileWriter:
+					fileWriter.close()
 					
 		else: # else of if bUsingGetPartialObject
 
 			timeStart = secondsElapsed(None)
 			try:
-				mtpTcpCmdResultGetObj = mtpwifi.execMtpOp(g.socketPrimary, mtpOpGet, struct.pack('<I', mtpObject.mtpObjectHandle),\
+				mtpTcpCmdResultGetObj = mtpwifi.execMtpOp(session.connPrimary, mtpOpGet, struct.pack('<I', mtpObject.mtpObjectHandle),\
 					rxTxProgressFunc=lambda bytesReceivedAllCurrentPayloads, totalBytesExpectedAllCurrentPayloads : downloadMtpFileObjects_DownloadProgressCallback(bytesReceivedAllCurrentPayloads, totalBytesExpectedAllCurrentPayloads, 0, 0))
 				dataReceived = mtpTcpCmdResultGetObj.dataReceived
 				fileDownloadTimeSecs = secondsElapsed(timeStart)
@@ -2860,7 +4013,8 @@ def downloadMtpFileObjects(firstMtpObjectToDownload = None):
 			mtpObject.setAsDownloadedThisSession()
 			mtpObject.releasePartialDownloadObj()
 			os.rename(localFilenameWithPath_TemporaryFilename, localFilenameWithPath) # download done - safe to rename to final filename
-			g.filesToDeleteOnAppExit.remove(localFilenameWithPath_TemporaryFilename)
+			session.filesToDeleteOnAppExit.remove(localFilenameWithPath_TemporaryFilename)
+			deleteResumeJournal(localFilenameWithPath)
 			
 			#
 			# print download completion message with transfer rate calculation
@@ -2875,31 +4029,26 @@ def downloadMtpFileObjects(firstMtpObjectToDownload = None):
 			#
 			# update running stats and mark the file as downloaded
 			#
-			g.dlstats.totalDownloadTimeSecs += fileDownloadTimeSecs
-			g.dlstats.totalBytesDownloaded += fileSizeBytes
-			g.dlstats.countFilesDownloaded += 1
-			g.countFilesDownloadedPersistentAcrossStatsReset += 1
+			session.dlstats.totalDownloadTimeSecs += fileDownloadTimeSecs
+			session.dlstats.totalBytesDownloaded += fileSizeBytes
+			session.dlstats.countFilesDownloaded += 1
+			session.countFilesDownloadedPersistentAcrossStatsReset += 1
 
 
 			#
 			# notify camera of acquisition end for this object if it was selected by the user in the camera (in camera transfer list).
 			# this action removes the image/file from the transfer list in the camera
 			#
-			if g.fAllObjsAreFromCameraTransferList:
-				mtpwifi.execMtpOp(g.socketPrimary, MTP_OP_NotifyFileAcquisitionEnd, struct.pack('<I', mtpObject.mtpObjectHandle))
+			if session.fAllObjsAreFromCameraTransferList:
+				mtpwifi.execMtpOp(session.connPrimary, MTP_OP_NotifyFileAcquisitionEnd, struct.pack('<I', mtpObject.mtpObjectHandle))
 
 			#
-			# add this file to the download history file. also note when
+			# add this file to the download history. also note when
 			# fSkipDownloadedFiles==FALSE (user specified to ignore download history and
-			# force download), there may already be an entry in the history file for
-			# this image - to prevent duplicates we check membership first
+			# force download), there may already be an entry in the history for
+			# this image - add() leaves any existing entry in place
 			#
-			if downloadHistoryDescStr_Key not in downloadHistoryDict:
-				# if this file is not already in the history
-				fileDownloadHistory.write(downloadHistoryDescStr_Full)
-				fileDownloadHistory.flush()
-				# add file to the in-memory copy of the history
-				downloadHistoryDict[downloadHistoryDescStr_Key] = downloadHistoryDescStr_Info
+			downloadHistory.add(downloadHistoryDescStr_Key, currentTimeStr, localFilenameWithPath)
 
 									
 			#
@@ -2915,7 +4064,7 @@ def downloadMtpFileObjects(firstMtpObjectToDownload = None):
 			#
 			# launch optional user-specific program for this downloaded file
 			#
-			if g.args['downloadexec']:
+			if session.args['downloadexec']:
 				renameDict['filename'] = localFilenameWithoutPath # update dict in case filename changed due to ifexists unique creation
 				doDownloadExec(renameDict, mtpObject)
 					
@@ -2935,13 +4084,14 @@ def downloadMtpFileObjects(firstMtpObjectToDownload = None):
 			# delete the partially-downloaded portion of file (if any of it was written
 			# before we detected the deletion)
 			#
-			if localFilenameWithPath_TemporaryFilename in g.filesToDeleteOnAppExit:
+			if localFilenameWithPath_TemporaryFilename in session.filesToDeleteOnAppExit:
 				deleteFileIgnoreErrors(localFilenameWithPath_TemporaryFilename)
-				g.filesToDeleteOnAppExit.remove(localFilenameWithPath_TemporaryFilename)
+				session.filesToDeleteOnAppExit.remove(localFilenameWithPath_TemporaryFilename)
+			deleteResumeJournal(localFilenameWithPath)
 				
 
 	# do any post-operation cleanup
-	fileDownloadHistory.close()	
+	downloadHistory.close()	
 		
 
 #
@@ -2991,7 +4141,7 @@ def printMtpObjectDirectoryListing():
 	# print listing summary
 	#		
 	applog_i("        {:4d} File(s)  {:13,} bytes".format(countFilesListed, totalBytesOfImagesInObjectsListed))
-	applog_i("        {:4d} Dir(s)  {:13,} bytes free {:s}".format(MtpObject._CountMtpObjectDirectories, g.mtpStorageInfoList[0].freeSpaceBytes,\
+	applog_i("        {:4d} Dir(s)  {:13,} bytes free {:s}".format(g.mtpObjects.countDirectories, g.mtpStorageInfoList[0].freeSpaceBytes,\
 				"[CARD 1]" if g.countCardsUsed > 1 else ""))
 	for cardIndex in xrange(1, g.countCardsUsed):
 		applog_i("                     {:13,} bytes free [CARD {:d}]".format(g.mtpStorageInfoList[cardIndex].freeSpaceBytes, cardIndex+1))
@@ -3006,7 +4156,7 @@ def printMtpObjectDirectoryListing():
 #		
 def getMtpDeviceProperty(mtpDevicePropCode, fIgnoreIfNotSupported=False):
 	try:
-		mtpTcpCmdResultGetObj = mtpwifi.execMtpOp(g.socketPrimary, MTP_OP_GetDevicePropValue, struct.pack('<I', mtpDevicePropCode))
+		mtpTcpCmdResultGetObj = mtpwifi.execMtpOp(g.connPrimary, MTP_OP_GetDevicePropValue, struct.pack('<I', mtpDevicePropCode))
 		return mtpTcpCmdResultGetObj.dataReceived
 	except mtpwifi.MtpOpExecFailureException as e:
 		if fIgnoreIfNotSupported and e.mtpRespCode != MTP_RESP_COMMUNICATION_ERROR:
@@ -3021,7 +4171,7 @@ def getMtpDeviceProperty(mtpDevicePropCode, fIgnoreIfNotSupported=False):
 #		
 def setMtpDeviceProperty(mtpDevicePropCode, devicePropData, fIgnoreIfNotSupported=False):
 	try:
-		mtpTcpCmdResultGetObj = mtpwifi.execMtpOp(g.socketPrimary, MTP_OP_SetDevicePropValue, struct.pack('<I', mtpDevicePropCode), devicePropData)
+		mtpTcpCmdResultGetObj = mtpwifi.execMtpOp(g.connPrimary, MTP_OP_SetDevicePropValue, struct.pack('<I', mtpDevicePropCode), devicePropData)
 		return False
 	except mtpwifi.MtpOpExecFailureException as e:
 		if fIgnoreIfNotSupported and e.mtpRespCode != MTP_RESP_COMMUNICATION_ERROR:
@@ -3035,7 +4185,7 @@ def setMtpDeviceProperty(mtpDevicePropCode, devicePropData, fIgnoreIfNotSupporte
 #		
 def setMtpDeviceProperty_Canon(devicePropData, fIgnoreIfNotSupported=False):
 	try:
-		mtpTcpCmdResultGetObj = mtpwifi.execMtpOp(g.socketPrimary, MTP_OP_Canon_SetDevicePropValue, dataToSend=devicePropData)
+		mtpTcpCmdResultGetObj = mtpwifi.execMtpOp(g.connPrimary, MTP_OP_Canon_SetDevicePropValue, dataToSend=devicePropData)
 		return False
 	except mtpwifi.MtpOpExecFailureException as e:
 		if fIgnoreIfNotSupported and e.mtpRespCode != MTP_RESP_COMMUNICATION_ERROR:
@@ -3157,6 +4307,7 @@ def printSpinningProgressCharToConsole():
 # of MtpEventTuple's describing each event
 # 
 MtpEventTuple = namedtuple('MtpEvent', 'eventCode eventParameter')	
+@mtpResponseParser
 def parseNikonMtpEventData(data):
 	mtpEventTupleList = []
 	(eventCount,) = struct.unpack('<H', data[0:2])
@@ -3187,7 +4338,7 @@ def genNikonEventListDescription(mtpEventList):
 # retrieves any queued events from Nikon camera, returning parsed event list
 #	
 def getNikonMtpEvents():
-	mtpTcpCmdResultGetObj = mtpwifi.execMtpOp(g.socketPrimary, MTP_OP_NkonGetEvent)
+	mtpTcpCmdResultGetObj = mtpwifi.execMtpOp(g.connPrimary, MTP_OP_NkonGetEvent)
 	return parseNikonMtpEventData(mtpTcpCmdResultGetObj.dataReceived)
 	
 #
@@ -3253,6 +4404,48 @@ def realTimeCapture_NikonEventsMethod():
 		raise
 
 		
+#
+# waits up to 'timeoutSecs' for events from the camera on the MTP-TCP/IP events socket,
+# returning the list of mtpwifi.MtpTcpEvent received (empty if none). events that don't
+# affect the object list (ex: MTP_EVENT_DevicePropChanged) are collected but don't end
+# the wait early, otherwise a camera that sends a steady stream of them would cause
+# us to poll far more often than 'timeoutSecs' - we return before the deadline only
+# when an event in REALTIME_OBJLIST_EVENT_CODES arrives. if listening for events is
+# disabled (--rtd_mtpevents no) this just sleeps for 'timeoutSecs' and returns an empty list
+#
+def waitForRealtimeMtpEvents(timeoutSecs):
+	if g.args['rtd_mtpevents'] == 'no':
+		time.sleep(timeoutSecs)
+		return []
+	mtpEventList = []
+	timeDeadline = time.time() + timeoutSecs
+	while True:
+		timeRemaining = max(timeDeadline - time.time(), 0)
+		newMtpEventList = mtpwifi.rxEvents(g.connEvents, timeRemaining)
+		mtpEventList.extend(newMtpEventList)
+		if timeRemaining == 0 or any(mtpEvent.eventCode in REALTIME_OBJLIST_EVENT_CODES for mtpEvent in newMtpEventList):
+			return mtpEventList
+
+#
+# creates MTP objects for the handles reported by MTP_EVENT_ObjectAdded events,
+# skipping any not on the user's configured card slot. returns the number of
+# new file (non-folder) objects created
+#
+def createMtpObjectsFromObjectAddedHandles(objHandlesList):
+	countNewFileObjects = 0
+	for objHandle in objHandlesList:
+		if MtpObject.getByMtpObjectHandle(objHandle):
+			applog_d("realTimeCapture: MtpObject for handle 0x{:08x} already exists, skipping".format(objHandle))
+			continue
+		mtpObjectInfo = getMtpObjectInfo(objHandle)
+		if g.storageId != MTP_STORAGEID_ALL_CARDS and mtpObjectInfo.storageId != g.storageId:
+			applog_v("Ignoring \"{:s}\" because it's not from your configured --slot".format(mtpObjectInfo.filename))
+			continue
+		mtpObject = createMtpObjectFromHandle(objHandle, mtpObjectInfo=mtpObjectInfo)
+		if mtpObject.mtpObjectInfo.associationType != MTP_OBJASSOC_GenericFolder:
+			countNewFileObjects += 1
+	return countNewFileObjects
+
 #
 # realtime download loop using generic MTP-object count polling method
 #
@@ -3293,6 +4486,17 @@ def realTimeCapture_MtpObjPollingMethod():
 	# because the user hasn't been told we're ready for realtime until
 	# the message that will be posted below to the console)
 	#
+	# rather than sleeping between polls we wait on the MTP-TCP/IP events socket,
+	# which some cameras use to report MTP_EVENT_ObjectAdded for each new object.
+	# once the camera has sent us one of those we know it reports new objects
+	# this way, so we download new objects as soon as their events arrive and stop
+	# retrieving the full object handle list every interval - from then on we only
+	# do so every --rtd_mtpeventsfallbackpollsecs as a safety net for any object
+	# the camera didn't send an event for, or immediately when the camera reports
+	# an event that may have changed the object list in other ways (object or
+	# card removed, card inserted). cameras that never send events on the socket
+	# are polled every --realtimepollsecs as before
+	#
 	
 	lastFullMtpHandleList = g.lastFullMtpHandleListProcessedByBuildMtpObjects
 	if not lastFullMtpHandleList:
@@ -3301,7 +4505,12 @@ def realTimeCapture_MtpObjPollingMethod():
 		if isDebugLog():
 			applog_d("realTimeCapture_MtpObjPollingMethod(): First MTP object list (count={:d}):".format(len(lastFullMtpHandleList)))
 			applog_d(strutil.hexdump(struct.pack('<' + 'I'*len(lastFullMtpHandleList), *lastFullMtpHandleList), bytesPerField=4, includeASCII=False))
+	knownMtpHandleSet = set(lastFullMtpHandleList)	# handles we've already processed, either from an object list or an event
 		
+	fCameraSendsObjectAddedEvents = False
+	fPollObjList = True
+	timeLastPolled = None
+	timeProbeLastSent = mtpSessionKeepAlive(None)
 	fRedrawWaitingMessage = True
 	try:
 		while True:
@@ -3311,49 +4520,81 @@ def realTimeCapture_MtpObjPollingMethod():
 				fRedrawWaitingMessage = False
 			printSpinningProgressCharToConsole()
 			
-			fNumObjsChanged = False
-			if g.args['rtd_mtppollingmethod_newobjdetection'] == 'numobjs':
-				#
-				# see if the number of MTP objects on the camera has changed since
-				# the last time we've processed the camera's object list
-				#
-				numMtpObjects = getNumMtpObjects(g.storageId)
-				fNumObjsChanged = numMtpObjects != len(lastFullMtpHandleList)
-				if fNumObjsChanged:
-					applog_d("fNumObjsChanged TRUE: (previous=0x{:d}, new=0x{:d}".format(len(lastFullMtpHandleList), numMtpObjects))
-				
-			if fNumObjsChanged or g.args['rtd_mtppollingmethod_newobjdetection'] == 'objlist':
+			if fPollObjList:
 			
-				#
-				# get current list of object handles from camera if we're using the
-				# numobjs method for detection and the number of objects changed or if
-				# we're using the objlist method (to see if there are new objects)
-				#
-				currentFullMtpHandleList = getMtpObjectHandles(g.storageId)
-				newMtpHandleList = list(set(currentFullMtpHandleList).difference(lastFullMtpHandleList))				
-				lastFullMtpHandleList = currentFullMtpHandleList
+				timeLastPolled = time.time()
+				fNumObjsChanged = False
+				if g.args['rtd_mtppollingmethod_newobjdetection'] == 'numobjs':
+					#
+					# see if the number of MTP objects on the camera has changed since
+					# the last time we've processed the camera's object list
+					#
+					numMtpObjects = getNumMtpObjects(g.storageId)
+					fNumObjsChanged = numMtpObjects != len(knownMtpHandleSet)
+					if fNumObjsChanged:
+						applog_d("fNumObjsChanged TRUE: (previous=0x{:d}, new=0x{:d}".format(len(knownMtpHandleSet), numMtpObjects))
+					
+				if fNumObjsChanged or g.args['rtd_mtppollingmethod_newobjdetection'] == 'objlist':
 				
-				if isDebugLog() and (fNumObjsChanged or newMtpHandleList):
-					applog_d("realTimeCapture_MtpObjPollingMethod(): Current MTP object list (count={:d}):".format(len(currentFullMtpHandleList)))
-					applog_d(strutil.hexdump(struct.pack('<' + 'I'*len(currentFullMtpHandleList), *currentFullMtpHandleList), bytesPerField=4, includeASCII=False))
-					applog_d("realTimeCapture_MtpObjPollingMethod(): New MTP object list (count={:d}):".format(len(newMtpHandleList)))
-					applog_d(strutil.hexdump(struct.pack('<' + 'I'*len(newMtpHandleList), *newMtpHandleList), bytesPerField=4, includeASCII=False))				
-								
-				if newMtpHandleList:
-										
-					# we have new objects to process
-					consoleClearLine()
-					fRedrawWaitingMessage = True
-														
-					createMtpObjectsFromHandleList(newMtpHandleList)
-					downloadMtpFileObjects()
+					#
+					# get current list of object handles from camera if we're using the
+					# numobjs method for detection and the number of objects changed or if
+					# we're using the objlist method (to see if there are new objects)
+					#
+					currentFullMtpHandleList = getMtpObjectHandles(g.storageId)
+					newMtpHandleList = [objHandle for objHandle in currentFullMtpHandleList if objHandle not in knownMtpHandleSet]
+					knownMtpHandleSet = set(currentFullMtpHandleList)
 					
-					continue # check for new objects immediately without sleeping first
+					if isDebugLog() and (fNumObjsChanged or newMtpHandleList):
+						applog_d("realTimeCapture_MtpObjPollingMethod(): Current MTP object list (count={:d}):".format(len(currentFullMtpHandleList)))
+						applog_d(strutil.hexdump(struct.pack('<' + 'I'*len(currentFullMtpHandleList), *currentFullMtpHandleList), bytesPerField=4, includeASCII=False))
+						applog_d("realTimeCapture_MtpObjPollingMethod(): New MTP object list (count={:d}):".format(len(newMtpHandleList)))
+						applog_d(strutil.hexdump(struct.pack('<' + 'I'*len(newMtpHandleList), *newMtpHandleList), bytesPerField=4, includeASCII=False))				
+									
+					if newMtpHandleList:
+											
+						# we have new objects to process
+						consoleClearLine()
+						fRedrawWaitingMessage = True
+															
+						createMtpObjectsFromHandleList(newMtpHandleList)
+						downloadMtpFileObjects()
+						
+						continue # check for new objects immediately without waiting first
 				
 			#
-			# no new objects. sleep before checking again
+			# no new objects. wait for events from the camera before checking again
 			#
-			time.sleep(g.args['realtimepollsecs'])
+			mtpEventList = waitForRealtimeMtpEvents(g.args['realtimepollsecs'])
+			fObjListMayHaveChanged = False
+			newMtpHandleList = []
+			for mtpEvent in mtpEventList:
+				if mtpEvent.eventCode == MTP_EVENT_ObjectAdded and mtpEvent.params:
+					if not fCameraSendsObjectAddedEvents:
+						applog_d("realTimeCapture_MtpObjPollingMethod(): Camera sends MTP_EVENT_ObjectAdded - switching to event-driven detection")
+						fCameraSendsObjectAddedEvents = True
+					objHandle = mtpEvent.params[0]
+					if objHandle not in knownMtpHandleSet:
+						knownMtpHandleSet.add(objHandle)
+						newMtpHandleList.append(objHandle)
+				elif mtpEvent.eventCode == MTP_EVENT_StoreFull:
+					consoleClearLine()
+					fRedrawWaitingMessage = True
+					applog_i("Camera reports its media card is full")
+				elif mtpEvent.eventCode in (MTP_EVENT_ObjectRemoved, MTP_EVENT_StoreAdded, MTP_EVENT_StoreRemoved):
+					fObjListMayHaveChanged = True
+				
+			if newMtpHandleList:
+				consoleClearLine()
+				fRedrawWaitingMessage = True
+				if createMtpObjectsFromObjectAddedHandles(newMtpHandleList):
+					downloadMtpFileObjects()
+				
+			fPollObjList = not fCameraSendsObjectAddedEvents or fObjListMayHaveChanged or\
+				time.time() - timeLastPolled >= g.args['rtd_mtpeventsfallbackpollsecs']
+			if not fPollObjList:
+				# we're no longer polling the camera, which would otherwise keep the session alive
+				timeProbeLastSent = mtpSessionKeepAlive(timeProbeLastSent)
 			
 	except KeyboardInterrupt as e: # <ctrl-c> pressed
 		consoleClearLine()
@@ -3424,9 +4665,6 @@ def realTimeCapture():
 #
 def appMain():
 
-	if not hasattr(appMain, "lastConnectErrMsg"):
-		appMain.lastConnectErrMsg = "" # static var to track last connect err msg to allow supressing reporting while waiting for connection across retries
-
 	bSessionStarted = False
 	bAttemptCloseSessionAtTermination = False
 	bEchoNewlineBeforeReturning = True
@@ -3437,7 +4675,7 @@ def appMain():
 		startMtpSession()
 		bSessionStarted = True						# we're now in a session
 		bAttemptCloseSessionAtTermination = True	# we're now in a session, so set flag to close it when we're done
-		appMain.lastConnectErrMsg = ""				# clear out last connection error msg now that we're connected
+		g.lastConnectErrMsg = ""				# clear out last connection error msg now that we're connected
 		
 		#
 		# sync clocks if necessary
@@ -3471,8 +4709,17 @@ def appMain():
 		# user already started taking photos that he expects us to download and since the realtime logic
 		# only detects images taken after they enter their polling loop we would miss those initial images)
 		#
-		if (g.fRetrievedMtpObjects == False and g.args['realtimedownload'] != 'only') or g.fRealTimeDownloadPhaseStarted\
-			or secondsElapsed(g.appStartTimeEpoch) > g.args['rtd_maxsecsbeforeforceinitialobjlistget']:
+		# if the user enabled --overlapenum we instead enumerate the objects as we download them
+		# (see genMtpObjectsOverlappedWithEnumeration()). we only do this for the initial object
+		# retrieval of a download session - the realtime recovery paths below need the full object
+		# list before they start downloading. if we're interrupted by an error the retry will run
+		# the overlapped enumeration again, which skips objects we already created and files we
+		# already downloaded
+		#
+		fOverlapEnumWithDownload = g.args['overlapenum'] == 'yes' and g.args['action'] != 'listfiles' and\
+			g.fRetrievedMtpObjects == False and g.args['realtimedownload'] != 'only' and not g.fRealTimeDownloadPhaseStarted
+		if not fOverlapEnumWithDownload and ((g.fRetrievedMtpObjects == False and g.args['realtimedownload'] != 'only') or g.fRealTimeDownloadPhaseStarted\
+			or secondsElapsed(g.appStartTimeEpoch) > g.args['rtd_maxsecsbeforeforceinitialobjlistget']):
 			buildMtpObjects()
 			g.fRetrievedMtpObjects = True
 			
@@ -3492,7 +4739,13 @@ def appMain():
 			# in recovery) and if we established an initial connection to the camera
 			# fast enough to allow us to avoid worrying about missing any initial photos
 			#
-			if g.fRetrievedMtpObjects:
+			if fOverlapEnumWithDownload:
+			
+				downloadMtpFileObjects(mtpObjectsIter=genMtpObjectsOverlappedWithEnumeration())
+				g.fRetrievedMtpObjects = True
+				g.dlstats.reportDownloadStats(False)
+
+			elif g.fRetrievedMtpObjects:
 			
 				if g.fRealTimeDownloadPhaseStarted or g.args['realtimedownload'] == 'only':
 					#
@@ -3531,9 +4784,9 @@ def appMain():
 		
 	except (mtpwifi.MtpConnectionFailureException, ssdp.DiscoverFailureException) as e:
 		newConnectErrMsg = str(e)
-		if newConnectErrMsg != appMain.lastConnectErrMsg or g.args['suppressdupconnecterrmsgs'] == 'no':
+		if newConnectErrMsg != g.lastConnectErrMsg or g.args['suppressdupconnecterrmsgs'] == 'no':
 			applog_e(newConnectErrMsg)
-			appMain.lastConnectErrMsg = newConnectErrMsg
+			g.lastConnectErrMsg = newConnectErrMsg
 		else:
 			# don't do newline since we're keeping the last connection error message displayed
 			bEchoNewlineBeforeReturning = False
@@ -3631,12 +4884,16 @@ def appMain():
 # deletes all files marked for deletion upon exit. this mechanism is necessary to
 # delete a file we were downloading/writing but failed before the operation could
 # completed. we don't want to leave a partially written file, otherwise the user
-# might think it's a valid file
+# might think it's a valid file. the exception is a .part file that has a resume
+# journal - we keep those so that a later invocation can resume the download
 #
 def deleteFilesMarkedForDeletionOnExit():
 	for filenameWithPath in g.filesToDeleteOnAppExit:
 		applog_d("deleteFilesMarkedForDeletionOnExit(): Processing {:s}".format(filenameWithPath))
 		try: # ignore os.path.exists() errors
+			if os.path.exists(filenameWithPath + ".resume"):
+				applog_v("Keeping \"{:s}\" to resume its download on a future invocation".format(filenameWithPath))
+				continue
 			if (os.path.exists(filenameWithPath)):
 				applog_v("Deleting \"{:s}\" because of a failed download or file operation".format(filenameWithPath))
 				deleteFileIgnoreErrors(filenameWithPath)
@@ -3644,6 +4901,22 @@ def deleteFilesMarkedForDeletionOnExit():
 			pass
 
 			
+#
+# writes the per-op MTP stats of the session to the log (and console if verbose logging is enabled)
+# and, if configured, exports them as JSON to the file specified by --mtpopstatsfile
+#
+def reportMtpOpStats():
+	if g.mtpOpStats.isEmpty():
+		return
+	logFlags = APPLOGF_LEVEL_INFORMATIONAL if isVerboseLog() else APPLOGF_LEVEL_INFORMATIONAL | APPLOGF_DONT_WRITE_TO_CONSOLE
+	for line in g.mtpOpStats.genReportLines():
+		applog(line, logFlags)
+	if g.args['mtpopstatsfile']:
+		try:
+			g.mtpOpStats.save(g.args['mtpopstatsfile'])
+		except IOError as e:
+			applog_e("Unable to write MTP op stats file \"{:s}\": {:s}".format(g.args['mtpopstatsfile'], str(e)))
+
 #
 # invoked near  exit, issues a final log message which is used by utils to signify a gracefully
 # shutdown and then tells the applog module to shut itself down
@@ -3686,13 +4959,17 @@ def main():
 	verifyPythonVersion()	
 	
 	#
-	# process command line arguments
-	#
-	processCmdLine()
-		
-	#
-	# do app's main work
+	# process command line arguments and do app's main work
 	#
+	_errno = getActiveCameraSession().run()
+	shutdownApplog()
+	return _errno
+
+#
+# performs appMain(), retrying it on errors as configured by the user. returns
+# the errno of the last invocation
+#
+def runSessionWithRetries():
 	attemptNumber = 0
 	while True:	
 		try:
@@ -3726,12 +5003,6 @@ def main():
 				# for some reason we intermittently get a second SIGINT running on Linux frozen; ignore the 2nd
 				pass
 			break;
-
-	#
-	# cleanup and then exit
-	#
-	deleteFilesMarkedForDeletionOnExit()
-	shutdownApplog()
 	return _errno
 
 #
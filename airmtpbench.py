@@ -0,0 +1,395 @@
+#!/usr/bin/env python
+
+#
+#############################################################################
+#
+# airmtpbench.py - End-to-end benchmark of airmtp's enumeration, cache, history
+# and download phases against the MTP/IP camera simulator
+# Copyright (C) 2015, testcams.com
+#
+# This module is licensed under GPL v3: http://www.gnu.org/licenses/gpl-3.0.html
+#
+#############################################################################
+#
+# For each card size (--sizes, in number of camera objects) the benchmark starts
+# mtpsim.py with a card of that size and runs two complete airmtp sessions against it:
+#
+#	cold	- no object cache or download history; every object is enumerated from the
+#			  camera and every file downloaded
+#	warm	- repeats the session with the cache and history from the cold pass, so
+#			  enumeration comes from the cache and every file is skipped via the history
+#
+# Each pass runs in its own worker process (this script invoked with the hidden --worker
+# option), which runs the airmtp session in-process with timers wrapped around its
+# phases - buildMtpObjects(), loadAndValidateMtpObjectInfoCacheFromDisk(),
+# saveMtpObjectsToDiskCache(), openDownloadHistory(), rename.performRename(), the
+# download history lookups (DownloadHistory.prefetch() and lookup()) and
+# downloadMtpFileObjects(). Keeping each pass in its own process means the CPU time
+# and peak RSS measured are airmtp's alone (the simulator runs in a separate process)
+# and aren't inflated by earlier passes. Phase times are inclusive - for example
+# buildMtpObjects() includes the cache load/save it performs, and downloadMtpFileObjects()
+# includes opening the history and renaming files.
+#
+# The results are written as JSON (--resultfile) with, for each size and pass, the
+# wall time, CPU time (user+system), peak RSS at the end of each phase and MB/s for
+# phases that transfer file data, along with the session's per-op MTP latency stats
+# (see mtpwifi.MtpOpStatsRegistry). Any arguments the benchmark doesn't recognize are passed
+# through to airmtp, and --simargs to the simulator, for example:
+#
+#	airmtpbench.py --sizes 100 1000 10000 --simargs "--latencyms 2 --maxratekbsec 20000" --getobjpipelinedepth 4
+#
+
+from __future__ import print_function
+from __future__ import division
+import argparse
+import subprocess
+import threading
+import tempfile
+import shutil
+import shlex
+import json
+import time
+import sys
+import os
+import errno
+import platform
+import multiprocessing
+import traceback
+import strutil
+import rename
+import dlhistory
+import airmtp
+from applog import *
+try:
+	import resource		# not available on Windows, where we don't report peak RSS
+except ImportError:
+	resource = None
+
+#
+# constants
+#
+AIRMTPBENCH_APP_VERSION				= "1.0"
+AIRMTPBENCH_RESULTS_FORMAT_VERSION	= 1
+DEFAULT_CARD_SIZES					= [100, 1000, 10000, 50000]
+DEFAULT_FILE_SIZE_KB				= 16		# kept small so the largest card doesn't need gigabytes of scratch space
+SIMULATOR_STARTUP_TIMEOUT_SECS		= 300		# max time we wait for the simulator to build its card and start listening
+SIMULATOR_READY_TEXT				= "Running - press"	# line mtpsim.py prints once it's listening
+SIMULATOR_IP_ADDRESS				= "127.0.0.1"
+BENCH_PASSES						= ['cold', 'warm']
+WORKER_LOG_LINES_ON_ERROR			= 20		# lines of a failed worker's output we display
+
+#
+# airmtp arguments every worker session runs with. they precede any pass-through arguments from the
+# user, so the user can override them. the rename spec exercises rename.performRename() for every file
+#
+DEFAULT_AIRMTP_ARGS = ['--retrycount', '1', '--camerasleepwhendone', 'no',
+	'--filenamespec', '@capturedate_y@@capturedate_m@@capturedate_d@-@capturetime_h@@capturetime_m@@capturetime_s@_@filename@']
+
+#
+# phases we time, as (phase name, module, function name)
+#
+BENCH_PHASES = [
+	('buildMtpObjects',							airmtp, 'buildMtpObjects'),
+	('loadAndValidateMtpObjectInfoCacheFromDisk',	airmtp, 'loadAndValidateMtpObjectInfoCacheFromDisk'),
+	('saveMtpObjectsToDiskCache',				airmtp, 'saveMtpObjectsToDiskCache'),
+	('openDownloadHistory',						airmtp, 'openDownloadHistory'),
+	('rename.performRename',					rename, 'performRename'),
+	('DownloadHistory.prefetch',				dlhistory.DownloadHistory, 'prefetch'),
+	('DownloadHistory.lookup',					dlhistory.DownloadHistory, 'lookup'),
+	('downloadMtpFileObjects',					airmtp, 'downloadMtpFileObjects'),
+]
+
+#
+# global variables
+#
+class GlobalVarsStruct:
+	def __init__(self):
+		self.appDir = None					# directory where script is located
+		self.args = None					# dictionary of our command-line arguments (generated by argparse)
+		self.passThroughArgs = None			# command-line arguments we pass through to airmtp
+		self.workDir = None					# directory holding the app data, output and logs of each run
+		self.resultsDict = None				# results we write to --resultfile
+g = GlobalVarsStruct()
+
+
+#
+# exception raised when the simulator or a worker can't be run
+#
+class BenchmarkException(Exception):
+	def __init__(self, message):
+		Exception.__init__(self, message)
+
+
+def getCpuSecs():
+	if hasattr(time, 'process_time'):
+		return time.process_time()
+	(userSecs, systemSecs) = os.times()[:2]	# python 2
+	return userSecs + systemSecs
+
+#
+# returns the peak RSS of our process so far, in KB (None if it's not available on this platform)
+#
+def getPeakRssKb():
+	if resource == None:
+		return None
+	maxRss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	return maxRss // 1024 if platform.system() == 'Darwin' else maxRss	# OSX reports in bytes, Linux in KB
+
+def calcMbPerSec(numBytes, secs):
+	if numBytes == None or secs <= 0:
+		return None
+	return numBytes / secs / 1048576
+
+
+#
+# accumulates the time spent in one phase across all calls to it. 'fnGetBytesCounter'
+# optionally returns a running count of the bytes the phase transferred
+#
+class BenchPhaseTimer:
+	def __init__(self, name, fnGetBytesCounter=None):
+		self.name = name
+		self.fnGetBytesCounter = fnGetBytesCounter
+		self.countCalls = 0
+		self.wallSecs = 0
+		self.cpuSecs = 0
+		self.numBytes = 0 if fnGetBytesCounter else None
+		self.peakRssKb = None
+		self.nesting = 0					# so that recursive calls are only timed once
+
+	def wrap(self, func):
+		def timedFunc(*args, **kwargs):
+			self.nesting += 1
+			if self.nesting > 1:
+				try:
+					return func(*args, **kwargs)
+				finally:
+					self.nesting -= 1
+			timeStart = time.time()
+			cpuSecsStart = getCpuSecs()
+			bytesStart = self.fnGetBytesCounter() if self.fnGetBytesCounter else None
+			try:
+				return func(*args, **kwargs)
+			finally:
+				self.nesting -= 1
+				self.countCalls += 1
+				self.wallSecs += time.time() - timeStart
+				self.cpuSecs += getCpuSecs() - cpuSecsStart
+				if self.fnGetBytesCounter:
+					self.numBytes += self.fnGetBytesCounter() - bytesStart
+				self.peakRssKb = getPeakRssKb()
+		return timedFunc
+
+	def genResultDict(self):
+		return { 'calls' : self.countCalls, 'wallSecs' : self.wallSecs, 'cpuSecs' : self.cpuSecs, 'bytes' : self.numBytes,
+			'mbPerSec' : calcMbPerSec(self.numBytes, self.wallSecs), 'peakRssKb' : self.peakRssKb }
+
+
+#
+# worker mode - runs one airmtp session in this process with our timers installed, writing
+# the results to --workerresultfile. returns the session's exit code
+#
+def runWorker():
+	phaseTimersList = []
+	for (phaseName, module, funcName) in BENCH_PHASES:
+		fnGetBytesCounter = (lambda: airmtp.g.dlstats.totalBytesDownloaded) if funcName == 'downloadMtpFileObjects' else None
+		phaseTimer = BenchPhaseTimer(phaseName, fnGetBytesCounter)
+		setattr(module, funcName, phaseTimer.wrap(getattr(module, funcName)))
+		phaseTimersList.append(phaseTimer)
+
+	session = airmtp.CameraSession()
+	session.activate()
+	airmtp.establishAppEnvironment()
+	session.appDataDir = g.args['workerappdatadir']
+
+	timeStart = time.time()
+	cpuSecsStart = getCpuSecs()
+	_errno = session.run(g.passThroughArgs)
+	wallSecs = time.time() - timeStart
+	cpuSecs = getCpuSecs() - cpuSecsStart
+
+	resultDict = { 'exitCode' : _errno, 'wallSecs' : wallSecs, 'cpuSecs' : cpuSecs, 'peakRssKb' : getPeakRssKb(),
+		'countMtpObjects' : len(session.mtpObjects.objectHandleDict), 'countFilesDownloaded' : session.countFilesDownloadedPersistentAcrossStatsReset,
+		'phases' : dict((phaseTimer.name, phaseTimer.genResultDict()) for phaseTimer in phaseTimersList),
+		'mtpOps' : session.mtpOpStats.toDict() }
+	with open(g.args['workerresultfile'], "w") as f:
+		json.dump(resultDict, f)
+	return _errno
+
+
+#
+# the simulator, running in its own process. we collect its output on a separate thread,
+# both to detect when it's ready and so that it never blocks writing to a full pipe
+#
+class SimulatorProcess:
+	def __init__(self, simArgs):
+		args = [sys.executable, '-u', os.path.join(g.appDir, "mtpsim.py"), '--ipaddress', SIMULATOR_IP_ADDRESS] + simArgs
+		applog_d("Simulator args: {:s}".format(str(args)))
+		self.outputLinesList = []
+		self.readyEvent = threading.Event()
+		self.process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+		self.outputThread = threading.Thread(target=self.__outputThread, name="mtpsim-output")
+		self.outputThread.daemon = True
+		self.outputThread.start()
+
+	def __outputThread(self):
+		for line in iter(self.process.stdout.readline, b''):
+			line = line.decode('utf-8', 'replace').rstrip()
+			self.outputLinesList.append(line)
+			if SIMULATOR_READY_TEXT in line:
+				self.readyEvent.set()
+		self.readyEvent.set() # process exited - wake up anyone waiting for it to become ready
+
+	def waitUntilReady(self):
+		self.readyEvent.wait(SIMULATOR_STARTUP_TIMEOUT_SECS)
+		if self.process.poll() != None or not any(SIMULATOR_READY_TEXT in line for line in self.outputLinesList):
+			raise BenchmarkException("Simulator failed to start:\n" + "\n".join(self.outputLinesList))
+
+	def stop(self):
+		if self.process.poll() == None:
+			self.process.terminate()
+		self.process.wait()
+		self.outputThread.join()
+
+
+#
+# runs a worker process for one pass, returning its results dictionary
+#
+def runWorkerProcess(numObjects, passName, sizeWorkDir):
+	resultFilename = os.path.join(sizeWorkDir, "result-{:s}.json".format(passName))
+	logFilename = os.path.join(sizeWorkDir, "worker-{:s}.txt".format(passName))
+	args = [sys.executable, os.path.realpath(__file__), '--worker',
+		'--workerappdatadir', os.path.join(sizeWorkDir, "appdata"), '--workerresultfile', resultFilename,
+		'--ipaddress', SIMULATOR_IP_ADDRESS, '--outputdir', os.path.join(sizeWorkDir, "output")] + DEFAULT_AIRMTP_ARGS + g.passThroughArgs
+	applog_d("Worker args: {:s}".format(str(args)))
+	with open(logFilename, "w") as fLog:
+		retCode = subprocess.call(args, stdout=fLog, stderr=subprocess.STDOUT)
+	if retCode != 0 or not os.path.exists(resultFilename):
+		with open(logFilename) as fLog:
+			lastLogLinesStr = "".join(fLog.readlines()[-WORKER_LOG_LINES_ON_ERROR:])
+		raise BenchmarkException("{:,} objects, {:s} pass: Worker exited with code {:d}. Last output:\n{:s}".format(numObjects, passName, retCode, lastLogLinesStr))
+	with open(resultFilename) as f:
+		resultDict = json.load(f)
+	resultDict['numObjects'] = numObjects
+	resultDict['pass'] = passName
+	return resultDict
+
+
+def reportPassResult(resultDict):
+	applog_i("  {:s} pass: {:,} objects, {:d} files downloaded, wall {:.2f}s, cpu {:.2f}s, peak RSS {:s}".format(resultDict['pass'],
+		resultDict['countMtpObjects'], resultDict['countFilesDownloaded'], resultDict['wallSecs'], resultDict['cpuSecs'],
+		"{:,} KB".format(resultDict['peakRssKb']) if resultDict['peakRssKb'] != None else "n/a"))
+	for (phaseName, module, funcName) in BENCH_PHASES:
+		phaseDict = resultDict['phases'][phaseName]
+		mbPerSecStr = "{:.2f} MB/s".format(phaseDict['mbPerSec']) if phaseDict['mbPerSec'] != None else ""
+		applog_i("    {:<44s} {:>7,} calls {:>9.3f}s wall {:>9.3f}s cpu  {:s}".format(phaseName, phaseDict['calls'],
+			phaseDict['wallSecs'], phaseDict['cpuSecs'], mbPerSecStr))
+
+
+#
+# runs both passes for a card of 'numObjects' objects
+#
+def runBenchmarkForCardSize(numObjects):
+	applog_i("Card with {:,} objects:".format(numObjects))
+	sizeWorkDir = os.path.join(g.workDir, "{:d}".format(numObjects))
+	os.makedirs(os.path.join(sizeWorkDir, "appdata"))
+	os.makedirs(os.path.join(sizeWorkDir, "output"))
+	numCaptures = max(numObjects // len(g.args['simextlist']), 1)
+	simulator = SimulatorProcess(['--make', g.args['make'], '--numfiles', str(numCaptures), '--filesizekb', str(g.args['filesizekb']),
+		'--extlist'] + g.args['simextlist'] + shlex.split(g.args['simargs']))
+	try:
+		simulator.waitUntilReady()
+		for passName in BENCH_PASSES:
+			resultDict = runWorkerProcess(numObjects, passName, sizeWorkDir)
+			reportPassResult(resultDict)
+			g.resultsDict['results'].append(resultDict)
+			saveResults()
+	finally:
+		simulator.stop()
+	if g.args['keepworkdir'] == 'no':
+		shutil.rmtree(sizeWorkDir, ignore_errors=True)
+
+
+def saveResults():
+	with open(g.args['resultfile'], "w") as f:
+		json.dump(g.resultsDict, f, indent=2, sort_keys=True)
+
+
+def processCmdLine():
+	parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter,
+		description='Benchmarks airmtp\'s enumeration, cache, history and download phases against the MTP/IP camera simulator (mtpsim.py)',
+		epilog="Any arguments not listed above are passed through to airmtp. Example:\n  %(prog)s --sizes 100 1000 10000 --simargs \"--latencyms 2\" --getobjpipelinedepth 4")
+	parser.add_argument('--sizes', type=int, help='Card sizes to benchmark, in number of objects. Default is %(default)s', default=DEFAULT_CARD_SIZES, nargs='+', metavar="count", required=False)
+	parser.add_argument('--make', type=str.lower, choices=['nikon', 'canon', 'sony'], help='Make of camera to simulate. Default is "%(default)s"', default='nikon', required=False)
+	parser.add_argument('--filesizekb', type=int, help='Size of each simulated file, in KB. Default is %(default)s', default=DEFAULT_FILE_SIZE_KB, metavar="KB", required=False)
+	parser.add_argument('--simextlist', help='File extension(s) of each simulated capture. Default is %(default)s', default=['NEF', 'JPG'], nargs='+', metavar='extension', required=False)
+	parser.add_argument('--simargs', type=str, help='Additional arguments for the simulator, as a single quoted string. Ex: --simargs "--latencyms 2 --maxratekbsec 20000"', default="", metavar="args", required=False)
+	parser.add_argument('--resultfile', type=str, help='JSON file to write results to. Default is "%(default)s"', default="airmtpbench-results.json", metavar="path", required=False)
+	parser.add_argument('--workdir', type=str, help='Directory for the app data and downloaded files of each run. Default is a temporary directory', default=None, metavar="path", required=False)
+	parser.add_argument('--keepworkdir', type=str.lower, choices=['no', 'yes'], help='Keep the app data, downloaded files and worker output of each run. Default is "%(default)s"', default='no', required=False)
+	parser.add_argument('--logginglevel', type=str.lower, choices=['normal', 'verbose', 'debug' ], help='Sets how much information is logged. Default is "%(default)s"', default='normal', required=False)
+	parser.add_argument('--worker', help=argparse.SUPPRESS, action='store_true', default=False, required=False)
+	parser.add_argument('--workerappdatadir', help=argparse.SUPPRESS, type=str, default=None, required=False)
+	parser.add_argument('--workerresultfile', help=argparse.SUPPRESS, type=str, default=None, required=False)
+	(args, g.passThroughArgs) = parser.parse_known_args()
+	g.args = vars(args)
+	if g.args['logginglevel'] == 'verbose':
+		applog_set_loggingFlags(APPLOGF_LEVEL_INFORMATIONAL | APPLOGF_LEVEL_ERROR | APPLOGF_LEVEL_WARNING | APPLOGF_LEVEL_VERBOSE)
+	elif g.args['logginglevel'] == 'debug':
+		applog_set_loggingFlags(APPLOGF_LEVEL_INFORMATIONAL | APPLOGF_LEVEL_ERROR | APPLOGF_LEVEL_WARNING | APPLOGF_LEVEL_VERBOSE | APPLOGF_LEVEL_DEBUG)
+
+
+#
+# main app routine
+#
+def main():
+	g.appDir = os.path.dirname(os.path.realpath(sys.argv[0]))
+	processCmdLine()
+
+	if g.args['worker']:
+		applog_init(APPLOGF_LEVEL_INFORMATIONAL | APPLOGF_LEVEL_ERROR | APPLOGF_LEVEL_WARNING)
+		_errno = runWorker()
+		applog_shutdown()
+		return _errno
+
+	applog_init(APPLOGF_LEVEL_INFORMATIONAL | APPLOGF_LEVEL_ERROR | APPLOGF_LEVEL_WARNING)
+	applog_i("\nairmtpbench v{:s} - airmtp benchmark [GPL v3]".format(AIRMTPBENCH_APP_VERSION))
+	applog_i("Time: {:s}, Py: {:d}.{:d}.{:d}, OS: {:s}\n".format(strutil.getDateTimeStr(fMilitaryTime=True),\
+		sys.version_info.major, sys.version_info.minor, sys.version_info.micro, platform.system()))
+
+	g.workDir = g.args['workdir'] if g.args['workdir'] else tempfile.mkdtemp(prefix="airmtpbench-")
+	g.resultsDict = {
+		'formatVersion' : AIRMTPBENCH_RESULTS_FORMAT_VERSION,
+		'time' : strutil.getDateTimeStr(fMilitaryTime=True),
+		'host' : { 'python' : platform.python_version(), 'platform' : platform.platform(), 'cpuCount' : multiprocessing.cpu_count() },
+		'config' : { 'make' : g.args['make'], 'filesizekb' : g.args['filesizekb'], 'simextlist' : g.args['simextlist'],
+			'simargs' : g.args['simargs'], 'airmtpargs' : DEFAULT_AIRMTP_ARGS + g.passThroughArgs },
+		'results' : []
+	}
+
+	_errno = 0
+	try:
+		for numObjects in g.args['sizes']:
+			runBenchmarkForCardSize(numObjects)
+		applog_i("\nResults written to \"{:s}\"".format(g.args['resultfile']))
+	except BenchmarkException as e:
+		applog_e(str(e))
+		_errno = errno.EFAULT
+	except KeyboardInterrupt as e:
+		applog_i("\n>> Terminated by user keypress <<")
+		_errno = errno.EINTR
+	except:
+		applog_e("An exception occurred. Here is the stack trace information:\n" + traceback.format_exc())
+		_errno = errno.EFAULT
+	if g.args['keepworkdir'] == 'no' and not g.args['workdir']:
+		shutil.rmtree(g.workDir, ignore_errors=True)
+	elif g.args['keepworkdir'] == 'yes':
+		applog_i("Work files kept in \"{:s}\"".format(g.workDir))
+	applog_shutdown()
+	return _errno
+
+#
+# program entry point
+#
+if __name__ == "__main__":
+	_errno = main()
+	sys.exit(_errno)
@@ -0,0 +1,345 @@
+#!/usr/bin/env python
+
+#
+#############################################################################
+#
+# airmtpdaemon.py - Long-running ingest daemon that downloads from multiple
+# cameras concurrently
+# Copyright (C) 2015, testcams.com
+#
+# This module is licensed under GPL v3: http://www.gnu.org/licenses/gpl-3.0.html
+#
+#############################################################################
+#
+# The airmtp command line talks to a single camera. This daemon scales ingest to
+# multiple cameras by running one airmtp worker process per camera, each with a fully
+# independent session - a camera's worker can crash, retry or be killed without
+# affecting the others, and the applog logging module (which is process-wide) gets
+# a separate log per camera. Cameras are either specified by
+# IP address (--ipaddress, for cameras that don't advertise via SSDP such as Nikon)
+# and/or found by periodic SSDP discovery (Sony, Canon). A worker that exits is
+# relaunched after --restartdelaysecs if its camera is still configured/discoverable.
+#
+# The workers share a single bandwidth budget (--maxdownloadratekbsec) and download
+# write-buffer budget (--maxgetobjbuffersizekb). Each worker reports how much it has
+# downloaded through a status file, and the budgets are divided evenly across the workers
+# that are actively downloading - a worker whose camera is idle or unreachable only gets
+# a small share (enough to start downloading, at which point it's rebalanced into a full
+# share). The budgets are rebalanced whenever a worker starts, exits, or starts/stops
+# downloading. The shares are handed to each worker through its download rate control
+# file (see airmtp's DownloadRateLimiter).
+#
+# Any arguments the daemon doesn't recognize are passed through to every worker, for
+# example:
+#
+#	airmtpdaemon.py --ipaddress 192.168.1.1 --maxdownloadratekbsec 6000 --realtimedownload afternormal
+#		--outputdir /ingest --dirnamespec @cameramodel@-@cameraserial@
+#
+# Each worker's console output is written to "airmtpdaemon-worker-<ip>.txt" in the app data directory
+#
+
+from __future__ import print_function
+from __future__ import division
+import argparse
+import subprocess
+import time
+import sys
+import os
+import errno
+import json
+import platform
+import traceback
+import ssdp
+import strutil
+from applog import *
+
+#
+# constants
+#
+AIRMTPDAEMON_APP_VERSION				= "1.1"
+DEFAULT_DISCOVER_INTERVAL_SECS			= 15		# how often we look for new cameras via SSDP
+DEFAULT_RESTART_DELAY_SECS				= 10		# min time before we relaunch a worker for a camera whose worker exited
+DEFAULT_MAX_CAMERAS						= 8			# max number of cameras we download from at once
+DEFAULT_MAX_KB_TO_BUFFER_ALL_CAMERAS	= 65536		# default write-buffer budget shared by all workers
+MIN_KB_TO_BUFFER_PER_CAMERA				= 4096		# min write-buffer share we give a worker
+MIN_KB_SEC_PER_IDLE_CAMERA				= 512		# bandwidth share we give a worker that isn't downloading, so that it can start
+WORKER_ACTIVITY_CHECK_INTERVAL_SECS		= 5			# how often we check which workers are downloading
+WORKER_EXIT_WAIT_SECS					= 30		# how long we wait for workers to exit on shutdown before terminating them
+SSDP_SERVICE_NAMES = [ "urn:microsoft-com:service:MtpNullService:1", 		# Sony
+	"urn:schemas-canon-com:service:ICPO-SmartPhoneEOSSystemService:1"		# Canon
+]
+
+#
+# global variables
+#
+class GlobalVarsStruct:
+	def __init__(self):
+		self.appDir = None					# directory where script is located
+		self.appDataDir = None				# directory where we keep app metadata (same as airmtp)
+		self.args = None					# dictionary of our command-line arguments (generated by argparse)
+		self.workerArgs = None				# command-line arguments we pass through to every airmtp worker
+		self.workersDict = {}				# CameraWorker for each camera, keyed by IP address
+		self.timeLastActivityCheck = None	# time we last checked which workers are downloading (see serviceWorkers)
+g = GlobalVarsStruct()
+
+
+#
+# one airmtp worker process, downloading from the camera at 'ipAddressStr'
+#
+class CameraWorker:
+	def __init__(self, ipAddressStr, fDiscovered):
+		self.ipAddressStr = ipAddressStr
+		self.fDiscovered = fDiscovered		# True if found via SSDP, False if specified via --ipaddress
+		self.process = None
+		self.timeExited = None
+		self.fDownloading = False			# True if the worker downloaded data since our last activity check
+		self.bytesDownloadedLastCheck = 0	# 'bytesdownloaded' the worker reported as of our last activity check
+		fileSafeIpAddressStr = ipAddressStr.replace(':', '_')
+		self.logFilename = os.path.join(g.appDataDir, "airmtpdaemon-worker-{:s}.txt".format(fileSafeIpAddressStr))
+		self.controlFilename = os.path.join(g.appDataDir, "airmtpdaemon-worker-{:s}-ratecontrol.json".format(fileSafeIpAddressStr))
+		self.statusFilename = os.path.join(g.appDataDir, "airmtpdaemon-worker-{:s}-ratestatus.json".format(fileSafeIpAddressStr))
+	def isRunning(self):
+		return self.process != None
+	def canStart(self):
+		return self.process == None and (self.timeExited == None or time.time() - self.timeExited >= g.args['restartdelaysecs'])
+	def start(self):
+		args = [sys.executable, os.path.join(g.appDir, "airmtp.py"), '--ipaddress', self.ipAddressStr,\
+			'--downloadratecontrolfile', self.controlFilename, '--downloadratestatusfile', self.statusFilename] + g.workerArgs
+		# the new process starts counting from zero, so discard the status of any previous one
+		try:
+			os.remove(self.statusFilename)
+		except OSError as e:
+			pass
+		self.fDownloading = False
+		self.bytesDownloadedLastCheck = 0
+		applog_i("{:s}: Starting worker (output in \"{:s}\")".format(self.ipAddressStr, self.logFilename))
+		applog_d("{:s}: Worker args: {:s}".format(self.ipAddressStr, str(args)))
+		with open(self.logFilename, "a") as fLog:
+			self.process = subprocess.Popen(args, stdout=fLog, stderr=subprocess.STDOUT)
+	def checkExited(self):
+		if self.process == None:
+			return False
+		retCode = self.process.poll()
+		if retCode == None:
+			return False
+		applog_i("{:s}: Worker exited with code {:d}".format(self.ipAddressStr, retCode))
+		self.process = None
+		self.timeExited = time.time()
+		self.fDownloading = False
+		return True
+	#
+	# checks the worker's status file to see if it has downloaded any data since
+	# the last check. returns True if the worker started or stopped downloading
+	#
+	def checkDownloadActivity(self):
+		try:
+			with open(self.statusFilename, "r") as f:
+				statusDict = json.load(f)
+			bytesDownloaded = statusDict['bytesdownloaded']
+		except (IOError, OSError, ValueError, KeyError, TypeError) as e:
+			bytesDownloaded = self.bytesDownloadedLastCheck # not created yet (worker hasn't downloaded anything) or caught mid-write
+		fDownloading = bytesDownloaded > self.bytesDownloadedLastCheck
+		self.bytesDownloadedLastCheck = bytesDownloaded
+		if fDownloading == self.fDownloading:
+			return False
+		applog_d("{:s}: Worker {:s} downloading".format(self.ipAddressStr, "is" if fDownloading else "stopped"))
+		self.fDownloading = fDownloading
+		return True
+	def setBudgetShare(self, maxDownloadRateKbSec, maxGetObjBufferSizeKb):
+		controlDict = { 'maxdownloadratekbsec' : maxDownloadRateKbSec, 'maxgetobjbuffersizekb' : maxGetObjBufferSizeKb }
+		try:
+			with open(self.controlFilename, "w") as f:
+				json.dump(controlDict, f)
+		except IOError as e:
+			applog_e("{:s}: Unable to write rate control file \"{:s}\": {:s}".format(self.ipAddressStr, self.controlFilename, str(e)))
+
+
+#
+# divides the bandwidth and write-buffer budgets evenly across the workers that are
+# downloading. the workers that aren't downloading (ex: camera is idle or the worker
+# is still trying to reach it) get a minimal share, enough for them to start downloading
+# and be noticed by the next activity check. if no worker is downloading the budgets are
+# divided evenly across all the running workers, since there's nobody to take them from
+#
+def rebalanceBudgets():
+	runningWorkersList = [worker for worker in g.workersDict.values() if worker.isRunning()]
+	if not runningWorkersList:
+		return
+	downloadingWorkersList = [worker for worker in runningWorkersList if worker.fDownloading]
+	if not downloadingWorkersList:
+		downloadingWorkersList = runningWorkersList
+	countIdleWorkers = len(runningWorkersList) - len(downloadingWorkersList)
+	if g.args['maxdownloadratekbsec'] > 0:
+		idleDownloadRateKbSec = max(min(MIN_KB_SEC_PER_IDLE_CAMERA, g.args['maxdownloadratekbsec'] // len(runningWorkersList)), 1)
+		maxDownloadRateKbSec = max((g.args['maxdownloadratekbsec'] - idleDownloadRateKbSec*countIdleWorkers) // len(downloadingWorkersList), 1)
+	else:
+		(idleDownloadRateKbSec, maxDownloadRateKbSec) = (0, 0)
+	idleGetObjBufferSizeKb = MIN_KB_TO_BUFFER_PER_CAMERA
+	maxGetObjBufferSizeKb = max((g.args['maxgetobjbuffersizekb'] - idleGetObjBufferSizeKb*countIdleWorkers) // len(downloadingWorkersList), MIN_KB_TO_BUFFER_PER_CAMERA)
+	applog_v("Budget per downloading camera for {:d} of {:d} camera(s): {:s}, {:d}KB write buffer".format(len(downloadingWorkersList), len(runningWorkersList),\
+		"{:d} KB/s".format(maxDownloadRateKbSec) if maxDownloadRateKbSec else "unlimited bandwidth", maxGetObjBufferSizeKb))
+	for worker in runningWorkersList:
+		if worker in downloadingWorkersList:
+			worker.setBudgetShare(maxDownloadRateKbSec, maxGetObjBufferSizeKb)
+		else:
+			worker.setBudgetShare(idleDownloadRateKbSec, idleGetObjBufferSizeKb)
+
+
+#
+# uses SSDP to find cameras we're not already running a worker for. returns list of IP address strings
+#
+def discoverNewCameras():
+	def isNewCamera(ssdpMessage):
+		ipAddressStr = ssdp.extractIpAddressFromSSDPMessage(ssdpMessage)
+		return ipAddressStr != None and ipAddressStr not in g.workersDict and ipAddressStr not in newIpAddressesList
+	ssdpServiceNames = SSDP_SERVICE_NAMES + (g.args['ssdp_addservice'] if g.args['ssdp_addservice'] else [])
+	newIpAddressesList = []
+	while len(g.workersDict) + len(newIpAddressesList) < g.args['maxcameras']:
+		try:
+			ssdpMessage = ssdp.discover(ssdpServiceNames, isNewCamera, numAttempts=1, timeoutSecsPerAttempt=2)
+		except ssdp.DiscoverFailureException as e:
+			applog_d("SSDP discovery failed: {:s}".format(str(e)))
+			break
+		if ssdpMessage == None:
+			break
+		ipAddressStr = ssdp.extractIpAddressFromSSDPMessage(ssdpMessage)
+		applog_i("Found camera at IP address {:s}".format(ipAddressStr))
+		newIpAddressesList.append(ipAddressStr)
+	return newIpAddressesList
+
+
+#
+# starts workers for cameras that need one, reaps workers that have exited, and
+# periodically checks which workers are downloading
+#
+def serviceWorkers():
+	fWorkersChanged = False
+	for ipAddressStr in list(g.workersDict.keys()):
+		worker = g.workersDict[ipAddressStr]
+		if worker.checkExited():
+			fWorkersChanged = True
+			if worker.fDiscovered:
+				del g.workersDict[ipAddressStr] # camera has to be rediscovered (it may have left)
+	for worker in g.workersDict.values():
+		if worker.canStart():
+			worker.start()
+			fWorkersChanged = True
+	if g.timeLastActivityCheck == None or time.time() - g.timeLastActivityCheck >= WORKER_ACTIVITY_CHECK_INTERVAL_SECS:
+		for worker in g.workersDict.values():
+			if worker.isRunning() and worker.checkDownloadActivity():
+				fWorkersChanged = True
+		g.timeLastActivityCheck = time.time()
+	if fWorkersChanged:
+		rebalanceBudgets()
+
+
+#
+# waits for workers to exit (they receive the same SIGINT we do when the user presses
+# <ctrl-c> on the console), terminating any that don't exit in time
+#
+def shutdownWorkers():
+	timeStart = time.time()
+	while any(worker.isRunning() for worker in g.workersDict.values()) and time.time() - timeStart < WORKER_EXIT_WAIT_SECS:
+		for worker in g.workersDict.values():
+			worker.checkExited()
+		time.sleep(0.25)
+	for worker in g.workersDict.values():
+		if worker.isRunning():
+			applog_i("{:s}: Terminating worker".format(worker.ipAddressStr))
+			worker.process.terminate()
+
+
+#
+# processes our command line. arguments we don't recognize are passed through to the workers
+#
+def processCmdLine():
+	parser = argparse.ArgumentParser(fromfile_prefix_chars='!',\
+		description='Downloads from multiple cameras concurrently, running an airmtp session for each. Arguments not listed here are passed to each airmtp session')
+	parser.add_argument('--ipaddress', help='IP address(es) of cameras to download from, in addition to those found via SSDP', default=[], nargs='+', metavar="addr", required=False)
+	parser.add_argument('--ssdp', type=str.lower, choices=['yes', 'no'], help='Discover Sony/Canon cameras via SSDP. Default is "%(default)s"', default='yes', required=False)
+	parser.add_argument('--discoverintervalsecs', type=int, help='How often to look for new cameras via SSDP, in seconds. Default is %(default)s', default=DEFAULT_DISCOVER_INTERVAL_SECS, metavar="seconds", required=False)
+	parser.add_argument('--restartdelaysecs', type=int, help='Delay before restarting the session for a camera whose session ended, in seconds. Default is %(default)s', default=DEFAULT_RESTART_DELAY_SECS, metavar="seconds", required=False)
+	parser.add_argument('--maxcameras', type=int, help='Max number of cameras to download from at once. Default is %(default)s', default=DEFAULT_MAX_CAMERAS, metavar="count", required=False)
+	parser.add_argument('--maxdownloadratekbsec', type=int, help='Download bandwidth budget shared by all cameras, in KB/s. Default is 0 (unlimited)', default=0, metavar="KB/s", required=False)
+	parser.add_argument('--maxgetobjbuffersizekb', type=int, help='Download write-buffer budget shared by all cameras, in KB. Default is %(default)s', default=DEFAULT_MAX_KB_TO_BUFFER_ALL_CAMERAS, metavar="kilobytes", required=False)
+	parser.add_argument('--daemon_logginglevel', type=str.lower, choices=['normal', 'verbose', 'debug' ], help='Sets how much information is saved to the daemon log. Default is "%(default)s"', default='normal', required=False)
+	parser.add_argument('--ssdp_addservice', help=argparse.SUPPRESS, default=None, nargs='+', required=False)
+	(args, g.workerArgs) = parser.parse_known_args()
+	g.args = vars(args)
+	if '--ipaddress' in g.workerArgs:
+		applog_e("--ipaddress must be placed before any arguments passed to airmtp")
+		sys.exit(errno.EINVAL)
+	if g.args['daemon_logginglevel'] == 'verbose':
+		applog_set_loggingFlags(APPLOGF_LEVEL_INFORMATIONAL | APPLOGF_LEVEL_ERROR | APPLOGF_LEVEL_WARNING | APPLOGF_LEVEL_VERBOSE)
+	elif g.args['daemon_logginglevel'] == 'debug':
+		applog_set_loggingFlags(APPLOGF_LEVEL_INFORMATIONAL | APPLOGF_LEVEL_ERROR | APPLOGF_LEVEL_WARNING | APPLOGF_LEVEL_VERBOSE | APPLOGF_LEVEL_DEBUG)
+
+
+#
+# determines our app and app data directories. the app data directory is the same one
+# airmtp uses (see airmtp.establishAppEnvironment), so the worker logs live alongside airmtp's
+#
+def establishAppEnvironment():
+	g.appDir = os.path.dirname(os.path.realpath(sys.argv[0]))
+	g.appDataDir = None
+	if platform.system() == 'Darwin':
+		userHomeDir = os.getenv('HOME')
+		if userHomeDir and os.path.exists(os.path.join(userHomeDir, 'Library/Application Support')):
+			g.appDataDir = os.path.join(userHomeDir, 'Library/Application Support/airmtp/appdata')
+	if not g.appDataDir:
+		g.appDataDir = os.path.join(g.appDir, "appdata")
+	if not os.path.exists(g.appDataDir):
+		os.makedirs(g.appDataDir)
+
+
+#
+# main app routine
+#
+def main():
+	establishAppEnvironment()
+	_errno = applog_init(APPLOGF_LEVEL_INFORMATIONAL | APPLOGF_LEVEL_ERROR, os.path.join(g.appDataDir, "airmtpdaemon-log-last.txt"),\
+		os.path.join(g.appDataDir, "airmtpdaemon-log-lifetime.txt"))
+	if _errno:
+		return _errno
+	applog_i("\nairmtpdaemon v{:s} - Multi-camera MTP network transfer [GPL v3]".format(AIRMTPDAEMON_APP_VERSION))
+	applog_i("Time: {:s}, Py: {:d}.{:d}.{:d}, OS: {:s}\n".format(strutil.getDateTimeStr(fMilitaryTime=True),\
+		sys.version_info.major, sys.version_info.minor, sys.version_info.micro, platform.system()))
+	processCmdLine()
+
+	for ipAddressStr in g.args['ipaddress']:
+		g.workersDict[ipAddressStr] = CameraWorker(ipAddressStr, False)
+	if not g.workersDict and g.args['ssdp'] == 'no':
+		applog_e("No cameras to download from - specify --ipaddress and/or enable --ssdp")
+		return errno.EINVAL
+
+	_errno = 0
+	timeLastDiscover = None
+	try:
+		applog_i("Running - press <ctrl-c> to exit")
+		while True:
+			if g.args['ssdp'] == 'yes' and (timeLastDiscover == None or time.time() - timeLastDiscover >= g.args['discoverintervalsecs']):
+				for ipAddressStr in discoverNewCameras():
+					g.workersDict[ipAddressStr] = CameraWorker(ipAddressStr, True)
+				timeLastDiscover = time.time()
+			serviceWorkers()
+			time.sleep(1)
+	except KeyboardInterrupt as e:
+		applog_i("\n>> Terminated by user keypress - waiting for camera sessions to end <<")
+		_errno = errno.EINTR
+	except:
+		applog_e("An exception occurred. Here is the stack trace information:\n" + traceback.format_exc())
+		_errno = errno.EFAULT
+	try:
+		shutdownWorkers()
+	except KeyboardInterrupt as e:
+		pass
+	applog(">>>> airmtpdaemon session over - App Exit Time: {:s}".format(strutil.getDateTimeStr(fMilitaryTime=True)), APPLOGF_LEVEL_INFORMATIONAL | APPLOGF_DONT_WRITE_TO_CONSOLE)
+	applog_shutdown()
+	return _errno
+
+#
+# program entry point
+#
+if __name__ == "__main__":
+	_errno = main()
+	sys.exit(_errno)
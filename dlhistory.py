@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+
+#
+#############################################################################
+#
+# dlhistory.py - Persistent download history store
+# Copyright (C) 2015, testcams.com
+#
+# This module is licensed under GPL v3: http://www.gnu.org/licenses/gpl-3.0.html
+#
+#############################################################################
+#
+
+from __future__ import print_function
+from __future__ import division
+import six
+import os
+import sqlite3
+from applog import *
+
+#
+# The download history is kept in an SQLite database with a single table, keyed
+# by the history key (camera filename + capture date + size - see downloadMtpFileObjects()).
+# Membership tests are an indexed lookup, so nothing is loaded up front - opening the
+# history costs the same whether it has ten entries or a lifetime's worth. Each entry
+# is committed as soon as it's added so that the history survives an abrupt exit
+# just like the text file it replaces did. The database uses write-ahead logging with
+# synchronous=NORMAL, which makes each commit an append to the WAL without an fsync
+# (the WAL is synced at checkpoints) - a committed entry survives the app exiting or
+# crashing at any point, and a power loss can only lose the most recent entries, never
+# corrupt the database. With the default rollback journal each commit cost several
+# fsyncs, which dominated the time spent on the history for a card of small files.
+#
+# Prior versions kept the history in a text file of lines in the form:
+#
+# 	key::::download date/time string::outputDirAndFilename
+#
+# The first time a history database is opened for a camera that has one of these
+# text files the file is imported in a single transaction and then renamed with a
+# ".migrated" suffix so it's not imported again.
+#
+# Callers checking many files at once (ex: a download pass over a card that's mostly
+# been downloaded) can prefetch() the entries for a batch of keys with a single query,
+# after which lookup() of those keys doesn't touch the database.
+#
+DLHISTORY_MAX_KEYS_PER_QUERY			= 500		# max keys in a prefetch query (SQLite limits the number of parameters to 999 in older versions)
+
+#
+# exception raised when the history database can't be opened or accessed
+#
+class DownloadHistoryException(Exception):
+	def __init__(self, message):
+		Exception.__init__(self, message)
+
+
+class DownloadHistory(object):
+
+	def __init__(self, dbFilename, legacyTextFilename=None):
+		self.dbFilename = dbFilename
+		self.legacyBloomFilename = os.path.splitext(dbFilename)[0] + ".bloom"	# bloom filter kept by prior versions
+		self.legacyTextFilename = legacyTextFilename
+		self.db = None
+		self.countEntries = None	# cached count of entries, so we don't have to run a COUNT(*) for every file downloaded
+		self.prefetchedKeysSet = set()		# keys of the last prefetch()
+		self.prefetchedEntriesDict = {}		# (dateDownloadedStr, pathDownloadedToStr) of keys in 'prefetchedKeysSet' that are in the history
+
+	#
+	# opens the history database, creating it (and migrating the legacy text history
+	# into it) if necessary. raises DownloadHistoryException on errors
+	#
+	def open(self):
+		if self.db:
+			return
+		try:
+			fNewDb = not os.path.exists(self.dbFilename)
+			self.db = sqlite3.connect(self.dbFilename)
+			self.db.execute("PRAGMA journal_mode=WAL")
+			self.db.execute("PRAGMA synchronous=NORMAL")
+			self.db.execute("CREATE TABLE IF NOT EXISTS history (key TEXT PRIMARY KEY, datedownloaded TEXT, path TEXT)")
+			self.db.commit()
+			if fNewDb and self.legacyTextFilename and os.path.exists(self.legacyTextFilename):
+				self._migrateLegacyTextHistory()
+			if self.countEntries == None:
+				(self.countEntries,) = self.db.execute("SELECT COUNT(*) FROM history").fetchone()
+		except (sqlite3.Error, IOError, OSError) as e:
+			self.close()
+			raise DownloadHistoryException("Unable to open download history \"{:s}\": {:s}".format(self.dbFilename, str(e)))
+
+	def close(self):
+		if self.db:
+			self.db.close()
+			self.db = None
+		self.prefetchedKeysSet = set()
+		self.prefetchedEntriesDict = {}
+
+	#
+	# deletes the history, including any legacy text history that hasn't been migrated
+	#
+	def clear(self):
+		self.close()
+		self.countEntries = None
+		for filename in (self.dbFilename, self.dbFilename + "-wal", self.dbFilename + "-shm", self.legacyBloomFilename, self.legacyTextFilename):
+			if filename and os.path.exists(filename):
+				os.remove(filename)
+
+	def count(self):
+		return self.countEntries
+
+	#
+	# returns a (dateDownloadedStr, pathDownloadedToStr) tuple for 'key' if it's in the history, otherwise None
+	#
+	def lookup(self, key):
+		if key in self.prefetchedKeysSet:
+			return self.prefetchedEntriesDict.get(key)
+		return self.db.execute("SELECT datedownloaded, path FROM history WHERE key = ?", (key,)).fetchone()
+
+	def __contains__(self, key):
+		return self.lookup(key) != None
+
+	#
+	# retrieves the entries of all the keys in 'keysList' that are in the history, so
+	# that subsequent lookup() calls for them are answered without a query. replaces
+	# the entries of any previous prefetch
+	#
+	def prefetch(self, keysList):
+		self.prefetchedKeysSet = set(keysList)
+		self.prefetchedEntriesDict = {}
+		keysList = list(self.prefetchedKeysSet)
+		for keyIndex in six.moves.xrange(0, len(keysList), DLHISTORY_MAX_KEYS_PER_QUERY):
+			batchKeysList = keysList[keyIndex:keyIndex+DLHISTORY_MAX_KEYS_PER_QUERY]
+			cursor = self.db.execute("SELECT key, datedownloaded, path FROM history WHERE key IN ({:s})".format(",".join("?" * len(batchKeysList))), batchKeysList)
+			for (key, dateDownloadedStr, pathDownloadedToStr) in cursor:
+				self.prefetchedEntriesDict[key] = (dateDownloadedStr, pathDownloadedToStr)
+
+	def isPrefetched(self, key):
+		return key in self.prefetchedKeysSet
+
+	#
+	# adds an entry to the history unless an entry for 'key' is already present
+	#
+	def add(self, key, dateDownloadedStr, pathDownloadedToStr):
+		cursor = self.db.execute("INSERT OR IGNORE INTO history (key, datedownloaded, path) VALUES (?, ?, ?)", (key, dateDownloadedStr, pathDownloadedToStr))
+		self.db.commit()
+		if cursor.rowcount > 0:
+			self.countEntries += cursor.rowcount
+			if key in self.prefetchedKeysSet:
+				self.prefetchedEntriesDict[key] = (dateDownloadedStr, pathDownloadedToStr)
+
+	#
+	# imports the legacy text history into the (new, empty) database. lines that aren't in the
+	# expected format are skipped
+	#
+	def _migrateLegacyTextHistory(self):
+		def genLegacyEntries(f):
+			for line in f:
+				if isinstance(line, six.binary_type):
+					line = line.decode('utf-8', 'replace') # python 2 - sqlite3 requires unicode for non-ASCII text
+				line = line.rstrip("\r\n")
+				keyEnd = line.find("::::")
+				if keyEnd == -1:
+					continue
+				infoList = line[keyEnd+4:].split("::", 1)
+				if len(infoList) != 2:
+					continue
+				yield (line[:keyEnd], infoList[0], infoList[1])
+		with open(self.legacyTextFilename) as f:
+			self.db.executemany("INSERT OR IGNORE INTO history (key, datedownloaded, path) VALUES (?, ?, ?)", genLegacyEntries(f))
+		self.db.commit()
+		(countEntries,) = self.db.execute("SELECT COUNT(*) FROM history").fetchone()
+		applog_v("Migrated {:d} entries from download history file \"{:s}\" to \"{:s}\"".format(countEntries, self.legacyTextFilename, self.dbFilename))
+		migratedFilename = self.legacyTextFilename + ".migrated"
+		if os.path.exists(migratedFilename):
+			os.remove(migratedFilename)
+		os.rename(self.legacyTextFilename, migratedFilename)
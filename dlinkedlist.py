@@ -13,54 +13,66 @@
 
 from __future__ import print_function
 from __future__ import division
+import bisect
 
+#
+# doubly-linked list whose objects are kept sorted by key. in addition to the
+# prev/next links we maintain a parallel pair of sorted arrays (keys and objects)
+# so that the insertion point for a new object is found via a binary search
+# rather than by walking the list from the head, which made building a list of
+# many objects quadratic. objects with equal keys are kept in insertion order
+#
 class LinkedList():
 	def __init__(self):
 		self._head = None
 		self._tail = None
 		self._countObjs = 0
+		self._sortedKeys = []	# keys of all objs in list, in list order (for bisect)
+		self._sortedObjs = []	# all objs in list, in list order (parallels _sortedKeys)
 	def insert(self, objIns):
-		objInList = self._head
-		if not objInList:
-			# we're the first obj in list
+		# find insertion point - after any existing objs with the same key
+		index = bisect.bisect_right(self._sortedKeys, objIns._key)
+		if index < self._countObjs:
+			objNext = self._sortedObjs[index]
+		else:
+			objNext = None
+		if index > 0:
+			objPrev = self._sortedObjs[index-1]
+		else:
+			objPrev = None
+		# link the obj in between its neighbors
+		objIns._prev = objPrev
+		objIns._next = objNext
+		if objPrev:
+			objPrev._next = objIns
+		else:
 			self._head = objIns
+		if objNext:
+			objNext._prev = objIns
+		else:
 			self._tail = objIns
-			# already set in LinkedListObj()__init__: objIns._prev = None
-			# already set in LinkedListObj()__init__: objIns._next = None
-		else:			
-			while objInList:
-				if objIns._key < objInList._key:
-					objIns._next = objInList
-					objIns._prev = objInList._prev
-					if objInList._prev:
-						objInList._prev._next = objIns
-					objInList._prev = objIns
-					if objIns._prev == None:
-						self._head = objIns
-					elif objIns._next == None:
-						self._tail = tail
-					break;
-				objInList = objInList._next
-			if not objInList:
-				# no key smaller than objIns, insert at end
-				# already set in LinkedListObj()__init__: objIns._next = None
-				objIns._prev = self._tail
-				self._tail._next = objIns
-				self._tail = objIns
+		self._sortedKeys.insert(index, objIns._key)
+		self._sortedObjs.insert(index, objIns)
 		self._countObjs += 1
 	def remove(self, objRem):
-		if objRem == self._head:
+		if objRem._prev:
+			objRem._prev._next = objRem._next
+		else:
+			# we were in the first obj position in list
 			self._head = objRem._next
-			if not self._head:
-				# we are only obj in list
-				self._tail = None
+		if objRem._next:
+			objRem._next._prev = objRem._prev
 		else:
-			objRem._prev._next = objRem._next
-			if objRem._next != None:
-				objRem._next._prev = objRem._prev
-			else:
-				# we were in the last obj position in list
-				self._tail = None
+			# we were in the last obj position in list
+			self._tail = objRem._prev
+		# locate obj in sorted arrays - start at the first obj with same key and walk any duplicates
+		index = bisect.bisect_left(self._sortedKeys, objRem._key)
+		while self._sortedObjs[index] is not objRem:
+			index += 1
+		del self._sortedKeys[index]
+		del self._sortedObjs[index]
+		objRem._prev = None
+		objRem._next = None
 		self._countObjs -= 1
 	def head(self):
 		return self._head
@@ -69,14 +81,15 @@ class LinkedList():
 	def count(self):
 		return self._countObjs
 	def dump(self):
-		obj = self.getHead()
+		obj = self.head()
 		i = 0
 		while obj:
 			print("{:d}, {}: key={}".format(i, obj, obj._key))
-			obj = obj.getNext()
+			obj = obj.llNext()
 			i += 1
-			
-class LinkedListObj():
+				
+class LinkedListObj(object):
+	__slots__ = ('_key', '_prev', '_next') # no per-instance __dict__ - there can be many of these
 	def __init__(self, key, linkedList=None):
 		self._key = key
 		self._prev = None
@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+
+#
+#############################################################################
+#
+# downloadexec.py - Bounded, optionally batching launcher for --downloadexec
+# Copyright (C) 2015, testcams.com
+#
+# This module is licensed under GPL v3: http://www.gnu.org/licenses/gpl-3.0.html
+#
+#############################################################################
+#
+
+from __future__ import print_function
+from __future__ import division
+import sys
+import time
+import threading
+import subprocess
+from applog import *
+
+#
+# Launches the app/script the user specified via --downloadexec for downloaded files.
+# At most 'maxConcurrent' launched processes run at once - when that many are running
+# the submitter waits for one to exit, calling its idle callback while it waits (used
+# by airmtp to keep the camera's MTP session alive).
+#
+# In batch mode files are accumulated and passed to a single invocation once
+# 'batchMaxFiles' files have been submitted or the oldest file in the batch has waited
+# 'batchMaxSecs' seconds. Each file is submitted as a list of common args (the executable
+# and any leading args shared by every file) and a list of per-file args - a batch is the
+# common args followed by the per-file args of every file in the batch, similar to
+# "find -exec {} +". Files whose common args differ are never placed in the same batch.
+#
+# A background thread reaps exited processes and launches batches whose time limit has
+# expired, so a batch doesn't sit waiting for the next download (ex: realtime mode). Errors
+# the thread encounters (launch failures, non-zero exit codes when the user asked to
+# exit on those) are raised to the main thread on its next call into the engine.
+#
+# drain() flushes any pending batch and waits for every launched process to exit; airmtp
+# calls it before exiting so that no post-processing is lost
+#
+
+DOWNLOADEXEC_POLL_INTERVAL_SECS		= 0.10	# how often we check for exited processes while waiting
+
+#
+# exception raised for a --downloadexec launch error or a non-zero exit code
+# (when the user configured us to treat those as errors)
+#
+class DownloadExecException(Exception):
+	LAUNCH_ERROR		= 0
+	NON_ZERO_EXIT_CODE	= 1
+	def __init__(self, message, errorType, retCode=None):
+		Exception.__init__(self, message)
+		self.errorType = errorType
+		self.retCode = retCode
+
+
+class DownloadExecEngine(object):
+
+	def __init__(self, maxConcurrent, batchMaxFiles=0, batchMaxSecs=0, fIgnoreLaunchErrors=False, fCheckExitCodes=False):
+		self.maxConcurrent = max(maxConcurrent, 1)
+		self.batchMaxFiles = batchMaxFiles
+		self.batchMaxSecs = batchMaxSecs
+		self.fBatchMode = batchMaxFiles > 0 or batchMaxSecs > 0
+		self.fIgnoreLaunchErrors = fIgnoreLaunchErrors
+		self.fCheckExitCodes = fCheckExitCodes
+		self.lock = threading.Lock()
+		self.runningProcessList = []		# list of (subprocess.Popen, execArgs) for processes we launched that haven't been reaped
+		self.pendingBatchCommonArgs = None	# common args for files in current batch
+		self.pendingBatchPerFileArgs = []	# per-file args of all files in current batch
+		self.countPendingBatchFiles = 0		# number of files in current batch
+		self.pendingBatchTimeStarted = None	# time first file was added to current batch
+		self.pendingException = None		# error encountered by background thread, raised on next call from main thread
+		self.countLaunched = 0
+		self.backgroundThread = None
+		self.fStopBackgroundThread = False
+		if self.batchMaxSecs > 0:
+			self.backgroundThread = threading.Thread(target=self._backgroundThreadMain, name="downloadexec")
+			self.backgroundThread.daemon = True
+			self.backgroundThread.start()
+
+	#
+	# submits a file. 'commonArgs' includes the executable. if 'fnIdleCallback' is
+	# specified it's called periodically if we have to wait for a free process slot
+	#
+	def submit(self, commonArgs, perFileArgs, fnIdleCallback=None):
+		self._raisePendingException()
+		if not self.fBatchMode:
+			self._launchWhenSlotAvailable(commonArgs + perFileArgs, fnIdleCallback)
+			return
+		with self.lock:
+			fFlushFirst = self.countPendingBatchFiles > 0 and commonArgs != self.pendingBatchCommonArgs
+		if fFlushFirst:
+			self.flush(fnIdleCallback)
+		with self.lock:
+			if self.countPendingBatchFiles == 0:
+				self.pendingBatchCommonArgs = commonArgs
+				self.pendingBatchTimeStarted = time.time()
+			self.pendingBatchPerFileArgs.extend(perFileArgs)
+			self.countPendingBatchFiles += 1
+			fBatchFull = self.batchMaxFiles > 0 and self.countPendingBatchFiles >= self.batchMaxFiles
+		if fBatchFull:
+			self.flush(fnIdleCallback)
+
+	#
+	# launches the pending batch (if any)
+	#
+	def flush(self, fnIdleCallback=None):
+		while True:
+			with self.lock:
+				self._reapExitedProcesses()
+				if self.countPendingBatchFiles == 0:
+					break
+				if len(self.runningProcessList) < self.maxConcurrent:
+					self._launchPendingBatch()
+					break
+			self._idleWait(fnIdleCallback)
+		self._raisePendingException()
+
+	#
+	# waits until all launched processes have exited
+	#
+	def waitForAll(self, fnIdleCallback=None):
+		while True:
+			with self.lock:
+				self._reapExitedProcesses()
+				if not self.runningProcessList:
+					break
+			self._idleWait(fnIdleCallback)
+		self._raisePendingException()
+
+	#
+	# flushes any pending batch and waits for all launched processes to exit. the
+	# engine can't be used afterwards
+	#
+	def drain(self, fnIdleCallback=None):
+		if self.backgroundThread:
+			self.fStopBackgroundThread = True
+			self.backgroundThread.join()
+			self.backgroundThread = None
+		if self.countPendingBatchFiles:
+			applog_d("downloadexec: Draining batch of {:d} file(s)".format(self.countPendingBatchFiles))
+		self.flush(fnIdleCallback)
+		if self.runningProcessList:
+			applog_i("Waiting for {:d} launched '--downloadexec' app(s) to exit...".format(len(self.runningProcessList)))
+		self.waitForAll(fnIdleCallback)
+
+	def _idleWait(self, fnIdleCallback):
+		if fnIdleCallback:
+			fnIdleCallback()
+		time.sleep(DOWNLOADEXEC_POLL_INTERVAL_SECS)
+
+	def _launchWhenSlotAvailable(self, execArgs, fnIdleCallback):
+		while True:
+			with self.lock:
+				self._reapExitedProcesses()
+				if len(self.runningProcessList) < self.maxConcurrent:
+					self._launch(execArgs)
+					break
+			self._idleWait(fnIdleCallback)
+		self._raisePendingException()
+
+	#
+	# the following methods must be called with self.lock held
+	#
+	def _launchPendingBatch(self):
+		execArgs = self.pendingBatchCommonArgs + self.pendingBatchPerFileArgs
+		self.pendingBatchCommonArgs = None
+		self.pendingBatchPerFileArgs = []
+		self.pendingBatchTimeStarted = None
+		self.countPendingBatchFiles = 0
+		self._launch(execArgs)
+
+	def _launch(self, execArgs):
+		applog_v("Launching 'downloadexec': {:s}".format(str(execArgs)))
+		try:
+			process = subprocess.Popen(execArgs)
+		except:
+			# different platforms can throw different platform-specific exceptions
+			errStr = "Error launching for 'downloadexec' {:s}: {:s} {:s}".format(str(execArgs), str(sys.exc_info()[0]), str(sys.exc_info()[1]))
+			if self.fIgnoreLaunchErrors:
+				applog_d(errStr)
+				return
+			if self.pendingException == None:
+				self.pendingException = DownloadExecException(errStr, DownloadExecException.LAUNCH_ERROR)
+			return
+		self.runningProcessList.append((process, execArgs))
+		self.countLaunched += 1
+
+	def _reapExitedProcesses(self):
+		stillRunningProcessList = []
+		for (process, execArgs) in self.runningProcessList:
+			retCode = process.poll()
+			if retCode == None:
+				stillRunningProcessList.append((process, execArgs))
+				continue
+			if retCode != 0:
+				applog_d("downloadexec: {:s} exited with code {:d}".format(str(execArgs), retCode))
+				if self.fCheckExitCodes and self.pendingException == None:
+					self.pendingException = DownloadExecException("Launched app for '--downloadexec' returned non-zero code ({:d})".format(retCode),\
+						DownloadExecException.NON_ZERO_EXIT_CODE, retCode)
+		self.runningProcessList = stillRunningProcessList
+
+	# end of methods requiring self.lock
+
+	def _raisePendingException(self):
+		with self.lock:
+			exception = self.pendingException
+			self.pendingException = None
+		if exception:
+			raise exception
+
+	def _backgroundThreadMain(self):
+		while not self.fStopBackgroundThread:
+			time.sleep(DOWNLOADEXEC_POLL_INTERVAL_SECS)
+			with self.lock:
+				self._reapExitedProcesses()
+				if self.countPendingBatchFiles and time.time() - self.pendingBatchTimeStarted >= self.batchMaxSecs and\
+						len(self.runningProcessList) < self.maxConcurrent:
+					applog_d("downloadexec: Launching batch of {:d} file(s) on time limit".format(self.countPendingBatchFiles))
+					self._launchPendingBatch()
@@ -409,6 +409,11 @@ MTP_STORAGEID_SubSlotPopulated			= 0x00020001
 MTP_STORAGEID_PresenceBit				= 0x00000001	# bit 0 is set if slot is populated
 MTP_STORAGEID_ALL_CARDS					= 0xFFFFFFFF
 
+#
+# special object handle values
+#
+MTP_OBJHANDLE_ROOT						= 0xFFFFFFFF	# as MTP_OP_GetObjectHandles parent - objects in the root folder of the storage
+
 MtpStorageIdDescDictionary = {\
 	MTP_STORAGEID_MainSlotEmptyOrUnavail : 'MTP_STORAGEID_MainSlotEmptyOrUnavail',
 	MTP_STORAGEID_MainSlotPopulated : 'MTP_STORAGEID_MainSlotPopulated',
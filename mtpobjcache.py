@@ -0,0 +1,490 @@
+#!/usr/bin/env python
+
+#
+#############################################################################
+#
+# mtpobjcache.py - Incremental on-disk cache of MTP object infos
+# Copyright (C) 2015, testcams.com
+#
+# This module is licensed under GPL v3: http://www.gnu.org/licenses/gpl-3.0.html
+#
+#############################################################################
+#
+
+from __future__ import print_function
+from __future__ import division
+import six
+from six.moves import xrange
+import struct
+import time
+import os
+import zlib
+import mmap
+from applog import *
+from mtpdef import *
+
+#
+# The cache is kept in two files:
+#
+# Snapshot - The objects as of the last compaction, as fixed-width records sorted
+# by object handle followed by a heap of the records' (utf-8) strings. The snapshot
+# is memory-mapped and looked up by binary search on the handle, so we only decode
+# the records for objects we actually need rather than deserializing the whole card.
+#
+#	Header:		magic (4 bytes), version (u32), record count (u32), time saved (double, epoch),
+#				CRC-32 of the preceding header fields (u32)
+#	Records:	object handle (u32), all MtpObjectInfoTuple integer fields, heap offset (u32)
+#				and length (u16) of each MtpObjectInfoTuple string field, and a CRC-32 (u32)
+#				of the record's other fields plus its strings
+#	Heap:		string data referenced by the records (identical strings are stored once)
+#
+# Journal - An append-only log of the changes since the snapshot. Each session only
+# appends records for the objects that were added, changed or removed, followed by a
+# commit record, so the cost of saving the cache scales with the number of objects that
+# changed rather than with the number of objects on the card. Once the journal grows
+# large relative to the snapshot we compact by writing a new snapshot and emptying the
+# journal. Replaying a journal over the snapshot it was compacted into is harmless,
+# so an interruption between the two steps leaves the cache consistent.
+#
+#	Header:		magic (4 bytes), version (u32)
+#	Records:	payload length (u32), CRC-32 of payload (u32), payload
+#
+# The first byte of each journal payload is the record type:
+#
+#	MTPOBJCACHE_REC_PUT		- object handle (u32) + serialized MtpObjectInfoTuple
+#	MTPOBJCACHE_REC_DEL		- object handle (u32)
+#	MTPOBJCACHE_REC_COMMIT	- time records were committed (double, epoch)
+#
+# Journal records are applied on load only once their commit record is reached, so
+# a session that was interrupted while appending (or a record that was corrupted)
+# leaves the journal at the state of its last intact commit. All integers are
+# little-endian
+#
+MTPOBJCACHE_MAGIC					= b'AMOC'
+MTPOBJCACHE_VERSION					= 2
+MTPOBJCACHE_SNAPSHOT_MAGIC			= b'AMOS'
+MTPOBJCACHE_SNAPSHOT_VERSION		= 1
+MTPOBJCACHE_REC_PUT					= 1
+MTPOBJCACHE_REC_DEL					= 2
+MTPOBJCACHE_REC_COMMIT				= 3
+MTPOBJCACHE_COMPACT_MIN_RECORDS		= 256	# don't bother compacting journals with fewer records than this
+MTPOBJCACHE_COMPACT_JOURNAL_PERCENT	= 25	# compact once the journal has this many records per 100 live objects
+
+MTPOBJCACHE_HEADER_STRUCT			= struct.Struct('<4sI')
+MTPOBJCACHE_RECORD_HEADER_STRUCT	= struct.Struct('<II')
+MTPOBJCACHE_OBJINFO_INTS_FORMAT		= 'IHHIHIIIIIIIHII'	# all MtpObjectInfoTuple fields before 'filename'
+MTPOBJCACHE_OBJINFO_INTS_STRUCT		= struct.Struct('<' + MTPOBJCACHE_OBJINFO_INTS_FORMAT)
+MTPOBJCACHE_OBJINFO_STR_FIELD_COUNT	= 3					# filename, captureDateStr, modificationDateStr
+
+MTPOBJCACHE_SNAPSHOT_HEADER_STRUCT	= struct.Struct('<4sIIdI')
+MTPOBJCACHE_SNAPSHOT_RECORD_STRUCT	= struct.Struct('<I' + MTPOBJCACHE_OBJINFO_INTS_FORMAT + 'IH'*MTPOBJCACHE_OBJINFO_STR_FIELD_COUNT + 'I')
+MTPOBJCACHE_SNAPSHOT_ASSOCTYPE_OFFSET	= struct.calcsize('<I' + MTPOBJCACHE_OBJINFO_INTS_FORMAT[:MtpObjectInfoTuple._fields.index('associationType')])
+
+
+#
+# exception raised when the cache is unreadable as a whole (bad header, version mismatch, etc...)
+#
+class MtpObjCacheCorruptException(Exception):
+	def __init__(self, message):
+		Exception.__init__(self, message)
+
+
+#
+# serializes an MtpObjectInfoTuple into the body of a MTPOBJCACHE_REC_PUT record
+#
+def packMtpObjectInfo(mtpObjectInfo):
+	data = MTPOBJCACHE_OBJINFO_INTS_STRUCT.pack(*mtpObjectInfo[:-MTPOBJCACHE_OBJINFO_STR_FIELD_COUNT])
+	for fieldStr in mtpObjectInfo[-MTPOBJCACHE_OBJINFO_STR_FIELD_COUNT:]:
+		fieldBytes = six.text_type(fieldStr).encode('utf-8')
+		data += struct.pack('<H', len(fieldBytes)) + fieldBytes
+	return data
+
+
+#
+# deserializes an MtpObjectInfoTuple from the body of a MTPOBJCACHE_REC_PUT record
+#
+def unpackMtpObjectInfo(data, offset):
+	fields = list(MTPOBJCACHE_OBJINFO_INTS_STRUCT.unpack_from(data, offset))
+	offset += MTPOBJCACHE_OBJINFO_INTS_STRUCT.size
+	for i in xrange(MTPOBJCACHE_OBJINFO_STR_FIELD_COUNT):
+		(fieldLen,) = struct.unpack_from('<H', data, offset)
+		offset += 2
+		fields.append(data[offset:offset+fieldLen].decode('utf-8'))
+		offset += fieldLen
+	return MtpObjectInfoTuple._make(fields)
+
+
+#
+# read-only, memory-mapped view of a snapshot file. records are located by binary
+# search on the object handle and only decoded into an MtpObjectInfoTuple on request
+#
+class MtpObjCacheSnapshot(object):
+
+	def __init__(self, filename):
+		self.mmap = None
+		with open(filename, "rb") as f:
+			fileSize = os.fstat(f.fileno()).st_size
+			if fileSize < MTPOBJCACHE_SNAPSHOT_HEADER_STRUCT.size:
+				raise MtpObjCacheCorruptException("MTP object cache snapshot {:s} is truncated".format(filename))
+			self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+		(magic, version, self.countRecords, self.timeSavedEpoch, headerCrc) = MTPOBJCACHE_SNAPSHOT_HEADER_STRUCT.unpack_from(self.mmap, 0)
+		if magic != MTPOBJCACHE_SNAPSHOT_MAGIC or version != MTPOBJCACHE_SNAPSHOT_VERSION or\
+			(zlib.crc32(self.mmap[:MTPOBJCACHE_SNAPSHOT_HEADER_STRUCT.size-4]) & 0xffffffff) != headerCrc or\
+			MTPOBJCACHE_SNAPSHOT_HEADER_STRUCT.size + self.countRecords * MTPOBJCACHE_SNAPSHOT_RECORD_STRUCT.size > fileSize:
+			self.close()
+			raise MtpObjCacheCorruptException("MTP object cache snapshot {:s} has unknown format or is corrupt".format(filename))
+
+	def close(self):
+		if self.mmap:
+			self.mmap.close()
+			self.mmap = None
+
+	def __len__(self):
+		return self.countRecords
+
+	def getObjHandle(self, index):
+		return struct.unpack_from('<I', self.mmap, MTPOBJCACHE_SNAPSHOT_HEADER_STRUCT.size + index * MTPOBJCACHE_SNAPSHOT_RECORD_STRUCT.size)[0]
+
+	def getAssociationType(self, index):
+		return struct.unpack_from('<H', self.mmap, MTPOBJCACHE_SNAPSHOT_HEADER_STRUCT.size + index * MTPOBJCACHE_SNAPSHOT_RECORD_STRUCT.size + MTPOBJCACHE_SNAPSHOT_ASSOCTYPE_OFFSET)[0]
+
+	#
+	# returns the index of the record for 'objHandle', or -1 if not in the snapshot
+	#
+	def find(self, objHandle):
+		lo = 0
+		hi = self.countRecords
+		while lo < hi:
+			mid = (lo+hi) // 2
+			if self.getObjHandle(mid) < objHandle:
+				lo = mid+1
+			else:
+				hi = mid
+		if lo < self.countRecords and self.getObjHandle(lo) == objHandle:
+			return lo
+		return -1
+
+	#
+	# decodes the record at 'index' into an MtpObjectInfoTuple. returns None if the record
+	# fails its integrity check
+	#
+	def getObjInfo(self, index):
+		recordOffset = MTPOBJCACHE_SNAPSHOT_HEADER_STRUCT.size + index * MTPOBJCACHE_SNAPSHOT_RECORD_STRUCT.size
+		fields = MTPOBJCACHE_SNAPSHOT_RECORD_STRUCT.unpack_from(self.mmap, recordOffset)
+		countIntFields = len(MTPOBJCACHE_OBJINFO_INTS_FORMAT)
+		strRefs = fields[1+countIntFields:-1]
+		strBytesList = [self.mmap[strRefs[i]:strRefs[i]+strRefs[i+1]] for i in xrange(0, len(strRefs), 2)]
+		crc = zlib.crc32(self.mmap[recordOffset:recordOffset+MTPOBJCACHE_SNAPSHOT_RECORD_STRUCT.size-4])
+		for strBytes in strBytesList:
+			crc = zlib.crc32(strBytes, crc)
+		if (crc & 0xffffffff) != fields[-1]:
+			applog_d("MTP object cache snapshot record for handle 0x{:08x} is corrupt".format(fields[0]))
+			return None
+		return MtpObjectInfoTuple._make(list(fields[1:1+countIntFields]) + [strBytes.decode('utf-8') for strBytes in strBytesList])
+
+	#
+	# writes a snapshot file from 'objInfoDict' (object handle -> MtpObjectInfoTuple)
+	#
+	@staticmethod
+	def write(filename, objInfoDict, timeSavedEpoch):
+		objHandlesList = sorted(objInfoDict)
+		heapOffset = MTPOBJCACHE_SNAPSHOT_HEADER_STRUCT.size + len(objHandlesList) * MTPOBJCACHE_SNAPSHOT_RECORD_STRUCT.size
+		heapList = []
+		heapStrOffsetDict = {}	# string bytes -> offset in file, so identical strings (dates, etc...) are stored once
+		recordsList = []
+		for objHandle in objHandlesList:
+			mtpObjectInfo = objInfoDict[objHandle]
+			strRefs = []
+			strBytesList = []
+			for fieldStr in mtpObjectInfo[-MTPOBJCACHE_OBJINFO_STR_FIELD_COUNT:]:
+				strBytes = six.text_type(fieldStr).encode('utf-8')
+				if strBytes not in heapStrOffsetDict:
+					heapStrOffsetDict[strBytes] = heapOffset
+					heapList.append(strBytes)
+					heapOffset += len(strBytes)
+				strRefs.extend((heapStrOffsetDict[strBytes], len(strBytes)))
+				strBytesList.append(strBytes)
+			record = MTPOBJCACHE_SNAPSHOT_RECORD_STRUCT.pack(objHandle, *(tuple(mtpObjectInfo[:-MTPOBJCACHE_OBJINFO_STR_FIELD_COUNT]) + tuple(strRefs) + (0,)))[:-4]
+			crc = zlib.crc32(record)
+			for strBytes in strBytesList:
+				crc = zlib.crc32(strBytes, crc)
+			recordsList.append(record + struct.pack('<I', crc & 0xffffffff))
+		header = MTPOBJCACHE_SNAPSHOT_HEADER_STRUCT.pack(MTPOBJCACHE_SNAPSHOT_MAGIC, MTPOBJCACHE_SNAPSHOT_VERSION, len(objHandlesList), timeSavedEpoch, 0)[:-4]
+		header += struct.pack('<I', zlib.crc32(header) & 0xffffffff)
+		with open(filename, "wb") as f:
+			f.write(header)
+			f.write(b''.join(recordsList))
+			f.write(b''.join(heapList))
+
+
+#
+# the cache contents returned by MtpObjCache.load(). behaves like a read-only dictionary of
+# object handle -> MtpObjectInfoTuple, combining the snapshot with the journal's changes.
+# snapshot records are only decoded when looked up, and aren't kept once decoded - the
+# caller keeps what it needs (MtpObjectStore keeps a more compact copy than the tuple)
+#
+class MtpObjCacheView(object):
+
+	def __init__(self, snapshot, journalPutsDict, journalDelsSet, fnTransformObjInfo):
+		self.snapshot = snapshot
+		self.journalPutsDict = journalPutsDict		# handle -> MtpObjectInfoTuple for objects added/changed since the snapshot
+		self.journalDelsSet = journalDelsSet		# handles of snapshot objects removed since the snapshot
+		self.fnTransformObjInfo = fnTransformObjInfo
+		self.countObjs = len(journalPutsDict) + sum(1 for objHandle in self.iterSnapshotObjHandles() if objHandle not in journalPutsDict)
+
+	def iterSnapshotObjHandles(self):
+		if self.snapshot:
+			for index in xrange(len(self.snapshot)):
+				objHandle = self.snapshot.getObjHandle(index)
+				if objHandle not in self.journalDelsSet:
+					yield objHandle
+
+	#
+	# returns the handles of the objects whose associationType is 'associationType' (ex: folders),
+	# without decoding the other objects
+	#
+	def iterObjHandlesWithAssociationType(self, associationType):
+		for (objHandle, mtpObjectInfo) in six.iteritems(self.journalPutsDict):
+			if mtpObjectInfo.associationType == associationType:
+				yield objHandle
+		if self.snapshot:
+			for index in xrange(len(self.snapshot)):
+				if self.snapshot.getAssociationType(index) == associationType:
+					objHandle = self.snapshot.getObjHandle(index)
+					if objHandle not in self.journalDelsSet and objHandle not in self.journalPutsDict:
+						yield objHandle
+
+	def get(self, objHandle, default=None):
+		if objHandle in self.journalPutsDict:
+			return self.journalPutsDict[objHandle]
+		if objHandle in self.journalDelsSet or not self.snapshot:
+			return default
+		index = self.snapshot.find(objHandle)
+		if index == -1:
+			return default
+		mtpObjectInfo = self.snapshot.getObjInfo(index)
+		if mtpObjectInfo == None:
+			return default
+		if self.fnTransformObjInfo:
+			mtpObjectInfo = self.fnTransformObjInfo(mtpObjectInfo)
+		return mtpObjectInfo
+
+	def __getitem__(self, objHandle):
+		mtpObjectInfo = self.get(objHandle)
+		if mtpObjectInfo == None:
+			raise KeyError(objHandle)
+		return mtpObjectInfo
+
+	def __contains__(self, objHandle):
+		return self.get(objHandle) != None
+
+	def __len__(self):
+		return self.countObjs
+
+	def __iter__(self):
+		for objHandle in self.journalPutsDict:
+			yield objHandle
+		for objHandle in self.iterSnapshotObjHandles():
+			if objHandle not in self.journalPutsDict:
+				yield objHandle
+
+	def iteritems(self):
+		for objHandle in self:
+			mtpObjectInfo = self.get(objHandle)
+			if mtpObjectInfo != None:
+				yield (objHandle, mtpObjectInfo)
+	items = iteritems
+
+
+#
+# incremental cache of MtpObjectInfoTuple's keyed by object handle, backed by a snapshot and a
+# journal file (see top of module). load() must be called before save() for save() to write
+# only the changes - otherwise save() writes a new snapshot
+#
+class MtpObjCache(object):
+
+	def __init__(self, filenameRoot):
+		self.filenameRoot = filenameRoot
+		self.filename = filenameRoot + "journal"
+		self.snapshotFilename = filenameRoot + "snapshot"
+		self.view = None				# MtpObjCacheView of the cache contents as of the last commit. None if cache not loaded
+		self.timeSavedEpoch = None		# time of the cache's last commit
+		self.countJournalRecords = 0	# number of committed records in the journal, used to decide when to compact
+		self.fNeedsCompaction = True	# cache is missing, unreadable or has a damaged journal tail and must be compacted on the next save
+
+	#
+	# loads the cache, returning an MtpObjCacheView of its contents as of the last intact commit,
+	# or None if there is no cache. 'fnTransformObjInfo' is an optional function applied to each
+	# MtpObjectInfoTuple as it's decoded (ex: to share field values across objects). raises IOError
+	# on read errors and MtpObjCacheCorruptException if the cache isn't one we recognize
+	#
+	def load(self, fnTransformObjInfo=None):
+		self.close()
+		self.timeSavedEpoch = None
+		self.countJournalRecords = 0
+		self.fNeedsCompaction = True
+
+		snapshot = None
+		if os.path.exists(self.snapshotFilename):
+			snapshot = MtpObjCacheSnapshot(self.snapshotFilename)
+			self.timeSavedEpoch = snapshot.timeSavedEpoch
+
+		journalPutsDict = {}
+		journalDelsSet = set()
+		fJournalIntact = False
+		if os.path.exists(self.filename):
+			try:
+				with open(self.filename, "rb") as f:
+					data = f.read()
+			except:
+				if snapshot:
+					snapshot.close()
+				raise
+			fJournalIntact = self._replayJournal(data, journalPutsDict, journalDelsSet, fnTransformObjInfo)
+
+		if self.timeSavedEpoch == None:
+			# no snapshot and no intact commit in the journal - the cache is of no use to us
+			if snapshot:
+				snapshot.close()
+			return None
+		self.view = MtpObjCacheView(snapshot, journalPutsDict, journalDelsSet, fnTransformObjInfo)
+		self.fNeedsCompaction = not snapshot or not fJournalIntact
+		if self.fNeedsCompaction:
+			applog_d("MTP object cache {:s} is missing its snapshot or has a damaged journal - it will be compacted".format(self.filename))
+		return self.view
+
+	#
+	# replays the journal in 'data', applying the records of each intact commit to 'journalPutsDict'
+	# and 'journalDelsSet'. returns True if the journal was intact to its end
+	#
+	def _replayJournal(self, data, journalPutsDict, journalDelsSet, fnTransformObjInfo):
+		if len(data) < MTPOBJCACHE_HEADER_STRUCT.size:
+			return False
+		(magic, version) = MTPOBJCACHE_HEADER_STRUCT.unpack_from(data, 0)
+		if magic != MTPOBJCACHE_MAGIC or version != MTPOBJCACHE_VERSION:
+			return False
+
+		pendingRecordsList = []	# (handle, MtpObjectInfoTuple or None for delete) of records since last commit
+		offset = MTPOBJCACHE_HEADER_STRUCT.size
+		while offset < len(data):
+			if offset + MTPOBJCACHE_RECORD_HEADER_STRUCT.size > len(data):
+				break
+			(payloadLen, crc) = MTPOBJCACHE_RECORD_HEADER_STRUCT.unpack_from(data, offset)
+			payloadOffset = offset + MTPOBJCACHE_RECORD_HEADER_STRUCT.size
+			payload = data[payloadOffset:payloadOffset+payloadLen]
+			if payloadLen == 0 or len(payload) != payloadLen or (zlib.crc32(payload) & 0xffffffff) != crc:
+				break
+			recordType = six.indexbytes(payload, 0)
+			try:
+				if recordType == MTPOBJCACHE_REC_PUT:
+					(objHandle,) = struct.unpack_from('<I', payload, 1)
+					mtpObjectInfo = unpackMtpObjectInfo(payload, 5)
+					if fnTransformObjInfo:
+						mtpObjectInfo = fnTransformObjInfo(mtpObjectInfo)
+					pendingRecordsList.append((objHandle, mtpObjectInfo))
+				elif recordType == MTPOBJCACHE_REC_DEL:
+					(objHandle,) = struct.unpack_from('<I', payload, 1)
+					pendingRecordsList.append((objHandle, None))
+				elif recordType == MTPOBJCACHE_REC_COMMIT:
+					(self.timeSavedEpoch,) = struct.unpack_from('<d', payload, 1)
+					for (objHandle, mtpObjectInfo) in pendingRecordsList:
+						if mtpObjectInfo != None:
+							journalPutsDict[objHandle] = mtpObjectInfo
+							journalDelsSet.discard(objHandle)
+						else:
+							journalPutsDict.pop(objHandle, None)
+							journalDelsSet.add(objHandle)
+					self.countJournalRecords += len(pendingRecordsList) + 1
+					pendingRecordsList = []
+				else:
+					break
+			except (struct.error, UnicodeDecodeError):
+				break
+			offset = payloadOffset + payloadLen
+		return offset == len(data) and not pendingRecordsList
+
+	#
+	# saves the objects in 'objInfoDict' (object handle -> MtpObjectInfoTuple) as the new contents of
+	# the cache. objects in the cache that aren't in 'objInfoDict' are removed unless their handle is
+	# in 'objHandlesToKeepSet'. only the objects that differ from what's in the cache are written,
+	# unless the cache is due for compaction. 'fnIsObjFromCache' is an optional function that's
+	# called with an object handle and returns True if the object's info came from the cache we
+	# loaded, so that we can skip looking it up to compare. returns the number of objects written.
+	# raises IOError on write errors
+	#
+	def save(self, objInfoDict, objHandlesToKeepSet=None, fnIsObjFromCache=None):
+		if self.view == None or self.fNeedsCompaction or\
+			self.countJournalRecords >= max(MTPOBJCACHE_COMPACT_MIN_RECORDS, len(self.view) * MTPOBJCACHE_COMPACT_JOURNAL_PERCENT // 100):
+			return self._compact(objInfoDict, objHandlesToKeepSet)
+
+		recordsList = []
+		for objHandle in objInfoDict:
+			if fnIsObjFromCache and fnIsObjFromCache(objHandle):
+				continue
+			mtpObjectInfo = objInfoDict[objHandle]
+			if self.view.journalPutsDict.get(objHandle) is mtpObjectInfo:
+				continue # object came from the cache
+			if self.view.get(objHandle) == mtpObjectInfo:
+				continue
+			recordsList.append(self._genRecord(struct.pack('<BI', MTPOBJCACHE_REC_PUT, objHandle) + packMtpObjectInfo(mtpObjectInfo)))
+		for objHandle in self.view:
+			if objHandle not in objInfoDict and not (objHandlesToKeepSet and objHandle in objHandlesToKeepSet):
+				recordsList.append(self._genRecord(struct.pack('<BI', MTPOBJCACHE_REC_DEL, objHandle)))
+		countChangedObjs = len(recordsList)
+		# we always append a commit record, even if nothing changed, since it records the time the cache was last known to be current
+		recordsList.append(self._genRecord(struct.pack('<Bd', MTPOBJCACHE_REC_COMMIT, time.time())))
+		with open(self.filename, "ab") as f:
+			f.write(b''.join(recordsList))
+		self.load(self.view.fnTransformObjInfo)
+		return countChangedObjs
+
+	#
+	# closes the snapshot. must be done before the snapshot file can be replaced or deleted
+	#
+	def close(self):
+		if self.view and self.view.snapshot:
+			self.view.snapshot.close()
+		self.view = None
+
+	#
+	# deletes the cache
+	#
+	def discard(self):
+		self.close()
+		self.timeSavedEpoch = None
+		self.countJournalRecords = 0
+		self.fNeedsCompaction = True
+		for filename in (self.snapshotFilename, self.filename):
+			try:
+				os.remove(filename)
+			except OSError:
+				pass
+
+	#
+	# writes a new snapshot containing the objects in 'objInfoDict' (plus those in 'objHandlesToKeepSet'
+	# that are still in the cache) and empties the journal. the snapshot is written to a temporary
+	# file and then renamed over the existing snapshot so that an interrupted compaction doesn't
+	# lose the previous one
+	#
+	def _compact(self, objInfoDict, objHandlesToKeepSet):
+		fnTransformObjInfo = self.view.fnTransformObjInfo if self.view else None
+		if objHandlesToKeepSet and self.view:
+			objInfoDict = dict(objInfoDict)
+			for objHandle in objHandlesToKeepSet:
+				if objHandle not in objInfoDict and objHandle in self.view:
+					objInfoDict[objHandle] = self.view[objHandle]
+		tempFilename = self.snapshotFilename + ".tmp"
+		MtpObjCacheSnapshot.write(tempFilename, objInfoDict, time.time())
+		self.close()
+		if os.path.exists(self.snapshotFilename):
+			os.remove(self.snapshotFilename) # os.rename() on Windows won't replace an existing file
+		os.rename(tempFilename, self.snapshotFilename)
+		with open(self.filename, "wb") as f:
+			f.write(MTPOBJCACHE_HEADER_STRUCT.pack(MTPOBJCACHE_MAGIC, MTPOBJCACHE_VERSION))
+		applog_d("Compacted MTP object cache {:s} with {:d} objects".format(self.snapshotFilename, len(objInfoDict)))
+		self.load(fnTransformObjInfo)
+		return len(objInfoDict)
+
+	@staticmethod
+	def _genRecord(payload):
+		return MTPOBJCACHE_RECORD_HEADER_STRUCT.pack(len(payload), zlib.crc32(payload) & 0xffffffff) + payload
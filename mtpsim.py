@@ -0,0 +1,1124 @@
+#!/usr/bin/env python
+
+#
+#############################################################################
+#
+# mtpsim.py - Simulated MTP/IP camera for testing and benchmarking airmtp
+# Copyright (C) 2015, testcams.com
+#
+# This module is licensed under GPL v3: http://www.gnu.org/licenses/gpl-3.0.html
+#
+#############################################################################
+#
+# Speaks the MTP-TCP/IP framing implemented in mtpwifi.py (host introduction, init
+# events, probe and the CmdReq/DataStart/DataPayload/CmdResponse exchange) from the
+# camera side, serving a synthetic media card whose size and folder layout are set
+# on the command line. Object data is generated from a fixed pseudo-random pattern,
+# so every run serves byte-identical files for the same options and no storage is
+# needed regardless of the card size. This lets airmtp be exercised and timed on a
+# workstation without a camera:
+#
+#	mtpsim.py --make nikon --numfiles 2000 --filesizekb 8192
+#	airmtp.py --ipaddress 127.0.0.1 --outputdir /tmp/sim
+#
+# Link behavior can be made to resemble a camera's Wifi - a fixed latency between
+# receiving each request and responding to it (overridable per MTP op), which like a
+# network round trip overlaps with that of other requests the host has in flight, a
+# bandwidth cap shared by all connections
+# and randomly dropped connections in the middle of data transfers. Make-specific
+# behavior is modeled after what airmtp has to handle on real bodies:
+#
+#	nikon	- data in a single MTP_TCPIP_PAYLOAD_ID_DataPayloadLast, MTP_OP_NkonGetEvent
+#			  events for new captures, in-camera transfer lists (MTP_OP_GetTransferList)
+#	canon	- data split across multiple MTP_TCPIP_PAYLOAD_ID_DataPayload payloads, ".0"
+#			  suffix on capture dates, clock set via MTP_OP_Canon_SetDevicePropValue
+#	sony	- folders named by date (YYYY-MM-DD) without a capture date, MTP_OP_Sony_Set_Request/
+#			  MTP_OP_Sony_Get_Request, camera refuses new sessions after it's been put to sleep
+#
+# New captures can be simulated periodically (--captureintervalsecs) to exercise
+# airmtp's realtime download. With --mtpipevents the camera also reports each new object
+# with an MTP_EVENT_ObjectAdded on the MTP-TCP/IP events socket, which airmtp listens to
+# in place of polling the object list (other cameras never send events there, which airmtp
+# then has to fall back to polling for). The simulator can also be used in-process - create
+# an MtpSimCamera and MtpSimLink and start() an MtpSimServer
+#
+# Alternatively the simulator can replay a trace recorded by airmtp (--tracefile) from a
+# real camera, answering each connection with the frames the camera sent on the corresponding
+# connection of the trace (see MtpSimReplayConnection):
+#
+#	airmtp.py --ipaddress 192.168.1.1 --tracefile d7200.trace
+#	mtpsim.py --replay d7200.trace
+#	airmtp.py --ipaddress 127.0.0.1 --replaymode yes
+#
+# --replaymode keeps airmtp from setting the clock, using its object cache or touching the
+# download history of the camera the trace was recorded from. pass the same --maxgetobjtransfersizekb
+# the trace was recorded with so the object data requests line up with the trace
+#
+
+from __future__ import print_function
+from __future__ import division
+import six
+from six.moves import xrange
+from six.moves import queue
+import argparse
+import socket
+import select
+import struct
+import threading
+import random
+import time
+import sys
+import os
+import errno
+import platform
+import traceback
+import strutil
+import mtpwifi
+from collections import namedtuple
+from mtpdef import *
+from applog import *
+
+#
+# constants
+#
+MTPSIM_APP_VERSION					= "1.0"
+MTPSIM_DEFAULT_PORT					= 15740				# port airmtp connects to (see mtpwifi.openConnection)
+MTPSIM_DATA_PATTERN_SIZE			= 1024*1024			# size of pseudo-random pattern all object data is generated from
+MTPSIM_SEND_CHUNK_SIZE				= 256*1024			# max data we pass to the socket per send
+MTPSIM_THUMB_SIZE					= 8*1024			# size of the data we return for MTP_OP_GetThumb
+MTPSIM_LARGE_THUMB_SIZE				= 64*1024			# size of the data we return for MTP_OP_GetLargeThumb
+MTPSIM_FIRST_CAPTURE_TIME			= (2015, 6, 1, 9, 0, 0, 0, 0, -1)	# capture date/time of first file on card
+MTPSIM_SECS_BETWEEN_CAPTURES		= 2					# capture time between successive files on card
+MTPSIM_FIRST_OBJECT_HANDLE			= 0x1000
+MTPSIM_SESSION_ID					= 0x1
+MTPSIM_DROPPABLE_OPS				= (MTP_OP_GetObject, MTP_OP_GetPartialObject)	# ops whose data transfers --dropprobability applies to
+MTPSIM_EVENTS_POLL_INTERVAL_SECS	= 0.05		# how often an events connection checks for new events to send to the host
+MTPSIM_REPLAY_FILL_CHUNK			= b'\x00' * MTPSIM_SEND_CHUNK_SIZE			# zeros we send in place of payload data a trace didn't capture
+MTPSIM_REPLAY_HOST_ONLY_OPS			= (MTP_OP_GetDevicePropValue, MTP_OP_SetDevicePropValue, MTP_OP_Canon_SetDevicePropValue)	# ops a replay answers itself when they're not next in the trace (reading/setting the clock)
+
+#
+# MTP-TCP/IP responses from camera -> host for the low-level requests in mtpwifi.py
+#
+MTP_TCPIP_RESP_INIT_CMD_ACK			= 0x02
+MTP_TCPIP_RESP_INIT_EVENTS_ACK		= 0x04
+MTP_TCPIP_RESP_PROBE				= 0x0e
+
+#
+# make-specific info we report and behavior we model (see module comments)
+#
+MtpSimCameraProfile = namedtuple('MtpSimCameraProfile', 'manufacturerStr modelStr serialNumberStr folderSuffix filenamePrefix opsList devicePropsList')
+MTPSIM_COMMON_OPS = [ MTP_OP_GetDeviceInfo, MTP_OP_OpenSession, MTP_OP_CloseSession, MTP_OP_GetStorageIDs, MTP_OP_GetStorageInfo,
+	MTP_OP_GetNumObjects, MTP_OP_GetObjectHandles, MTP_OP_GetObjectInfo, MTP_OP_GetObject, MTP_OP_GetThumb, MTP_OP_GetPartialObject,
+	MTP_OP_GetDevicePropValue, MTP_OP_SetDevicePropValue ]
+MtpSimCameraProfileDict = {
+	'nikon' : MtpSimCameraProfile("Nikon Corporation", "D7200", "3000001", "NCD72", "DSC_",
+		MTPSIM_COMMON_OPS + [MTP_OP_GetLargeThumb, MTP_OP_NkonGetEvent, MTP_OP_GetTransferList, MTP_OP_NotifyFileAcquisitionStart, MTP_OP_NotifyFileAcquisitionEnd],
+		[MTP_DeviceProp_DateTime]),
+	'canon' : MtpSimCameraProfile("Canon Inc.", "Canon EOS 6D", "082021000001", "CANON", "IMG_",
+		MTPSIM_COMMON_OPS + [MTP_OP_Canon_SetDevicePropValue], []),
+	'sony'	: MtpSimCameraProfile("Sony Corporation", "ILCE-7M2", "3100001", None, "DSC",
+		MTPSIM_COMMON_OPS + [MTP_OP_Sony_Set_Request, MTP_OP_Sony_Get_Request], []),
+}
+
+MtpSimExtToObjFormatDict = {
+	'NEF' : MTP_OBJFORMAT_NEF_WithoutMtp,
+	'CR2' : MTP_OBJFORMAT_CR2,
+	'JPG' : MTP_OBJFORMAT_EXIF_or_JPEG,
+	'MOV' : MTP_OBJFORMAT_MOV,
+	'TIF' : MTP_OBJFORMAT_TIFF,
+}
+
+
+#
+# raised by a connection handler to simulate the camera dropping the connection
+#
+class MtpSimConnectionDroppedException(Exception):
+	def __init__(self, message):
+		Exception.__init__(self, message)
+
+
+#
+# encodes a string into MTP's counted UTF-16 format (see airmtp.mtpCountedUtf16ToPythonUnicodeStr)
+#
+def mtpCountedUtf16Str(s):
+	if not s:
+		return struct.pack('<B', 0)
+	return struct.pack('<B', len(s)+1) + six.text_type(s).encode('utf-16-le') + b'\x00\x00'
+
+def mtpCountedHalfwordList(halfwordList):
+	return struct.pack('<I{:d}H'.format(len(halfwordList)), len(halfwordList), *halfwordList)
+
+def mtpCountedWordList(wordList):
+	return struct.pack('<I{:d}I'.format(len(wordList)), len(wordList), *wordList)
+
+def epochToMtpTimeStr(timeEpoch):
+	return time.strftime("%Y%m%dT%H%M%S", time.localtime(timeEpoch))
+
+
+#
+# a file or folder on the simulated card. the file data itself is generated on demand (see MtpSimCamera.genObjectData)
+#
+class MtpSimObject(object):
+	__slots__ = ('handle', 'storageId', 'parentHandle', 'objectFormat', 'associationType', 'filename', 'captureDateStr', 'sizeBytes')
+	def __init__(self, handle, storageId, parentHandle, objectFormat, associationType, filename, captureDateStr, sizeBytes):
+		self.handle = handle
+		self.storageId = storageId
+		self.parentHandle = parentHandle
+		self.objectFormat = objectFormat
+		self.associationType = associationType
+		self.filename = filename
+		self.captureDateStr = captureDateStr
+		self.sizeBytes = sizeBytes
+	def isFolder(self):
+		return self.associationType == MTP_OBJASSOC_GenericFolder
+
+
+#
+# the simulated camera - its cards and their objects, plus the state shared by all
+# connections to it (events, transfer list, etc...). 'numFiles' is the number of
+# captures per card; each capture produces a file for each extension in 'extList' (ie,
+# RAW+JPEG), all sharing the same capture date
+#
+class MtpSimCamera:
+
+	def __init__(self, make, numCards=1, numFiles=1000, filesPerFolder=999, fileSizeBytes=8*1024*1024, extList=['NEF', 'JPG'],
+			transferListCount=0, seed=0, fMtpIpEvents=False):
+		self.make = make
+		self.fMtpIpEvents = fMtpIpEvents
+		self.profile = MtpSimCameraProfileDict[make]
+		self.filesPerFolder = filesPerFolder
+		self.fileSizeBytes = fileSizeBytes
+		self.extList = [ext.upper() for ext in extList]
+		self.lock = threading.Lock()
+		self.objectsList = []					# all objects, in order of creation (which is capture-date order)
+		self.objectsDict = {}					# all objects, keyed by handle
+		self.nextHandle = MTPSIM_FIRST_OBJECT_HANDLE
+		self.storageIdsList = [MTP_STORAGEID_MainSlotPopulated, MTP_STORAGEID_SubSlotPopulated][:numCards]
+		self.lastFolderDict = {}				# (folderObj, countFilesInFolder) of the last folder of each card, keyed by storage ID
+		self.countCapturesDict = {}				# number of captures on each card, keyed by storage ID
+		self.nextCaptureEpoch = time.mktime(MTPSIM_FIRST_CAPTURE_TIME)
+		self.nikonEventsList = []				# MTP events not yet retrieved by MTP_OP_NkonGetEvent, as (eventCode, eventParameter)
+		self.mtpIpEventsList = []				# MTP events posted for the events socket (fMtpIpEvents), as (eventCode, eventParameter). each events connection sends those posted while it's open
+		self.transferListHandlesList = []		# handles in the camera's transfer list (ie, user selected for download in camera)
+		self.fAsleep = False					# camera was put to sleep (Sony) - we refuse any new sessions
+		self.deviceTimeOffsetSecs = 0			# offset of camera's clock from system's clock
+
+		# generate the pattern all object data is derived from. the pattern is extended by a chunk so that any chunk-sized slice starting within the pattern is contiguous
+		rng = random.Random(seed)
+		pattern = struct.pack('<{:d}I'.format(MTPSIM_DATA_PATTERN_SIZE//4), *[rng.getrandbits(32) for i in xrange(MTPSIM_DATA_PATTERN_SIZE//4)])
+		self.dataPatternView = memoryview(pattern + pattern[:MTPSIM_SEND_CHUNK_SIZE])
+
+		# build the cards. Nikon/Canon folders are within a DCIM folder in the root
+		for storageId in self.storageIdsList:
+			self.countCapturesDict[storageId] = 0
+			dcimFolder = None
+			if self.profile.folderSuffix:
+				dcimFolder = self._addObject(storageId, 0, MTP_OBJFORMAT_Assocation, MTP_OBJASSOC_GenericFolder, "DCIM", "", 0)
+			self.lastFolderDict[storageId] = (dcimFolder, None, 0)
+			captureEpochSave = self.nextCaptureEpoch
+			for i in xrange(numFiles):
+				self.simulateCapture(storageId, fQueueEvents=False)
+			self.nextCaptureEpoch = captureEpochSave if storageId != self.storageIdsList[-1] else self.nextCaptureEpoch
+
+		# the last 'transferListCount' files (Nikon) are in the in-camera transfer list
+		if transferListCount:
+			self.transferListHandlesList = [obj.handle for obj in self.objectsList if not obj.isFolder()][-transferListCount:]
+
+	def _addObject(self, storageId, parentHandle, objectFormat, associationType, filename, captureDateStr, sizeBytes):
+		obj = MtpSimObject(self.nextHandle, storageId, parentHandle, objectFormat, associationType, filename, captureDateStr, sizeBytes)
+		self.nextHandle += 1
+		self.objectsList.append(obj)
+		self.objectsDict[obj.handle] = obj
+		return obj
+
+	#
+	# adds the file(s) for a new capture to card 'storageId' (None = first card), creating a new folder
+	# first if the current folder is full. returns the list of objects created
+	#
+	def simulateCapture(self, storageId=None, fQueueEvents=True):
+		with self.lock:
+			if storageId == None:
+				storageId = self.storageIdsList[0]
+			(dcimFolder, folder, countFilesInFolder) = self.lastFolderDict[storageId]
+			captureEpoch = self.nextCaptureEpoch
+			self.nextCaptureEpoch += MTPSIM_SECS_BETWEEN_CAPTURES
+			captureNumber = self.countCapturesDict[storageId] % 9999 + 1
+			self.countCapturesDict[storageId] += 1
+			newObjectsList = []
+			if folder == None or countFilesInFolder + len(self.extList) > self.filesPerFolder:
+				if self.profile.folderSuffix:
+					folderNumber = 100 + len([obj for obj in self.objectsList if obj.storageId == storageId and obj.isFolder()]) - 1
+					folder = self._addObject(storageId, dcimFolder.handle, MTP_OBJFORMAT_Assocation, MTP_OBJASSOC_GenericFolder,
+						"{:03d}{:s}".format(folderNumber, self.profile.folderSuffix), epochToMtpTimeStr(captureEpoch), 0)
+				else:
+					# Sony - folders are named by date and have no capture date
+					folder = self._addObject(storageId, 0, MTP_OBJFORMAT_Assocation, MTP_OBJASSOC_GenericFolder,
+						time.strftime("%Y-%m-%d", time.localtime(captureEpoch)), "", 0)
+				newObjectsList.append(folder)
+				countFilesInFolder = 0
+			captureDateStr = epochToMtpTimeStr(captureEpoch)
+			if self.make == 'canon':
+				captureDateStr += ".0"
+			for ext in self.extList:
+				newObjectsList.append(self._addObject(storageId, folder.handle, MtpSimExtToObjFormatDict.get(ext, MTP_OBJFORMAT_NEF_WithoutMtp), 0,
+					"{:s}{:04d}.{:s}".format(self.profile.filenamePrefix, captureNumber, ext), captureDateStr, self.fileSizeBytes))
+				countFilesInFolder += 1
+			self.lastFolderDict[storageId] = (dcimFolder, folder, countFilesInFolder)
+			if fQueueEvents and self.make == 'nikon':
+				self.nikonEventsList.extend([(MTP_EVENT_ObjectAdded, obj.handle) for obj in newObjectsList])
+			if fQueueEvents and self.fMtpIpEvents:
+				self.mtpIpEventsList.extend([(MTP_EVENT_ObjectAdded, obj.handle) for obj in newObjectsList])
+			return newObjectsList
+
+	def getObject(self, handle):
+		return self.objectsDict.get(handle)
+
+	def getObjectHandles(self, storageId, objectFormat, parentHandle):
+		with self.lock:
+			objectsList = list(self.objectsList)
+		return [obj.handle for obj in objectsList if\
+			(storageId == MTP_STORAGEID_ALL_CARDS or obj.storageId == storageId) and\
+			(objectFormat == 0 or obj.objectFormat == objectFormat) and\
+			(parentHandle == 0 or obj.parentHandle == (0 if parentHandle == MTP_OBJHANDLE_ROOT else parentHandle))]
+
+	def retrieveNikonEvents(self):
+		with self.lock:
+			eventsList = self.nikonEventsList
+			self.nikonEventsList = []
+		return eventsList
+
+	#
+	# returns the events socket events posted starting at 'startIndex', along with the index to pass on the next call
+	#
+	def getMtpIpEvents(self, startIndex):
+		with self.lock:
+			return (self.mtpIpEventsList[startIndex:], len(self.mtpIpEventsList))
+
+	def genDeviceInfoData(self):
+		data = struct.pack('<HIH', 100, 0x0000000a if self.make == 'nikon' else 0x00000006, 100)
+		data += mtpCountedUtf16Str("microsoft.com: 1.0;")
+		data += struct.pack('<H', 0)	# functional mode
+		data += mtpCountedHalfwordList(self.profile.opsList)
+		data += mtpCountedHalfwordList([MTP_EVENT_ObjectAdded, MTP_EVENT_ObjectRemoved, MTP_EVENT_StoreFull, MTP_EVENT_DevicePropChanged])
+		data += mtpCountedHalfwordList(self.profile.devicePropsList)
+		data += mtpCountedHalfwordList([])
+		data += mtpCountedHalfwordList(sorted(set(MtpSimExtToObjFormatDict.get(ext, MTP_OBJFORMAT_NEF_WithoutMtp) for ext in self.extList)))
+		data += mtpCountedUtf16Str(self.profile.manufacturerStr)
+		data += mtpCountedUtf16Str(self.profile.modelStr)
+		data += mtpCountedUtf16Str("V1.00 (mtpsim)")
+		data += mtpCountedUtf16Str(self.profile.serialNumberStr)
+		return data
+
+	def genStorageInfoData(self, storageId):
+		with self.lock:
+			usedBytes = sum(obj.sizeBytes for obj in self.objectsList if obj.storageId == storageId)
+		maxCapacityBytes = max(64*1024*1024*1024, usedBytes*2)
+		freeSpaceBytes = maxCapacityBytes - usedBytes
+		data = struct.pack('<HHHQQIB', 0x0004, 0x0002, 0x0000, maxCapacityBytes, freeSpaceBytes, freeSpaceBytes // max(self.fileSizeBytes, 1), 0)
+		data += mtpCountedUtf16Str("SLOT{:d}".format(storageId >> 16))
+		return data
+
+	def genObjectInfoData(self, obj):
+		if obj.isFolder():
+			(thumbFormat, thumbSize, thumbPixWidth, thumbPixHeight, imagePixWidth, imagePixHeight) = (0, 0, 0, 0, 0, 0)
+		else:
+			(thumbFormat, thumbSize, thumbPixWidth, thumbPixHeight, imagePixWidth, imagePixHeight) = (MTP_OBJFORMAT_JFIF, MTPSIM_THUMB_SIZE, 160, 120, 6000, 4000)
+		data = struct.pack('<IHHIHIIIIIIIHII', obj.storageId, obj.objectFormat, 0, obj.sizeBytes, thumbFormat, thumbSize,
+			thumbPixWidth, thumbPixHeight, imagePixWidth, imagePixHeight, 0, obj.parentHandle, obj.associationType, 0, 0)
+		data += mtpCountedUtf16Str(obj.filename)
+		data += mtpCountedUtf16Str(obj.captureDateStr)
+		data += mtpCountedUtf16Str(obj.captureDateStr)	# modification date
+		data += mtpCountedUtf16Str("")					# keywords
+		return data
+
+	#
+	# generates the data of an object from 'offset' for 'count' bytes, in chunks of up to MTPSIM_SEND_CHUNK_SIZE.
+	# each chunk is a memoryview into our data pattern, starting at a different point of the pattern for each object
+	#
+	def genObjectData(self, obj, offset, count):
+		patternOffset = (obj.handle * 7919 + offset) % MTPSIM_DATA_PATTERN_SIZE
+		while count:
+			chunkSize = min(count, MTPSIM_SEND_CHUNK_SIZE)
+			yield self.dataPatternView[patternOffset:patternOffset+chunkSize]
+			patternOffset = (patternOffset + chunkSize) % MTPSIM_DATA_PATTERN_SIZE
+			count -= chunkSize
+
+	def getDeviceTimeStr(self):
+		return epochToMtpTimeStr(time.time() + self.deviceTimeOffsetSecs)
+
+	def setDeviceTimeStr(self, mtpTimeStr):
+		try:
+			self.deviceTimeOffsetSecs = time.mktime(time.strptime(mtpTimeStr[:15], "%Y%m%dT%H%M%S")) - time.time()
+		except ValueError:
+			pass
+
+
+#
+# emulates the characteristics of the camera's link - the latency between the camera
+# receiving each request and responding to it (the default for all ops, overridden for
+# specific ops in 'opLatencySecsDict'), a bandwidth cap shared by all connections and randomly dropped
+# connections during object data transfers (with probability 'dropProbability' per
+# MTP_OP_GetObject/MTP_OP_GetPartialObject). 'seed' makes the drops repeatable
+#
+class MtpSimLink:
+
+	def __init__(self, latencySecs=0, opLatencySecsDict={}, maxBytesPerSec=0, dropProbability=0, seed=0):
+		self.latencySecs = latencySecs
+		self.opLatencySecsDict = opLatencySecsDict
+		self.maxBytesPerSec = maxBytesPerSec
+		self.dropProbability = dropProbability
+		self.lock = threading.Lock()
+		self.rng = random.Random(seed)
+		self.tokens = 0
+		self.timeLastRefill = time.time()
+
+	#
+	# waits until the latency for an 'mtpOp' request received at 'timeReceived' has
+	# elapsed. the latency runs from when the request was received rather than from
+	# when we get around to it, so that requests the host has pipelined wait out their
+	# latencies concurrently, as they would the round trip of a real network
+	#
+	def waitOpLatency(self, mtpOp, timeReceived):
+		latencySecs = self.opLatencySecsDict.get(mtpOp, self.latencySecs)
+		sleepSecs = timeReceived + latencySecs - time.time()
+		if sleepSecs > 0:
+			time.sleep(sleepSecs)
+
+	#
+	# waits until 'numBytes' can be sent within the bandwidth cap. the token bucket holds
+	# up to a tenth of a second's worth of data, so bursts are kept short
+	#
+	def throttle(self, numBytes):
+		if not self.maxBytesPerSec:
+			return
+		with self.lock:
+			timeCurrent = time.time()
+			self.tokens = min(self.tokens + (timeCurrent - self.timeLastRefill) * self.maxBytesPerSec, self.maxBytesPerSec / 10)
+			self.timeLastRefill = timeCurrent
+			self.tokens -= numBytes
+			sleepSecs = -self.tokens / self.maxBytesPerSec if self.tokens < 0 else 0
+		if sleepSecs:
+			time.sleep(sleepSecs)
+
+	#
+	# returns the number of bytes of a 'sizeBytes' data transfer we should send before dropping the connection, or None if it shouldn't be dropped
+	#
+	def getDropPoint(self, sizeBytes):
+		if not self.dropProbability:
+			return None
+		with self.lock:
+			if self.rng.random() >= self.dropProbability:
+				return None
+			return self.rng.randint(0, max(sizeBytes-1, 0))
+
+
+#
+# services one TCP/IP connection from the host. the first request on the connection
+# determines whether it's the command connection (MTP_TCPIP_REQ_INIT_CMD_REQ) or the
+# event connection (MTP_TCPIP_REQ_INIT_EVENTS)
+#
+class MtpSimConnection:
+
+	def __init__(self, server, s, addr):
+		self.server = server
+		self.camera = server.camera
+		self.link = server.link
+		self.s = s
+		self.addr = addr
+		self.fSessionOpen = False
+
+	def rxExactly(self, numBytes):
+		data = bytearray(numBytes)
+		view = memoryview(data)
+		bytesReceived = 0
+		while bytesReceived < numBytes:
+			bytesReceivedThisCall = self.s.recv_into(view[bytesReceived:])
+			if bytesReceivedThisCall == 0:
+				raise MtpSimConnectionDroppedException("Connection closed by host")
+			bytesReceived += bytesReceivedThisCall
+		return six.binary_type(data)
+
+	def rxFrame(self):
+		(totalBytesIncludingPreamble,) = struct.unpack('<I', self.rxExactly(4))
+		return self.rxExactly(totalBytesIncludingPreamble - 4)
+
+	def txFrame(self, data):
+		self.s.sendall(struct.pack('<I', len(data)+4) + data)
+
+	def serve(self):
+		try:
+			if self.camera.fAsleep:
+				applog_i("{:s}: Refusing connection - camera is asleep".format(self.addr))
+				return
+			frame = self.rxFrame()
+			(requestId,) = struct.unpack_from('<I', frame, 0)
+			if requestId == mtpwifi.MTP_TCPIP_REQ_INIT_CMD_REQ:
+				self.txFrame(struct.pack('<II', MTP_TCPIP_RESP_INIT_CMD_ACK, MTPSIM_SESSION_ID) + frame[4:20] + mtpCountedUtf16Str(self.camera.profile.modelStr))
+				self.serveCommands()
+			elif requestId == mtpwifi.MTP_TCPIP_REQ_INIT_EVENTS:
+				self.txFrame(struct.pack('<I', MTP_TCPIP_RESP_INIT_EVENTS_ACK))
+				self.serveEvents()
+			else:
+				applog_e("{:s}: Unexpected initial request 0x{:x} - closing connection".format(self.addr, requestId))
+		except MtpSimConnectionDroppedException as e:
+			applog_v("{:s}: {:s}".format(self.addr, str(e)))
+		except socket.error as e:
+			applog_v("{:s}: Socket error: {:s}".format(self.addr, str(e)))
+		finally:
+			self.s.close()
+			self.server.connectionClosed(self)
+
+	def serveEvents(self):
+		(eventsList, nextEventIndex) = self.camera.getMtpIpEvents(0)	# events posted before the connection was opened aren't sent
+		while True:
+			(readableList, writableList, exceptionalList) = select.select([self.s], [], [], MTPSIM_EVENTS_POLL_INTERVAL_SECS)
+			if readableList:
+				frame = self.rxFrame()
+				(requestId,) = struct.unpack_from('<I', frame, 0)
+				if requestId == mtpwifi.MTP_TCPIP_REQ_PROBE:
+					self.txFrame(struct.pack('<I', MTP_TCPIP_RESP_PROBE))
+				else:
+					applog_d("{:s}: Ignoring event connection request 0x{:x}".format(self.addr, requestId))
+			(eventsList, nextEventIndex) = self.camera.getMtpIpEvents(nextEventIndex)
+			for (eventCode, eventParameter) in eventsList:
+				applog_d("{:s}: Sending {:s} 0x{:08x}".format(self.addr, getMtpEventDesc(eventCode), eventParameter))
+				self.txFrame(struct.pack('<IHII', mtpwifi.MTP_TCPIP_PAYLOAD_ID_Event, eventCode, 0xffffffff, eventParameter))
+
+	#
+	# the requests are received on a separate thread (see rxRequests), which timestamps
+	# each as it arrives. this lets the latency of a request overlap with the servicing
+	# of the requests ahead of it when the host has more than one in flight
+	#
+	def serveCommands(self):
+		requestQueue = queue.Queue()
+		rxThread = threading.Thread(target=self.rxRequests, args=(requestQueue,))
+		rxThread.daemon = True
+		rxThread.start()
+		try:
+			self.serveQueuedCommands(requestQueue)
+		finally:
+			try:
+				self.s.shutdown(socket.SHUT_RDWR) # wake rxThread if it's blocked receiving
+			except socket.error as e:
+				pass
+			rxThread.join()
+
+	def serveQueuedCommands(self, requestQueue):
+		while True:
+			request = requestQueue.get()
+			if isinstance(request, Exception):
+				raise request
+			(timeReceived, mtpOp, transactionId, cmdArgs, dataFromHost) = request
+			self.link.waitOpLatency(mtpOp, timeReceived)
+			(mtpRespCode, responseParameter, dataToHost) = self.execOp(mtpOp, cmdArgs, dataFromHost)
+			self.server.countOp(mtpOp)
+			if dataToHost != None:
+				self.txDataToHost(mtpOp, transactionId, dataToHost)
+			self.txFrame(struct.pack('<IHII', mtpwifi.MTP_TCPIP_PAYLOAD_ID_CmdResponse, mtpRespCode, transactionId, responseParameter))
+
+	#
+	# receives the requests on the command connection, putting each onto 'requestQueue' along
+	# with the time it was received. a connection error is put onto the queue for serveCommands
+	#
+	def rxRequests(self, requestQueue):
+		try:
+			while True:
+				frame = self.rxFrame()
+				(payloadId,) = struct.unpack_from('<I', frame, 0)
+				if payloadId != mtpwifi.MTP_TCPIP_PAYLOAD_ID_CmdReq:
+					raise MtpSimConnectionDroppedException("Unexpected payload ID 0x{:x} on command connection".format(payloadId))
+				(dataDirection, mtpOp, transactionId) = struct.unpack_from('<IHI', frame, 4)
+				argsData = frame[14:]
+				cmdArgs = struct.unpack('<{:d}I'.format(len(argsData)//4), argsData[:len(argsData)//4*4])
+				dataFromHost = None
+				if dataDirection == mtpwifi.MTP_TCPIP_CmdReq_DataDir_HostToCamera:
+					dataFromHost = self.rxDataFromHost(transactionId)
+				requestQueue.put((time.time(), mtpOp, transactionId, cmdArgs, dataFromHost))
+		except (MtpSimConnectionDroppedException, socket.error) as e:
+			requestQueue.put(e)
+
+	def rxDataFromHost(self, transactionId):
+		data = six.binary_type()
+		while True:
+			frame = self.rxFrame()
+			(payloadId,) = struct.unpack_from('<I', frame, 0)
+			if payloadId == mtpwifi.MTP_TCPIP_PAYLOAD_ID_DataPayload or payloadId == mtpwifi.MTP_TCPIP_PAYLOAD_ID_DataPayloadLast:
+				data += frame[8:]
+				if payloadId == mtpwifi.MTP_TCPIP_PAYLOAD_ID_DataPayloadLast:
+					return data
+			elif payloadId != mtpwifi.MTP_TCPIP_PAYLOAD_ID_DataStart:
+				raise MtpSimConnectionDroppedException("Unexpected payload ID 0x{:x} during host data".format(payloadId))
+
+	#
+	# sends the DataStart and data payload(s) for 'dataToHost', which is either a bytes or a
+	# (size, chunk iterator) tuple. Nikon sends all the data in a single DataPayloadLast; Canon
+	# splits it into payloads of up to server.canonPayloadSize
+	#
+	def txDataToHost(self, mtpOp, transactionId, dataToHost):
+		if isinstance(dataToHost, six.binary_type):
+			(sizeBytes, chunksIter) = (len(dataToHost), iter([dataToHost]))
+		else:
+			(sizeBytes, chunksIter) = dataToHost
+		dropPoint = self.link.getDropPoint(sizeBytes) if mtpOp in MTPSIM_DROPPABLE_OPS else None
+		self.txFrame(struct.pack('<IIQ', mtpwifi.MTP_TCPIP_PAYLOAD_ID_DataStart, transactionId, sizeBytes))
+		payloadSize = self.server.canonPayloadSize if self.camera.make == 'canon' else sizeBytes
+		bytesSent = 0
+		bytesLeftInPayload = 0
+		pendingChunk = None
+		while True:
+			if bytesLeftInPayload == 0:
+				bytesLeftInPayload = min(payloadSize, sizeBytes - bytesSent)
+				payloadId = mtpwifi.MTP_TCPIP_PAYLOAD_ID_DataPayloadLast if bytesSent + bytesLeftInPayload >= sizeBytes else mtpwifi.MTP_TCPIP_PAYLOAD_ID_DataPayload
+				self.s.sendall(struct.pack('<III', bytesLeftInPayload+12, payloadId, transactionId))
+				if bytesLeftInPayload == 0:
+					break
+			if not pendingChunk:
+				pendingChunk = next(chunksIter)
+			chunk = pendingChunk[:bytesLeftInPayload]
+			pendingChunk = pendingChunk[len(chunk):]
+			if dropPoint != None and bytesSent + len(chunk) > dropPoint:
+				self.s.sendall(chunk[:dropPoint-bytesSent])
+				self.server.countBytesSent(dropPoint-bytesSent)
+				raise MtpSimConnectionDroppedException("Simulated drop during {:s} after 0x{:x} of 0x{:x} bytes".format(getMtpOpDesc(mtpOp), dropPoint, sizeBytes))
+			self.link.throttle(len(chunk))
+			self.s.sendall(chunk)
+			self.server.countBytesSent(len(chunk))
+			bytesSent += len(chunk)
+			bytesLeftInPayload -= len(chunk)
+			if bytesSent >= sizeBytes:
+				break
+
+	#
+	# executes an MTP op, returning (mtpRespCode, responseParameter, dataToHost). 'dataToHost'
+	# is None for ops without Camera->Host data (see txDataToHost for its format otherwise)
+	#
+	def execOp(self, mtpOp, cmdArgs, dataFromHost):
+		cmdArgs = list(cmdArgs) + [0] * (3 - len(cmdArgs))
+		applog_d("{:s}: {:s} {:s}".format(self.addr, getMtpOpDesc(mtpOp), str(cmdArgs)))
+		if mtpOp not in self.camera.profile.opsList:
+			return (MTP_RESP_OperationNotSupported, 0, None)
+		if mtpOp == MTP_OP_GetDeviceInfo:
+			return (MTP_RESP_Ok, 0, self.camera.genDeviceInfoData())
+		if mtpOp == MTP_OP_OpenSession:
+			if self.fSessionOpen:
+				return (MTP_RESP_SessionAlreadyOpen, 0, None)
+			self.fSessionOpen = True
+			return (MTP_RESP_Ok, 0, None)
+		if not self.fSessionOpen:
+			return (MTP_RESP_SessionNotOpen, 0, None)
+		if mtpOp == MTP_OP_CloseSession:
+			self.fSessionOpen = False
+			return (MTP_RESP_Ok, 0, None)
+		if mtpOp == MTP_OP_GetStorageIDs:
+			return (MTP_RESP_Ok, 0, mtpCountedWordList(self.camera.storageIdsList))
+		if mtpOp == MTP_OP_GetStorageInfo:
+			if cmdArgs[0] not in self.camera.storageIdsList:
+				return (MTP_RESP_InvalidStorageID, 0, None)
+			return (MTP_RESP_Ok, 0, self.camera.genStorageInfoData(cmdArgs[0]))
+		if mtpOp == MTP_OP_GetNumObjects:
+			return (MTP_RESP_Ok, len(self.camera.getObjectHandles(cmdArgs[0], cmdArgs[1], cmdArgs[2])), None)
+		if mtpOp == MTP_OP_GetObjectHandles:
+			return (MTP_RESP_Ok, 0, mtpCountedWordList(self.camera.getObjectHandles(cmdArgs[0], cmdArgs[1], cmdArgs[2])))
+		if mtpOp == MTP_OP_GetDevicePropValue:
+			if cmdArgs[0] not in self.camera.profile.devicePropsList:
+				return (MTP_RESP_DevicePropNotSupported, 0, None)
+			return (MTP_RESP_Ok, 0, mtpCountedUtf16Str(self.camera.getDeviceTimeStr()))
+		if mtpOp == MTP_OP_SetDevicePropValue:
+			if cmdArgs[0] not in self.camera.profile.devicePropsList:
+				return (MTP_RESP_DevicePropNotSupported, 0, None)
+			(mtpTimeStr, byteLen) = self.parseCountedUtf16Str(dataFromHost)
+			self.camera.setDeviceTimeStr(mtpTimeStr)
+			return (MTP_RESP_Ok, 0, None)
+		if mtpOp == MTP_OP_Canon_SetDevicePropValue:
+			return (MTP_RESP_Ok, 0, None)
+		if mtpOp == MTP_OP_Sony_Set_Request:
+			if dataFromHost and len(dataFromHost) >= 8 and struct.unpack_from('<I', dataFromHost, 4)[0] == 0x00000005:
+				applog_i("Camera put to sleep by host - refusing any new sessions")
+				self.camera.fAsleep = True
+			return (MTP_RESP_Ok, 0, None)
+		if mtpOp == MTP_OP_Sony_Get_Request:
+			return (MTP_RESP_Ok, 0, None)
+		if mtpOp == MTP_OP_NkonGetEvent:
+			eventsList = self.camera.retrieveNikonEvents()
+			data = struct.pack('<H', len(eventsList)) + six.binary_type().join(struct.pack('<HI', eventCode, eventParameter) for (eventCode, eventParameter) in eventsList)
+			return (MTP_RESP_Ok, 0, data)
+		if mtpOp == MTP_OP_GetTransferList:
+			if not self.camera.transferListHandlesList:
+				return (MTP_RESP_NoTransferList, 0, None)
+			return (MTP_RESP_Ok, 0, mtpCountedWordList(self.camera.transferListHandlesList))
+		if mtpOp == MTP_OP_NotifyFileAcquisitionEnd:
+			with self.camera.lock:
+				if cmdArgs[0] in self.camera.transferListHandlesList:
+					self.camera.transferListHandlesList.remove(cmdArgs[0])
+			return (MTP_RESP_Ok, 0, None)
+		if mtpOp == MTP_OP_NotifyFileAcquisitionStart:
+			return (MTP_RESP_Ok, 0, None)
+
+		# remaining ops are for a specific object
+		obj = self.camera.getObject(cmdArgs[0])
+		if obj == None:
+			return (MTP_RESP_InvalidObjectHandle, 0, None)
+		if mtpOp == MTP_OP_GetObjectInfo:
+			return (MTP_RESP_Ok, 0, self.camera.genObjectInfoData(obj))
+		if obj.isFolder():
+			return (MTP_RESP_InvalidObjectHandle, 0, None)
+		if mtpOp == MTP_OP_GetObject:
+			return (MTP_RESP_Ok, 0, (obj.sizeBytes, self.camera.genObjectData(obj, 0, obj.sizeBytes)))
+		if mtpOp == MTP_OP_GetPartialObject:
+			(offset, count) = (cmdArgs[1], cmdArgs[2])
+			if offset > obj.sizeBytes:
+				return (MTP_RESP_InvalidParameter, 0, None)
+			count = min(count, obj.sizeBytes - offset)
+			return (MTP_RESP_Ok, count, (count, self.camera.genObjectData(obj, offset, count)))
+		if mtpOp == MTP_OP_GetThumb or mtpOp == MTP_OP_GetLargeThumb:
+			thumbSize = MTPSIM_THUMB_SIZE if mtpOp == MTP_OP_GetThumb else MTPSIM_LARGE_THUMB_SIZE
+			return (MTP_RESP_Ok, 0, (thumbSize, self.camera.genObjectData(obj, obj.sizeBytes, thumbSize)))
+		return (MTP_RESP_OperationNotSupported, 0, None)
+
+	@staticmethod
+	def parseCountedUtf16Str(data):
+		if not data or not six.indexbytes(data, 0):
+			return ("", 1)
+		byteLen = six.indexbytes(data, 0)*2
+		return (data[1:1+byteLen-2].decode('utf-16-le'), 1+byteLen)
+
+
+#
+# offset of the transaction ID in the Camera -> Host frames that have one, keyed by payload ID
+#
+MtpSimReplayTransactionIdOffsetDict = {
+	mtpwifi.MTP_TCPIP_PAYLOAD_ID_CmdResponse : 6,
+	mtpwifi.MTP_TCPIP_PAYLOAD_ID_DataStart : 4,
+	mtpwifi.MTP_TCPIP_PAYLOAD_ID_DataPayload : 4,
+	mtpwifi.MTP_TCPIP_PAYLOAD_ID_DataPayloadLast : 4
+}
+
+#
+# returns the offset of the transaction ID in the captured bytes of a Camera -> Host frame, or None
+# if the frame doesn't have one (or not enough of the frame was captured to include it)
+#
+def getReplayFrameTransactionIdOffset(data):
+	if len(data) < 4:
+		return None
+	transactionIdOffset = MtpSimReplayTransactionIdOffsetDict.get(struct.unpack_from('<I', data, 0)[0])
+	if transactionIdOffset == None or len(data) < transactionIdOffset+4:
+		return None
+	return transactionIdOffset
+
+#
+# returns the MTP op of a Host -> Camera frame if it's a command request, otherwise None
+#
+def getReplayRequestMtpOp(data):
+	if len(data) < 14 or struct.unpack_from('<I', data, 0)[0] != mtpwifi.MTP_TCPIP_PAYLOAD_ID_CmdReq:
+		return None
+	return struct.unpack_from('<H', data, 8)[0]
+
+#
+# one exchange of a traced connection - a request the host sent (None for frames the camera
+# sent before the host sent anything) and the records of the frames the camera sent in response
+#
+MtpSimReplayExchange = namedtuple('MtpSimReplayExchange', 'requestRecord responseRecordsList')
+
+#
+# groups the records of a traced connection into MtpSimReplayExchange's, in the order the host
+# sent the requests. the data the host sent for a request is part of that request. the frames
+# the camera sent are assigned to the request with the same transaction ID, which keeps them
+# with the right request when the host had several in flight, and frames without a transaction
+# ID (ex: init acks, events) to the request sent before them
+#
+def groupTraceRecordsIntoExchanges(recordsList):
+	exchangesList = []
+	exchangeByTransactionIdDict = {}
+	for record in recordsList:
+		if record.recType == mtpwifi.TRACE_REC_TX:
+			if len(record.data) < 4:
+				continue
+			(payloadId,) = struct.unpack_from('<I', record.data, 0)
+			if payloadId in (mtpwifi.MTP_TCPIP_PAYLOAD_ID_DataStart, mtpwifi.MTP_TCPIP_PAYLOAD_ID_DataPayload, mtpwifi.MTP_TCPIP_PAYLOAD_ID_DataPayloadLast):
+				continue
+			exchange = MtpSimReplayExchange(record, [])
+			exchangesList.append(exchange)
+			if getReplayRequestMtpOp(record.data) != None:
+				exchangeByTransactionIdDict[struct.unpack_from('<I', record.data, 10)[0]] = exchange
+		elif record.recType == mtpwifi.TRACE_REC_RX or record.recType == mtpwifi.TRACE_REC_RX_ERROR:
+			transactionIdOffset = getReplayFrameTransactionIdOffset(record.data)
+			exchange = None
+			if transactionIdOffset != None:
+				exchange = exchangeByTransactionIdDict.get(struct.unpack_from('<I', record.data, transactionIdOffset)[0])
+			if exchange == None:
+				if not exchangesList:
+					exchangesList.append(MtpSimReplayExchange(None, []))
+				exchange = exchangesList[-1]
+			exchange.responseRecordsList.append(record)
+	return exchangesList
+
+
+#
+# services a connection from the host by replaying the connection at the same index of a
+# trace recorded by mtpwifi.MtpTraceRecorder. each request the host sends is answered with
+# the frames the camera sent for the next request of the same type (MTP op for commands) in
+# the trace, with their transaction IDs changed to the host's. the host doesn't always send
+# the same requests it did when the trace was recorded (ex: it only sets the camera's clock
+# if it's off by enough), so:
+#
+#	- requests in the trace that the host skips over are skipped, with a warning
+#	- reading/setting the clock (MTPSIM_REPLAY_HOST_ONLY_OPS) that isn't next in the
+#	  trace is answered by us rather than skipping ahead to the next such request
+#	- requests that aren't in the rest of the trace are answered by us - successfully for
+#	  the clock, otherwise with MTP_RESP_OperationNotSupported
+#
+# payload data the trace didn't capture (object data of traces without full payloads) is sent
+# as zeros. if the camera connection failed in the trace we close the connection at the same point.
+# 'replaySpeed' of 0 sends frames as fast as possible, otherwise the original gaps between the
+# camera's frames are reproduced, scaled by 1/replaySpeed. the host should be run with
+# --replaymode yes, so that it doesn't use or update the state it keeps for the real camera
+#
+class MtpSimReplayConnection(MtpSimConnection):
+
+	def __init__(self, server, s, addr, traceRecordsList):
+		MtpSimConnection.__init__(self, server, s, addr)
+		self.traceRecordsList = traceRecordsList
+		self.exchangesList = None
+		self.nextExchangeIndex = 0
+		self.timePrevFrameSent = None		# time in trace of the last frame we sent, for --replayspeed
+		self.fWarnedArgsDiffer = False
+
+	def serve(self):
+		try:
+			if self.traceRecordsList == None:
+				applog_i("{:s}: No more connections in trace - closing".format(self.addr))
+				return
+			self.exchangesList = groupTraceRecordsIntoExchanges(self.traceRecordsList)
+			if self.exchangesList and self.exchangesList[0].requestRecord == None:
+				self.txExchangeResponse(self.exchangesList[0], None)
+				self.nextExchangeIndex = 1
+			while True:
+				self.replayRequest(self.rxFrame())
+		except MtpSimConnectionDroppedException as e:
+			applog_v("{:s}: {:s}".format(self.addr, str(e)))
+		except socket.error as e:
+			applog_v("{:s}: Socket error: {:s}".format(self.addr, str(e)))
+		finally:
+			self.s.close()
+			self.server.connectionClosed(self)
+
+	def replayRequest(self, frame):
+		if len(frame) < 4:
+			raise MtpSimConnectionDroppedException("Malformed request from host (0x{:x} bytes)".format(len(frame)))
+		(payloadId,) = struct.unpack_from('<I', frame, 0)
+		if payloadId != mtpwifi.MTP_TCPIP_PAYLOAD_ID_CmdReq:
+			exchange = self.findNextExchange(lambda requestData : requestData[:4] == frame[:4], "request 0x{:x}".format(payloadId), False)
+			if exchange:
+				self.txExchangeResponse(exchange, None)
+			elif payloadId == mtpwifi.MTP_TCPIP_REQ_PROBE:
+				self.txFrame(struct.pack('<I', MTP_TCPIP_RESP_PROBE))
+			else:
+				applog_w("{:s}: Ignoring request 0x{:x} that isn't next in the trace".format(self.addr, payloadId))
+			return
+		if len(frame) < 14:
+			raise MtpSimConnectionDroppedException("Malformed command request from host (0x{:x} bytes)".format(len(frame)))
+		(dataDirection, mtpOp, transactionId) = struct.unpack_from('<IHI', frame, 4)
+		argsData = frame[14:]
+		cmdArgs = struct.unpack('<{:d}I'.format(len(argsData)//4), argsData[:len(argsData)//4*4])
+		dataFromHost = None
+		if dataDirection == mtpwifi.MTP_TCPIP_CmdReq_DataDir_HostToCamera:
+			dataFromHost = self.rxDataFromHost(transactionId)
+		self.server.countOp(mtpOp)
+		exchange = self.findNextExchange(lambda requestData : getReplayRequestMtpOp(requestData) == mtpOp, getMtpOpDesc(mtpOp), mtpOp not in MTPSIM_REPLAY_HOST_ONLY_OPS)
+		if exchange:
+			if exchange.requestRecord.data[14:] != argsData and not self.fWarnedArgsDiffer:
+				# ex: a different get-object transfer size - run the host with the --maxgetobjtransfersizekb the trace was recorded with
+				applog_w("{:s}: Replay diverged from trace - arguments of {:s} differ from the trace, so the responses may not match the requests".format(self.addr, getMtpOpDesc(mtpOp)))
+				self.fWarnedArgsDiffer = True
+			self.txExchangeResponse(exchange, transactionId)
+		else:
+			self.txHostOnlyOpResponse(mtpOp, transactionId, cmdArgs)
+
+	#
+	# returns the next exchange in the trace whose request satisfies 'fMatchesFunc', skipping over
+	# those before it if 'fSkipAhead' (otherwise only the next exchange is considered). returns
+	# None if there's no such exchange, leaving our position in the trace unchanged
+	#
+	def findNextExchange(self, fMatchesFunc, requestDesc, fSkipAhead):
+		lastExchangeIndex = len(self.exchangesList) if fSkipAhead else min(self.nextExchangeIndex+1, len(self.exchangesList))
+		for exchangeIndex in xrange(self.nextExchangeIndex, lastExchangeIndex):
+			if fMatchesFunc(self.exchangesList[exchangeIndex].requestRecord.data):
+				skippedExchangesList = self.exchangesList[self.nextExchangeIndex:exchangeIndex]
+				if skippedExchangesList:
+					# skipping the clock requests of the trace is expected when the host is run with --replaymode yes
+					fOnlyHostOnlyOpsSkipped = all(getReplayRequestMtpOp(skippedExchange.requestRecord.data) in MTPSIM_REPLAY_HOST_ONLY_OPS for skippedExchange in skippedExchangesList)
+					(applog_v if fOnlyHostOnlyOpsSkipped else applog_w)("{:s}: Replay diverged from trace - skipping {:d} request(s) in trace to get to {:s}".format(self.addr,
+						len(skippedExchangesList), requestDesc))
+				self.nextExchangeIndex = exchangeIndex + 1
+				return self.exchangesList[exchangeIndex]
+		applog_v("{:s}: {:s} isn't next in the trace".format(self.addr, requestDesc))
+		return None
+
+	#
+	# sends the frames the camera sent for an exchange, changing their transaction ID
+	# to 'transactionId' if not None
+	#
+	def txExchangeResponse(self, exchange, transactionId):
+		for record in exchange.responseRecordsList:
+			if self.server.replaySpeed and self.timePrevFrameSent != None:
+				time.sleep(max(record.timeSecs - self.timePrevFrameSent, 0) / self.server.replaySpeed)
+			self.timePrevFrameSent = record.timeSecs
+			data = record.data
+			transactionIdOffset = getReplayFrameTransactionIdOffset(data)
+			if transactionId != None and transactionIdOffset != None:
+				data = data[:transactionIdOffset] + struct.pack('<I', transactionId) + data[transactionIdOffset+4:]
+			if record.recType == mtpwifi.TRACE_REC_RX_ERROR:
+				if record.frameLen:
+					self.s.sendall(struct.pack('<I', record.frameLen+4) + data)
+				raise MtpSimConnectionDroppedException("Connection dropped at same point as in trace")
+			self.txTraceFrame(record.frameLen, data)
+
+	def txTraceFrame(self, frameLen, data):
+		self.s.sendall(struct.pack('<I', frameLen+4) + data)
+		bytesLeftToFill = frameLen - len(data)
+		while bytesLeftToFill > 0:
+			chunk = MTPSIM_REPLAY_FILL_CHUNK[:bytesLeftToFill]
+			self.link.throttle(len(chunk))
+			self.s.sendall(chunk)
+			bytesLeftToFill -= len(chunk)
+		self.server.countBytesSent(frameLen)
+
+	#
+	# answers a request that isn't in the trace
+	#
+	def txHostOnlyOpResponse(self, mtpOp, transactionId, cmdArgs):
+		dataToHost = None
+		if mtpOp == MTP_OP_GetDevicePropValue and cmdArgs and cmdArgs[0] == MTP_DeviceProp_DateTime:
+			(mtpRespCode, dataToHost) = (MTP_RESP_Ok, mtpCountedUtf16Str(epochToMtpTimeStr(time.time())))
+		elif mtpOp in MTPSIM_REPLAY_HOST_ONLY_OPS and mtpOp != MTP_OP_GetDevicePropValue:
+			mtpRespCode = MTP_RESP_Ok
+		else:
+			mtpRespCode = MTP_RESP_OperationNotSupported
+		if dataToHost != None:
+			self.txFrame(struct.pack('<IIQ', mtpwifi.MTP_TCPIP_PAYLOAD_ID_DataStart, transactionId, len(dataToHost)))
+			self.txFrame(struct.pack('<II', mtpwifi.MTP_TCPIP_PAYLOAD_ID_DataPayloadLast, transactionId) + dataToHost)
+		self.txFrame(struct.pack('<IHII', mtpwifi.MTP_TCPIP_PAYLOAD_ID_CmdResponse, mtpRespCode, transactionId, 0))
+
+
+#
+# loads a trace for replay, returning a list of the records of each connection in the trace
+#
+def loadTraceForReplay(filename):
+	connRecordsList = []
+	for record in mtpwifi.genMtpTraceRecords(filename):
+		if record.recType == mtpwifi.TRACE_REC_CONNECT:
+			connRecordsList.append([])
+		elif record.connIndex < len(connRecordsList):
+			connRecordsList[record.connIndex].append(record)
+	return connRecordsList
+
+
+#
+# listens for connections from the host, servicing each on its own thread. if 'replayConnRecordsList'
+# is specified then connections replay a trace (see MtpSimReplayConnection) instead of simulating 'camera'
+#
+class MtpSimServer:
+
+	def __init__(self, camera, link, ipAddressStr="127.0.0.1", port=MTPSIM_DEFAULT_PORT, canonPayloadSize=64*1024, replayConnRecordsList=None, replaySpeed=0):
+		self.camera = camera
+		self.link = link
+		self.replayConnRecordsList = replayConnRecordsList
+		self.replaySpeed = replaySpeed
+		self.countConnectionsAccepted = 0
+		self.ipAddressStr = ipAddressStr
+		self.port = port
+		self.canonPayloadSize = canonPayloadSize
+		self.lock = threading.Lock()
+		self.listenSocket = None
+		self.acceptThread = None
+		self.connectionsList = []
+		self.opCountsDict = {}				# number of times each MTP op was executed, keyed by op
+		self.totalBytesSent = 0				# object/thumb data bytes sent
+
+	#
+	# starts listening, returning the port we're listening on (useful when 'port' is 0)
+	#
+	def start(self):
+		self.listenSocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+		self.listenSocket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+		self.listenSocket.bind((self.ipAddressStr, self.port))
+		self.listenSocket.listen(4)
+		self.port = self.listenSocket.getsockname()[1]
+		self.acceptThread = threading.Thread(target=self._acceptThreadMain, name="mtpsim-accept")
+		self.acceptThread.daemon = True
+		self.acceptThread.start()
+		return self.port
+
+	def stop(self):
+		if self.listenSocket:
+			try:
+				self.listenSocket.shutdown(socket.SHUT_RDWR)
+			except socket.error:
+				pass
+			self.listenSocket.close()
+			self.listenSocket = None
+		with self.lock:
+			connectionsList = list(self.connectionsList)
+		for connection in connectionsList:
+			try:
+				connection.s.shutdown(socket.SHUT_RDWR)
+			except socket.error:
+				pass
+		if self.acceptThread:
+			self.acceptThread.join()
+			self.acceptThread = None
+
+	def _acceptThreadMain(self):
+		while True:
+			try:
+				(s, addr) = self.listenSocket.accept()
+			except (socket.error, AttributeError):
+				return # listening socket closed by stop()
+			s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+			addrStr = "{:s}:{:d}".format(addr[0], addr[1])
+			if self.replayConnRecordsList != None:
+				traceRecordsList = self.replayConnRecordsList[self.countConnectionsAccepted] if self.countConnectionsAccepted < len(self.replayConnRecordsList) else None
+				connection = MtpSimReplayConnection(self, s, addrStr, traceRecordsList)
+			else:
+				connection = MtpSimConnection(self, s, addrStr)
+			self.countConnectionsAccepted += 1
+			applog_v("Connection from {:s}".format(connection.addr))
+			with self.lock:
+				self.connectionsList.append(connection)
+			thread = threading.Thread(target=connection.serve, name="mtpsim-conn")
+			thread.daemon = True
+			thread.start()
+
+	def connectionClosed(self, connection):
+		applog_v("Connection from {:s} closed".format(connection.addr))
+		with self.lock:
+			if connection in self.connectionsList:
+				self.connectionsList.remove(connection)
+
+	def countOp(self, mtpOp):
+		with self.lock:
+			self.opCountsDict[mtpOp] = self.opCountsDict.get(mtpOp, 0) + 1
+
+	def countBytesSent(self, numBytes):
+		with self.lock:
+			self.totalBytesSent += numBytes
+
+	def reportStats(self):
+		applog_i("\n{:,} bytes of object data sent".format(self.totalBytesSent))
+		for (mtpOp, count) in sorted(self.opCountsDict.items()):
+			applog_i("  {:s}: {:d}".format(getMtpOpDesc(mtpOp), count))
+
+
+#
+# converts the --oplatencyms "<op name>=<ms>" list into a dictionary of latency seconds keyed by op
+#
+def parseOpLatencyArgs(opLatencyArgsList):
+	opNameToOpDict = dict((desc.upper(), mtpOp) for (mtpOp, desc) in MtpOpDescDictionary.items())
+	opLatencySecsDict = {}
+	for opLatencyArg in opLatencyArgsList or []:
+		(opName, sep, msStr) = opLatencyArg.partition('=')
+		opName = opName.upper()
+		if not opName.startswith("MTP_OP_"):
+			opName = "MTP_OP_" + opName
+		if opName not in opNameToOpDict or not sep:
+			raise ValueError("Invalid --oplatencyms value \"{:s}\". Expected <op>=<ms>, ex: GetObjectInfo=20".format(opLatencyArg))
+		opLatencySecsDict[opNameToOpDict[opName]] = float(msStr) / 1000
+	return opLatencySecsDict
+
+
+def processCmdLine():
+	parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter,
+		description='Simulated MTP/IP camera for testing and benchmarking airmtp',
+		epilog="Example:\n  %(prog)s --make nikon --numfiles 2000 --latencyms 5 --maxratekbsec 4000")
+	parser.add_argument('--make', type=str.lower, choices=sorted(MtpSimCameraProfileDict.keys()), help='Make of camera to simulate. Default is "%(default)s"', default='nikon', required=False)
+	parser.add_argument('--ipaddress', type=str, help='IP address to listen on. Default is "%(default)s"', default='127.0.0.1', metavar="addr", required=False)
+	parser.add_argument('--port', type=int, help='Port to listen on. Default is %(default)s', default=MTPSIM_DEFAULT_PORT, required=False)
+	parser.add_argument('--numcards', type=int, choices=[1, 2], help='Number of media cards. Default is %(default)s', default=1, required=False)
+	parser.add_argument('--numfiles', type=int, help='Number of captures on each card. Each capture has a file for each --extlist extension. Default is %(default)s', default=1000, metavar="count", required=False)
+	parser.add_argument('--filesperfolder', type=int, help='Max files per camera folder. Default is %(default)s', default=999, metavar="count", required=False)
+	parser.add_argument('--filesizekb', type=int, help='Size of each file, in KB. Default is %(default)s', default=8192, metavar="KB", required=False)
+	parser.add_argument('--extlist', help='File extension(s) of each capture. Default is %(default)s', default=['NEF', 'JPG'], nargs='+', metavar='extension', required=False)
+	parser.add_argument('--transferlist', type=int, help='Number of the newest files in the camera\'s transfer list (Nikon). Default is %(default)s', default=0, metavar="count", required=False)
+	parser.add_argument('--latencyms', type=float, help='Delay before responding to each request, in milliseconds. Default is %(default)s', default=0, metavar="ms", required=False)
+	parser.add_argument('--oplatencyms', help='Delay for specific MTP ops, overriding --latencyms. Ex: --oplatencyms GetObjectInfo=20 GetPartialObject=5', default=None, nargs='+', metavar='op=ms', required=False)
+	parser.add_argument('--maxratekbsec', type=int, help='Bandwidth cap shared by all connections, in KB/s. Default is 0 (unlimited)', default=0, metavar="KB/s", required=False)
+	parser.add_argument('--dropprobability', type=float, help='Probability a file data transfer is interrupted by dropping the connection. Default is %(default)s', default=0, metavar="fraction", required=False)
+	parser.add_argument('--mtpipevents', type=str.lower, choices=['no', 'yes'], help='Report new captures with MTP_EVENT_ObjectAdded on the events socket. Default is %(default)s', default='no', required=False)
+	parser.add_argument('--captureintervalsecs', type=float, help='Simulate a new capture every n seconds (for realtime download). Default is 0 (disabled)', default=0, metavar="seconds", required=False)
+	parser.add_argument('--replay', type=str, help='Replay a trace recorded by airmtp\'s --tracefile instead of simulating a camera', default=None, metavar="tracefile", required=False)
+	parser.add_argument('--replayspeed', type=float, help='Speed to replay the trace at relative to the original timing. Default is 0 (as fast as possible)', default=0, metavar="factor", required=False)
+	parser.add_argument('--seed', type=int, help='Seed for generated file data and drops. Default is %(default)s', default=0, required=False)
+	parser.add_argument('--logginglevel', type=str.lower, choices=['normal', 'verbose', 'debug' ], help='Sets how much information is logged. Default is "%(default)s"', default='normal', required=False)
+	parser.add_argument('--canonpayloadkb', help=argparse.SUPPRESS, type=int, default=64, required=False)
+	args = vars(parser.parse_args())
+	try:
+		args['oplatencyms'] = parseOpLatencyArgs(args['oplatencyms'])
+	except ValueError as e:
+		parser.error(str(e))
+	if args['logginglevel'] == 'verbose':
+		applog_set_loggingFlags(APPLOGF_LEVEL_INFORMATIONAL | APPLOGF_LEVEL_ERROR | APPLOGF_LEVEL_WARNING | APPLOGF_LEVEL_VERBOSE)
+	elif args['logginglevel'] == 'debug':
+		applog_set_loggingFlags(APPLOGF_LEVEL_INFORMATIONAL | APPLOGF_LEVEL_ERROR | APPLOGF_LEVEL_WARNING | APPLOGF_LEVEL_VERBOSE | APPLOGF_LEVEL_DEBUG)
+	return args
+
+
+#
+# main app routine
+#
+def main():
+	applog_init(APPLOGF_LEVEL_INFORMATIONAL | APPLOGF_LEVEL_ERROR | APPLOGF_LEVEL_WARNING)
+	applog_i("\nmtpsim v{:s} - Simulated MTP/IP camera [GPL v3]".format(MTPSIM_APP_VERSION))
+	applog_i("Time: {:s}, Py: {:d}.{:d}.{:d}, OS: {:s}\n".format(strutil.getDateTimeStr(fMilitaryTime=True),\
+		sys.version_info.major, sys.version_info.minor, sys.version_info.micro, platform.system()))
+	args = processCmdLine()
+
+	link = MtpSimLink(args['latencyms'] / 1000, args['oplatencyms'], args['maxratekbsec']*1024, args['dropprobability'], args['seed'])
+	if args['replay']:
+		camera = None
+		try:
+			replayConnRecordsList = loadTraceForReplay(args['replay'])
+		except (IOError, mtpwifi.MtpProtocolException) as e:
+			applog_e("Unable to load trace: {:s}".format(str(e)))
+			return errno.EINVAL
+		server = MtpSimServer(None, link, args['ipaddress'], args['port'], replayConnRecordsList=replayConnRecordsList, replaySpeed=args['replayspeed'])
+	else:
+		camera = MtpSimCamera(args['make'], args['numcards'], args['numfiles'], args['filesperfolder'], args['filesizekb']*1024,
+			args['extlist'], args['transferlist'], args['seed'], args['mtpipevents'] == 'yes')
+		server = MtpSimServer(camera, link, args['ipaddress'], args['port'], args['canonpayloadkb']*1024)
+	try:
+		port = server.start()
+	except socket.error as e:
+		applog_e("Unable to listen on {:s}:{:d}: {:s}".format(args['ipaddress'], args['port'], str(e)))
+		return e.errno if e.errno else errno.EADDRINUSE
+	if camera:
+		applog_i("Simulating {:s} \"{:s}\" with {:d} objects on {:d} card(s), listening on {:s}:{:d}".format(camera.profile.manufacturerStr,
+			camera.profile.modelStr, len(camera.objectsList), len(camera.storageIdsList), args['ipaddress'], port))
+	else:
+		applog_i("Replaying {:d} connection(s) from \"{:s}\", listening on {:s}:{:d}".format(len(replayConnRecordsList), args['replay'], args['ipaddress'], port))
+	applog_i("Running - press <ctrl-c> to exit")
+
+	_errno = 0
+	try:
+		timeLastCapture = time.time()
+		while True:
+			time.sleep(0.25)
+			if camera and args['captureintervalsecs'] and time.time() - timeLastCapture >= args['captureintervalsecs']:
+				newObjectsList = camera.simulateCapture()
+				applog_v("Simulated capture: {:s}".format(", ".join(obj.filename for obj in newObjectsList)))
+				timeLastCapture = time.time()
+	except KeyboardInterrupt as e:
+		applog_i("\n>> Terminated by user keypress <<")
+	except:
+		applog_e("An exception occurred. Here is the stack trace information:\n" + traceback.format_exc())
+		_errno = errno.EFAULT
+	server.stop()
+	server.reportStats()
+	applog_shutdown()
+	return _errno
+
+#
+# program entry point
+#
+if __name__ == "__main__":
+	_errno = main()
+	sys.exit(_errno)
@@ -28,15 +28,29 @@ import struct
 import time
 import strutil
 import errno
+import select
+import bisect
+import json
 from applog import *
 from mtpdef import *
 from collections import namedtuple
+from collections import deque
 
 #
 # module constants
 #
 SOCKET_TIMEOUT_CONNECT_SECS_DEFAULT		= 10	# timeout for connect attempts
 SOCKET_TIMEOUT_READS_WRITES_DEFAULT		= 5		# we configure the socket to time out send/receive requests after 5 seconds
+RX_PAYLOAD_BUFFER_SIZE_INITIAL			= 1024*1024+64	# initial size of our reusable receive buffer - enough for a default-sized MTP_OP_GetPartialObject piece plus headers
+RX_PAYLOAD_STREAM_CHUNK_SIZE			= 256*1024		# max data we hold before handing off to a data sink when streaming a payload (see rxPayload)
+OP_STATS_HISTOGRAM_MIN_SECS				= 0.0001		# upper bound of the first bucket of the per-op latency histograms (see MtpOpStatsRegistry)
+OP_STATS_HISTOGRAM_BUCKETS_PER_DOUBLING	= 4				# each histogram bucket is ~19% wider than the one before it
+OP_STATS_HISTOGRAM_NUM_BUCKETS			= 4*22			# last bucket ends at ~420 seconds; anything longer lands in an overflow bucket
+TRACE_FILE_MAGIC						= b'AMTR'
+TRACE_FILE_VERSION						= 1
+TRACE_FILE_HEADER_STRUCT				= struct.Struct('<4sHHd')	# magic, version, flags (TRACE_FILE_FLAG_*), time trace started (epoch)
+TRACE_FILE_FLAG_FULL_PAYLOADS			= 0x0001
+TRACE_RECORD_HEADER_STRUCT				= struct.Struct('<BBIdI')	# record type (TRACE_REC_*), connection index, frame length, secs since trace started, bytes of frame captured
 
 #
 # types of low-level PTP-TCP/IP commands that can be send
@@ -52,6 +66,7 @@ MTP_TCPIP_REQ_PROBE					= 0x0d  # "probe request"
 #
 MTP_TCPIP_PAYLOAD_ID_CmdReq				= 0x06	# "cmd req" is arbtirary name - don't know what undocumented PTP-TCP/IP spec calls it
 MTP_TCPIP_PAYLOAD_ID_CmdResponse		= 0x07	# "cmd response" is arbtirary name - don't know what undocumented PTP-TCP/IP spec calls it
+MTP_TCPIP_PAYLOAD_ID_Event				= 0x08	# event sent by camera on the events socket (see rxEvents)
 MTP_TCPIP_PAYLOAD_ID_DataStart			= 0x09	# "data start" is arbtirary name - don't know what undocumented PTP-TCP/IP spec calls it
 MTP_TCPIP_PAYLOAD_ID_DataPayload		= 0x0a 	# "data payload" is arbtirary name - don't know what undocumented PTP-TCP/IP spec calls it
 MTP_TCPIP_PAYLOAD_ID_DataPayloadLast	= 0x0c	# "data payload last" is arbtirary name - don't know what undocumented PTP-TCP/IP spec calls it
@@ -64,6 +79,11 @@ MTP_TCPIP_CmdReq_DataDir_HostToCamera = 0x2			# data direction is Host -> Camera
 #
 MtpTcpCmdResult = namedtuple('MTPTcpCmdResult', 'mtpRespCode mtpResponseParameter dataReceived')
 
+#
+# structure (named tuple) returned by our rxEvents() method for each event
+#
+MtpTcpEvent = namedtuple('MtpTcpEvent', 'eventCode transactionId params')
+
 #
 # exceptions thrown by our methods. 
 #
@@ -78,17 +98,264 @@ class MtpProtocolException(Exception):
 	def __init__(self, message):
 		Exception.__init__(self, message)
 			
+#
+# protocol error where a camera's frame is for a different transaction than the one we're
+# receiving the response for - the camera has lost track of which request it's responding
+# to, which is how cameras that can't handle pipelined requests misbehave
+#
+class MtpTransactionIdMismatchException(MtpProtocolException):
+	def __init__(self, message):
+		MtpProtocolException.__init__(self, message)
+
 class MtpConnectionFailureException(Exception):
 	def __init__(self, message):
 		Exception.__init__(self, message)
 
 #
-# global data
+# timer used for the per-op latency stats. python 2 doesn't have perf_counter()
+#
+getTimerSecs = time.perf_counter if hasattr(time, 'perf_counter') else time.time
+
+#
+# upper bounds of the latency histogram buckets, in seconds (log scale)
+#
+OpStatsHistogramBucketBounds = [OP_STATS_HISTOGRAM_MIN_SECS * 2 ** (i / OP_STATS_HISTOGRAM_BUCKETS_PER_DOUBLING) for i in six.moves.xrange(OP_STATS_HISTOGRAM_NUM_BUCKETS)]
+
+#
+# histogram of latencies. recording a sample is a bisect plus a few counter updates, so
+# it's cheap enough to do for every MTP op. percentiles are reported as the upper bound
+# of the bucket they fall in (capped at the max sample), so they're accurate to within
+# a bucket's width
+#
+class MtpLatencyHistogram(object):
+
+	def __init__(self):
+		self.bucketCounts = [0] * (OP_STATS_HISTOGRAM_NUM_BUCKETS+1)	# last entry is the overflow bucket
+		self.count = 0
+		self.totalSecs = 0
+		self.minSecs = None
+		self.maxSecs = 0
+
+	def record(self, secs):
+		self.bucketCounts[bisect.bisect_left(OpStatsHistogramBucketBounds, secs)] += 1
+		self.count += 1
+		self.totalSecs += secs
+		if self.minSecs == None or secs < self.minSecs:
+			self.minSecs = secs
+		if secs > self.maxSecs:
+			self.maxSecs = secs
+
+	def getPercentile(self, percentile):
+		if not self.count:
+			return None
+		countNeeded = percentile / 100 * self.count
+		countSoFar = 0
+		for (bucketIndex, bucketCount) in enumerate(self.bucketCounts):
+			countSoFar += bucketCount
+			if countSoFar >= countNeeded and bucketCount:
+				break
+		if bucketIndex == OP_STATS_HISTOGRAM_NUM_BUCKETS:
+			return self.maxSecs
+		return min(OpStatsHistogramBucketBounds[bucketIndex], self.maxSecs)
+
+	def toDict(self):
+		return { 'count' : self.count, 'totalSecs' : self.totalSecs, 'minSecs' : self.minSecs, 'maxSecs' : self.maxSecs,
+			'meanSecs' : self.totalSecs / self.count if self.count else None,
+			'p50Secs' : self.getPercentile(50), 'p90Secs' : self.getPercentile(90), 'p99Secs' : self.getPercentile(99),
+			'buckets' : [[OpStatsHistogramBucketBounds[bucketIndex] if bucketIndex < OP_STATS_HISTOGRAM_NUM_BUCKETS else None, bucketCount]\
+				for (bucketIndex, bucketCount) in enumerate(self.bucketCounts) if bucketCount] }
+
+#
+# stats for one MTP op. the latencies recorded for each successful exchange with the camera are:
+#
+#	timeToFirstByte	- from when the CmdReq was sent until the first payload of the camera's
+#					  reply started arriving (DataStart for ops with Camera->Host data, otherwise
+#					  the CmdResponse). for pipelined ops this includes the time the request
+#					  waited in the camera behind the ones sent before it
+#	transfer		- from the start of the DataStart to the end of the last data payload (only
+#					  for ops with Camera->Host data)
+#	response		- from when the CmdReq was sent until the CmdResponse was received
+#
+class MtpOpStats(object):
+
+	def __init__(self):
+		self.count = 0
+		self.countErrorResponses = 0		# ops the camera completed with a response code other than MTP_RESP_Ok
+		self.countCommErrors = 0			# ops that failed due to socket errors (no latencies recorded)
+		self.bytesReceived = 0
+		self.bytesSent = 0
+		self.timeToFirstByte = MtpLatencyHistogram()
+		self.transfer = MtpLatencyHistogram()
+		self.response = MtpLatencyHistogram()
+
+	def toDict(self):
+		return { 'count' : self.count, 'countErrorResponses' : self.countErrorResponses, 'countCommErrors' : self.countCommErrors,
+			'bytesReceived' : self.bytesReceived, 'bytesSent' : self.bytesSent, 'timeToFirstByte' : self.timeToFirstByte.toDict(),
+			'transfer' : self.transfer.toDict(), 'response' : self.response.toDict() }
+
+#
+# per-op stats for all the MTP ops performed on one or more connections (see MtpOpStats). each
+# connection records into the registry it was opened with, so a registry can accumulate the
+# stats of a camera session across reconnects
+#
+class MtpOpStatsRegistry(object):
+
+	def __init__(self):
+		self.opStatsDict = {}		# MtpOpStats keyed by MTP op
+
+	def getOpStats(self, mtpOp):
+		opStats = self.opStatsDict.get(mtpOp)
+		if opStats == None:
+			opStats = self.opStatsDict[mtpOp] = MtpOpStats()
+		return opStats
+
+	def recordOp(self, mtpOp, mtpRespCode, timeCmdReqSent, timeFirstByte, timeTransferStarted, timeTransferEnded, timeResponseReceived, bytesReceived, bytesSent):
+		opStats = self.getOpStats(mtpOp)
+		opStats.count += 1
+		if mtpRespCode != MTP_RESP_Ok:
+			opStats.countErrorResponses += 1
+		opStats.bytesReceived += bytesReceived
+		opStats.bytesSent += bytesSent
+		if timeCmdReqSent != None:
+			opStats.timeToFirstByte.record(timeFirstByte - timeCmdReqSent)
+			opStats.response.record(timeResponseReceived - timeCmdReqSent)
+		if timeTransferStarted != None and timeTransferEnded != None:
+			opStats.transfer.record(timeTransferEnded - timeTransferStarted)
+
+	def recordCommError(self, mtpOp):
+		opStats = self.getOpStats(mtpOp)
+		opStats.count += 1
+		opStats.countCommErrors += 1
+
+	def isEmpty(self):
+		return not self.opStatsDict
+
+	#
+	# generates a human-readable summary, one line per op. latencies are p50/p90/p99 in milliseconds
+	#
+	def genReportLines(self):
+		def latencyStr(histogram):
+			if not histogram.count:
+				return "-"
+			return "/".join("{:.1f}".format(histogram.getPercentile(percentile)*1000) for percentile in (50, 90, 99))
+		linesList = ["MTP op latencies (p50/p90/p99 ms):"]
+		for (mtpOp, opStats) in sorted(self.opStatsDict.items()):
+			linesList.append("  {:<34s} count={:<7d} errs={:d}/{:d} rx={:,} ttfb={:s} xfer={:s} resp={:s}".format(getMtpOpDesc(mtpOp),
+				opStats.count, opStats.countErrorResponses, opStats.countCommErrors, opStats.bytesReceived,
+				latencyStr(opStats.timeToFirstByte), latencyStr(opStats.transfer), latencyStr(opStats.response)))
+		return linesList
+
+	def toDict(self):
+		return dict((getMtpOpDesc(mtpOp), opStats.toDict()) for (mtpOp, opStats) in self.opStatsDict.items())
+
+	def save(self, filename):
+		with open(filename, "w") as f:
+			json.dump(self.toDict(), f, indent=2, sort_keys=True)
+
+#
+# types of records in a trace file (see MtpTraceRecorder)
+#
+TRACE_REC_CONNECT	= 1		# connection opened
+TRACE_REC_TX		= 2		# frame sent Host -> Camera
+TRACE_REC_RX		= 3		# frame received Camera -> Host
+TRACE_REC_RX_ERROR	= 4		# socket error while receiving a frame. frame length is as indicated by camera (0 if unknown), captured bytes are what we received of its header
+TRACE_REC_CLOSE		= 5		# connection closed
+
+MtpTraceRecord = namedtuple('MtpTraceRecord', 'recType connIndex frameLen timeSecs data')
+
+#
+# MTP ops whose Camera->Host data payloads only have their headers captured, unless full payloads were requested
+#
+MtpTraceObjectDataOps = (MTP_OP_GetObject, MTP_OP_GetPartialObject, MTP_OP_GetThumb, MTP_OP_GetLargeThumb)
+
+#
+# Records the MTP-TCP/IP frames exchanged on one or more connections to a trace file, as
+# an alternative to hexdumps in the debug log - each frame is written as a small fixed
+# header (type, connection, length, timestamp) plus the frame's bytes, without any formatting.
+# Every frame is captured in full except the data payloads of object/thumbnail transfers, which
+# are the bulk of a session and are reduced to their 8-byte header unless 'fFullPayloads' is set. A
+# trace can be replayed back to airmtp by mtpsim.py, acting as the camera (see genMtpTraceRecords)
 #
-gTransferInterruptedBySIGINT = False
-g_PartialRxDataPayloadData = None
-g_PartialRxDataPayloadData_SizeIndicated = None
+class MtpTraceRecorder(object):
+
+	def __init__(self, filename, fFullPayloads=False):
+		self.fFullPayloads = fFullPayloads
+		self.f = open(filename, "wb")
+		self.f.write(TRACE_FILE_HEADER_STRUCT.pack(TRACE_FILE_MAGIC, TRACE_FILE_VERSION, TRACE_FILE_FLAG_FULL_PAYLOADS if fFullPayloads else 0, time.time()))
+		self.timeStarted = getTimerSecs()
+		self.countConnections = 0
+		self.objectDataTransactionsSet = set()		# (connection index, transaction ID) of object data ops in flight
+
+	def _writeRecord(self, recType, conn, frameLen, data):
+		self.f.write(TRACE_RECORD_HEADER_STRUCT.pack(recType, conn.traceConnIndex, frameLen, getTimerSecs() - self.timeStarted, len(data)))
+		self.f.write(data)
 
+	def registerConnection(self, conn):
+		conn.traceConnIndex = self.countConnections
+		self.countConnections += 1
+		self._writeRecord(TRACE_REC_CONNECT, conn, 0, b'')
+
+	def recordTx(self, conn, frame):
+		if len(frame) >= 14:
+			(payloadId, mtpOp, transactionId) = struct.unpack_from('<I4xHI', frame, 0)
+			if payloadId == MTP_TCPIP_PAYLOAD_ID_CmdReq and mtpOp in MtpTraceObjectDataOps:
+				self.objectDataTransactionsSet.add((conn.traceConnIndex, transactionId))
+		self._writeRecord(TRACE_REC_TX, conn, len(frame), frame)
+
+	#
+	# records a received frame. 'frameView' is the frame as held in the receive buffer. if the frame
+	# was streamed to a data sink (see rxPayload) then the buffer only holds its header plus the
+	# last chunk, and 'streamedData' (only maintained for full-payload traces) holds the chunks before it
+	#
+	def recordRx(self, conn, frameLen, frameView, streamedData=None):
+		fHeaderOnly = False
+		if len(frameView) >= 8:
+			(payloadId, transactionId) = struct.unpack_from('<II', frameView, 0)
+			if payloadId == MTP_TCPIP_PAYLOAD_ID_CmdResponse:
+				(transactionId,) = struct.unpack_from('<I', frameView, 6)
+				self.objectDataTransactionsSet.discard((conn.traceConnIndex, transactionId))
+			elif not self.fFullPayloads and (payloadId == MTP_TCPIP_PAYLOAD_ID_DataPayload or payloadId == MTP_TCPIP_PAYLOAD_ID_DataPayloadLast):
+				fHeaderOnly = (conn.traceConnIndex, transactionId) in self.objectDataTransactionsSet or len(frameView) < frameLen
+		if fHeaderOnly:
+			data = frameView[:8].tobytes()
+		elif streamedData:
+			data = frameView[:8].tobytes() + six.binary_type(streamedData) + frameView[8:].tobytes()
+		else:
+			data = frameView.tobytes()
+		self._writeRecord(TRACE_REC_RX, conn, frameLen, data)
+
+	def recordRxError(self, conn, frameLen, headerData):
+		self._writeRecord(TRACE_REC_RX_ERROR, conn, frameLen, headerData)
+
+	def recordClose(self, conn):
+		self._writeRecord(TRACE_REC_CLOSE, conn, 0, b'')
+
+	def close(self):
+		if self.f:
+			self.f.close()
+			self.f = None
+
+#
+# generator that reads a trace file written by MtpTraceRecorder, yielding an MtpTraceRecord
+# for each record. raises MtpProtocolException if the file isn't a trace file
+#
+def genMtpTraceRecords(filename):
+	with open(filename, "rb") as f:
+		fileHeader = f.read(TRACE_FILE_HEADER_STRUCT.size)
+		if len(fileHeader) < TRACE_FILE_HEADER_STRUCT.size:
+			raise MtpProtocolException("\"{:s}\" is not an MTP trace file".format(filename))
+		(magic, version, flags, timeStartedEpoch) = TRACE_FILE_HEADER_STRUCT.unpack(fileHeader)
+		if magic != TRACE_FILE_MAGIC or version != TRACE_FILE_VERSION:
+			raise MtpProtocolException("\"{:s}\" is not an MTP trace file or is from an unsupported version".format(filename))
+		while True:
+			recordHeader = f.read(TRACE_RECORD_HEADER_STRUCT.size)
+			if len(recordHeader) < TRACE_RECORD_HEADER_STRUCT.size:
+				return # end of trace (a trace cut short by a crash simply ends at its last complete record)
+			(recType, connIndex, frameLen, timeSecs, capturedLen) = TRACE_RECORD_HEADER_STRUCT.unpack(recordHeader)
+			data = f.read(capturedLen)
+			if len(data) < capturedLen:
+				return
+			yield MtpTraceRecord(recType, connIndex, frameLen, timeSecs, data)
 
 #
 # Iterator that generates a transaction ID for MTP-TCP/IP requests,
@@ -99,68 +366,185 @@ def transactionIdCounter():
 	while True:
 		k += 1
 		yield k
-generateTransactionId = transactionIdCounter()
 
 #
-# Transmits data over MTP-TCP/IP socket
+# A TCP/IP connection to the camera, returned by openConnection(). It owns the socket
+# plus all the protocol state that goes with it - the transaction ID counter, the reusable
+# receive buffer and the partial-payload data we save off when a receive fails - so that
+# separate connections (ex: to different cameras from different threads) don't share any
+# state. The module-level functions below all take an MtpConnection as their first
+# argument; the methods here are convenience wrappers around the most commonly used ones
 #
-def txdata(s, data):
+class MtpConnection(object):
+
+	def __init__(self, s, opStatsRegistry=None, traceRecorder=None):
+		self.s = s											# the connected socket
+		self.traceRecorder = traceRecorder					# MtpTraceRecorder the frames on this connection are recorded to, if any
+		self.traceConnIndex = None							# index of this connection in the trace (set by MtpTraceRecorder.registerConnection)
+		self.generateTransactionId = transactionIdCounter()
+		self.opStats = opStatsRegistry if opStatsRegistry != None else MtpOpStatsRegistry()
+		self.cmdReqInFlightDict = {}						# (time CmdReq was sent, Host->Camera data bytes) of each request awaiting its response, keyed by transaction ID
+		self.timeLastPayloadStarted = None					# time the first bytes of the last payload received arrived (see rxPayload)
+		if traceRecorder:
+			traceRecorder.registerConnection(self)
+		self.fTransferInterruptedBySIGINT = False			# a transfer was interrupted, leaving the session in an unknown state
+		self.partialRxDataPayloadData = None				# data payload received before a socket error (see rxPayload)
+		self.partialRxDataPayloadData_SizeIndicated = None	# size of the payload 'partialRxDataPayloadData' is from, as indicated by the camera
+		self.rxPayloadBuffer = bytearray(RX_PAYLOAD_BUFFER_SIZE_INITIAL)
+		self.rxPayloadBytesSentToSink = 0					# data bytes of last payload handed to the data sink (see rxPayload)
+		self.pendingEventsList = []							# events received while waiting for a probe response, returned by next rxEvents()
+
+	def close(self):
+		if self.s:
+			self.s.close()
+			self.s = None
+			if self.traceRecorder:
+				self.traceRecorder.recordClose(self)
+
+	def execMtpOp(self, mtpOp, cmdArgsPacked=six.binary_type(), dataToSend=six.binary_type(), rxTxProgressFunc=None, dataSinkFunc=None):
+		return execMtpOp(self, mtpOp, cmdArgsPacked, dataToSend, rxTxProgressFunc, dataSinkFunc)
+
+	def execMtpOpPipelined(self, mtpOp, cmdArgsPackedIter, pipelineDepth, rxTxProgressFunc=None, dataSinkFunc=None):
+		return execMtpOpPipelined(self, mtpOp, cmdArgsPackedIter, pipelineDepth, rxTxProgressFunc, dataSinkFunc)
+
+#
+# Transmits data over MTP-TCP/IP connection
+#
+def txdata(conn, data):
 	if isDebugLog():
 		applog_d(strutil.hexdump(data[:min(len(data),1024)]))
-	s.send(struct.pack('<I',len(data)+4)+data)
+	if conn.traceRecorder:
+		conn.traceRecorder.recordTx(conn, data)
+	conn.s.send(struct.pack('<I',len(data)+4)+data)
 	
 #
-# Receives a payload over a MTP-TCP/IP socket
+# returns the connection's reusable receive buffer, growing it if necessary so that
+# it can hold at least 'sizeBytes'. note that we allocate a new buffer rather than
+# resizing the existing one in place - any memoryview a caller is still holding
+# on the previous buffer keeps that buffer alive (and a bytearray can't be resized
+# while it has exported views anyway)
 #
-def rxPayload(s, rxProgressFunc=None):
+def getRxPayloadBuffer(conn, sizeBytes):
+	if len(conn.rxPayloadBuffer) < sizeBytes:
+		conn.rxPayloadBuffer = bytearray(max(sizeBytes, len(conn.rxPayloadBuffer)*2))
+	return conn.rxPayloadBuffer
 
-	global g_PartialRxDataPayloadData, g_PartialRxDataPayloadData_SizeIndicated
+#
+# Receives a payload over a MTP-TCP/IP connection. The payload is received via recv_into()
+# directly into a reusable buffer sized from the 4-byte length preamble, avoiding the
+# quadratic cost of building the payload by repeated bytes concatenation. The return
+# value is a memoryview into that buffer [not including the 4-byte size preamble] -
+# it is only valid until the next call to rxPayload(), so callers must copy out
+# whatever they need to keep.
+#
+# If 'dataSinkFunc' is specified then a data payload for 'dataSinkTransactionId' is
+# streamed to the sink in chunks of up to RX_PAYLOAD_STREAM_CHUNK_SIZE bytes as they
+# arrive rather than being held in the buffer in its entirety. In that case only the
+# 8-byte payload header is returned and the number of data bytes handed to the sink
+# is left in conn.rxPayloadBytesSentToSink. Payloads of any other type (or for a different
+# transaction ID, which the caller will reject) are received normally
+#
+def rxPayload(conn, rxProgressFunc=None, dataSinkFunc=None, dataSinkTransactionId=None):
 
 	totalPayloadBytes = 0			# need to initialize here in case exception occurs before var is set
 	payloadBytesReceived = 0		# need to initialize here in case exception occurs before var is set
+	bufferBytes = 0					# bytes of the payload currently held in our buffer (ie, not yet handed to the sink)
 	payloadId = None
-	data = six.binary_type()
-	g_PartialRxDataPayloadData = None
-	g_PartialRxDataPayloadData_SizeIndicated = 0
+	dataView = None
+	fStreamingToSink = False
+	traceStreamedData = None		# data streamed to the sink, kept only for full-payload traces (see MtpTraceRecorder.recordRx)
+	conn.partialRxDataPayloadData = None
+	conn.partialRxDataPayloadData_SizeIndicated = 0
+	conn.rxPayloadBytesSentToSink = 0
 	try:
 	
 		# transmitter first sends word indicating size of payload to follow
-		dataPreamble = s.recv(4)
+		dataPreamble = conn.s.recv(4)
 		if len(dataPreamble) < 4:
 			raise socket.error(errno.EBADF, "TCP/IP error receiving data - received insufficient payload preamble bytes (exp=4, got=0x{:x})".format(len(dataPreamble)))
+		conn.timeLastPayloadStarted = getTimerSecs()
 		(totalBytesIncludingPreamble,) = struct.unpack('<I', dataPreamble)
 		totalPayloadBytes = totalBytesIncludingPreamble-4
+		if totalPayloadBytes < 4:
+			raise MtpProtocolException("Camera Protocol Error: Payload too short to hold a payload ID (length=0x{:x})".format(totalBytesIncludingPreamble))
 
-		# receive the payload
-		while (payloadBytesReceived < totalPayloadBytes):		
-			data += s.recv(totalPayloadBytes - payloadBytesReceived)
-			if not payloadId and len(data) >= 4:
+		#
+		# receive the payload. when a sink was specified we start with a buffer only large enough
+		# for the header plus one chunk, growing it to the full payload size if it turns out the
+		# payload isn't one we'll be streaming
+		#
+		if dataSinkFunc:
+			bufferSize = min(totalPayloadBytes, 8 + RX_PAYLOAD_STREAM_CHUNK_SIZE)
+		else:
+			bufferSize = totalPayloadBytes
+		dataView = memoryview(getRxPayloadBuffer(conn, bufferSize))[:bufferSize]
+		while (payloadBytesReceived < totalPayloadBytes):
+			if bufferBytes == len(dataView):
+				# buffer is full, which only happens when streaming. hand off the data to the sink and reuse the area after the header
+				if conn.traceRecorder and conn.traceRecorder.fFullPayloads:
+					if traceStreamedData == None:
+						traceStreamedData = bytearray()
+					traceStreamedData += dataView[8:bufferBytes]
+				dataSinkFunc(dataView[8:bufferBytes])
+				conn.rxPayloadBytesSentToSink += bufferBytes - 8
+				bufferBytes = 8
+			bytesToReceive = min(len(dataView)-bufferBytes, totalPayloadBytes-payloadBytesReceived)
+			bytesReceivedThisCall = conn.s.recv_into(dataView[bufferBytes:bufferBytes+bytesToReceive])
+			if bytesReceivedThisCall == 0:
+				raise socket.error(errno.ECONNRESET, "TCP/IP error receiving data - connection closed by camera (exp=0x{:x}, got=0x{:x})".format(totalPayloadBytes, payloadBytesReceived))
+			payloadBytesReceived += bytesReceivedThisCall
+			bufferBytes += bytesReceivedThisCall
+			if not payloadId and payloadBytesReceived >= 4:
 				# if we have not received the payload ID and we have at least 4 bytes of data (first four bytes has payload ID)
-				(payloadId,) = struct.unpack('<I', data[0:4])
-			payloadBytesReceived = len(data)
+				(payloadId,) = struct.unpack_from('<I', dataView, 0)
+			if dataSinkFunc and not fStreamingToSink and payloadBytesReceived >= 8:
+				(rxTransactionId,) = struct.unpack_from('<I', dataView, 4)
+				if (payloadId == MTP_TCPIP_PAYLOAD_ID_DataPayload or payloadId == MTP_TCPIP_PAYLOAD_ID_DataPayloadLast) and rxTransactionId == dataSinkTransactionId:
+					fStreamingToSink = True
+				else:
+					# not a payload we're streaming - switch to receiving the full payload into the buffer
+					dataSinkFunc = None
+					if len(dataView) < totalPayloadBytes:
+						fullView = memoryview(getRxPayloadBuffer(conn, totalPayloadBytes))[:totalPayloadBytes]
+						fullView[:bufferBytes] = dataView[:bufferBytes]
+						dataView = fullView
 			if rxProgressFunc and payloadBytesReceived >= 8 and (payloadId == MTP_TCPIP_PAYLOAD_ID_DataPayload or payloadId == MTP_TCPIP_PAYLOAD_ID_DataPayloadLast):
 				rxProgressFunc(payloadBytesReceived - 8) # -8 to exclude header data from count
+
+		if conn.traceRecorder:
+			conn.traceRecorder.recordRx(conn, totalPayloadBytes, dataView[:bufferBytes], traceStreamedData)
+
+		if fStreamingToSink:
+			# hand off the final chunk and return just the header
+			if bufferBytes > 8:
+				dataSinkFunc(dataView[8:bufferBytes])
+				conn.rxPayloadBytesSentToSink += bufferBytes - 8
+			return dataView[:8]
 				
 		# return the data received [not including 4-byte size preamble]
-		return data
+		return dataView[:bufferBytes]
 	except socket.error as error:
-		if payloadBytesReceived and (payloadId == MTP_TCPIP_PAYLOAD_ID_DataPayload or payloadId == MTP_TCPIP_PAYLOAD_ID_DataPayloadLast) and\
-		  payloadBytesReceived >= 12:
+		if conn.traceRecorder:
+			conn.traceRecorder.recordRxError(conn, totalPayloadBytes, dataView[:min(bufferBytes, 8)].tobytes() if dataView != None else b'')
+		if bufferBytes and (payloadId == MTP_TCPIP_PAYLOAD_ID_DataPayload or payloadId == MTP_TCPIP_PAYLOAD_ID_DataPayloadLast) and\
+		  bufferBytes >= 12:
 			#
 			# if this is a data payload and we received at least 12 bytes of data (8 bytes of header data, so at least 4 bytes of actual data),
-			# save it to off to support retry invocation logic (use MTP_OP_GetPartialObject for future retry)
+			# save it to off to support retry invocation logic (use MTP_OP_GetPartialObject for future retry). this is
+			# the only path where we copy out of the reusable receive buffer. when streaming this only includes
+			# the data not already handed off to the sink, and the indicated size is adjusted to match
 			#
-			g_PartialRxDataPayloadData = data
-			g_PartialRxDataPayloadData_SizeIndicated = totalPayloadBytes
+			conn.partialRxDataPayloadData = dataView[:bufferBytes].tobytes()
+			conn.partialRxDataPayloadData_SizeIndicated = totalPayloadBytes - conn.rxPayloadBytesSentToSink
 		raise # let upper levels print out contents of actual socket.error exception
 
 		
 #
 # Transmits request and receives response payload(s)
 #
-def txrxdata(s, data):
-	txdata(s, data)
-	return rxPayload(s)
+def txrxdata(conn, data):
+	txdata(conn, data)
+	return rxPayload(conn)
 	
 
 #
@@ -217,41 +601,82 @@ def execMtpOp_rxPayloadProgressFunc(totalBytesReceivedThisPayload, rxTxProgressF
 		rxTxProgressFunc(countBytesReceivedAcrossAllPayloads + totalBytesReceivedThisPayload,
 			totalDataTransferSizeBytesExpectedAcrossAllPayloads)
 
-def execMtpOp(s, mtpOp, cmdArgsPacked=six.binary_type(), dataToSend=six.binary_type(), rxTxProgressFunc=None):
+#
+# If 'dataSinkFunc' is specified then Camera->Host data is streamed to it as it arrives (see rxPayload)
+# instead of being accumulated and returned in MtpTcpCmdResult.dataReceived, which will be empty. The
+# sink is called with memoryviews that are only valid for the duration of the call. If a communication
+# error occurs the MtpOpExecFailureException.partialData will contain only the data received but not
+# yet handed to the sink, so that callers can process it the same way as the non-streaming case
+#
+def execMtpOp(conn, mtpOp, cmdArgsPacked=six.binary_type(), dataToSend=six.binary_type(), rxTxProgressFunc=None, dataSinkFunc=None):
+	txTransactionId = execMtpOp_txCmdReq(conn, mtpOp, cmdArgsPacked, dataToSend)
+	return execMtpOp_rxResponse(conn, mtpOp, txTransactionId, rxTxProgressFunc, dataSinkFunc)
 
-	mtpDataDirToCmdReqDataDirectionCode={
-		MTP_DATA_DIRECTION_NONE : MTP_TCPIP_CmdReq_DataDir_CameraToHost_or_None,
-		MTP_DATA_DIRECTION_CAMERA_TO_HOST : MTP_TCPIP_CmdReq_DataDir_CameraToHost_or_None,
-		MTP_DATA_DIRECTION_HOST_TO_CAMERA : MTP_TCPIP_CmdReq_DataDir_HostToCamera,
-	}
-	
-	global gTransferInterruptedBySIGINT
-	if gTransferInterruptedBySIGINT:
+#
+# raises an exception if a previous transfer was interrupted, leaving the session in an unknown state
+#
+def execMtpOp_checkSessionState(conn):
+	if conn.fTransferInterruptedBySIGINT:
 		#
 		# if a previous invocation was interrupted we can't perform any more requests during
 		# this session because the camera may still be sending us data from the interrupt request
 		#
 		raise MtpProtocolException("Previous transfer interrupted - session in unknown state")
 
-	dataReceivedSoFar = six.binary_type()
+#
+# first half of execMtpOp() - sends the command request (and for Host->Camera ops the
+# data) for an MTP op. returns the transaction ID of the request, which is passed to
+# execMtpOp_rxResponse() to process the camera's response
+#
+def execMtpOp_txCmdReq(conn, mtpOp, cmdArgsPacked=six.binary_type(), dataToSend=six.binary_type()):
+
+	mtpDataDirToCmdReqDataDirectionCode={
+		MTP_DATA_DIRECTION_NONE : MTP_TCPIP_CmdReq_DataDir_CameraToHost_or_None,
+		MTP_DATA_DIRECTION_CAMERA_TO_HOST : MTP_TCPIP_CmdReq_DataDir_CameraToHost_or_None,
+		MTP_DATA_DIRECTION_HOST_TO_CAMERA : MTP_TCPIP_CmdReq_DataDir_HostToCamera,
+	}
+	
+	execMtpOp_checkSessionState(conn)
 	dataDirection = getMtpOpDataDirection(mtpOp)
 
 	#
 	# send the MTP op command request
 	#
-	txTransactionId = next(generateTransactionId) # transaction ID, increments by 1 for each transaction
+	txTransactionId = next(conn.generateTransactionId) # transaction ID, increments by 1 for each transaction
 	theCmdReq = struct.pack('<IIHI', MTP_TCPIP_PAYLOAD_ID_CmdReq, mtpDataDirToCmdReqDataDirectionCode[dataDirection], mtpOp, txTransactionId) + cmdArgsPacked
 	applog_d("execMtpOp: {:s} - CmdReq payload:".format(getMtpOpDesc(mtpOp)))
-	txdata(s, theCmdReq)
+	txdata(conn, theCmdReq)
+	timeCmdReqSent = getTimerSecs()
 	
 	#
 	# if this MTP op has Host -> Camera data ,send it now
 	#
 	if dataDirection == MTP_DATA_DIRECTION_HOST_TO_CAMERA:
 		applog_d("execMtpOp: Sending MTP_TCPIP_PAYLOAD_ID_DataStart")
-		txdata(s, struct.pack('<IIII', MTP_TCPIP_PAYLOAD_ID_DataStart, txTransactionId, len(dataToSend), 0))
+		txdata(conn, struct.pack('<IIII', MTP_TCPIP_PAYLOAD_ID_DataStart, txTransactionId, len(dataToSend), 0))
 		applog_d("execMtpOp: Sending MTP_TCPIP_PAYLOAD_ID_DataPayloadLast:")
-		txdata(s, struct.pack('<II', MTP_TCPIP_PAYLOAD_ID_DataPayloadLast, txTransactionId) + dataToSend)
+		txdata(conn, struct.pack('<II', MTP_TCPIP_PAYLOAD_ID_DataPayloadLast, txTransactionId) + dataToSend)
+		conn.cmdReqInFlightDict[txTransactionId] = (timeCmdReqSent, len(dataToSend))
+	else:
+		conn.cmdReqInFlightDict[txTransactionId] = (timeCmdReqSent, 0)
+
+	return txTransactionId
+
+#
+# second half of execMtpOp() - receives the camera's data payloads (if any) and the
+# command response for the request sent via execMtpOp_txCmdReq()
+#
+def execMtpOp_rxResponse(conn, mtpOp, txTransactionId, rxTxProgressFunc=None, dataSinkFunc=None):
+
+	execMtpOp_checkSessionState(conn)
+
+	(timeCmdReqSent, bytesSent) = conn.cmdReqInFlightDict.pop(txTransactionId, (None, 0))
+	timeFirstByte = None			# for op latency stats - see MtpOpStats
+	timeTransferStarted = None
+	timeTransferEnded = None
+	dataReceivedSoFar = bytearray() # appended to directly from rxPayload()'s memoryview, avoiding an intermediate copy per payload
+	countDataBytesReceived = 0		# data bytes received across all payloads, including any streamed to dataSinkFunc
+	dataDirection = getMtpOpDataDirection(mtpOp)
 			
 	#
 	# loop, processing inbound data payloads (MTP_DATA_DIRECTION_CAMERA_TO_HOST) and
@@ -262,9 +687,11 @@ def execMtpOp(s, mtpOp, cmdArgsPacked=six.binary_type(), dataToSend=six.binary_t
 	
 		try:
 	
-			data = rxPayload(s, lambda totalBytesReceivedThisPayload : execMtpOp_rxPayloadProgressFunc(totalBytesReceivedThisPayload, 
-				rxTxProgressFunc, len(dataReceivedSoFar), totalDataTransferSizeBytesExpectedAcrossAllPayloads))
-			(payloadId,) = struct.unpack('<I', data[0:4])
+			data = rxPayload(conn, lambda totalBytesReceivedThisPayload : execMtpOp_rxPayloadProgressFunc(totalBytesReceivedThisPayload, 
+				rxTxProgressFunc, countDataBytesReceived, totalDataTransferSizeBytesExpectedAcrossAllPayloads), dataSinkFunc, txTransactionId)
+			(payloadId,) = struct.unpack_from('<I', data, 0)
+			if timeFirstByte == None:
+				timeFirstByte = conn.timeLastPayloadStarted
 			
 			if payloadId == MTP_TCPIP_PAYLOAD_ID_DataStart:
 			
@@ -273,16 +700,17 @@ def execMtpOp(s, mtpOp, cmdArgsPacked=six.binary_type(), dataToSend=six.binary_t
 						format(getMtpOpDesc(mtpOp)))
 			
 				# process MTP_TCPIP_PAYLOAD_ID_DataStart
-				(rxTransactionId,) = struct.unpack('<I', data[4:8])
+				(rxTransactionId,) = struct.unpack_from('<I', data, 4)
 				if rxTransactionId != txTransactionId:
-					raise MtpProtocolException("Camera Protocol Error: {:s}: Incorrect transaction ID for MTP_TCPIP_PAYLOAD_ID_DataStart (exp={:08x}, got={:08x})".\
+					raise MtpTransactionIdMismatchException("Camera Protocol Error: {:s}: Incorrect transaction ID for MTP_TCPIP_PAYLOAD_ID_DataStart (exp={:08x}, got={:08x})".\
 						format(getMtpOpDesc(mtpOp), txTransactionId, rxTransactionId))
-				(totalDataTransferSizeBytesExpectedAcrossAllPayloads,) = struct.unpack('<I', data[8:12])				
+				(totalDataTransferSizeBytesExpectedAcrossAllPayloads,) = struct.unpack_from('<I', data, 8)				
+				timeTransferStarted = conn.timeLastPayloadStarted
 				
 				# debug dump of DataStart payload
 				if isDebugLog():
 					applog_d("execMtpOp: {:s} - DataStart payload [expected data bytes is 0x{:x}]".format(getMtpOpDesc(mtpOp), totalDataTransferSizeBytesExpectedAcrossAllPayloads))
-					applog_d(strutil.hexdump(data))	
+					applog_d(strutil.hexdump(data.tobytes()))	
 
 			elif payloadId == MTP_TCPIP_PAYLOAD_ID_DataPayload or payloadId == MTP_TCPIP_PAYLOAD_ID_DataPayloadLast:
 
@@ -292,31 +720,40 @@ def execMtpOp(s, mtpOp, cmdArgsPacked=six.binary_type(), dataToSend=six.binary_t
 					else:
 						maxBytesToDump = 4096
 					applog_d("execMtpOp: {:s} - Data payload [ID {:x}] (0x{:08x} bytes):".format(getMtpOpDesc(mtpOp), payloadId, len(data)))
-					applog_d(strutil.hexdump(data[:min(len(data), maxBytesToDump)]))
+					applog_d(strutil.hexdump(data[:min(len(data), maxBytesToDump)].tobytes()))
 
-				(rxTransactionId,) = struct.unpack('<I', data[4:8])
+				(rxTransactionId,) = struct.unpack_from('<I', data, 4)
 				if rxTransactionId != txTransactionId:
-					raise MtpProtocolException("Camera Protocol Error: {:s}: Incorrect transaction ID for data payload (exp={:08x}, got={:08x})".format(\
+					raise MtpTransactionIdMismatchException("Camera Protocol Error: {:s}: Incorrect transaction ID for data payload (exp={:08x}, got={:08x})".format(\
 						getMtpOpDesc(mtpOp), txTransactionId, rxTransactionId))				
 				
-				dataReceivedSoFar += data[8:]				
+				if dataSinkFunc:
+					# payload data was already streamed to the sink by rxPayload()
+					countDataBytesReceived += conn.rxPayloadBytesSentToSink
+				else:
+					dataReceivedSoFar += data[8:] # memoryview slice - no copy until it lands in dataReceivedSoFar
+					countDataBytesReceived += len(data)-8
+				timeTransferEnded = getTimerSecs()
 					
 			elif payloadId == MTP_TCPIP_PAYLOAD_ID_CmdResponse:
 					
-				(mtpRespCode, rxTransactionId) = struct.unpack('<HI', data[4:10])
+				(mtpRespCode, rxTransactionId) = struct.unpack_from('<HI', data, 4)
 				if rxTransactionId != txTransactionId:
-					raise MtpProtocolException("Camera Protocol Error: {:s}: Incorrect transaction ID for MTP_TCPIP_PAYLOAD_ID_CmdResponse (exp={:08x}, got={:08x})".\
+					raise MtpTransactionIdMismatchException("Camera Protocol Error: {:s}: Incorrect transaction ID for MTP_TCPIP_PAYLOAD_ID_CmdResponse (exp={:08x}, got={:08x})".\
 						format(getMtpOpDesc(mtpOp), txTransactionId, rxTransactionId))
 
 				if len(data)>=14:				
-					(mtpResponseParameter,)=struct.unpack('<I', data[10:14])
+					(mtpResponseParameter,)=struct.unpack_from('<I', data, 10)
 				else:
 					mtpResponseParameter = None
+
+				conn.opStats.recordOp(mtpOp, mtpRespCode, timeCmdReqSent, timeFirstByte, timeTransferStarted, timeTransferEnded, getTimerSecs(),
+					countDataBytesReceived, bytesSent)
 					
 				# debug dump of CmdResonse payload
 				if isDebugLog():
 					applog_d("execMtpOp: {:s} - CmdResponse payload (resp=\"{:s}\"):".format(getMtpOpDesc(mtpOp), getMtpRespDesc(mtpRespCode)))
-					applog_d(strutil.hexdump(data))
+					applog_d(strutil.hexdump(data.tobytes()))
 				
 				if mtpRespCode != MTP_RESP_Ok:
 					raise MtpOpExecFailureException(mtpRespCode, "Camera Command Failed: {:s}, Error: {:s}".format(getMtpOpDesc(mtpOp), getMtpRespDesc(mtpRespCode)))
@@ -326,66 +763,141 @@ def execMtpOp(s, mtpOp, cmdArgsPacked=six.binary_type(), dataToSend=six.binary_t
 				# completions we want to report that high-level error code rather than an underrun, since an underrun
 				# is theoretically possible if the camera decided to stop transferrring data and send a response frame
 				#
-				if totalDataTransferSizeBytesExpectedAcrossAllPayloads and len(dataReceivedSoFar) < totalDataTransferSizeBytesExpectedAcrossAllPayloads:
+				if totalDataTransferSizeBytesExpectedAcrossAllPayloads and countDataBytesReceived < totalDataTransferSizeBytesExpectedAcrossAllPayloads:
 					raise MtpProtocolException("Camera Protocol Error: {:s}: Data underrun (exp=0x{:08x}, got=0x{:08x})".format(\
-						getMtpOpDesc(mtpOp), totalDataTransferSizeBytesExpectedAcrossAllPayloads, len(dataReceivedSoFar[8:])))											
+						getMtpOpDesc(mtpOp), totalDataTransferSizeBytesExpectedAcrossAllPayloads, countDataBytesReceived))											
 					
-				return MtpTcpCmdResult(mtpRespCode, mtpResponseParameter, dataReceivedSoFar)
+				return MtpTcpCmdResult(mtpRespCode, mtpResponseParameter, six.binary_type(dataReceivedSoFar))
 				
 			else:
 				if isDebugLog():
 					applog_d("Unrecognized payload ID 0x{:x}. Data received:".format(payloadId))
-					applog_d(strutil.hexdump(data))				
+					applog_d(strutil.hexdump(data.tobytes()))				
 				raise MtpProtocolException("Camera Networking Error: {:s}: Unrecognized payload ID (0x{:08x})".format(getMtpOpDesc(mtpOp), payloadId))
 
 		except (socket.error) as e:
+				conn.opStats.recordCommError(mtpOp)
 				# we received at least some data payload data before the error
-				if g_PartialRxDataPayloadData:
-					data = g_PartialRxDataPayloadData
+				if conn.partialRxDataPayloadData:
+					data = conn.partialRxDataPayloadData
 					if isDebugLog():
 						applog_d("execMtpOp: {:s} - Partial payload after error (0x{:08x} bytes):".format(getMtpOpDesc(mtpOp), len(data)))
 						applog_d(strutil.hexdump(data[:min(len(data),1024)]))
 					(rxTransactionId,) = struct.unpack('<I', data[4:8])
 					if rxTransactionId != txTransactionId:
-						raise MtpProtocolException("Camera Networking Error: {:s}: Incorrect transaction ID for data payload (exp={:08x}, got={:08x})".format(\
+						raise MtpTransactionIdMismatchException("Camera Networking Error: {:s}: Incorrect transaction ID for data payload (exp={:08x}, got={:08x})".format(\
 							getMtpOpDesc(mtpOp), txTransactionId, rxTransactionId))								
-					dataReceivedSoFar += data[8:]
+					if dataSinkFunc:
+						# only report the data not already streamed to the sink
+						partialData = data[8:]
+					else:
+						dataReceivedSoFar += data[8:]
+						partialData = six.binary_type(dataReceivedSoFar)
 					bytesReceivedLastPayload = len(data[8:])
-					lastPayloadExpectedSize = g_PartialRxDataPayloadData_SizeIndicated - 8
+					countDataBytesReceived += conn.rxPayloadBytesSentToSink + bytesReceivedLastPayload
+					lastPayloadExpectedSize = conn.partialRxDataPayloadData_SizeIndicated - 8
 				else:
 					bytesReceivedLastPayload = 0
 					lastPayloadExpectedSize = 0
+					countDataBytesReceived += conn.rxPayloadBytesSentToSink
+					partialData = None if dataSinkFunc else six.binary_type(dataReceivedSoFar)
 				
 				raise MtpOpExecFailureException(MTP_RESP_COMMUNICATION_ERROR, \
 					"{:s}: Socket error, partial data received - 0x{:x} of 0x{:x} bytes for specific payload, 0x{:x} of 0x{:x} of total data bytes expected. Error: {:s}".\
-						format(getMtpOpDesc(mtpOp), bytesReceivedLastPayload, lastPayloadExpectedSize, len(dataReceivedSoFar), totalDataTransferSizeBytesExpectedAcrossAllPayloads, str(e)),
-						dataReceivedSoFar, totalDataTransferSizeBytesExpectedAcrossAllPayloads)										
+						format(getMtpOpDesc(mtpOp), bytesReceivedLastPayload, lastPayloadExpectedSize, countDataBytesReceived, totalDataTransferSizeBytesExpectedAcrossAllPayloads, str(e)),
+						partialData, totalDataTransferSizeBytesExpectedAcrossAllPayloads)										
+
+		except struct.error as e:
+			# payload is shorter than its payload ID calls for
+			raise MtpProtocolException("Camera Protocol Error: {:s}: Truncated payload ({:s})".format(getMtpOpDesc(mtpOp), str(e)))
 
 		except KeyboardInterrupt as e: # <ctrl-c> pressed			
-			gTransferInterruptedBySIGINT = True
-			applog_d("gTransferInterruptedBySIGINT set")
+			conn.fTransferInterruptedBySIGINT = True
+			applog_d("fTransferInterruptedBySIGINT set")
 			raise
 						
 			
+#
+# performs a series of the same MTP op with different arguments, keeping up to 'pipelineDepth'
+# requests in flight on the socket - the command request for the next op(s) is sent before the
+# response to the current op is received, so that each op doesn't pay the full round-trip latency
+# of the link. this is a generator that yields the MtpTcpCmdResult of each op, in the order of
+# 'cmdArgsPackedIter'. the camera processes requests in the order received so responses arrive
+# in that order, which execMtpOp_rxResponse() verifies by transaction ID. a 'pipelineDepth' of
+# 1 is equivalent to calling execMtpOp() for each set of arguments. 'rxTxProgressFunc' and
+# 'dataSinkFunc' are applied to every op.
+#
+# if an op fails the requests still in flight are drained (their responses discarded) before the
+# exception is raised, so that the session remains usable for subsequent ops. this isn't possible
+# for communication errors, which leave the connection in an unknown state anyway
+#
+def execMtpOpPipelined(conn, mtpOp, cmdArgsPackedIter, pipelineDepth, rxTxProgressFunc=None, dataSinkFunc=None):
+	cmdArgsPackedIter = iter(cmdArgsPackedIter)
+	outstandingTransactionIds = deque()
+	fMoreCmdArgs = True
+	try:
+		while True:
+			# top off the pipeline
+			while fMoreCmdArgs and len(outstandingTransactionIds) < pipelineDepth:
+				try:
+					cmdArgsPacked = next(cmdArgsPackedIter)
+				except StopIteration:
+					fMoreCmdArgs = False
+					break
+				outstandingTransactionIds.append(execMtpOp_txCmdReq(conn, mtpOp, cmdArgsPacked))
+			if not outstandingTransactionIds:
+				return
+			txTransactionId = outstandingTransactionIds.popleft()
+			try:
+				mtpTcpCmdResult = execMtpOp_rxResponse(conn, mtpOp, txTransactionId, rxTxProgressFunc, dataSinkFunc)
+			except MtpOpExecFailureException as e:
+				if e.mtpRespCode != MTP_RESP_COMMUNICATION_ERROR:
+					drainPipelinedMtpOps(conn, mtpOp, outstandingTransactionIds)
+				raise
+			yield mtpTcpCmdResult
+	except GeneratorExit:
+		# caller stopped consuming results before all ops completed - drain what's still in flight
+		drainPipelinedMtpOps(conn, mtpOp, outstandingTransactionIds)
+		raise
+		
+#
+# receives and discards the responses to pipelined requests still in flight. any
+# failure of these requests is ignored since the caller is already handling the
+# failure that caused the pipeline to be abandoned
+#
+def drainPipelinedMtpOps(conn, mtpOp, outstandingTransactionIds):
+	while outstandingTransactionIds:
+		txTransactionId = outstandingTransactionIds.popleft()
+		applog_d("drainPipelinedMtpOps: {:s} - discarding response for transaction ID {:08x}".format(getMtpOpDesc(mtpOp), txTransactionId))
+		try:
+			execMtpOp_rxResponse(conn, mtpOp, txTransactionId, dataSinkFunc=lambda data : None)
+		except MtpOpExecFailureException as e:
+			if e.mtpRespCode == MTP_RESP_COMMUNICATION_ERROR:
+				break # connection is gone - nothing left to drain
+		except MtpProtocolException:
+			break
+	outstandingTransactionIds.clear()
+		
+				
 #
 # sends host introduction to camera (not sure what the spec calls this since it's not publicly documented.
 # this is the first operation performed after opening a TCP/IP socket with the camera. the camera returns
 # the session identifier that we're to use as the session ID when performing a later MTP_OP_OpenSession
 #
-def sendInitCmdReq(s, guidHighLowTuple, hostNameStr, hostVerInt):
+def sendInitCmdReq(conn, guidHighLowTuple, hostNameStr, hostVerInt):
 	applog_d("sendInitCmdReq(): Sending MTP_TCPIP_REQ_INIT_CMD_REQ")
 	(guidHigh, guidLow) = guidHighLowTuple
 	cmdtype=struct.pack('<I', MTP_TCPIP_REQ_INIT_CMD_REQ)
 	guid = struct.pack('<QQ', guidHigh, guidLow) 
 	hostNameUtf16ByteArray = strutil.stringToUtf16ByteArray(hostNameStr, True)
 	try:
-		rxdata = txrxdata(s, cmdtype + guid + hostNameUtf16ByteArray + struct.pack('<I', hostVerInt))
+		rxdata = txrxdata(conn, cmdtype + guid + hostNameUtf16ByteArray + struct.pack('<I', hostVerInt))
 		if isDebugLog():
 			applog_d("sendInitCmdReq() response:")
-			applog_d(strutil.hexdump(rxdata))
-		(wordResponse,) = struct.unpack('<I',rxdata[:4])
+			applog_d(strutil.hexdump(rxdata.tobytes()))
+		(wordResponse,) = struct.unpack_from('<I',rxdata, 0)
 		if wordResponse == 0x2 and len(rxdata) >= 8:	# make sure first 32-bit word is equal to a value of 0x2 ("ACK") and has 4-byte session ID after
-			return rxdata[4:]
+			return rxdata[4:].tobytes()
 		else:
 			raise MtpProtocolException(\
 				"\nThe camera is rejecting the unique identifier (GUID) that airnef is\n"\
@@ -407,15 +919,15 @@ def sendInitCmdReq(s, guidHighLowTuple, hostNameStr, hostVerInt):
 # analog of sendInitCmdReq() but for the TCP/IP sockets used for events and
 # no session identifier is returned
 #
-def sendInitEvents(s, sessionId):
+def sendInitEvents(conn, sessionId):
 	applog_d("sendInitEvents(): Sending MTP_TCPIP_REQ_INIT_EVENTS")
 	cmdtype = struct.pack('<II', MTP_TCPIP_REQ_INIT_EVENTS, sessionId)
 	try:
-		rxdata = txrxdata(s, cmdtype)
+		rxdata = txrxdata(conn, cmdtype)
 		if isDebugLog():
 			applog_d("sendInitEvents() response:")
-			applog_d(strutil.hexdump(rxdata))
-		(wordResponse,) = struct.unpack('<I',rxdata[:4])
+			applog_d(strutil.hexdump(rxdata.tobytes()))
+		(wordResponse,) = struct.unpack_from('<I',rxdata, 0)
 		if wordResponse != 0x4:	# make sure first 32-bit word is equal to a value of 0x4 ("ACK")
 			raise MtpProtocolException("sendInitEvents(): Bad response/ACK - expected 0x04, got 0x{:x}".format(wordResponse))
 	except socket.error as error:
@@ -424,25 +936,77 @@ def sendInitEvents(s, sessionId):
 #
 # sends a probe request. this should be done on the events socket
 #		
-def sendProbeRequest(s):
+def sendProbeRequest(conn):
 	applog_d("sendProbeRequest(): Sending probe request")
 	cmdtype = struct.pack('<I', MTP_TCPIP_REQ_PROBE)
 	try:
-		rxdata = txrxdata(s, cmdtype)
-		if isDebugLog():
-			applog_d("sendProbeRequest() response:")
-			applog_d(strutil.hexdump(rxdata))
-		(wordResponse,) = struct.unpack('<I',rxdata[:4])
+		txdata(conn, cmdtype)
+		while True:
+			rxdata = rxPayload(conn)
+			if isDebugLog():
+				applog_d("sendProbeRequest() response:")
+				applog_d(strutil.hexdump(rxdata.tobytes()))
+			(wordResponse,) = struct.unpack_from('<I',rxdata, 0)
+			if wordResponse != MTP_TCPIP_PAYLOAD_ID_Event:
+				break
+			# camera sent an event ahead of the probe response - save it for rxEvents()
+			conn.pendingEventsList.append(parseMtpEvent(rxdata))
 		if wordResponse != 0xe:	# make sure first 32-bit word is equal to a value of 0xe ("probe response")
 			raise MtpProtocolException("sendProbeRequest(): Bad response/ACK - expected 0x0e, got 0x{:x}".format(wordResponse))
 	except socket.error as error:
 		raise		
 
+
+#
+# parses an event frame received on the events socket:
+#
+#	bytes 0x00 - 0x03: 0x00000008: MTP_TCPIP_PAYLOAD_ID_Event
+#	bytes 0x04 - 0x05: MTP event code (see mtpdef.MTP_EVENT_* values)
+#	bytes 0x06 - 0x09: transaction ID (0xffffffff if event isn't associated with a transaction)
+#	bytes 0x0a - ....: zero to three 32-bit event parameters
+#
+def parseMtpEvent(data):
+	if len(data) < 10:
+		raise MtpProtocolException("Camera Protocol Error: Event payload too short (0x{:x} bytes)".format(len(data)))
+	(eventCode, transactionId) = struct.unpack_from('<HI', data, 4)
+	numParams = min((len(data) - 10) // 4, 3)
+	params = struct.unpack_from('<{:d}I'.format(numParams), data, 10)
+	return MtpTcpEvent(eventCode, transactionId, params)
+
+#
+# receives events the camera sent on the events socket, waiting up to 'timeoutSecs' for
+# the first to arrive. returns a list of MtpTcpEvent for all the events received, which is
+# empty if none arrived in time. most cameras don't send any events on this socket (Nikon
+# queues them for MTP_OP_NkonGetEvent instead) so the caller must be prepared to never
+# receive any. frames other than events are ignored
+#
+def rxEvents(conn, timeoutSecs=0):
+	eventsList = conn.pendingEventsList
+	conn.pendingEventsList = []
+	if eventsList:
+		timeoutSecs = 0		# already have events to return - only pick up any others immediately available
+	while True:
+		(readableList, writableList, exceptionalList) = select.select([conn.s], [], [], timeoutSecs)
+		if not readableList:
+			return eventsList
+		rxdata = rxPayload(conn)
+		(payloadId,) = struct.unpack_from('<I', rxdata, 0)
+		if payloadId == MTP_TCPIP_PAYLOAD_ID_Event:
+			event = parseMtpEvent(rxdata)
+			applog_d("rxEvents(): Received {:s}, Params: {:s}".format(getMtpEventDesc(event.eventCode), str(["0x{:08x}".format(param) for param in event.params])))
+			eventsList.append(event)
+		else:
+			applog_d("rxEvents(): Ignoring unexpected payload ID 0x{:x} on events socket".format(payloadId))
+		timeoutSecs = 0
+
 		
 #
-# opens TCP/IP socket to camera. this is the first step in communication
+# opens TCP/IP socket to camera, returning an MtpConnection for it. this is the
+# first step in communication. the connection records the stats of the MTP ops
+# performed on it into 'opStatsRegistry', or into a registry of its own if None,
+# and its frames to 'traceRecorder' if specified
 #		
-def openConnection(ipAddrStr, verbose, connectionTimeoutSecs=SOCKET_TIMEOUT_CONNECT_SECS_DEFAULT, readWriteTimeoutSecs=SOCKET_TIMEOUT_READS_WRITES_DEFAULT):
+def openConnection(ipAddrStr, verbose, connectionTimeoutSecs=SOCKET_TIMEOUT_CONNECT_SECS_DEFAULT, readWriteTimeoutSecs=SOCKET_TIMEOUT_READS_WRITES_DEFAULT, opStatsRegistry=None, traceRecorder=None):
 	port = 15740
 	applog_d("openConnection(): Attempting connection to {:s}:{:d}".format(ipAddrStr, port))
 	s = None
@@ -478,4 +1042,4 @@ def openConnection(ipAddrStr, verbose, connectionTimeoutSecs=SOCKET_TIMEOUT_CONN
 		applog_i("Connection established to {:s}:{:d}".format(ipAddrStr, port))
 	s.settimeout(readWriteTimeoutSecs)						# set per-call timeout on socket, most useful for our future recv() calls
 	s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)	# for performance
-	return s
+	return MtpConnection(s, opStatsRegistry, traceRecorder)
@@ -41,11 +41,14 @@ def dayOfYearToSeason(dayOfYear):
 
 
 #
-# verifies the syntax of a rename format string
+# verifies the syntax of a rename format string. returns the compiled
+# spec, which callers can keep and pass to performRename() for each file
 #	
 def verifyRenameFormatStringSyntax(formatString):
+	compiledSpec = compileRenameFormatString(formatString)
 	renameDict = createTestRenameDict()
-	performRename(formatString, renameDict)
+	performRename(compiledSpec, renameDict)
+	return compiledSpec
 
 
 #
@@ -65,179 +68,288 @@ def getNextSpecifierPos(formatString, formatStringPos):
 		raise GenerateReplacementNameException("Missing specifier after @ at character #{:d}".format(nextSpecifierStartPos))
 		
 	return (nextSpecifierStartPos, nextSpecifierEndPos)
-	
+
+
 #
-# performs a rename operation
+# returns the time.struct_time for one of the epoch values in the rename dict ('captureDateEpoch'
+# or 'downloadDateEpoch'). the struct is cached in 'timeStructCacheDict', which lives for a
+# single rename, so that a spec with several date/time specifiers converts the epoch only once
 #
-def performRename(formatString, parmsDict):
+def getTimeStruct(parmsDict, timeStructCacheDict, epochKey):
+	timeStruct = timeStructCacheDict.get(epochKey)
+	if timeStruct == None:
+		timeStruct = timeStructCacheDict[epochKey] = time.localtime(parmsDict[epochKey])
+	return timeStruct
 
-	#
-	# build dictionary that translates specifiers
-	#
-	
-	captureTimeStruct = time.localtime(parmsDict['captureDateEpoch'])
-	downloadTimeStruct = time.localtime(parmsDict['downloadDateEpoch'])
-	
-	specifierTranslationDict = dict()
-	
-	specifierTranslationDict['capturedate'] = time.strftime("%Y%m%d", captureTimeStruct)      	# date captured full (numeric)
-	specifierTranslationDict['capturedate_m'] = time.strftime("%m", captureTimeStruct)				# date captured month (numeric)
-	specifierTranslationDict['capturedate_d'] = time.strftime("%d", captureTimeStruct)				# date captured day (numeric)
-	specifierTranslationDict['capturedate_y'] = time.strftime("%Y", captureTimeStruct)				# date captured year (numeric)
-	specifierTranslationDict['capturedate_dow'] = str(captureTimeStruct.tm_wday+1)					# date captured day of week (numeric, 1=Monday)
-	specifierTranslationDict['capturedate_woy'] = time.strftime("%W", captureTimeStruct)			# date captured week of year (numeric, Monday first day of week)
-	specifierTranslationDict['capturedate_month'] = time.strftime("%B", captureTimeStruct)			# date captured month (text)
-	specifierTranslationDict['capturedate_dayofweek'] = time.strftime("%A", captureTimeStruct)		# date captured day of week (text)
-	specifierTranslationDict['capturedate_season'] = dayOfYearToSeason(captureTimeStruct.tm_yday)	# date captured season (text)
-
-	specifierTranslationDict['capturetime'] = time.strftime("%H%M%S", captureTimeStruct)			# time captured full
-	specifierTranslationDict['capturetime_h'] = time.strftime("%H", captureTimeStruct)				# time captured hour (military)
-	specifierTranslationDict['capturetime_m'] = time.strftime("%M", captureTimeStruct)				# capure time minute
-	specifierTranslationDict['capturetime_s'] = time.strftime("%S", captureTimeStruct)				# time captured seconds
-	
-	specifierTranslationDict['dldate'] = time.strftime("%Y%m%d", downloadTimeStruct)      			# date downloaded full (numeric)
-	specifierTranslationDict['dldate_m'] = time.strftime("%m", downloadTimeStruct)					# date downloaded month (numeric)
-	specifierTranslationDict['dldate_d'] = time.strftime("%d", downloadTimeStruct)					# date downloaded day (numeric)
-	specifierTranslationDict['dldate_y'] = time.strftime("%Y", downloadTimeStruct)					# date downloaded year (numeric)
-	specifierTranslationDict['dldate_dow'] = str(downloadTimeStruct.tm_wday+1)						# date downloaded day of week (numeric, 1=Monday)
-	specifierTranslationDict['dldate_woy'] = time.strftime("%W", downloadTimeStruct)				# date downloaded week of year (numeric, Monday first day of week)
-	specifierTranslationDict['dldate_month'] = time.strftime("%B", downloadTimeStruct)				# date downloaded month (text)
-	specifierTranslationDict['dldate_dayofweek'] = time.strftime("%A", downloadTimeStruct)			# date downloaded day of week (text)
-	specifierTranslationDict['dldate_season'] = dayOfYearToSeason(downloadTimeStruct.tm_yday)		# date downloaded season (text)
-
-	specifierTranslationDict['dltime'] = time.strftime("%H%M%S", downloadTimeStruct)				# time downloaded full
-	specifierTranslationDict['dltime_h'] = time.strftime("%H", downloadTimeStruct)					# time downloaded hour (military)
-	specifierTranslationDict['dltime_m'] = time.strftime("%M", downloadTimeStruct)					# capure time minute
-	specifierTranslationDict['dltime_s'] = time.strftime("%S", downloadTimeStruct)					# time downloaded seconds
-
-	specifierTranslationDict['filename'] = parmsDict['filename']									# local filename 
-	specifierTranslationDict['filename_root'] = os.path.splitext(parmsDict['filename'])[0]			# local filename base (filename without extension)
-	specifierTranslationDict['filename_ext'] = os.path.splitext(parmsDict['filename'])[1][1:]		# local filename extension	
-	specifierTranslationDict['capturefilename'] = parmsDict['capturefilename']						# capture filename 
-	specifierTranslationDict['capturefilename_root'] = os.path.splitext(parmsDict['capturefilename'])[0]	# capture filename base (filename without extension)
-	specifierTranslationDict['capturefilename_ext'] = os.path.splitext(parmsDict['capturefilename'])[1][1:]	# capture filename extension
-	specifierTranslationDict['path'] = parmsDict['path']											# path
-	specifierTranslationDict['pf'] = os.path.join(parmsDict['path'], parmsDict['filename'])			# path+filename
-		
-	specifierTranslationDict['camerafolder'] = parmsDict['camerafolder']							# camera folder file is in
-	specifierTranslationDict['slotnumber'] = str(parmsDict['slotnumber'])							# camera media slot # file was downloaded from
+def genDateTimeSpecifierFunc(epochKey, strftimeFormat):
+	return lambda parmsDict, timeStructCacheDict: time.strftime(strftimeFormat, getTimeStruct(parmsDict, timeStructCacheDict, epochKey))
 
-	specifierTranslationDict['cameramake'] = parmsDict['cameramake']								# camera make
-	specifierTranslationDict['cameramodel'] = parmsDict['cameramodel']								# camera model
-	specifierTranslationDict['cameraserial'] = parmsDict['cameraserial'] 							# camera serial number
-	
-	specifierTranslationDict['dlnum'] = "{:04d}".format(parmsDict['dlnum'])							# download number this session
-	specifierTranslationDict['dlnum_lifetime'] = "{:04d}".format(parmsDict['dlnum_lifetime'])		# download number lifetime for this model/serial
+def genDayOfWeekSpecifierFunc(epochKey):
+	return lambda parmsDict, timeStructCacheDict: str(getTimeStruct(parmsDict, timeStructCacheDict, epochKey).tm_wday+1)
 
-	formatStringLen = len(formatString)
-	formatStringPos = 0
-	outputName = ""
-	while formatStringPos < formatStringLen:
+def genSeasonSpecifierFunc(epochKey):
+	return lambda parmsDict, timeStructCacheDict: dayOfYearToSeason(getTimeStruct(parmsDict, timeStructCacheDict, epochKey).tm_yday)
 
-		#
-		# find next specifier
-		#
-		(nextSpecifierStartPos, nextSpecifierEndPos) = getNextSpecifierPos(formatString, formatStringPos)
-	
-		if nextSpecifierStartPos == -1:
-			# no more specifiers - insert remainder of format string into output
-			outputName += formatString[formatStringPos:]
-			break;
-				
-		#
-		# insert from format string up to start of this specifier
-		#
-		outputName += formatString[formatStringPos:nextSpecifierStartPos]
-			
-		formatStringPos = nextSpecifierEndPos+1 # advance past specifier in preparation for next loop iteration
+#
+# translates each specifier to the function that generates its value from the rename dict. the
+# functions are only called for the specifiers a format string actually uses, so per-file renames
+# don't pay for the date/time formatting of specifiers nobody asked for
+#
+SpecifierFuncDict = {
+	'capturedate'				: genDateTimeSpecifierFunc('captureDateEpoch', "%Y%m%d"),		# date captured full (numeric)
+	'capturedate_m'				: genDateTimeSpecifierFunc('captureDateEpoch', "%m"),			# date captured month (numeric)
+	'capturedate_d'				: genDateTimeSpecifierFunc('captureDateEpoch', "%d"),			# date captured day (numeric)
+	'capturedate_y'				: genDateTimeSpecifierFunc('captureDateEpoch', "%Y"),			# date captured year (numeric)
+	'capturedate_dow'			: genDayOfWeekSpecifierFunc('captureDateEpoch'),				# date captured day of week (numeric, 1=Monday)
+	'capturedate_woy'			: genDateTimeSpecifierFunc('captureDateEpoch', "%W"),			# date captured week of year (numeric, Monday first day of week)
+	'capturedate_month'			: genDateTimeSpecifierFunc('captureDateEpoch', "%B"),			# date captured month (text)
+	'capturedate_dayofweek'		: genDateTimeSpecifierFunc('captureDateEpoch', "%A"),			# date captured day of week (text)
+	'capturedate_season'		: genSeasonSpecifierFunc('captureDateEpoch'),					# date captured season (text)
+
+	'capturetime'				: genDateTimeSpecifierFunc('captureDateEpoch', "%H%M%S"),		# time captured full
+	'capturetime_h'				: genDateTimeSpecifierFunc('captureDateEpoch', "%H"),			# time captured hour (military)
+	'capturetime_m'				: genDateTimeSpecifierFunc('captureDateEpoch', "%M"),			# capure time minute
+	'capturetime_s'				: genDateTimeSpecifierFunc('captureDateEpoch', "%S"),			# time captured seconds
+
+	'dldate'					: genDateTimeSpecifierFunc('downloadDateEpoch', "%Y%m%d"),		# date downloaded full (numeric)
+	'dldate_m'					: genDateTimeSpecifierFunc('downloadDateEpoch', "%m"),			# date downloaded month (numeric)
+	'dldate_d'					: genDateTimeSpecifierFunc('downloadDateEpoch', "%d"),			# date downloaded day (numeric)
+	'dldate_y'					: genDateTimeSpecifierFunc('downloadDateEpoch', "%Y"),			# date downloaded year (numeric)
+	'dldate_dow'				: genDayOfWeekSpecifierFunc('downloadDateEpoch'),				# date downloaded day of week (numeric, 1=Monday)
+	'dldate_woy'				: genDateTimeSpecifierFunc('downloadDateEpoch', "%W"),			# date downloaded week of year (numeric, Monday first day of week)
+	'dldate_month'				: genDateTimeSpecifierFunc('downloadDateEpoch', "%B"),			# date downloaded month (text)
+	'dldate_dayofweek'			: genDateTimeSpecifierFunc('downloadDateEpoch', "%A"),			# date downloaded day of week (text)
+	'dldate_season'				: genSeasonSpecifierFunc('downloadDateEpoch'),					# date downloaded season (text)
+
+	'dltime'					: genDateTimeSpecifierFunc('downloadDateEpoch', "%H%M%S"),		# time downloaded full
+	'dltime_h'					: genDateTimeSpecifierFunc('downloadDateEpoch', "%H"),			# time downloaded hour (military)
+	'dltime_m'					: genDateTimeSpecifierFunc('downloadDateEpoch', "%M"),			# capure time minute
+	'dltime_s'					: genDateTimeSpecifierFunc('downloadDateEpoch', "%S"),			# time downloaded seconds
+
+	'filename'					: lambda parmsDict, tscd: parmsDict['filename'],									# local filename
+	'filename_root'				: lambda parmsDict, tscd: os.path.splitext(parmsDict['filename'])[0],				# local filename base (filename without extension)
+	'filename_ext'				: lambda parmsDict, tscd: os.path.splitext(parmsDict['filename'])[1][1:],			# local filename extension
+	'capturefilename'			: lambda parmsDict, tscd: parmsDict['capturefilename'],								# capture filename
+	'capturefilename_root'		: lambda parmsDict, tscd: os.path.splitext(parmsDict['capturefilename'])[0],		# capture filename base (filename without extension)
+	'capturefilename_ext'		: lambda parmsDict, tscd: os.path.splitext(parmsDict['capturefilename'])[1][1:],	# capture filename extension
+	'path'						: lambda parmsDict, tscd: parmsDict['path'],										# path
+	'pf'						: lambda parmsDict, tscd: os.path.join(parmsDict['path'], parmsDict['filename']),	# path+filename
+
+	'camerafolder'				: lambda parmsDict, tscd: parmsDict['camerafolder'],								# camera folder file is in
+	'slotnumber'				: lambda parmsDict, tscd: str(parmsDict['slotnumber']),								# camera media slot # file was downloaded from
+
+	'cameramake'				: lambda parmsDict, tscd: parmsDict['cameramake'],									# camera make
+	'cameramodel'				: lambda parmsDict, tscd: parmsDict['cameramodel'],									# camera model
+	'cameraserial'				: lambda parmsDict, tscd: parmsDict['cameraserial'],								# camera serial number
+
+	'dlnum'						: lambda parmsDict, tscd: "{:04d}".format(parmsDict['dlnum']),						# download number this session
+	'dlnum_lifetime'			: lambda parmsDict, tscd: "{:04d}".format(parmsDict['dlnum_lifetime']),				# download number lifetime for this model/serial
+}
+
+#
+# operations a format string is compiled into. each op is a tuple whose first element is the op type:
+#
+#	(RENAME_OP_LITERAL, str)									- insert literal text
+#	(RENAME_OP_SPECIFIER, name, func, start, end, caseFuncList)	- insert specifier value, sliced [start:end] then case-converted
+#	(RENAME_OP_REPLACE, findStr, newStr)						- search/replace on output built so far
+#	(RENAME_OP_REPLACERE, compiledRegex, newStr)				- regular expression search/replace on output built so far
+#
+RENAME_OP_LITERAL		= 0
+RENAME_OP_SPECIFIER		= 1
+RENAME_OP_REPLACE		= 2
+RENAME_OP_REPLACERE		= 3
+
+#
+# a format string parsed into a list of rename ops. parsing (and the reporting of any syntax
+# errors) happens once here rather than on every rename
+#
+class CompiledRenameSpec(object):
+
+	def __init__(self, formatString):
+		self.formatString = formatString
+		self.opList = []
+		self._compile()
+
+	def _addLiteral(self, literalStr):
+		if not literalStr:
+			return
+		if self.opList and self.opList[-1][0] == RENAME_OP_LITERAL:
+			# merge with previous literal (ex: text around an '@@')
+			self.opList[-1] = (RENAME_OP_LITERAL, self.opList[-1][1] + literalStr)
+		else:
+			self.opList.append((RENAME_OP_LITERAL, literalStr))
+
+	def _compile(self):
+		formatString = self.formatString
+		formatStringLen = len(formatString)
+		formatStringPos = 0
+		while formatStringPos < formatStringLen:
+
+			#
+			# find next specifier
+			#
+			(nextSpecifierStartPos, nextSpecifierEndPos) = getNextSpecifierPos(formatString, formatStringPos)
 		
-		#
-		# extract specifier to do replacment insertion. example specifier formats:
-		#	@filename@			- Filename
-		#	@filename:0:2@ 		- Filename, characters 0 through 1
-		#	@filename:4:@		- Filename, characters 4 through end
-		#	@filename::1@		- Filename, character 0
-		#	@filename:-2:@		- Filename, last two characters
-		#	@filename:4:-2:@	- Filename, characters 4 through to last two characters
-		#
-		#
-		specifierForReporting = formatString[nextSpecifierStartPos:nextSpecifierEndPos+1]	# for use in reporting errors, entire specifier in original case including enclosing @@
-		specifierWithArgs = formatString[nextSpecifierStartPos+1:nextSpecifierEndPos]		# the entire specifier with optional args included (everything between @@)
-		if not specifierWithArgs:
-			# found '@@', which means literal '@'
-			outputName += '@'
-			continue			
-		specifierWithArgsLowercase = specifierWithArgs.lower()
+			if nextSpecifierStartPos == -1:
+				# no more specifiers - insert remainder of format string into output
+				self._addLiteral(formatString[formatStringPos:])
+				break;
+					
+			#
+			# insert from format string up to start of this specifier
+			#
+			self._addLiteral(formatString[formatStringPos:nextSpecifierStartPos])
+				
+			formatStringPos = nextSpecifierEndPos+1 # advance past specifier in preparation for next loop iteration
 			
-		if specifierWithArgsLowercase.find('replace',0,7) != -1:
 			#
-			# special case specifier that does search/replace on output string built
-			# up to this point. Matches case of search/replace string as written. Formats:
+			# extract specifier to do replacment insertion. example specifier formats:
+			#	@filename@			- Filename
+			#	@filename:0:2@ 		- Filename, characters 0 through 1
+			#	@filename:4:@		- Filename, characters 4 through end
+			#	@filename::1@		- Filename, character 0
+			#	@filename:-2:@		- Filename, last two characters
+			#	@filename:4:-2:@	- Filename, characters 4 through to last two characters
 			#
-			# @replace~findstr~newstr@
-			# @replacere~findstr~newstr~ (regular expression version)
 			#
-			replaceList = specifierWithArgs.split('~')
-			if len(replaceList)==1:
-				raise GenerateReplacementNameException("No search string specified after specifier {:s} at character #{:d}".format(specifierForReporting, nextSpecifierStartPos))
-			if len(replaceList)==2:
-				raise GenerateReplacementNameException("No replacement string specified after specifier {:s} at character #{:d}".format(specifierForReporting, nextSpecifierStartPos))
-			if len(replaceList) > 3:
-				raise GenerateReplacementNameException("Too many fields for specifier {:s} at character #{:d}".format(specifierForReporting, nextSpecifierStartPos))			
-			if replaceList[0] == 'replace':				
-				outputName = outputName.replace(replaceList[1], replaceList[2])
-			elif replaceList[0] == 'replacere':
-				outputName = re.sub(replaceList[1], replaceList[2], outputName)
-			else:
-				raise GenerateReplacementNameException("Unknown specifier {:s} at character #{:d}".format(specifierForReporting, nextSpecifierStartPos))			
-			continue
-		
-		specifierList = specifierWithArgs.split(':')
-		speciferName = specifierList[0]
-		specifierListLowercase = specifierWithArgsLowercase.split(':')
-		speciferNameLowercase = specifierListLowercase[0]
-								
-		if speciferNameLowercase not in specifierTranslationDict:
-			raise GenerateReplacementNameException("Unknown specifier {:s} at character #{:d}".format(specifierForReporting, nextSpecifierStartPos))		
-
-		if len(specifierListLowercase) > 4:
-			raise GenerateReplacementNameException("Too many subscripts to specifier {:s} at character #{:d}".format(specifierForReporting, nextSpecifierStartPos))		
-		specifierSubscript_Start = 0
-		specifierSubscript_End = 9999 # arbitrary large number to get all of string
-		if len(specifierListLowercase) >= 2:
-			if specifierListLowercase[1]:
-				try:
-					specifierSubscript_Start = int(specifierListLowercase[1])
-				except ValueError as e:
-					raise GenerateReplacementNameException("First subscript value is not integer for specifier {:s} at character #{:d}".format(specifierForReporting, nextSpecifierStartPos))
-		if len(specifierListLowercase) >= 3:
-			if specifierListLowercase[2]:
-				try:
-					specifierSubscript_End = int(specifierListLowercase[2])
-				except ValueError as e:
-					raise GenerateReplacementNameException("Second subscript value is not integer for specifier {:s} at character #{:d}".format(specifierForReporting, nextSpecifierStartPos))
-		optionsLowercase = ""
-		if len(specifierListLowercase) >= 4:
-			if specifierListLowercase[3]:
-				optionsLowercase = specifierListLowercase[3]
+			specifierForReporting = formatString[nextSpecifierStartPos:nextSpecifierEndPos+1]	# for use in reporting errors, entire specifier in original case including enclosing @@
+			specifierWithArgs = formatString[nextSpecifierStartPos+1:nextSpecifierEndPos]		# the entire specifier with optional args included (everything between @@)
+			if not specifierWithArgs:
+				# found '@@', which means literal '@'
+				self._addLiteral('@')
+				continue			
+			specifierWithArgsLowercase = specifierWithArgs.lower()
+				
+			if specifierWithArgsLowercase.find('replace',0,7) != -1:
+				#
+				# special case specifier that does search/replace on output string built
+				# up to this point. Matches case of search/replace string as written. Formats:
+				#
+				# @replace~findstr~newstr@
+				# @replacere~findstr~newstr~ (regular expression version)
+				#
+				replaceList = specifierWithArgs.split('~')
+				if len(replaceList)==1:
+					raise GenerateReplacementNameException("No search string specified after specifier {:s} at character #{:d}".format(specifierForReporting, nextSpecifierStartPos))
+				if len(replaceList)==2:
+					raise GenerateReplacementNameException("No replacement string specified after specifier {:s} at character #{:d}".format(specifierForReporting, nextSpecifierStartPos))
+				if len(replaceList) > 3:
+					raise GenerateReplacementNameException("Too many fields for specifier {:s} at character #{:d}".format(specifierForReporting, nextSpecifierStartPos))			
+				if replaceList[0] == 'replace':				
+					self.opList.append((RENAME_OP_REPLACE, replaceList[1], replaceList[2]))
+				elif replaceList[0] == 'replacere':
+					try:
+						compiledRegex = re.compile(replaceList[1])
+					except re.error as e:
+						raise GenerateReplacementNameException("Invalid regular expression for specifier {:s} at character #{:d}: {:s}".format(specifierForReporting, nextSpecifierStartPos, str(e)))
+					self.opList.append((RENAME_OP_REPLACERE, compiledRegex, replaceList[2]))
+				else:
+					raise GenerateReplacementNameException("Unknown specifier {:s} at character #{:d}".format(specifierForReporting, nextSpecifierStartPos))			
+				continue
+			
+			specifierListLowercase = specifierWithArgsLowercase.split(':')
+			speciferNameLowercase = specifierListLowercase[0]
 									
-		strToAdd = specifierTranslationDict[speciferNameLowercase][specifierSubscript_Start:specifierSubscript_End]
-		
-		# process options
-		if optionsLowercase.find('u') != -1:
-			# uppercase
-			strToAdd = strToAdd.upper()
-		if optionsLowercase.find('l') != -1:
-			# lowercase
-			strToAdd = strToAdd.lower()
-		if optionsLowercase.find('c') != -1:
-			# capitalize
-			strToAdd = strToAdd.capitalize()
-		
-		# add generated specifier output to string we're building
-		outputName += strToAdd
-		
-	return outputName	
+			if speciferNameLowercase not in SpecifierFuncDict:
+				raise GenerateReplacementNameException("Unknown specifier {:s} at character #{:d}".format(specifierForReporting, nextSpecifierStartPos))		
+
+			if len(specifierListLowercase) > 4:
+				raise GenerateReplacementNameException("Too many subscripts to specifier {:s} at character #{:d}".format(specifierForReporting, nextSpecifierStartPos))		
+			specifierSubscript_Start = 0
+			specifierSubscript_End = None # get all of string
+			if len(specifierListLowercase) >= 2:
+				if specifierListLowercase[1]:
+					try:
+						specifierSubscript_Start = int(specifierListLowercase[1])
+					except ValueError as e:
+						raise GenerateReplacementNameException("First subscript value is not integer for specifier {:s} at character #{:d}".format(specifierForReporting, nextSpecifierStartPos))
+			if len(specifierListLowercase) >= 3:
+				if specifierListLowercase[2]:
+					try:
+						specifierSubscript_End = int(specifierListLowercase[2])
+					except ValueError as e:
+						raise GenerateReplacementNameException("Second subscript value is not integer for specifier {:s} at character #{:d}".format(specifierForReporting, nextSpecifierStartPos))
+			optionsLowercase = ""
+			if len(specifierListLowercase) >= 4:
+				if specifierListLowercase[3]:
+					optionsLowercase = specifierListLowercase[3]
+
+			# options, applied in this order
+			caseFuncList = []
+			if optionsLowercase.find('u') != -1:
+				caseFuncList.append(lambda strIn: strIn.upper())		# uppercase
+			if optionsLowercase.find('l') != -1:
+				caseFuncList.append(lambda strIn: strIn.lower())		# lowercase
+			if optionsLowercase.find('c') != -1:
+				caseFuncList.append(lambda strIn: strIn.capitalize())	# capitalize
+
+			self.opList.append((RENAME_OP_SPECIFIER, speciferNameLowercase, SpecifierFuncDict[speciferNameLowercase], specifierSubscript_Start, specifierSubscript_End, caseFuncList))
+
+	#
+	# generates the output for a rename dict
+	#
+	def render(self, parmsDict):
+		timeStructCacheDict = dict()
+		outputName = ""
+		for op in self.opList:
+			opType = op[0]
+			if opType == RENAME_OP_LITERAL:
+				outputName += op[1]
+			elif opType == RENAME_OP_SPECIFIER:
+				(opType, specifierName, specifierFunc, specifierSubscript_Start, specifierSubscript_End, caseFuncList) = op
+				strToAdd = specifierFunc(parmsDict, timeStructCacheDict)[specifierSubscript_Start:specifierSubscript_End]
+				for caseFunc in caseFuncList:
+					strToAdd = caseFunc(strToAdd)
+				outputName += strToAdd
+			elif opType == RENAME_OP_REPLACE:
+				outputName = outputName.replace(op[1], op[2])
+			else: # RENAME_OP_REPLACERE
+				outputName = op[1].sub(op[2], outputName)
+		return outputName
+
+	#
+	# determines if the spec uses any specifiers, ie whether its output can vary from file to file
+	#
+	def hasSpecifiers(self):
+		for op in self.opList:
+			if op[0] == RENAME_OP_SPECIFIER:
+				return True
+		return False
+
+	#
+	# determines if a particular specifier is used by the spec
+	#
+	def isSpecifierUsed(self, specifierName):
+		specifierName = specifierName.lower() # for case-insensitive match
+		for op in self.opList:
+			if op[0] == RENAME_OP_SPECIFIER and op[1] == specifierName:
+				return True
+		return False
+
+
+#
+# compiles a format string. raises GenerateReplacementNameException on syntax errors. compiled
+# specs are cached by format string, so callers that pass the same string repeatedly
+# to performRename() only pay for the parsing once
+#
+CompiledRenameSpecCacheDict = dict()
+def compileRenameFormatString(formatString):
+	compiledSpec = CompiledRenameSpecCacheDict.get(formatString)
+	if compiledSpec == None:
+		compiledSpec = CompiledRenameSpecCacheDict[formatString] = CompiledRenameSpec(formatString)
+	return compiledSpec
+
+
+#
+# performs a rename operation. 'formatString' is either a format string or a
+# spec previously returned by compileRenameFormatString()
+#
+def performRename(formatString, parmsDict):
+	if isinstance(formatString, CompiledRenameSpec):
+		compiledSpec = formatString
+	else:
+		compiledSpec = compileRenameFormatString(formatString)
+	return compiledSpec.render(parmsDict)
 
 
 #